@@ -4,6 +4,12 @@ Luna Bot package.
 Entry point: bot.main
 """
 
-from bot.main import create_app, run_bot
-
 __all__ = ["create_app", "run_bot"]
+
+
+def __getattr__(name: str):
+    # Lazy so that `python -m bot.<tool>` doesn't pull in telegram + the whole app
+    if name in __all__:
+        from bot import main
+        return getattr(main, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,637 @@
+"""
+Conversation log storage.
+
+`conversations_simple` is range-partitioned by month on created_at:
+- future partitions are created ahead of time (ensure_partitions)
+- retention drops whole expired partitions (DETACH + DROP) instead of
+  large DELETEs that bloat the table and flood the WAL
+
+Each partition carries the (user_id, created_at DESC) index; history reads
+bound created_at so the planner prunes partitions outside the retention window.
+
+A DEFAULT partition catches rows past the last monthly partition (cleanup job
+not run for months), so inserts never fail; ensure_partitions moves such rows
+into their month's partition when it creates it, and retention trims it.
+
+A pre-existing unpartitioned table keeps working (DELETE-based retention)
+until migrations/partition_conversations.sql is applied.
+
+Recent turns are also kept in memory (HistoryCache): save_message writes
+through, get_history serves from the cache and only hits Postgres on a miss.
+
+Inserts are write-behind (ConversationWriter): rows are buffered and
+flushed with COPY every few milliseconds or every N rows, off the reply path.
+
+History messages carry their row id ({"id", "role", "content"}); a message
+still queued in the writer has id None until its flush, which fills the id
+in on the cached message. Strip ids before sending history to an LLM.
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from core import get_logger
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+TABLE = "conversations_simple"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+_pool = None
+
+
+def set_pool(pool):
+    """Set database pool for this module."""
+    global _pool
+    _pool = pool
+
+
+CONVERSATIONS_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id BIGSERIAL,
+    user_id UUID REFERENCES memory_users(id),
+    role VARCHAR(10) NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at)
+"""
+
+CONVERSATIONS_INDEX = f"""
+CREATE INDEX IF NOT EXISTS idx_conv_simple_user
+ON {TABLE}(user_id, created_at DESC)
+"""
+
+
+# =============================================================================
+# PARTITION MATH
+# =============================================================================
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month_start: date) -> str:
+    """Partition name for a month, e.g. conversations_simple_y2025m03."""
+    return f"{TABLE}_y{month_start.year}m{month_start.month:02d}"
+
+
+def month_partitions(start: date, count: int) -> list[tuple[str, date, date]]:
+    """(name, from, to) for `count` monthly partitions starting at start's month."""
+    first = start.replace(day=1)
+    return [
+        (partition_name(_add_months(first, i)), _add_months(first, i), _add_months(first, i + 1))
+        for i in range(count)
+    ]
+
+
+def expired_partitions(names: list[str], cutoff: date) -> list[str]:
+    """
+    Partitions whose whole range is older than cutoff.
+
+    Retention is month-granular: a partition is dropped once its last day
+    is past the cutoff, so rows live between retention and retention + 1 month.
+    """
+    prefix = f"{TABLE}_y"
+    expired = []
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        try:
+            year, month = name[len(prefix):].split("m")
+            month_start = date(int(year), int(month), 1)
+        except ValueError:
+            continue
+        if _add_months(month_start, 1) <= cutoff:
+            expired.append(name)
+    return sorted(expired)
+
+
+# =============================================================================
+# DDL / MAINTENANCE
+# =============================================================================
+
+async def is_partitioned(conn) -> bool:
+    """True if conversations_simple is a partitioned table."""
+    relkind = await conn.fetchval("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = $1 AND n.nspname = current_schema()
+    """, TABLE)
+    return relkind == "p"
+
+
+def _partition_ddl(name: str, start: date, end: date) -> str:
+    return f"""
+        CREATE TABLE IF NOT EXISTS {name}
+        PARTITION OF {TABLE}
+        FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+    """
+
+
+async def ensure_partitions(conn, months_ahead: int = 2) -> int:
+    """
+    Create the DEFAULT partition, the current month's partition and the next
+    `months_ahead`. Returns count of monthly partitions created.
+    """
+    await conn.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+
+    created = 0
+    today = datetime.now(timezone.utc).date()
+    for name, start, end in month_partitions(today, months_ahead + 1):
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name)
+        if exists:
+            continue
+        stray = await conn.fetchval(f"""
+            SELECT EXISTS (
+                SELECT 1 FROM {DEFAULT_PARTITION}
+                WHERE created_at >= $1::date AND created_at < $2::date
+            )
+        """, start, end)
+        if stray:
+            await _split_default_partition(conn, name, start, end)
+        else:
+            await conn.execute(_partition_ddl(name, start, end))
+        created += 1
+    if created:
+        logger.info(f"Created {created} {TABLE} partitions")
+    return created
+
+
+async def _split_default_partition(conn, name: str, start: date, end: date) -> None:
+    """
+    Create a month's partition when the DEFAULT partition already holds rows
+    of that month (Postgres refuses the plain CREATE): detach DEFAULT, create,
+    move the rows, re-attach. One transaction; writers wait on the lock.
+    """
+    async with conn.transaction():
+        await conn.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}")
+        await conn.execute(_partition_ddl(name, start, end))
+        result = await conn.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE created_at >= $1::date AND created_at < $2::date
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, start, end)
+        await conn.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+    moved = int(result.split()[-1]) if result else 0
+    metrics.incr("conversation_default_partition_rows", moved)
+    logger.warning(f"Moved {moved} rows from {DEFAULT_PARTITION} into new partition {name}")
+
+
+async def init_conversations(conn, months_ahead: int = 2) -> None:
+    """Create the (partitioned) conversation table, its index and upcoming partitions."""
+    await conn.execute(CONVERSATIONS_TABLE)
+    await conn.execute(CONVERSATIONS_INDEX)
+
+    if await is_partitioned(conn):
+        await ensure_partitions(conn, months_ahead)
+    else:
+        logger.warning(
+            f"{TABLE} is not partitioned, retention falls back to DELETE. "
+            "Run migrations/partition_conversations.sql"
+        )
+
+
+async def enforce_retention(conn, retention_days: int = 90) -> int:
+    """
+    Drop conversation partitions older than the retention window (and
+    expired rows of the DEFAULT partition).
+
+    Returns:
+        Partitions dropped + DEFAULT rows deleted (rows deleted on a legacy
+        unpartitioned table)
+    """
+    if not await is_partitioned(conn):
+        return await conn.fetchval(f"""
+            WITH deleted AS (
+                DELETE FROM {TABLE}
+                WHERE created_at < NOW() - make_interval(days => $1)
+                RETURNING id
+            )
+            SELECT COUNT(*) FROM deleted
+        """, retention_days)
+
+    rows = await conn.fetch("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass
+    """, TABLE)
+    cutoff = await conn.fetchval("SELECT (NOW() - make_interval(days => $1))::date", retention_days)
+
+    dropped = 0
+    for name in expired_partitions([r["relname"] for r in rows], cutoff):
+        await conn.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+        await conn.execute(f"DROP TABLE {name}")
+        logger.info(f"Dropped expired partition {name}")
+        dropped += 1
+
+    if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", DEFAULT_PARTITION):
+        dropped += await conn.fetchval(f"""
+            WITH deleted AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE created_at < $1::date
+                RETURNING id
+            )
+            SELECT COUNT(*) FROM deleted
+        """, cutoff)
+    return dropped
+
+
+# =============================================================================
+# RECENT HISTORY CACHE
+# =============================================================================
+
+class _UserHistory:
+    """Ring buffer of one user's most recent messages."""
+
+    __slots__ = ("messages", "bytes")
+
+    def __init__(self, max_turns: int):
+        self.messages: deque[dict] = deque(maxlen=max_turns)
+        self.bytes = 0
+
+    def append(self, message: dict) -> int:
+        """Append a message, return the byte delta (evicted oldest included)."""
+        delta = len(message["content"].encode("utf-8"))
+        if len(self.messages) == self.messages.maxlen:
+            delta -= len(self.messages[0]["content"].encode("utf-8"))
+        self.messages.append(message)
+        self.bytes += delta
+        return delta
+
+
+class _Hydration:
+    """A user being loaded from Postgres: concurrent loads + appends made meanwhile."""
+
+    __slots__ = ("loaders", "pending")
+
+    def __init__(self):
+        self.loaders = 0
+        self.pending: list[dict] = []
+
+
+class HistoryCache:
+    """
+    Per-user recent-history ring buffers with LRU eviction by total bytes.
+
+    A user is cached only once hydrated from Postgres, so a cached buffer
+    always holds the user's latest `max_turns` messages (or all of them).
+    Messages appended while the user is loading (begin_hydrate .. hydrate)
+    are kept aside and replayed on top of the rows read, deduplicated by id.
+    """
+
+    def __init__(self, max_turns: int = 40, max_bytes: int = 32 * 1024 * 1024):
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self._users: OrderedDict = OrderedDict()
+        self._hydrating: dict = {}  # user_id -> _Hydration
+        self._bytes = 0
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._users
+
+    def configure(self, max_turns: int, max_bytes: int) -> None:
+        """Apply settings (called at startup, before the first message)."""
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def get(self, user_id, limit: int) -> Optional[list[dict]]:
+        """Last `limit` messages, or None on a miss (not cached / limit too large)."""
+        entry = self._users.get(user_id)
+        if entry is None or limit > self.max_turns:
+            metrics.incr("history_cache_misses")
+            return None
+        self._users.move_to_end(user_id)
+        metrics.incr("history_cache_hits")
+        messages = list(entry.messages)[-limit:] if limit > 0 else []
+        return [dict(m) for m in messages]
+
+    def begin_hydrate(self, user_id) -> None:
+        """A Postgres load is starting: appends until hydrate() are kept for replay."""
+        hydration = self._hydrating.get(user_id)
+        if hydration is None:
+            hydration = self._hydrating[user_id] = _Hydration()
+        hydration.loaders += 1
+
+    def end_hydrate(self, user_id) -> None:
+        """A load finished (hydrated or failed); pending appends go once no load is left."""
+        hydration = self._hydrating.get(user_id)
+        if hydration is None:
+            return
+        hydration.loaders -= 1
+        if hydration.loaders <= 0:
+            del self._hydrating[user_id]
+
+    def hydrate(self, user_id, messages: list[dict]) -> list[dict]:
+        """
+        Fill a user's buffer from Postgres (oldest first).
+
+        Messages saved during the load are replayed after the rows read
+        (unless already among them). Returns the cached messages.
+        """
+        hydration = self._hydrating.pop(user_id, None)
+        pending = hydration.pending if hydration is not None else []
+        read_ids = {m.get("id") for m in messages}
+
+        self.invalidate(user_id)
+        entry = _UserHistory(self.max_turns)
+        for m in messages[-self.max_turns:]:
+            entry.append({"id": m.get("id"), "role": m["role"], "content": m["content"]})
+        for message in pending:
+            if message["id"] is None or message["id"] not in read_ids:
+                entry.append(message)
+        self._users[user_id] = entry
+        self._bytes += entry.bytes
+        self._evict()
+        return [dict(m) for m in entry.messages]
+
+    def append(self, user_id, role: str, content: str, message_id: Optional[int] = None) -> Optional[dict]:
+        """
+        Write-through: only cached users are updated (others hydrate on next read).
+
+        Returns the cached message (its id is filled in once known), or None.
+        """
+        entry = self._users.get(user_id)
+        if entry is None:
+            hydration = self._hydrating.get(user_id)
+            if hydration is None:
+                return None
+            message = {"id": message_id, "role": role, "content": content}
+            hydration.pending.append(message)
+            return message
+        message = {"id": message_id, "role": role, "content": content}
+        self._bytes += entry.append(message)
+        self._users.move_to_end(user_id)
+        self._evict()
+        return message
+
+    def invalidate(self, user_id) -> None:
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.bytes
+        self._update_gauges()
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._hydrating.clear()
+        self._bytes = 0
+        self._update_gauges()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and len(self._users) > 1:
+            _, entry = self._users.popitem(last=False)
+            self._bytes -= entry.bytes
+            metrics.incr("history_cache_evictions")
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("history_cache_bytes", self._bytes)
+        metrics.set_gauge("history_cache_users", len(self._users))
+
+
+history_cache = HistoryCache()
+
+
+# =============================================================================
+# WRITE-BEHIND
+# =============================================================================
+
+COPY_COLUMNS = ["user_id", "role", "content", "created_at", "id"]
+
+# "after_send": save_message returns once queued (reply is not delayed)
+# "before_ack": save_message returns once the row is committed
+DURABILITY_MODES = ("after_send", "before_ack")
+
+
+class ConversationWriter:
+    """
+    Buffered conversation log inserts.
+
+    - One flush = one COPY (copy_records_to_table), every flush_interval
+      seconds or every flush_rows rows, whichever comes first
+    - created_at is set client-side, so batching never reorders history
+    - ids are reserved from the table's sequence per flush (COPY returns
+      none) and set on the cached history messages before the COPY, so a
+      row visible in Postgres always has its id in the cache
+    - Bounded queue: when Postgres is slow, producers wait (backpressure)
+    - close() drains everything still queued
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 0.02,
+        flush_rows: int = 200,
+        max_queue: int = 5000,
+        durability: str = "after_send",
+        max_retries: int = 5,
+    ):
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.max_queue = max_queue
+        self.durability = durability
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._cond: Optional[asyncio.Condition] = None
+        self._seq = 0
+        self._committed = 0
+
+    def configure(self, flush_interval: float, flush_rows: int, max_queue: int, durability: str) -> None:
+        """Apply settings (before start())."""
+        if durability not in DURABILITY_MODES:
+            logger.warning(f"Unknown durability mode '{durability}', using 'after_send'")
+            durability = "after_send"
+        self.flush_interval = flush_interval
+        self.flush_rows = max(1, flush_rows)
+        self.max_queue = max(1, max_queue)
+        self.durability = durability
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Start the background flusher (needs a running loop)."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._cond = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    async def append(self, user_id, role: str, content: str, message: Optional[dict] = None) -> None:
+        """
+        Queue a row; waits only when the queue is full or in before_ack mode.
+
+        `message` (the cached history message) gets the row id once flushed.
+        """
+        record = (user_id, role, content, datetime.now(timezone.utc))
+        item = [0, record, message]  # [seq, record, cached message]
+
+        if self._queue.full():
+            metrics.incr("conversation_writer_backpressure")
+        await self._queue.put(item)
+        # seq follows queue order: put() returns right after enqueueing (no
+        # await in between), whereas a producer blocked on a full queue can be
+        # overtaken by a newer one; _committed must never pass a queued row
+        self._seq += 1
+        seq = item[0] = self._seq
+        metrics.set_gauge("conversation_writer_queue", self._queue.qsize())
+
+        if self.durability == "before_ack":
+            await self.wait_for(seq)
+
+    async def wait_for(self, seq: int) -> None:
+        """Wait until every row up to `seq` is flushed (or dropped)."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._committed >= seq)
+
+    async def barrier(self) -> None:
+        """Wait until everything queued so far is flushed."""
+        if self.running and self._committed < self._seq:
+            await self.wait_for(self._seq)
+
+    async def close(self) -> None:
+        """Drain the queue and stop the flusher."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.flush_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stop:
+                # Drain whatever is left behind the stop marker
+                rest = []
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        rest.append(item)
+                if rest:
+                    await self._flush(rest)
+                return
+
+    async def _flush(self, batch: list) -> None:
+        records = [record for _, record, _ in batch]
+        for attempt in range(self.max_retries):
+            try:
+                async with _pool.acquire() as conn:
+                    ids = await conn.fetch(f"""
+                        SELECT nextval(pg_get_serial_sequence('{TABLE}', 'id')) AS id
+                        FROM generate_series(1, $1)
+                    """, len(records))
+                    ids = [r["id"] for r in ids]
+                    for (_, _, message), row_id in zip(batch, ids):
+                        if message is not None:
+                            message["id"] = row_id
+                    await conn.copy_records_to_table(
+                        TABLE,
+                        records=[record + (row_id,) for record, row_id in zip(records, ids)],
+                        columns=COPY_COLUMNS,
+                    )
+                metrics.incr("conversation_writer_rows", len(records))
+                metrics.incr("conversation_writer_flushes")
+                break
+            except Exception as e:
+                logger.warning(f"Conversation flush failed ({attempt + 1}/{self.max_retries}): {e}")
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 2.0))
+        else:
+            logger.error(f"Dropping {len(records)} conversation rows after {self.max_retries} attempts")
+            metrics.incr("conversation_writer_dropped", len(records))
+
+        metrics.set_gauge("conversation_writer_queue", self._queue.qsize())
+        async with self._cond:
+            self._committed = batch[-1][0]
+            self._cond.notify_all()
+
+
+writer = ConversationWriter()
+
+
+# =============================================================================
+# READ / WRITE
+# =============================================================================
+
+async def save_message(user_id, role: str, content: str):
+    """Save a message (write-behind when the writer runs) + history cache write-through."""
+    if writer.running:
+        message = history_cache.append(user_id, role, content)
+        await writer.append(user_id, role, content, message)
+        return
+
+    async with _pool.acquire() as conn:
+        message_id = await conn.fetchval(f"""
+            INSERT INTO {TABLE} (user_id, role, content)
+            VALUES ($1, $2, $3)
+            RETURNING id
+        """, user_id, role, content)
+    # Cached once the id is known (a load in flight may already read the row)
+    history_cache.append(user_id, role, content, message_id)
+
+
+async def fetch_history(user_id, limit: int, retention_days: int = 90) -> list[dict]:
+    """Read the last `limit` messages from Postgres (oldest first)."""
+    async with _pool.acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT id, role, content FROM {TABLE}
+            WHERE user_id = $1
+              AND created_at > NOW() - make_interval(days => $3)
+            ORDER BY created_at DESC
+            LIMIT $2
+        """, user_id, limit, retention_days)
+    return [{"id": r["id"], "role": r["role"], "content": r["content"]} for r in reversed(rows)]
+
+
+async def get_history(user_id, limit: int = 20, retention_days: int = 90) -> list[dict]:
+    """Conversation history, served from the cache when possible."""
+    cached = history_cache.get(user_id, limit)
+    if cached is not None:
+        return cached
+
+    if limit > history_cache.max_turns:
+        await writer.barrier()
+        return await fetch_history(user_id, limit, retention_days)
+
+    # Messages saved while we read are kept aside and replayed by hydrate()
+    history_cache.begin_hydrate(user_id)
+    try:
+        # Rows still buffered in the writer must be visible before hydrating
+        await writer.barrier()
+        messages = await fetch_history(user_id, history_cache.max_turns, retention_days)
+        if user_id in history_cache:
+            # A concurrent load hydrated first (and replayed what we would have)
+            return history_cache.get(user_id, limit)
+        messages = history_cache.hydrate(user_id, messages)
+    finally:
+        history_cache.end_hydrate(user_id)
+    return messages[-limit:]
@@ -7,6 +7,7 @@ from bot.handlers.commands import (
     handle_setday,
     handle_resetmsgs,
     handle_health,
+    handle_profile,
 )
 from bot.handlers.messages import handle_message
 
@@ -17,5 +18,6 @@ __all__ = [
     "handle_setday",
     "handle_resetmsgs",
     "handle_health",
+    "handle_profile",
     "handle_message",
 ]
@@ -1,14 +1,18 @@
 """
 Command handlers for Luna Bot.
 
-/start, /debug, /setpaid, /setday, /resetmsgs, /health
+/start, /debug, /setpaid, /setday, /resetmsgs, /health, /profile
 """
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from core import get_logger
+from core.overload import overload
+from core.profiler import profiler, ProfilerBusyError
+from core.tasks import task_supervisor
 from config.settings import settings
+from bot.conversations import save_message
 from memory import (
     get_or_create_user as memory_get_or_create_user,
     get_user as memory_get_user,
@@ -42,15 +46,6 @@ async def get_or_create_user_with_context(telegram_id: int) -> tuple[dict, dict]
     return user, relationship
 
 
-async def save_message(user_id, role: str, content: str):
-    """Save a message."""
-    async with _pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO conversations_simple (user_id, role, content)
-            VALUES ($1, $2, $3)
-        """, user_id, role, content)
-
-
 async def load_nsfw_gate(user_id) -> NSFWGate:
     """Load NSFW gate from DB."""
     import json
@@ -91,7 +86,12 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_health(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handler /health - Bot health check."""
+    """Handler /health - Bot health check (+ load-shedding level when degraded)."""
+    level = overload.level
+    if level:
+        shed = ", ".join(overload.stats()["shed"])
+        await update.message.reply_text(f"Luna v{settings.BOT_VERSION} - DEGRADED (level {level}: {shed} off)")
+        return
     await update.message.reply_text(f"Luna v{settings.BOT_VERSION} - OK")
 
 
@@ -151,6 +151,52 @@ User:
     await update.message.reply_text(debug_info)
 
 
+async def handle_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler /profile [seconds] (admin only) - sample the whole process."""
+    if update.effective_user.id != settings.ADMIN_TELEGRAM_ID:
+        return
+
+    args = context.args
+    try:
+        seconds = int(args[0]) if args else 30
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds]")
+        return
+    seconds = max(1, min(seconds, settings.PROFILE_MAX_SECONDS))
+
+    if profiler.running:
+        await update.message.reply_text("A profiling session is already running")
+        return
+
+    # Updates are handled one at a time: profile in the background, reply when done
+    task = task_supervisor.submit(
+        _profile_and_report(update, seconds), "profile", timeout=seconds + 60,
+    )
+    if task is None:
+        await update.message.reply_text("Profiler could not be started (task queue full)")
+        return
+    await update.message.reply_text(f"Profiling for {seconds}s...")
+
+
+async def _profile_and_report(update: Update, seconds: int):
+    """Run one profiling session and send the file paths + top functions."""
+    profiler.configure(
+        interval=settings.PROFILE_INTERVAL_MS / 1000,
+        output_dir=settings.PROFILE_DIR,
+    )
+    try:
+        result = await profiler.run(seconds)
+    except ProfilerBusyError:
+        await update.message.reply_text("A profiling session is already running")
+        return
+
+    await update.message.reply_text(
+        f"Profile: {result.samples} samples in {result.duration:.0f}s\n"
+        f"{result.speedscope_path}\n{result.collapsed_path}\n\n"
+        f"Top functions (self time):\n{result.format_top() or '(idle)'}"
+    )
+
+
 async def handle_setpaid(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler /setpaid (admin only)."""
     if update.effective_user.id != settings.ADMIN_TELEGRAM_ID:
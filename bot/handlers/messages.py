@@ -1,31 +1,34 @@
 """
 Message handler for Luna Bot.
 
-Main conversation logic.
+Buffers incoming messages, then runs the shared turn pipeline (bot/turn.py)
+with this entry point's DB and LLM helpers.
 """
 
 import asyncio
 import json
-import random
 import re
-from datetime import datetime
+import time
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from core import get_logger
 from core.errors import get_natural_error
+from core.http import get_http_client
+from core.overload import overload
+from core.usage import usage
 from config.settings import settings, NSFW_KEYWORDS, CLIMAX_PATTERNS
+from bot import conversations
+from bot.conversations import save_message
+from bot.turn import TurnDeps, build_turn_pipeline, combine_buffered, run_turn
 from memory import (
     get_or_create_user as memory_get_or_create_user,
     get_relationship,
-    extract_unified,
-    build_prompt_context,
 )
-from services.phases import Phase, get_current_phase, get_paywall_message
 from services.nsfw_gate import NSFWGate
-from services.engagement import VariableRewards, EngagementState, JealousyHandler
-from prompts.luna import build_system_prompt
+from services.engagement import EngagementState
+from services.llm import SOFT_SENSUAL_INSTRUCTION, call_with_breakers
 
 logger = get_logger(__name__)
 
@@ -77,25 +80,11 @@ async def get_or_create_user_with_context(telegram_id: int) -> tuple[dict, dict]
     return user, relationship
 
 
-async def save_message(user_id, role: str, content: str):
-    """Save message to DB."""
-    async with _pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO conversations_simple (user_id, role, content)
-            VALUES ($1, $2, $3)
-        """, user_id, role, content)
-
-
 async def get_history(user_id, limit: int = 20) -> list[dict]:
-    """Get conversation history."""
-    async with _pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT role, content FROM conversations_simple
-            WHERE user_id = $1
-            ORDER BY created_at DESC
-            LIMIT $2
-        """, user_id, limit)
-    return [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
+    """Get conversation history (in-memory ring buffer, Postgres on a miss)."""
+    return await conversations.get_history(
+        user_id, limit, retention_days=settings.CONVERSATION_RETENTION_DAYS
+    )
 
 
 async def increment_message_count(user_id) -> int:
@@ -161,17 +150,6 @@ async def save_engagement_state(user_id, state: EngagementState):
 # HELPERS
 # =============================================================================
 
-def create_safe_task(coro, task_name: str):
-    """Create async task with error handling."""
-    async def wrapped():
-        try:
-            return await coro
-        except Exception as e:
-            logger.error(f"[{task_name}] Task failed: {e}", exc_info=True)
-            return None
-    return asyncio.create_task(wrapped())
-
-
 def is_nsfw_message(message: str) -> bool:
     """Check if message contains NSFW keywords."""
     msg_lower = message.lower()
@@ -216,51 +194,53 @@ async def validate_response_facts(response: str, user_facts: dict) -> tuple[str,
 # LLM CALLS
 # =============================================================================
 
-async def call_haiku(messages: list[dict], system: str, max_tokens: int = 150) -> str:
-    """Call Claude Haiku."""
-    import httpx
-    async with httpx.AsyncClient(timeout=settings.LLM_TIMEOUT) as client:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "x-api-key": settings.ANTHROPIC_API_KEY,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json",
-            },
-            json={
-                "model": settings.HAIKU_MODEL,
-                "max_tokens": max_tokens,
-                "system": system,
-                "messages": messages,
-            },
-        )
-        response.raise_for_status()
-        return response.json()["content"][0]["text"]
+async def call_haiku(messages: list[dict], system: str, max_tokens: int = 150, site: str = "reply") -> str:
+    """Call Claude Haiku (`site` tags the token usage)."""
+    response = await get_http_client().post(
+        "https://api.anthropic.com/v1/messages",
+        headers={
+            "x-api-key": settings.ANTHROPIC_API_KEY,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json",
+        },
+        json={
+            "model": settings.HAIKU_MODEL,
+            "max_tokens": max_tokens,
+            "system": system,
+            "messages": messages,
+        },
+        timeout=settings.LLM_TIMEOUT,
+    )
+    response.raise_for_status()
+    data = response.json()
+    usage.record(site, data, model=settings.HAIKU_MODEL)
+    return data["content"][0]["text"]
 
 
 async def call_magnum(messages: list[dict], system: str) -> str:
     """Call Magnum via OpenRouter."""
-    import httpx
     formatted = [{"role": "system", "content": system}]
     for m in messages:
         formatted.append({"role": m["role"], "content": m["content"]})
 
-    async with httpx.AsyncClient(timeout=settings.LLM_TIMEOUT) as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": settings.MAGNUM_MODEL,
-                "max_tokens": 200,
-                "messages": formatted,
-                "temperature": 0.8,
-            },
-        )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+    response = await get_http_client().post(
+        "https://openrouter.ai/api/v1/chat/completions",
+        headers={
+            "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        json={
+            "model": settings.MAGNUM_MODEL,
+            "max_tokens": 200,
+            "messages": formatted,
+            "temperature": 0.8,
+        },
+        timeout=settings.LLM_TIMEOUT,
+    )
+    response.raise_for_status()
+    data = response.json()
+    usage.record("reply", data, model=settings.MAGNUM_MODEL)
+    return data["choices"][0]["message"]["content"]
 
 
 async def classify_nsfw(message: str) -> bool:
@@ -271,7 +251,8 @@ async def classify_nsfw(message: str) -> bool:
             system="""Tu es un classificateur. Réponds UNIQUEMENT 'YES' ou 'NO'.
 Ce message a-t-il une intention sexuelle/NSFW? Sois LARGE dans ton interprétation.
 EN CAS DE DOUTE -> YES""",
-            max_tokens=5
+            max_tokens=5,
+            site="classifier",
         )
         return "YES" in response.upper()
     except Exception as e:
@@ -280,17 +261,27 @@ EN CAS DE DOUTE -> YES""",
 
 
 async def generate_response(messages: list[dict], system: str, use_nsfw: bool) -> str:
-    """Generate response with appropriate model."""
+    """
+    Generate response with appropriate model, behind the per-model circuit
+    breakers (one short attempt; Magnum falls back to Haiku + soft prompt).
+    """
+    started = time.monotonic()
+    haiku = f"anthropic:{settings.HAIKU_MODEL}"
     try:
         if use_nsfw:
             logger.info("Using Magnum (NSFW)")
-            return await call_magnum(messages, system)
+            return await call_with_breakers(
+                lambda: call_magnum(messages, system), f"openrouter:{settings.MAGNUM_MODEL}",
+                lambda: call_haiku(messages, system + SOFT_SENSUAL_INSTRUCTION), haiku,
+            )
         else:
             logger.info("Using Haiku (SFW)")
-            return await call_haiku(messages, system)
+            return await call_with_breakers(lambda: call_haiku(messages, system), haiku)
     except Exception as e:
         logger.error(f"LLM error: {e}")
         return get_natural_error()
+    finally:
+        overload.record("llm_latency", time.monotonic() - started)
 
 
 # =============================================================================
@@ -324,7 +315,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def process_buffered_messages(telegram_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Process all buffered messages."""
+    """Process all buffered messages (one run of the shared turn pipeline)."""
     # Get and clear buffer
     messages_list = message_buffers.pop(telegram_id, [])
     buffer_tasks.pop(telegram_id, None)
@@ -332,145 +323,43 @@ async def process_buffered_messages(telegram_id: int, update: Update, context: C
     if not messages_list:
         return
 
-    # Dedupe consecutive identical messages
-    deduped = []
-    for msg in messages_list:
-        if not deduped or msg.lower() != deduped[-1].lower():
-            deduped.append(msg)
-
-    combined_text = " ".join(deduped) if len(deduped) > 1 else deduped[0]
-    logger.info(f"[{telegram_id}] Buffered {len(messages_list)} -> {len(deduped)} msgs")
-
-    # Get user context
-    user, relationship = await get_or_create_user_with_context(telegram_id)
-    user_id = user["id"]
-    day = (relationship or {}).get("day", 1)
-    is_paid = (relationship or {}).get("paid", False)
-    paywall_shown = (relationship or {}).get("paywall_shown", False)
-
-    # Increment message count
-    message_count = await increment_message_count(user_id)
-
-    # Save user message
-    await save_message(user_id, "user", combined_text)
-
-    # Get phase
-    current_phase = get_current_phase(message_count, day, is_paid, paywall_shown)
-    logger.info(f"[{telegram_id}] Phase: {current_phase.value} (msg={message_count})")
-
-    # Check NSFW
-    is_nsfw = is_nsfw_message(combined_text)
-
-    # PAYWALL PHASE
-    if current_phase == Phase.PAYWALL and not paywall_shown:
-        user_name = user.get("name") or "babe"
-        paywall_msg = get_paywall_message(user_name)
-        if settings.PAYMENT_LINK:
-            paywall_msg += f"\n\n{settings.PAYMENT_LINK}"
-        await update.message.reply_text(paywall_msg)
-        await save_message(user_id, "assistant", paywall_msg)
-        await mark_paywall_shown(user_id)
-        logger.info(f"[{telegram_id}] PAYWALL TRIGGERED")
-        return
+    combined_text = combine_buffered(messages_list)
+    logger.info(f"[{telegram_id}] Buffered {len(messages_list)} msgs")
 
-    # Build memory context
-    memory_context = await build_prompt_context(user_id, combined_text)
-
-    # Current time
-    now = datetime.now(settings.TIMEZONE)
-    current_time = now.strftime("%Hh%M")
-
-    # User name
-    user_name = user.get("name")
-
-    # Engagement system
-    engagement = await load_engagement_state(user_id)
-
-    # Variable rewards
-    affection_level = VariableRewards.get_affection_level(engagement.reward, current_phase.value)
-    affection_modifier = VariableRewards.get_modifier(affection_level)
-    VariableRewards.update_state(engagement.reward, affection_level)
-
-    # Jealousy
-    jealousy_modifier = None
-    if JealousyHandler.detect(combined_text):
-        jealousy_modifier = JealousyHandler.get_modifier(current_phase.value)
-        logger.info(f"[{telegram_id}] Jealousy detected")
-
-    mood_override = affection_modifier
-    if jealousy_modifier:
-        mood_override += f"\n\nJALOUSIE: {jealousy_modifier}"
-
-    # NSFW gate (LIBRE phase only)
-    nsfw_gate = None
-    use_nsfw_model = False
-    nsfw_allowed = False
-    nsfw_blocked_reason = None
-
-    if current_phase == Phase.LIBRE:
-        nsfw_gate = await load_nsfw_gate(user_id)
-        nsfw_gate.on_message()
-
-        if is_nsfw:
-            is_nsfw_request = await classify_nsfw(combined_text)
-            if is_nsfw_request:
-                can_nsfw, reason = nsfw_gate.check()
-                if can_nsfw:
-                    use_nsfw_model = True
-                    nsfw_allowed = True
-                    logger.info(f"[{telegram_id}] NSFW gate: OPEN")
-                else:
-                    nsfw_blocked_reason = reason
-                    logger.info(f"[{telegram_id}] NSFW gate: BLOCKED ({reason})")
-
-    # Build prompt
-    system = build_system_prompt(
-        phase=current_phase.value,
-        user_name=user_name,
-        memory_context=memory_context,
-        current_time=current_time,
-        nsfw_allowed=nsfw_allowed,
-        nsfw_blocked_reason=nsfw_blocked_reason,
-        mood=mood_override,
-    )
+    run = await run_turn(turn_pipeline, telegram_id, combined_text, update.message.reply_text)
+    if run.stopped_by:
+        return
 
-    # Get history and generate
-    history = await get_history(user_id, limit=20)
-    messages = history + [{"role": "user", "content": combined_text}]
-    response = await generate_response(messages, system, use_nsfw_model)
-
-    # Detect climax
-    if nsfw_gate and any(p in response.lower() for p in CLIMAX_PATTERNS):
-        nsfw_gate.on_nsfw_done()
-        logger.info(f"[{telegram_id}] CLIMAX detected")
-
-    # Save states
-    if nsfw_gate:
-        await save_nsfw_gate(user_id, nsfw_gate)
-    await save_engagement_state(user_id, engagement)
-
-    # Clean response
-    response = response.strip()
-    if len(response) > 500:
-        response = response[:500] + "..."
-
-    # Validate
-    response, warnings = await validate_response_facts(response, user)
-
-    # Save and send
-    await save_message(user_id, "assistant", response)
-
-    # Extract memory in background
-    history_short = await get_history(user_id, limit=10)
-    create_safe_task(
-        extract_unified(user_id, combined_text, response, history_short),
-        "extract_unified"
+    values = run.values
+    logger.info(
+        f"[{telegram_id}] Phase: {values['phase'].value} | Affection: {values['affection_level']} | "
+        f"NSFW: {values['is_nsfw']} | llm={run.timings.get('llm', 0) * 1000:.0f}ms"
     )
 
-    # Natural delay
-    if not settings.TEST_MODE:
-        await asyncio.sleep(random.uniform(0.3, 1.0))
 
-    await update.message.reply_text(response)
+# =============================================================================
+# TURN PIPELINE
+# =============================================================================
 
-    logger.info(f"[{telegram_id}] Phase: {current_phase.value} | Affection: {affection_level} | NSFW: {is_nsfw}")
+turn_pipeline = build_turn_pipeline(TurnDeps(
+    get_user_with_context=get_or_create_user_with_context,
+    increment_message_count=increment_message_count,
+    save_message=save_message,
+    get_history=get_history,
+    mark_paywall_shown=mark_paywall_shown,
+    load_engagement_state=load_engagement_state,
+    save_engagement_state=save_engagement_state,
+    load_nsfw_gate=load_nsfw_gate,
+    save_nsfw_gate=save_nsfw_gate,
+    classify_nsfw=classify_nsfw,
+    generate_response=generate_response,
+    validate_response_facts=validate_response_facts,
+    is_nsfw_message=is_nsfw_message,
+    climax_patterns=CLIMAX_PATTERNS,
+    timezone=settings.TIMEZONE,
+    payment_link=settings.PAYMENT_LINK,
+    natural_delay=not settings.TEST_MODE,
+    reply_model=settings.HAIKU_MODEL,
+    nsfw_model=settings.MAGNUM_MODEL,
+    prompt_token_limit=settings.PROMPT_TOKEN_LIMIT,
+))
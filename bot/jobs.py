@@ -0,0 +1,293 @@
+"""
+Scheduled maintenance jobs.
+
+Tier updates, weekly/monthly compression and daily cleanup. They run in the
+worker process (python -m bot.worker) or, when RUN_JOBS_IN_BOT is set, on the
+bot's own JobQueue.
+
+Every run goes through run_exclusive():
+- a Postgres advisory lock per job elects a single leader across instances
+- a run already recorded in the job's dedup window is not repeated
+  (instances whose clocks fire a little later skip the slot)
+- start, end, duration, status and error are stored in job_runs
+"""
+
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, time as dt_time, timedelta
+from typing import Awaitable, Callable, Optional
+
+from core import get_logger
+from core.database import disable_statement_timeout
+from config.settings import settings
+from middleware.metrics import metrics
+from memory import update_tiers
+from memory.prefilter import prune_outcomes
+from bot.conversations import enforce_retention, ensure_partitions
+
+logger = get_logger(__name__)
+
+_pool = None
+
+JOB_RUNS_TABLE = """
+CREATE TABLE IF NOT EXISTS job_runs (
+    id BIGSERIAL PRIMARY KEY,
+    job TEXT NOT NULL,
+    host TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE,
+    duration_ms INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_job_runs_job_started ON job_runs (job, started_at DESC);
+"""
+
+HOST = socket.gethostname()
+
+
+def set_pool(pool):
+    """Set database pool for this module."""
+    global _pool
+    _pool = pool
+
+
+async def init_job_tables(conn) -> None:
+    """Create the job_runs history table."""
+    await conn.execute(JOB_RUNS_TABLE)
+
+
+# =============================================================================
+# JOBS
+# =============================================================================
+
+def _compression():
+    """Import the compression module on first use (weekly/monthly jobs only)."""
+    from memory import compression
+    if compression.OPENROUTER_API_KEY is None:
+        compression.set_api_key(settings.OPENROUTER_API_KEY)
+    return compression
+
+
+def _check_compression(name: str, stats: dict) -> None:
+    """Fail the run (job_runs status 'error') when users failed, so the slot can be retried."""
+    if stats.get("users_failed"):
+        raise RuntimeError(f"{name} compression: {stats['users_failed']} users failed")
+
+
+async def job_memory_tiers(context):
+    """Hourly memory tier update."""
+    count = await update_tiers()
+    if count:
+        logger.info(f"Memory tiers updated: {count}")
+
+
+async def job_weekly_compression(context):
+    """Weekly compression (Sundays 3am)."""
+    logger.info("Running weekly compression...")
+    stats = await _compression().run_weekly_compression(
+        workers=settings.COMPRESSION_WORKERS,
+        deadline=settings.COMPRESSION_DEADLINE,
+    )
+    logger.info(f"Weekly compression done: {stats}")
+    _check_compression("Weekly", stats)
+
+
+async def job_monthly_compression(context):
+    """Monthly compression (1st of month 4am)."""
+    if datetime.now().day != 1:
+        return
+    logger.info("Running monthly compression...")
+    stats = await _compression().run_monthly_compression(
+        workers=settings.COMPRESSION_WORKERS,
+        deadline=settings.COMPRESSION_DEADLINE,
+    )
+    logger.info(f"Monthly compression done: {stats}")
+    _check_compression("Monthly", stats)
+
+
+async def job_compression_catchup(context):
+    """
+    Resume a compression run interrupted by a restart.
+
+    Runs are checkpointed per user, so this only processes the users the
+    scheduled run did not reach.
+    """
+    now = datetime.now()
+    if now.weekday() == 6 and now.hour >= 3:
+        await job_weekly_compression(context)
+    if now.day == 1 and now.hour >= 4:
+        await job_monthly_compression(context)
+
+
+async def job_daily_cleanup(context):
+    """Daily DB cleanup (2am)."""
+    async with _pool.acquire() as conn:
+        # Partition drops and batched deletes: not bound by the reply-path timeout
+        await disable_statement_timeout(conn)
+        # Conversations: monthly partitions, retention = drop whole partitions
+        await ensure_partitions(conn, months_ahead=settings.CONVERSATION_PARTITIONS_AHEAD)
+        conv_dropped = await enforce_retention(conn, retention_days=settings.CONVERSATION_RETENTION_DAYS)
+
+        # Timeline: row-selective retention (cold + unpinned), small batches
+        events_deleted = 0
+        while True:
+            deleted = await conn.fetchval("""
+                WITH deleted AS (
+                    DELETE FROM memory_timeline
+                    WHERE id IN (
+                        SELECT id FROM memory_timeline
+                        WHERE tier = 'cold'
+                          AND pinned = FALSE
+                          AND created_at < NOW() - INTERVAL '180 days'
+                        LIMIT 5000
+                    )
+                    RETURNING id
+                )
+                SELECT COUNT(*) FROM deleted
+            """)
+            events_deleted += deleted
+            if deleted < 5000:
+                break
+
+        # Extraction outcomes (pre-filter training data): raw user text, bounded
+        outcomes_deleted = await prune_outcomes(
+            conn,
+            keep=settings.EXTRACTION_OUTCOMES_KEEP,
+            retention_days=settings.EXTRACTION_OUTCOMES_RETENTION_DAYS,
+        )
+
+        if conv_dropped or events_deleted or outcomes_deleted:
+            logger.info(
+                f"DB cleanup: {conv_dropped} conv partitions/rows, {events_deleted} events, "
+                f"{outcomes_deleted} extraction outcomes"
+            )
+
+    # Daily full tier sweep (hourly runs only look past the high-water mark)
+    await update_tiers(full=True)
+
+
+# =============================================================================
+# SCHEDULE
+# =============================================================================
+
+@dataclass(frozen=True)
+class JobSpec:
+    """When a job runs. Exactly one of interval / at / once."""
+    name: str
+    func: Callable[[object], Awaitable]
+    interval: Optional[float] = None        # repeating, seconds
+    at: Optional[dt_time] = None            # daily at this time (UTC, like JobQueue)
+    days: tuple[int, ...] = tuple(range(7))  # JobQueue convention: 0 = Sunday
+    once: bool = False
+    first: float = 0                        # delay before the first interval/once run
+
+    @property
+    def dedup_window(self) -> float:
+        """A run started less than this many seconds ago means the slot is taken."""
+        if self.interval:
+            return self.interval / 2
+        return 3600
+
+
+JOBS = (
+    JobSpec("memory_tiers", job_memory_tiers, interval=3600, first=300),
+    JobSpec("weekly_compression", job_weekly_compression, at=dt_time(3, 0), days=(0,)),
+    JobSpec("monthly_compression", job_monthly_compression, at=dt_time(4, 0)),
+    JobSpec("compression_catchup", job_compression_catchup, once=True, first=600),
+    JobSpec("daily_cleanup", job_daily_cleanup, at=dt_time(2, 0)),
+)
+
+
+def next_run(spec: JobSpec, now: datetime, last: Optional[datetime] = None) -> Optional[datetime]:
+    """Next fire time after `now` (None when a one-shot job already ran)."""
+    if spec.once:
+        return now + timedelta(seconds=spec.first) if last is None else None
+    if spec.interval:
+        if last is None:
+            return now + timedelta(seconds=spec.first)
+        return max(now, last + timedelta(seconds=spec.interval))
+
+    candidate = now.replace(hour=spec.at.hour, minute=spec.at.minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    # datetime.weekday(): Monday = 0  ->  JobQueue: Sunday = 0
+    while (candidate.weekday() + 1) % 7 not in spec.days:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def register_jobs(job_queue) -> None:
+    """Schedule every job on a telegram JobQueue (in-bot mode)."""
+    for spec in JOBS:
+        callback = _queue_callback(spec)
+        if spec.once:
+            job_queue.run_once(callback, when=spec.first, name=spec.name)
+        elif spec.interval:
+            job_queue.run_repeating(callback, interval=spec.interval, first=spec.first, name=spec.name)
+        else:
+            job_queue.run_daily(callback, time=spec.at, days=spec.days, name=spec.name)
+
+
+def _queue_callback(spec: JobSpec):
+    async def callback(context):
+        await run_exclusive(spec, context)
+    return callback
+
+
+# =============================================================================
+# LEADER ELECTION + HISTORY
+# =============================================================================
+
+async def run_exclusive(spec: JobSpec, context=None) -> Optional[str]:
+    """
+    Run a job if this instance wins its advisory lock.
+
+    The lock is session-level, so it is held on one dedicated connection for
+    the whole run and released even if the job fails.
+
+    Returns:
+        "ok", "error", or None when skipped (lock held elsewhere / slot already run)
+    """
+    async with _pool.acquire() as conn:
+        locked = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", f"luna_job:{spec.name}")
+        if not locked:
+            metrics.incr(f"job_{spec.name}_skipped")
+            logger.debug(f"Job {spec.name} already running on another instance")
+            return None
+
+        try:
+            recent = await conn.fetchval("""
+                SELECT 1 FROM job_runs
+                WHERE job = $1 AND status <> 'error'
+                  AND started_at > NOW() - make_interval(secs => $2)
+                LIMIT 1
+            """, spec.name, spec.dedup_window)
+            if recent:
+                metrics.incr(f"job_{spec.name}_skipped")
+                return None
+
+            run_id = await conn.fetchval("""
+                INSERT INTO job_runs (job, host) VALUES ($1, $2) RETURNING id
+            """, spec.name, HOST)
+
+            started = time.monotonic()
+            status, error = "ok", None
+            try:
+                await spec.func(context)
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+                logger.error(f"Job {spec.name} failed: {e}", exc_info=True)
+            duration_ms = int((time.monotonic() - started) * 1000)
+
+            await conn.execute("""
+                UPDATE job_runs
+                SET status = $2, finished_at = NOW(), duration_ms = $3, error = $4
+                WHERE id = $1
+            """, run_id, status, duration_ms, error)
+            metrics.incr(f"job_{spec.name}_{status}")
+            metrics.set_gauge(f"job_{spec.name}_duration_ms", duration_ms)
+            return status
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", f"luna_job:{spec.name}")
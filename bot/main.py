@@ -6,22 +6,27 @@ Usage:
 """
 
 import asyncio
-from datetime import time as dt_time
+import time
 
-import asyncpg
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
 from core import get_logger, setup_logging
+from core import database, offload
+from core.http import close_http_client, configure_cassette, prewarm_http
+from core.usage import init_usage_table, usage
+from core.loop_monitor import loop_monitor
+from core.overload import overload
+from core.tasks import task_supervisor
 from config.settings import settings, validate_settings
 from memory import (
     set_pool as set_memory_pool,
     set_extraction_api_key,
-    set_compression_api_key,
     init_memory_tables,
-    update_tiers,
-    run_weekly_compression,
-    run_monthly_compression,
+    extraction_scheduler,
+    extraction_prefilter,
+    rolling_summaries,
 )
+from prompts.loader import preload_prompts
 from bot.handlers import (
     handle_start,
     handle_debug,
@@ -29,10 +34,14 @@ from bot.handlers import (
     handle_setday,
     handle_resetmsgs,
     handle_health,
+    handle_profile,
     handle_message,
 )
 from bot.handlers import commands as cmd_module
+from bot import conversations, jobs
+from bot.conversations import init_conversations
 from bot.handlers import messages as msg_module
+from payments.subscription import set_pool as set_subscription_pool
 
 logger = get_logger(__name__)
 
@@ -41,43 +50,43 @@ logger = get_logger(__name__)
 # DATABASE INIT
 # =============================================================================
 
-pool: asyncpg.Pool | None = None
+db: database.Database | None = None
 
 
 async def init_db():
     """Initialize database and memory system."""
-    global pool
-    pool = await asyncpg.create_pool(
-        **settings.DB_CONFIG,
-        min_size=settings.DB_POOL_MIN,
-        max_size=settings.DB_POOL_MAX,
+    global db
+    db = await database.init_db(**settings.DB_CONFIG, **settings.DB_POOL_OPTIONS)
+
+    # Every module shares the same Database (pool limits, timeouts, metrics)
+    cmd_module.set_pool(db)
+    msg_module.set_pool(db)
+    conversations.set_pool(db)
+    jobs.set_pool(db)
+    set_subscription_pool(db)
+    conversations.history_cache.configure(
+        max_turns=settings.HISTORY_CACHE_TURNS,
+        max_bytes=settings.HISTORY_CACHE_MAX_BYTES,
+    )
+    conversations.writer.configure(
+        flush_interval=settings.CONVERSATION_FLUSH_MS / 1000,
+        flush_rows=settings.CONVERSATION_FLUSH_ROWS,
+        max_queue=settings.CONVERSATION_QUEUE_MAX,
+        durability=settings.CONVERSATION_DURABILITY,
     )
-
-    # Set pool for handlers
-    cmd_module.set_pool(pool)
-    msg_module.set_pool(pool)
 
     # Init memory system
-    set_memory_pool(pool)
+    set_memory_pool(db)
     set_extraction_api_key(settings.OPENROUTER_API_KEY)
-    set_compression_api_key(settings.OPENROUTER_API_KEY)
-    await init_memory_tables(pool)
+    await init_memory_tables(db)
 
     # Create additional tables
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS conversations_simple (
-                id SERIAL PRIMARY KEY,
-                user_id UUID REFERENCES memory_users(id),
-                role VARCHAR(10) NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-            )
-        """)
-        await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_conv_simple_user
-            ON conversations_simple(user_id, created_at DESC)
-        """)
+    async with db.acquire() as conn:
+        await database.disable_statement_timeout(conn)
+        await init_conversations(conn, months_ahead=settings.CONVERSATION_PARTITIONS_AHEAD)
+        await jobs.init_job_tables(conn)
+        if settings.LLM_USAGE_AUDIT:
+            await init_usage_table(conn)
         await conn.execute("""
             ALTER TABLE memory_relationships
             ADD COLUMN IF NOT EXISTS nsfw_gate_data JSON DEFAULT NULL
@@ -103,75 +112,91 @@ async def init_db():
             )
         """)
 
+    # CPU-heavy steps go to worker processes above a size threshold
+    offload.configure(max_workers=settings.OFFLOAD_WORKERS, min_size=settings.OFFLOAD_MIN_SIZE)
+
+    # Fire-and-forget work runs in bounded lanes
+    task_supervisor.configure({
+        "default": (settings.TASKS_DEFAULT_CONCURRENCY, settings.TASKS_MAX_QUEUED, 1, 60.0),
+        "background": (settings.TASKS_BACKGROUND_CONCURRENCY, settings.TASKS_MAX_QUEUED, 2, 300.0),
+    })
+
+    # Token accounting: optional per-turn audit rows
+    usage.configure(pool=db, audit=settings.LLM_USAGE_AUDIT)
+
+    # Load shedding: optional stages are skipped while signals are above threshold
+    overload.configure(
+        {
+            "db_wait": settings.OVERLOAD_DB_WAIT_MS / 1000,
+            "loop_lag": settings.OVERLOAD_LOOP_LAG_MS / 1000,
+            "llm_latency": settings.OVERLOAD_LLM_LATENCY,
+            "queue_depth": settings.OVERLOAD_QUEUE_DEPTH,
+        },
+        recover_ratio=settings.OVERLOAD_RECOVER_RATIO,
+        step_up=settings.OVERLOAD_STEP_UP,
+        step_down=settings.OVERLOAD_STEP_DOWN,
+        enabled=settings.OVERLOAD_ENABLED,
+    )
+    overload.register_probe(
+        "queue_depth", lambda: sum(lane["queued"] for lane in task_supervisor.stats().values())
+    )
+
+    # Background extraction queue (persisted turns survive restarts)
+    extraction_scheduler.configure(
+        debounce=settings.EXTRACTION_DEBOUNCE,
+        max_batch=settings.EXTRACTION_MAX_BATCH,
+        max_concurrent=settings.EXTRACTION_MAX_CONCURRENT,
+    )
+    await extraction_scheduler.restore()
+    extraction_prefilter.configure(
+        threshold=settings.EXTRACTION_PREFILTER_THRESHOLD,
+        mode=settings.EXTRACTION_PREFILTER_MODE,
+        weights_path=settings.EXTRACTION_PREFILTER_WEIGHTS_PATH,
+    )
+
+    # Rolling conversation summary (replies carry it + a short raw tail)
+    rolling_summaries.configure(
+        every_turns=settings.ROLLING_SUMMARY_EVERY_TURNS,
+        raw_tail=settings.ROLLING_SUMMARY_RAW_TAIL,
+        api_key=settings.OPENROUTER_API_KEY,
+        barrier=conversations.writer.barrier,
+    )
+
+    # Write-behind conversation log (after tables exist)
+    conversations.writer.start()
+
     logger.info("Database initialized")
 
 
-# =============================================================================
-# JOBS
-# =============================================================================
+async def _timed(name: str, coro) -> tuple[str, float]:
+    """Await a startup step and return its duration in ms."""
+    start = time.perf_counter()
+    await coro
+    return name, (time.perf_counter() - start) * 1000
 
-async def job_memory_tiers(context):
-    """Hourly memory tier update."""
-    try:
-        count = await update_tiers()
-        if count:
-            logger.info(f"Memory tiers updated: {count}")
-    except Exception as e:
-        logger.error(f"Tier update error: {e}")
 
+async def warm_start():
+    """
+    Run the startup steps concurrently: DB pool + schema, provider
+    connections and prompt files.
 
-async def job_weekly_compression(context):
-    """Weekly compression (Sundays 3am)."""
-    try:
-        logger.info("Running weekly compression...")
-        stats = await run_weekly_compression()
-        logger.info(f"Weekly compression done: {stats}")
-    except Exception as e:
-        logger.error(f"Weekly compression error: {e}")
-
-
-async def job_monthly_compression(context):
-    """Monthly compression (1st of month 4am)."""
-    from datetime import datetime
-    if datetime.now().day != 1:
-        return
-    try:
-        logger.info("Running monthly compression...")
-        stats = await run_monthly_compression()
-        logger.info(f"Monthly compression done: {stats}")
-    except Exception as e:
-        logger.error(f"Monthly compression error: {e}")
+    Provider prewarm failures are logged but never block startup.
+    """
+    # Provider traffic record/replay (before the shared HTTP client exists)
+    configure_cassette(
+        settings.HTTP_CASSETTE_MODE,
+        settings.HTTP_CASSETTE_PATH,
+        time_scale=settings.HTTP_CASSETTE_TIME_SCALE,
+        strict=settings.HTTP_CASSETTE_STRICT,
+    )
 
+    steps = [_timed("db", init_db())]
+    if settings.STARTUP_PREWARM:
+        steps.append(_timed("http", prewarm_http()))
+        steps.append(_timed("prompts", asyncio.to_thread(preload_prompts)))
 
-async def job_daily_cleanup(context):
-    """Daily DB cleanup (2am)."""
-    try:
-        async with pool.acquire() as conn:
-            conv_deleted = await conn.fetchval("""
-                WITH deleted AS (
-                    DELETE FROM conversations_simple
-                    WHERE created_at < NOW() - INTERVAL '90 days'
-                    RETURNING id
-                )
-                SELECT COUNT(*) FROM deleted
-            """)
-
-            events_deleted = await conn.fetchval("""
-                WITH deleted AS (
-                    DELETE FROM memory_timeline
-                    WHERE tier = 'cold'
-                      AND pinned = FALSE
-                      AND created_at < NOW() - INTERVAL '180 days'
-                    RETURNING id
-                )
-                SELECT COUNT(*) FROM deleted
-            """)
-
-            if conv_deleted or events_deleted:
-                logger.info(f"DB cleanup: {conv_deleted} convs, {events_deleted} events")
-
-    except Exception as e:
-        logger.error(f"DB cleanup error: {e}")
+    timings = await asyncio.gather(*steps)
+    logger.info("Startup: " + ", ".join(f"{name}={ms:.0f}ms" for name, ms in timings))
 
 
 # =============================================================================
@@ -189,15 +214,14 @@ def create_app() -> Application:
     app.add_handler(CommandHandler("setpaid", handle_setpaid))
     app.add_handler(CommandHandler("setday", handle_setday))
     app.add_handler(CommandHandler("resetmsgs", handle_resetmsgs))
+    app.add_handler(CommandHandler("profile", handle_profile))
 
     # Message handler
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    # Jobs
-    app.job_queue.run_repeating(job_memory_tiers, interval=3600, first=300)
-    app.job_queue.run_daily(job_weekly_compression, time=dt_time(3, 0), days=(6,))
-    app.job_queue.run_daily(job_monthly_compression, time=dt_time(4, 0))
-    app.job_queue.run_daily(job_daily_cleanup, time=dt_time(2, 0))
+    # Scheduled jobs (normally run by python -m bot.worker instead)
+    if settings.RUN_JOBS_IN_BOT:
+        jobs.register_jobs(app.job_queue)
 
     return app
 
@@ -215,8 +239,15 @@ async def run_bot():
             logger.error(f"Config error: {e}")
         raise SystemExit(1)
 
-    # Init DB
-    await init_db()
+    # Init DB (+ prewarm providers and prompts concurrently)
+    await warm_start()
+
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.configure(
+            interval=settings.LOOP_LAG_INTERVAL_MS / 1000,
+            slow_threshold=settings.LOOP_SLOW_CALLBACK_MS / 1000,
+        )
+        loop_monitor.start()
 
     # Create and run app
     app = create_app()
@@ -236,8 +267,13 @@ async def run_bot():
         await app.updater.stop()
         await app.stop()
         await app.shutdown()
-        if pool:
-            await pool.close()
+        await task_supervisor.shutdown(deadline=settings.TASKS_SHUTDOWN_DEADLINE)
+        await extraction_scheduler.shutdown()
+        await conversations.writer.close()
+        await close_http_client()
+        await database.close_db()
+        await loop_monitor.stop()
+        offload.shutdown_offload()
 
 
 def main():
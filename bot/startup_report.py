@@ -0,0 +1,116 @@
+"""
+Startup import-time report.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+summarizes where startup time goes.
+
+Usage:
+    python -m bot.startup_report                 # bot.main, top 20
+    python -m bot.startup_report services.llm --top 10
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+
+
+@dataclass
+class ImportTiming:
+    """One line of -X importtime output."""
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> list[ImportTiming]:
+    """
+    Parse -X importtime output.
+
+    Lines look like:
+        import time:       412 |       1033 |   asyncio.events
+    """
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            # Header line ("self [us] | cumulative | imported package")
+            continue
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped)) // 2
+        timings.append(ImportTiming(stripped, self_us, cumulative_us, depth))
+    return timings
+
+
+def summarize_by_package(timings: list[ImportTiming]) -> dict[str, int]:
+    """Sum self time per top-level package (us), slowest first."""
+    totals: dict[str, int] = defaultdict(int)
+    for t in timings:
+        totals[t.module.split(".")[0]] += t.self_us
+    return dict(sorted(totals.items(), key=lambda kv: kv[1], reverse=True))
+
+
+def run_importtime(module: str) -> list[ImportTiming]:
+    """Import `module` in a clean subprocess and return its timings."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        # Last line of the traceback is enough to diagnose a missing dep
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "unknown error"
+        raise RuntimeError(f"import {module} failed: {error}")
+    return parse_importtime(proc.stderr)
+
+
+def format_report(module: str, timings: list[ImportTiming], top: int = 20) -> str:
+    """Build the text report."""
+    total_us = max((t.cumulative_us for t in timings if t.module == module), default=0)
+    lines = [
+        f"Import report for {module}: {total_us / 1000:.1f}ms, {len(timings)} modules",
+        "",
+        f"Top {top} by self time:",
+    ]
+    for t in sorted(timings, key=lambda t: t.self_us, reverse=True)[:top]:
+        lines.append(f"  {t.self_us / 1000:8.1f}ms  {t.module}")
+
+    lines += ["", f"Top {top} by cumulative time:"]
+    for t in sorted(timings, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        lines.append(f"  {t.cumulative_us / 1000:8.1f}ms  {t.module}")
+
+    lines += ["", "By top-level package (self time):"]
+    for package, us in list(summarize_by_package(timings).items())[:top]:
+        lines.append(f"  {us / 1000:8.1f}ms  {package}")
+
+    return "\n".join(lines)
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description="Startup import-time report")
+    parser.add_argument("module", nargs="?", default="bot.main")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    try:
+        timings = run_importtime(args.module)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        raise SystemExit(1)
+
+    print(format_report(args.module, timings, top=args.top))
+
+
+if __name__ == "__main__":
+    main()
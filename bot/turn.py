@@ -0,0 +1,364 @@
+"""
+Turn pipeline shared by both entry points.
+
+bot/handlers/messages.py and luna_simple.py run the same stage graph; each
+supplies its own I/O helpers (tables, models, delays) through TurnDeps.
+
+Stages and what they wait for:
+
+    load_user ─┬─ count ── phase ─┬─ paywall ─────┐
+               ├─ save_user ──────┘               │
+               ├─ memory ─────────────────────────┤
+               ├─ conversation_summary ───────────┤
+               ├─ engagement (phase) ─────────────┼─ prompt ── llm ─┬─ save_state
+               ├─ nsfw (phase) ───────────────────┤                 └─ finalize ─ persist ─┬─ extract
+               └─ history (save_user) ────────────┘                                        ├─ summarize
+                                                                                           └─ send
+
+memory, history, the rolling conversation summary, engagement and the NSFW
+gate load concurrently. The prompt stage packs memory sections, the summary
+and history turns by priority under one token budget for the reply model
+(core/tokens.py) and reports what it dropped; once a summary exists only
+the raw tail after it is sent (memory/conversation_summary.py). The LLM
+call starts right after. summarize refreshes the summary in the background
+every N turns. The paywall stage ends the turn (PipelineStop) before any
+LLM call.
+
+run_turn() collects the token usage of every LLM call of the turn
+(core/usage.py); the llm stage declares the prompt sections of the reply.
+"""
+
+import asyncio
+import random
+from dataclasses import dataclass
+from datetime import datetime, tzinfo
+from functools import partial
+from typing import Awaitable, Callable, Sequence
+
+from core import get_logger
+from core.overload import overload
+from core.pipeline import Pipeline, PipelineRun, PipelineStop, Stage
+from core.tasks import task_supervisor
+from core.tokens import MESSAGE_OVERHEAD_TOKENS, PromptBudget, count_tokens, prompt_token_limit
+from core.usage import usage
+from memory import build_prompt_sections, pack_sections, extraction_scheduler, rolling_summaries
+from middleware.metrics import metrics
+from services.phases import Phase, get_current_phase, get_paywall_message
+from services.engagement import VariableRewards, JealousyHandler
+from prompts.luna import build_system_prompt
+
+logger = get_logger(__name__)
+
+MAX_RESPONSE_CHARS = 500
+
+# History turns compete with memory sections for the prompt budget: the last
+# few messages rank with the must-have memory, older ones fade with age.
+HISTORY_RECENT_MESSAGES = 4
+
+
+@dataclass(frozen=True)
+class TurnDeps:
+    """Entry-point specific helpers used by the turn stages."""
+    get_user_with_context: Callable[[int], Awaitable[tuple[dict, dict]]]
+    increment_message_count: Callable[..., Awaitable[int]]
+    save_message: Callable[..., Awaitable]
+    get_history: Callable[..., Awaitable[list[dict]]]
+    mark_paywall_shown: Callable[..., Awaitable]
+    load_engagement_state: Callable[..., Awaitable]
+    save_engagement_state: Callable[..., Awaitable]
+    load_nsfw_gate: Callable[..., Awaitable]
+    save_nsfw_gate: Callable[..., Awaitable]
+    classify_nsfw: Callable[[str], Awaitable[bool]]
+    generate_response: Callable[[list[dict], str, bool], Awaitable[str]]
+    validate_response_facts: Callable[[str, dict], Awaitable[tuple[str, list[str]]]]
+    is_nsfw_message: Callable[[str], bool]
+    climax_patterns: Sequence[str]
+    timezone: tzinfo
+    payment_link: str = ""
+    paywall_name: str = "babe"
+    natural_delay: bool = True
+    # Prompt budget (core/tokens.py): per-model table unless prompt_token_limit > 0
+    reply_model: str = ""
+    nsfw_model: str = ""
+    prompt_token_limit: int = 0
+
+
+def combine_buffered(messages_list: list[str]) -> str:
+    """Drop consecutive duplicates (spam) and join the buffered messages."""
+    deduped = []
+    for msg in messages_list:
+        if not deduped or msg.lower() != deduped[-1].lower():
+            deduped.append(msg)
+    return " ".join(deduped) if len(deduped) > 1 else deduped[0]
+
+
+# =============================================================================
+# STAGES
+# =============================================================================
+
+async def _load_user(deps: TurnDeps, telegram_id: int) -> dict:
+    user, relationship = await deps.get_user_with_context(telegram_id)
+    return {"user": user, "user_id": user["id"], "relationship": relationship or {}}
+
+
+async def _count(deps: TurnDeps, user_id) -> dict:
+    return {"message_count": await deps.increment_message_count(user_id)}
+
+
+async def _save_user(deps: TurnDeps, user_id, text: str) -> dict:
+    await deps.save_message(user_id, "user", text)
+    return {"user_saved": True}
+
+
+async def _phase(telegram_id: int, relationship: dict, message_count: int) -> dict:
+    phase = get_current_phase(
+        message_count,
+        relationship.get("day", 1),
+        relationship.get("paid", False),
+        relationship.get("paywall_shown", False),
+    )
+    logger.info(f"[{telegram_id}] Phase: {phase.value} (msg={message_count}, day={relationship.get('day', 1)})")
+    return {"phase": phase}
+
+
+async def _paywall(deps: TurnDeps, telegram_id: int, phase: Phase, user: dict, user_id,
+                   relationship: dict, user_saved: bool, reply) -> dict:
+    if phase != Phase.PAYWALL or relationship.get("paywall_shown", False):
+        return {"paywall_checked": True}
+
+    paywall_msg = get_paywall_message(user.get("name") or deps.paywall_name)
+    if deps.payment_link:
+        paywall_msg += f"\n\n{deps.payment_link}"
+    await reply(paywall_msg)
+    await deps.save_message(user_id, "assistant", paywall_msg)
+    await deps.mark_paywall_shown(user_id)
+    logger.info(f"[{telegram_id}] PAYWALL TRIGGERED")
+    raise PipelineStop()
+
+
+async def _memory(user_id, text: str) -> dict:
+    return {"memory_sections": await build_prompt_sections(user_id, text)}
+
+
+async def _history(deps: TurnDeps, user_id, user_saved: bool) -> dict:
+    return {"history": await deps.get_history(user_id, limit=20)}
+
+
+async def _conversation_summary(user_id) -> dict:
+    return {"conversation_summary": await rolling_summaries.get(user_id)}
+
+
+async def _engagement(deps: TurnDeps, telegram_id: int, user_id, phase: Phase, text: str) -> dict:
+    engagement = await deps.load_engagement_state(user_id)
+
+    # Variable rewards
+    affection_level = VariableRewards.get_affection_level(engagement.reward, phase.value)
+    mood = VariableRewards.get_modifier(affection_level)
+    VariableRewards.update_state(engagement.reward, affection_level)
+
+    # Jealousy
+    if JealousyHandler.detect(text):
+        mood += f"\n\nJALOUSIE: {JealousyHandler.get_modifier(phase.value)}"
+        logger.info(f"[{telegram_id}] Jealousy detected")
+
+    return {"engagement": engagement, "affection_level": affection_level, "mood": mood}
+
+
+async def _nsfw(deps: TurnDeps, telegram_id: int, user_id, phase: Phase, text: str) -> dict:
+    """NSFW gate (LIBRE phase only): keywords first (free), then the classifier confirms."""
+    is_nsfw = deps.is_nsfw_message(text)
+    out = {
+        "is_nsfw": is_nsfw,
+        "nsfw_gate": None,
+        "use_nsfw_model": False,
+        "nsfw_allowed": False,
+        "nsfw_blocked_reason": None,
+    }
+    if phase != Phase.LIBRE:
+        return out
+
+    nsfw_gate = await deps.load_nsfw_gate(user_id)
+    nsfw_gate.on_message()
+    out["nsfw_gate"] = nsfw_gate
+
+    if is_nsfw and await deps.classify_nsfw(text):
+        can_nsfw, reason = nsfw_gate.check()
+        if can_nsfw:
+            out["use_nsfw_model"] = out["nsfw_allowed"] = True
+            logger.info(f"[{telegram_id}] NSFW gate: OPEN")
+        else:
+            out["nsfw_blocked_reason"] = reason
+            logger.info(f"[{telegram_id}] NSFW gate: BLOCKED ({reason})")
+    return out
+
+
+def history_priority(age: int) -> int:
+    """Budget priority of a history message (age 0 = latest)."""
+    if age < HISTORY_RECENT_MESSAGES:
+        return 10
+    return max(1, 9 - (age - HISTORY_RECENT_MESSAGES) // 4)
+
+
+async def _prompt(deps: TurnDeps, telegram_id: int, phase: Phase, user: dict, memory_sections: list,
+                  history: list[dict], conversation_summary, text: str, mood: str,
+                  nsfw_allowed: bool, nsfw_blocked_reason, use_nsfw_model: bool, paywall_checked: bool) -> dict:
+    """Pack memory sections, the conversation summary and history under the reply model's budget."""
+    def system_prompt(memory_context: str) -> str:
+        return build_system_prompt(
+            phase=phase.value,
+            user_name=user.get("name") or None,
+            memory_context=memory_context,
+            current_time=datetime.now(deps.timezone).strftime("%Hh%M"),
+            nsfw_allowed=nsfw_allowed,
+            nsfw_blocked_reason=nsfw_blocked_reason,
+            mood=mood,
+        )
+
+    model = deps.nsfw_model if use_nsfw_model else deps.reply_model
+    budget = PromptBudget(
+        prompt_token_limit(model, deps.prompt_token_limit),
+        reserved=count_tokens(system_prompt("")) + count_tokens(text) + MESSAGE_OVERHEAD_TOKENS,
+        separator_tokens=1,
+    )
+    pack_sections(budget, memory_sections)
+    if conversation_summary is not None:
+        # Older turns come from the rolling summary, messages past its watermark stay raw
+        history = rolling_summaries.recent_history(history, conversation_summary)
+        budget.add("memory", "conversation_summary",
+                   f"💬 PLUS TÔT DANS LA CONVERSATION:\n{conversation_summary['summary']}", priority=9)
+    # Newest first: the kept history is a contiguous tail
+    for age, message in enumerate(reversed(history)):
+        budget.add("history", str(age), message.get("content") or "", history_priority(age),
+                   chain="history", value=message)
+    packed = budget.pack()
+
+    memory_context = "\n\n".join(item.text for item in packed.kept_of("memory"))
+    # Row ids stay out of the provider payload
+    prompt_history = [{"role": item.value["role"], "content": item.value["content"]}
+                      for item in reversed(packed.kept_of("history"))]
+
+    metrics.set_gauge("prompt_budget_used_tokens", packed.used)
+    if packed.dropped:
+        for item in packed.dropped:
+            metrics.incr(f"prompt_dropped_{item.kind}")
+        logger.info(
+            f"[{telegram_id}] Prompt budget {packed.used}/{packed.limit} tokens, "
+            f"dropped {len(packed.dropped)}: {packed.dropped_names()}"
+        )
+    return {
+        "system": system_prompt(memory_context),
+        "memory_context": memory_context,
+        "prompt_history": prompt_history,
+        "prompt_dropped": packed.dropped_names(),
+    }
+
+
+async def _llm(deps: TurnDeps, prompt_history: list[dict], text: str, system: str, memory_context: str,
+               use_nsfw_model: bool) -> dict:
+    messages = prompt_history + [{"role": "user", "content": text}]
+    # Token attribution of the reply call (core/usage.py)
+    usage.set_sections(
+        "reply",
+        system=system.replace(memory_context, "") if memory_context else system,
+        memory=memory_context,
+        history=prompt_history,
+        user=text,
+    )
+    return {"raw_response": await deps.generate_response(messages, system, use_nsfw_model)}
+
+
+async def _save_state(deps: TurnDeps, telegram_id: int, user_id, raw_response: str, nsfw_gate, engagement) -> dict:
+    if nsfw_gate:
+        if any(p in raw_response.lower() for p in deps.climax_patterns):
+            nsfw_gate.on_nsfw_done()
+            logger.info(f"[{telegram_id}] CLIMAX detected")
+        await deps.save_nsfw_gate(user_id, nsfw_gate)
+    await deps.save_engagement_state(user_id, engagement)
+    return {"state_saved": True}
+
+
+async def _finalize(deps: TurnDeps, raw_response: str, user: dict) -> dict:
+    response = raw_response.strip()
+    if len(response) > MAX_RESPONSE_CHARS:
+        response = response[:MAX_RESPONSE_CHARS] + "..."
+    response, _warnings = await deps.validate_response_facts(response, user)
+    return {"response": response}
+
+
+async def _persist(deps: TurnDeps, user_id, response: str) -> dict:
+    await deps.save_message(user_id, "assistant", response)
+    return {"response_saved": True}
+
+
+async def _extract(user_id, text: str, response: str, history: list[dict], response_saved: bool) -> None:
+    # Debounced + merged per user; shed under heavy load
+    if overload.allows("extraction"):
+        task_supervisor.submit(
+            extraction_scheduler.enqueue(user_id, text, response, history[-10:]),
+            "extraction_enqueue",
+            lane="critical",
+        )
+
+
+async def _summarize(user_id, message_count: int, conversation_summary, response_saved: bool) -> None:
+    # Rolling summary refresh every N turns, deferred under load
+    if rolling_summaries.is_due(user_id, conversation_summary, message_count) \
+            and overload.allows("rolling_summary"):
+        task_supervisor.submit(
+            rolling_summaries.refresh(user_id, message_count),
+            "rolling_summary",
+            lane="background",
+        )
+
+
+async def _send(deps: TurnDeps, response: str, response_saved: bool, reply) -> None:
+    if deps.natural_delay:
+        await asyncio.sleep(random.uniform(0.3, 1.0))
+    await reply(response)
+
+
+# =============================================================================
+# GRAPH
+# =============================================================================
+
+def build_turn_pipeline(deps: TurnDeps) -> Pipeline:
+    """The turn graph, bound to one entry point's helpers."""
+    def stage(name, func, inputs, outputs=(), bind=True):
+        return Stage(name, partial(func, deps) if bind else func, inputs, outputs)
+
+    return Pipeline("turn", [
+        stage("load_user", _load_user, ("telegram_id",), ("user", "user_id", "relationship")),
+        stage("count", _count, ("user_id",), ("message_count",)),
+        stage("save_user", _save_user, ("user_id", "text"), ("user_saved",)),
+        stage("phase", _phase, ("telegram_id", "relationship", "message_count"), ("phase",), bind=False),
+        stage("paywall", _paywall,
+              ("telegram_id", "phase", "user", "user_id", "relationship", "user_saved", "reply"),
+              ("paywall_checked",)),
+        stage("memory", _memory, ("user_id", "text"), ("memory_sections",), bind=False),
+        stage("history", _history, ("user_id", "user_saved"), ("history",)),
+        stage("conversation_summary", _conversation_summary, ("user_id",), ("conversation_summary",), bind=False),
+        stage("engagement", _engagement, ("telegram_id", "user_id", "phase", "text"),
+              ("engagement", "affection_level", "mood")),
+        stage("nsfw", _nsfw, ("telegram_id", "user_id", "phase", "text"),
+              ("is_nsfw", "nsfw_gate", "use_nsfw_model", "nsfw_allowed", "nsfw_blocked_reason")),
+        stage("prompt", _prompt,
+              ("telegram_id", "phase", "user", "memory_sections", "history", "conversation_summary",
+               "text", "mood", "nsfw_allowed", "nsfw_blocked_reason", "use_nsfw_model", "paywall_checked"),
+              ("system", "memory_context", "prompt_history", "prompt_dropped")),
+        stage("llm", _llm, ("prompt_history", "text", "system", "memory_context", "use_nsfw_model"),
+              ("raw_response",)),
+        stage("save_state", _save_state, ("telegram_id", "user_id", "raw_response", "nsfw_gate", "engagement"),
+              ("state_saved",)),
+        stage("finalize", _finalize, ("raw_response", "user"), ("response",)),
+        stage("persist", _persist, ("user_id", "response"), ("response_saved",)),
+        stage("extract", _extract, ("user_id", "text", "response", "history", "response_saved"), bind=False),
+        stage("summarize", _summarize, ("user_id", "message_count", "conversation_summary", "response_saved"),
+              bind=False),
+        stage("send", _send, ("response", "response_saved", "reply")),
+    ], initial=("telegram_id", "text", "reply"))
+
+
+async def run_turn(pipeline: Pipeline, telegram_id: int, text: str, reply) -> PipelineRun:
+    """Run one turn; `reply` sends a message to the user (update.message.reply_text)."""
+    async with usage.turn(telegram_id):
+        return await pipeline.run({"telegram_id": telegram_id, "text": text, "reply": reply})
@@ -0,0 +1,112 @@
+"""
+Scheduled-jobs worker.
+
+Runs only the maintenance jobs (bot/jobs.py), away from the event loop that
+serves user messages. Several workers can run side by side: each job is
+executed by whichever instance wins its advisory lock.
+
+Usage:
+    python -m bot.worker
+"""
+
+import asyncio
+import signal
+from datetime import datetime, timezone
+
+from core import get_logger, setup_logging
+from core import database
+from core.database import disable_statement_timeout
+from core.http import close_http_client, configure_cassette
+from config.settings import settings
+from memory import set_pool as set_memory_pool, init_memory_tables
+from bot import jobs
+
+logger = get_logger(__name__)
+
+
+async def init_worker_db() -> database.Database:
+    """Connect and make sure the tables the jobs touch exist."""
+    db = await database.init_db(
+        **settings.DB_CONFIG,
+        **{**settings.DB_POOL_OPTIONS, "statement_timeout_ms": settings.DB_WORKER_STATEMENT_TIMEOUT_MS},
+    )
+    set_memory_pool(db)
+    jobs.set_pool(db)
+    await init_memory_tables(db)
+    async with db.acquire() as conn:
+        await disable_statement_timeout(conn)
+        await jobs.init_job_tables(conn)
+    return db
+
+
+async def run_scheduler(specs=jobs.JOBS, stop: asyncio.Event | None = None) -> None:
+    """
+    Fire each job at its next run time until `stop` is set.
+
+    A job that is still running when its next slot comes is not started twice.
+    """
+    stop = stop or asyncio.Event()
+    now = datetime.now(timezone.utc)
+    schedule = {spec: jobs.next_run(spec, now) for spec in specs}
+    running: dict[str, asyncio.Task] = {}
+
+    while not stop.is_set():
+        pending = {spec: at for spec, at in schedule.items() if at is not None}
+        if not pending:
+            break
+        spec, at = min(pending.items(), key=lambda item: item[1])
+        delay = (at - datetime.now(timezone.utc)).total_seconds()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+                break
+            except asyncio.TimeoutError:
+                pass
+
+        task = running.get(spec.name)
+        if task is None or task.done():
+            logger.info(f"Starting job {spec.name}")
+            running[spec.name] = asyncio.create_task(jobs.run_exclusive(spec))
+        else:
+            logger.warning(f"Job {spec.name} still running, slot skipped")
+        schedule[spec] = jobs.next_run(spec, datetime.now(timezone.utc), last=at)
+
+    # Let running jobs finish (compression is checkpointed if cut short later)
+    if running:
+        await asyncio.gather(*running.values(), return_exceptions=True)
+
+
+async def run_worker() -> None:
+    """Run the worker until SIGINT/SIGTERM."""
+    configure_cassette(
+        settings.HTTP_CASSETTE_MODE,
+        settings.HTTP_CASSETTE_PATH,
+        time_scale=settings.HTTP_CASSETTE_TIME_SCALE,
+        strict=settings.HTTP_CASSETTE_STRICT,
+    )
+    await init_worker_db()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    logger.info(f"Luna worker v{settings.BOT_VERSION} started ({len(jobs.JOBS)} jobs)")
+    try:
+        await run_scheduler(stop=stop)
+    finally:
+        await close_http_client()
+        await database.close_db()
+
+
+def main():
+    """Entry point."""
+    setup_logging(level=settings.LOG_LEVEL, json_format=settings.LOG_JSON)
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
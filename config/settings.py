@@ -59,6 +59,18 @@ class Settings:
     DB_NAME: str = field(default_factory=lambda: _env("DB_NAME", "luna_db"))
     DB_POOL_MIN: int = field(default_factory=lambda: _env_int("DB_POOL_MIN", 2))
     DB_POOL_MAX: int = field(default_factory=lambda: _env_int("DB_POOL_MAX", 10))
+    # Wait for a free connection / server-side statement_timeout (0 = disabled)
+    DB_ACQUIRE_TIMEOUT_MS: int = field(default_factory=lambda: _env_int("DB_ACQUIRE_TIMEOUT_MS", 5000))
+    DB_STATEMENT_TIMEOUT_MS: int = field(default_factory=lambda: _env_int("DB_STATEMENT_TIMEOUT_MS", 30000))
+    # Worker pool (maintenance jobs only): long DELETE/UPDATE batches, no timeout by default
+    DB_WORKER_STATEMENT_TIMEOUT_MS: int = field(default_factory=lambda: _env_int("DB_WORKER_STATEMENT_TIMEOUT_MS", 0))
+    # Prepared statements kept per connection (asyncpg LRU)
+    DB_STATEMENT_CACHE_SIZE: int = field(default_factory=lambda: _env_int("DB_STATEMENT_CACHE_SIZE", 256))
+
+    # Read replicas (comma-separated DSNs); read-only queries are routed there
+    DB_REPLICA_URLS: list[str] = field(default_factory=lambda: _env_list("DB_REPLICA_URLS"))
+    DB_REPLICA_MAX_LAG_MS: int = field(default_factory=lambda: _env_int("DB_REPLICA_MAX_LAG_MS", 5000))
+    DB_STICKY_MS: int = field(default_factory=lambda: _env_int("DB_STICKY_MS", 5000))
 
     @property
     def DB_CONFIG(self) -> dict:
@@ -71,6 +83,20 @@ class Settings:
             "database": self.DB_NAME,
         }
 
+    @property
+    def DB_POOL_OPTIONS(self) -> dict:
+        """Pool, timeout and replica options for core.database.Database.connect()."""
+        return {
+            "min_size": self.DB_POOL_MIN,
+            "max_size": self.DB_POOL_MAX,
+            "acquire_timeout": self.DB_ACQUIRE_TIMEOUT_MS / 1000 or None,
+            "statement_timeout_ms": self.DB_STATEMENT_TIMEOUT_MS,
+            "statement_cache_size": self.DB_STATEMENT_CACHE_SIZE,
+            "replicas": self.DB_REPLICA_URLS,
+            "max_replica_lag": self.DB_REPLICA_MAX_LAG_MS / 1000,
+            "sticky_seconds": self.DB_STICKY_MS / 1000,
+        }
+
     # =========================================================================
     # LLM PROVIDERS
     # =========================================================================
@@ -85,6 +111,19 @@ class Settings:
     LLM_TIMEOUT: int = field(default_factory=lambda: _env_int("LLM_TIMEOUT", 30))
     LLM_MAX_RETRIES: int = field(default_factory=lambda: _env_int("LLM_MAX_RETRIES", 3))
 
+    # Circuit breakers per provider/model: open above this rolling failure rate
+    # (calls slower than LLM_BREAKER_SLOW_CALL seconds count as failures)
+    LLM_BREAKER_ERROR_RATE: float = field(default_factory=lambda: float(_env("LLM_BREAKER_ERROR_RATE", "0.5")))
+    LLM_BREAKER_SLOW_CALL: float = field(default_factory=lambda: float(_env("LLM_BREAKER_SLOW_CALL", "20")))
+    LLM_BREAKER_OPEN_SECONDS: float = field(default_factory=lambda: float(_env("LLM_BREAKER_OPEN_SECONDS", "30")))
+    # One attempt per reply call behind the breakers (seconds): a failing
+    # provider hands over to the fallback instead of retrying
+    LLM_ATTEMPT_TIMEOUT: float = field(default_factory=lambda: float(_env("LLM_ATTEMPT_TIMEOUT", "12")))
+    # Hedged requests: fire the fallback after the primary's p95 (clamped to min/max seconds)
+    LLM_HEDGE_ENABLED: bool = field(default_factory=lambda: _env_bool("LLM_HEDGE_ENABLED", False))
+    LLM_HEDGE_MIN_DELAY: float = field(default_factory=lambda: float(_env("LLM_HEDGE_MIN_DELAY", "1.0")))
+    LLM_HEDGE_MAX_DELAY: float = field(default_factory=lambda: float(_env("LLM_HEDGE_MAX_DELAY", "8.0")))
+
     # =========================================================================
     # PAYMENTS
     # =========================================================================
@@ -114,6 +153,87 @@ class Settings:
     JOB_WINBACK_INTERVAL: int = field(default_factory=lambda: _env_int("JOB_WINBACK_INTERVAL", 7200))
     JOB_CHURN_INTERVAL: int = field(default_factory=lambda: _env_int("JOB_CHURN_INTERVAL", 3600))
     JOB_COMPRESSION_INTERVAL: int = field(default_factory=lambda: _env_int("JOB_COMPRESSION_INTERVAL", 86400))
+    # Run scheduled jobs on the bot's JobQueue too (set false when python -m bot.worker runs them)
+    RUN_JOBS_IN_BOT: bool = field(default_factory=lambda: _env_bool("RUN_JOBS_IN_BOT", True))
+
+    # Background memory extraction (per-user debounce + merge, bounded concurrency)
+    EXTRACTION_DEBOUNCE: float = field(default_factory=lambda: float(_env("EXTRACTION_DEBOUNCE", "20")))
+    EXTRACTION_MAX_BATCH: int = field(default_factory=lambda: _env_int("EXTRACTION_MAX_BATCH", 4))
+    EXTRACTION_MAX_CONCURRENT: int = field(default_factory=lambda: _env_int("EXTRACTION_MAX_CONCURRENT", 3))
+
+    # Conversation log: monthly partitions kept ahead, retention window (days)
+    CONVERSATION_PARTITIONS_AHEAD: int = field(default_factory=lambda: _env_int("CONVERSATION_PARTITIONS_AHEAD", 2))
+    CONVERSATION_RETENTION_DAYS: int = field(default_factory=lambda: _env_int("CONVERSATION_RETENTION_DAYS", 90))
+
+    # Conversation log write-behind: flush every N ms or N rows, bounded queue,
+    # durability "after_send" (reply first) or "before_ack" (row committed first)
+    CONVERSATION_FLUSH_MS: int = field(default_factory=lambda: _env_int("CONVERSATION_FLUSH_MS", 20))
+    CONVERSATION_FLUSH_ROWS: int = field(default_factory=lambda: _env_int("CONVERSATION_FLUSH_ROWS", 200))
+    CONVERSATION_QUEUE_MAX: int = field(default_factory=lambda: _env_int("CONVERSATION_QUEUE_MAX", 5000))
+    CONVERSATION_DURABILITY: str = field(default_factory=lambda: _env("CONVERSATION_DURABILITY", "after_send"))
+
+    # Background task lanes (core/tasks.py): concurrency, queue bound, shutdown drain (seconds)
+    TASKS_DEFAULT_CONCURRENCY: int = field(default_factory=lambda: _env_int("TASKS_DEFAULT_CONCURRENCY", 16))
+    TASKS_BACKGROUND_CONCURRENCY: int = field(default_factory=lambda: _env_int("TASKS_BACKGROUND_CONCURRENCY", 4))
+    TASKS_MAX_QUEUED: int = field(default_factory=lambda: _env_int("TASKS_MAX_QUEUED", 500))
+    TASKS_SHUTDOWN_DEADLINE: float = field(default_factory=lambda: float(_env("TASKS_SHUTDOWN_DEADLINE", "10")))
+
+    # Event-loop monitor: lag sampling period, callbacks slower than this are reported (ms)
+    LOOP_MONITOR_ENABLED: bool = field(default_factory=lambda: _env_bool("LOOP_MONITOR_ENABLED", True))
+    LOOP_LAG_INTERVAL_MS: int = field(default_factory=lambda: _env_int("LOOP_LAG_INTERVAL_MS", 250))
+    LOOP_SLOW_CALLBACK_MS: int = field(default_factory=lambda: _env_int("LOOP_SLOW_CALLBACK_MS", 100))
+    # CPU-heavy steps (core/offload.py): worker processes (0 = inline), min input size (chars)
+    OFFLOAD_WORKERS: int = field(default_factory=lambda: _env_int("OFFLOAD_WORKERS", 2))
+    OFFLOAD_MIN_SIZE: int = field(default_factory=lambda: _env_int("OFFLOAD_MIN_SIZE", 3000))
+    # Sampling profiler (/profile): sample period (ms), longest session (s), output directory
+    PROFILE_INTERVAL_MS: int = field(default_factory=lambda: _env_int("PROFILE_INTERVAL_MS", 10))
+    PROFILE_MAX_SECONDS: int = field(default_factory=lambda: _env_int("PROFILE_MAX_SECONDS", 120))
+    PROFILE_DIR: str = field(default_factory=lambda: _env("PROFILE_DIR", "/tmp/luna-profiles"))
+    # Load shedding (core/overload.py): degrade thresholds, recover at ratio x threshold, step timings (s)
+    OVERLOAD_ENABLED: bool = field(default_factory=lambda: _env_bool("OVERLOAD_ENABLED", True))
+    OVERLOAD_DB_WAIT_MS: int = field(default_factory=lambda: _env_int("OVERLOAD_DB_WAIT_MS", 50))
+    OVERLOAD_LOOP_LAG_MS: int = field(default_factory=lambda: _env_int("OVERLOAD_LOOP_LAG_MS", 100))
+    OVERLOAD_LLM_LATENCY: float = field(default_factory=lambda: float(_env("OVERLOAD_LLM_LATENCY", "8")))
+    OVERLOAD_QUEUE_DEPTH: int = field(default_factory=lambda: _env_int("OVERLOAD_QUEUE_DEPTH", 200))
+    OVERLOAD_RECOVER_RATIO: float = field(default_factory=lambda: float(_env("OVERLOAD_RECOVER_RATIO", "0.5")))
+    OVERLOAD_STEP_UP: float = field(default_factory=lambda: float(_env("OVERLOAD_STEP_UP", "5")))
+    OVERLOAD_STEP_DOWN: float = field(default_factory=lambda: float(_env("OVERLOAD_STEP_DOWN", "30")))
+    # Provider traffic record/replay (core/cassette.py): "off", "record" or "replay"
+    # TIME_SCALE: replay delays x scale (1 = recorded latency, 0 = instant); STRICT: exact body match only
+    HTTP_CASSETTE_MODE: str = field(default_factory=lambda: _env("HTTP_CASSETTE_MODE", "off"))
+    HTTP_CASSETTE_PATH: str = field(default_factory=lambda: _env("HTTP_CASSETTE_PATH", ""))
+    HTTP_CASSETTE_TIME_SCALE: float = field(default_factory=lambda: float(_env("HTTP_CASSETTE_TIME_SCALE", "1.0")))
+    HTTP_CASSETTE_STRICT: bool = field(default_factory=lambda: _env_bool("HTTP_CASSETTE_STRICT", False))
+
+    # Token accounting (core/usage.py): one llm_usage_audit row per turn
+    LLM_USAGE_AUDIT: bool = field(default_factory=lambda: _env_bool("LLM_USAGE_AUDIT", False))
+
+    # Prompt budget (core/tokens.py): memory + history tokens per reply, 0 = per-model default
+    PROMPT_TOKEN_LIMIT: int = field(default_factory=lambda: _env_int("PROMPT_TOKEN_LIMIT", 0))
+
+    # Rolling conversation summary: refreshed every N turns, raw messages kept after it
+    ROLLING_SUMMARY_EVERY_TURNS: int = field(default_factory=lambda: _env_int("ROLLING_SUMMARY_EVERY_TURNS", 6))
+    ROLLING_SUMMARY_RAW_TAIL: int = field(default_factory=lambda: _env_int("ROLLING_SUMMARY_RAW_TAIL", 6))
+
+    # In-memory recent history (per-user ring buffer, LRU by total bytes)
+    HISTORY_CACHE_TURNS: int = field(default_factory=lambda: _env_int("HISTORY_CACHE_TURNS", 40))
+    HISTORY_CACHE_MAX_BYTES: int = field(default_factory=lambda: _env_int("HISTORY_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+    # Weekly/monthly compression: users processed in parallel, max run time (seconds)
+    COMPRESSION_WORKERS: int = field(default_factory=lambda: _env_int("COMPRESSION_WORKERS", 4))
+    COMPRESSION_DEADLINE: int = field(default_factory=lambda: _env_int("COMPRESSION_DEADLINE", 3000))
+
+    # Extraction pre-filter: "off", "shadow" (measure only) or "on" (skip LLM below threshold)
+    EXTRACTION_PREFILTER_MODE: str = field(default_factory=lambda: _env("EXTRACTION_PREFILTER_MODE", "shadow"))
+    EXTRACTION_PREFILTER_THRESHOLD: float = field(default_factory=lambda: float(_env("EXTRACTION_PREFILTER_THRESHOLD", "0.2")))
+    # Trained weights (writable data dir, reloaded when the file changes)
+    EXTRACTION_PREFILTER_WEIGHTS_PATH: str = field(default_factory=lambda: _env("EXTRACTION_PREFILTER_WEIGHTS_PATH", "/app/data/prefilter_weights.json"))
+    # Training data retention: newest N outcomes, never older than N days
+    EXTRACTION_OUTCOMES_KEEP: int = field(default_factory=lambda: _env_int("EXTRACTION_OUTCOMES_KEEP", 20000))
+    EXTRACTION_OUTCOMES_RETENTION_DAYS: int = field(default_factory=lambda: _env_int("EXTRACTION_OUTCOMES_RETENTION_DAYS", 90))
+
+    # Startup: prewarm provider connections + preload prompts alongside the DB pool
+    STARTUP_PREWARM: bool = field(default_factory=lambda: _env_bool("STARTUP_PREWARM", True))
 
     # =========================================================================
     # TIMEZONE
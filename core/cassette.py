@@ -0,0 +1,312 @@
+"""
+Record/replay cassettes for provider HTTP traffic.
+
+Transport-level, so every caller of core.http.get_http_client() is covered
+(services/llm.py, memory/extraction.py, memory/compression.py) without any
+change to the call sites:
+
+- RecordingTransport forwards to the real transport and appends one line per
+  interaction to the cassette: request fingerprint, status, a few response
+  headers, time to headers and every body chunk with its offset (streamed
+  responses keep their pacing). Transport errors (timeouts...) are recorded
+  too and raised again on replay.
+- ReplayTransport serves the cassette without network. Delays are the
+  recorded ones multiplied by time_scale (1.0 = real latency, 0.1 = 10x
+  faster, 0 = instant).
+
+A cassette is JSON Lines, gzip-compressed when the path ends with ".gz".
+Request headers are never written (API keys); request bodies are stored as
+a hash plus their size.
+
+Replay matching: same method + URL + body hash first (identical requests
+are served in recorded order); unless strict, falls back to the next
+recorded interaction for the same method + URL, since prompts embed the
+current time.
+
+Usage:
+    HTTP_CASSETTE_MODE=record HTTP_CASSETTE_PATH=/tmp/llm.jsonl.gz python -m bot.main
+    HTTP_CASSETTE_MODE=replay HTTP_CASSETTE_PATH=/tmp/llm.jsonl.gz HTTP_CASSETTE_TIME_SCALE=0 pytest ...
+"""
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from core.errors import LunaError
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+CASSETTE_VERSION = 1
+
+# Response headers worth replaying (the rest is noise or per-account data)
+KEPT_HEADERS = ("content-type", "content-encoding", "retry-after", "x-request-id", "request-id")
+
+
+class CassetteMissError(LunaError):
+    """Replay found no recorded interaction for a request."""
+    pass
+
+
+def request_key(method: str, url: str, body: bytes) -> str:
+    """Fingerprint of a request (JSON bodies are canonicalized: key order does not matter)."""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+    except (ValueError, UnicodeDecodeError):
+        pass
+    digest = hashlib.sha256(f"{method.upper()} {url}\n".encode() + body)
+    return digest.hexdigest()[:24]
+
+
+def _encode_chunk(chunk: bytes) -> str:
+    try:
+        text = chunk.decode()
+        if not text.startswith("b64:"):
+            return text
+    except UnicodeDecodeError:
+        pass
+    return "b64:" + base64.b64encode(chunk).decode()
+
+
+def _decode_chunk(data: str) -> bytes:
+    if data.startswith("b64:"):
+        return base64.b64decode(data[4:])
+    return data.encode()
+
+
+@dataclass
+class Interaction:
+    """One recorded request/response pair."""
+    method: str
+    url: str
+    key: str
+    request_bytes: int
+    status: int = 0
+    headers: list[tuple[str, str]] = field(default_factory=list)
+    ttfb: float = 0.0  # seconds until response headers
+    chunks: list[tuple[float, bytes]] = field(default_factory=list)  # (offset from request start, bytes)
+    error: Optional[str] = None  # httpx exception class name
+
+    @property
+    def elapsed(self) -> float:
+        return self.chunks[-1][0] if self.chunks else self.ttfb
+
+    @property
+    def body(self) -> bytes:
+        return b"".join(chunk for _, chunk in self.chunks)
+
+    def to_json(self) -> str:
+        data = {
+            "v": CASSETTE_VERSION,
+            "method": self.method,
+            "url": self.url,
+            "key": self.key,
+            "req_bytes": self.request_bytes,
+            "status": self.status,
+            "headers": self.headers,
+            "ttfb": round(self.ttfb, 4),
+            "chunks": [[round(t, 4), _encode_chunk(c)] for t, c in self.chunks],
+        }
+        if self.error:
+            data["error"] = self.error
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, line: str) -> "Interaction":
+        data = json.loads(line)
+        return cls(
+            method=data["method"],
+            url=data["url"],
+            key=data["key"],
+            request_bytes=data.get("req_bytes", 0),
+            status=data.get("status", 0),
+            headers=[tuple(h) for h in data.get("headers", [])],
+            ttfb=data.get("ttfb", 0.0),
+            chunks=[(t, _decode_chunk(c)) for t, c in data.get("chunks", [])],
+            error=data.get("error"),
+        )
+
+
+class Cassette:
+    """A cassette file (JSON Lines, optionally gzip)."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def _open(self, mode: str):
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def load(self) -> list[Interaction]:
+        with self._open("r") as f:
+            return [Interaction.from_json(line) for line in f if line.strip()]
+
+    def append(self, interaction: Interaction) -> None:
+        """Write one interaction (one line per write: a crash loses at most the current one)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._open("a") as f:
+            f.write(interaction.to_json() + "\n")
+
+
+# =============================================================================
+# RECORD
+# =============================================================================
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes the body through, noting each chunk and its offset."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, interaction: Interaction, started: float, on_done):
+        self._stream = stream
+        self._interaction = interaction
+        self._started = started
+        self._on_done = on_done
+        self._done = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._interaction.chunks.append((time.perf_counter() - self._started, chunk))
+            yield chunk
+        self._finish()
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if not self._done:
+            self._done = True
+            self._on_done(self._interaction)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Forward to `inner` and record every interaction into `cassette`."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+        self.recorded = 0
+
+    def _save(self, interaction: Interaction) -> None:
+        try:
+            self.cassette.append(interaction)
+            self.recorded += 1
+        except OSError as e:
+            logger.warning(f"Cassette write failed ({self.cassette.path}): {e}")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        interaction = Interaction(
+            method=request.method,
+            url=str(request.url),
+            key=request_key(request.method, str(request.url), body),
+            request_bytes=len(body),
+        )
+        started = time.perf_counter()
+        try:
+            response = await self.inner.handle_async_request(request)
+        except httpx.TransportError as e:
+            interaction.ttfb = time.perf_counter() - started
+            interaction.error = type(e).__name__
+            self._save(interaction)
+            raise
+
+        interaction.ttfb = time.perf_counter() - started
+        interaction.status = response.status_code
+        interaction.headers = [(k, v) for k, v in response.headers.items() if k.lower() in KEPT_HEADERS]
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, interaction, started, self._save),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+# =============================================================================
+# REPLAY
+# =============================================================================
+
+class _ReplayStream(httpx.AsyncByteStream):
+    """Yields the recorded chunks at their recorded offsets (scaled)."""
+
+    def __init__(self, interaction: Interaction, time_scale: float, started: float):
+        self._interaction = interaction
+        self._time_scale = time_scale
+        self._started = started
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for offset, chunk in self._interaction.chunks:
+            if self._time_scale > 0:
+                delay = offset * self._time_scale - (time.perf_counter() - self._started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield chunk
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Serve recorded interactions, no network."""
+
+    def __init__(self, interactions: list[Interaction], time_scale: float = 1.0, strict: bool = False):
+        self.time_scale = time_scale
+        self.strict = strict
+        self.served = 0
+        self._by_key: dict[str, deque[Interaction]] = defaultdict(deque)
+        self._by_route: dict[tuple[str, str], deque[Interaction]] = defaultdict(deque)
+        for interaction in interactions:
+            self._by_key[interaction.key].append(interaction)
+            self._by_route[(interaction.method, interaction.url)].append(interaction)
+
+    @classmethod
+    def from_cassette(cls, cassette: Cassette, time_scale: float = 1.0, strict: bool = False) -> "ReplayTransport":
+        interactions = cassette.load()
+        logger.info(f"Replaying {len(interactions)} interactions from {cassette.path}")
+        return cls(interactions, time_scale=time_scale, strict=strict)
+
+    def _take(self, key: str, route: tuple[str, str]) -> Optional[Interaction]:
+        exact = self._by_key.get(key)
+        if exact:
+            interaction = exact.popleft()
+            self._by_route[route].remove(interaction)
+            return interaction
+        if not self.strict and self._by_route.get(route):
+            interaction = self._by_route[route].popleft()
+            self._by_key[interaction.key].remove(interaction)
+            return interaction
+        return None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        route = (request.method, str(request.url))
+        interaction = self._take(request_key(request.method, route[1], body), route)
+        if interaction is None:
+            raise CassetteMissError(f"No recorded interaction for {request.method} {request.url}")
+        self.served += 1
+
+        started = time.perf_counter()
+        if self.time_scale > 0 and interaction.ttfb > 0:
+            await asyncio.sleep(interaction.ttfb * self.time_scale)
+
+        if interaction.error:
+            error_cls = getattr(httpx, interaction.error, httpx.TransportError)
+            raise error_cls(f"Replayed {interaction.error}", request=request)
+
+        return httpx.Response(
+            status_code=interaction.status,
+            headers=interaction.headers,
+            stream=_ReplayStream(interaction, self.time_scale, started),
+            request=request,
+        )
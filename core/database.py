@@ -6,19 +6,51 @@ Usage:
 
     db = await get_db()
     result = await db.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
+
+One instance is shared by every module: it is what set_pool() receives
+(acquire() is pool-compatible), so pool limits, acquire/statement timeouts,
+the prepared statement cache and saturation metrics apply everywhere.
+
+Read replicas (optional):
+    rows = await db.fetch(query, *args, read_only=True, user_id=user_id)
+
+Read-only calls go to a healthy replica (round-robin). They fall back to the
+primary when every replica lags more than max_replica_lag, when a replica
+connection fails, or when the same user wrote less than sticky_seconds ago
+(read-your-writes).
+
+statement_timeout protects the reply path; migrations and maintenance jobs
+(index builds, backfills, partition drops) lift it on their connection with
+disable_statement_timeout().
 """
 
 import asyncio
-from contextlib import asynccontextmanager
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
 from typing import Any, Optional
 
 import asyncpg
 
 from core.logger import get_logger
 from core.errors import DatabaseError, with_retry
+from core.overload import overload
+from middleware.metrics import metrics
 
 logger = get_logger(__name__)
 
+# Replay lag in seconds (0 when the replica has replayed everything it received)
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Errors after which a replica is taken out of rotation until the next lag check
+REPLICA_CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.InterfaceError,
+                             asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError,
+                             DatabaseError)
+
 
 class Database:
     """
@@ -28,6 +60,16 @@ class Database:
     def __init__(self):
         self._pool: Optional[asyncpg.Pool] = None
         self._config: dict = {}
+        self._replicas: list[asyncpg.Pool] = []
+        self._replica_healthy: list[bool] = []
+        self._replica_lag: list[float] = []
+        self._next_replica = 0
+        self._recent_writes: dict[Any, float] = {}
+        self._lag_task: Optional[asyncio.Task] = None
+        self.max_replica_lag = 5.0
+        self.sticky_seconds = 5.0
+        self.acquire_timeout: Optional[float] = None
+        self._in_use: dict[str, int] = {}
 
     async def connect(
         self,
@@ -38,6 +80,14 @@ class Database:
         database: str = "luna_db",
         min_size: int = 2,
         max_size: int = 10,
+        replicas: Optional[list[str]] = None,
+        max_replica_lag: float = 5.0,
+        sticky_seconds: float = 5.0,
+        lag_check_interval: float = 5.0,
+        acquire_timeout: Optional[float] = None,
+        statement_timeout_ms: int = 0,
+        statement_cache_size: int = 100,
+        max_cacheable_statement_size: int = 15 * 1024,
     ) -> None:
         """
         Create connection pool.
@@ -50,6 +100,14 @@ class Database:
             database: Database name
             min_size: Minimum pool connections
             max_size: Maximum pool connections
+            replicas: DSNs of read replicas (optional)
+            max_replica_lag: Replicas lagging more than this (seconds) are skipped
+            sticky_seconds: Reads of a user go to the primary this long after a write
+            lag_check_interval: Seconds between replica lag checks
+            acquire_timeout: Max seconds to wait for a free connection (None = forever)
+            statement_timeout_ms: Server-side statement_timeout (0 = disabled)
+            statement_cache_size: Prepared statements cached per connection
+            max_cacheable_statement_size: Longer queries are not cached
         """
         self._config = {
             "host": host,
@@ -59,16 +117,48 @@ class Database:
             "database": database,
         }
 
-        self._pool = await asyncpg.create_pool(
-            **self._config,
-            min_size=min_size,
-            max_size=max_size,
-        )
+        # asyncpg prepares every query server-side and keeps the prepared
+        # statements in a per-connection LRU: hot queries (constant SQL text)
+        # are parsed/planned once per connection, not once per call.
+        pool_options = {
+            "min_size": min_size,
+            "max_size": max_size,
+            "statement_cache_size": statement_cache_size,
+            "max_cacheable_statement_size": max_cacheable_statement_size,
+        }
+        if statement_timeout_ms:
+            pool_options["server_settings"] = {"statement_timeout": str(statement_timeout_ms)}
+        self.acquire_timeout = acquire_timeout
+
+        self._pool = await asyncpg.create_pool(**self._config, **pool_options)
 
         logger.info(f"Database connected: {host}:{port}/{database}")
 
+        self.max_replica_lag = max_replica_lag
+        self.sticky_seconds = sticky_seconds
+        for dsn in replicas or []:
+            try:
+                replica = await asyncpg.create_pool(dsn, **pool_options)
+            except Exception as e:
+                logger.warning(f"Replica unavailable, skipped: {e}")
+                continue
+            self._replicas.append(replica)
+            self._replica_healthy.append(True)
+            self._replica_lag.append(0.0)
+
+        if self._replicas:
+            logger.info(f"Read replicas connected: {len(self._replicas)}")
+            await self.check_replica_lag()
+            self._lag_task = asyncio.create_task(self._lag_loop(lag_check_interval))
+
     async def disconnect(self) -> None:
         """Close connection pool."""
+        if self._lag_task:
+            self._lag_task.cancel()
+            self._lag_task = None
+        for replica in self._replicas:
+            await replica.close()
+        self._replicas, self._replica_healthy, self._replica_lag = [], [], []
         if self._pool:
             await self._pool.close()
             self._pool = None
@@ -82,44 +172,188 @@ class Database:
         return self._pool
 
     @asynccontextmanager
-    async def acquire(self):
+    async def acquire(self, read_only: bool = False, user_id: Any = None):
         """
         Acquire a connection from the pool.
 
         Usage:
             async with db.acquire() as conn:
                 await conn.execute(...)
+
+            async with db.acquire(read_only=True, user_id=uid) as conn:
+                await conn.fetch(...)   # replica when possible
         """
-        async with self.pool.acquire() as conn:
+        index = self._pick_replica(user_id) if read_only else None
+        if index is not None:
+            stack = AsyncExitStack()
+            try:
+                conn = await stack.enter_async_context(self._checkout(self._replicas[index], f"replica{index}"))
+            except REPLICA_CONNECTION_ERRORS as e:
+                # Nothing ran yet: the block goes to the primary instead
+                await stack.aclose()
+                self._replica_failed(index, e)
+            else:
+                async with stack:
+                    try:
+                        yield conn
+                    except REPLICA_CONNECTION_ERRORS as e:
+                        # Too late to replay the block, but the next reads skip this replica
+                        self._replica_failed(index, e)
+                        raise
+                return
+
+        async with self._checkout(self.pool, "primary") as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def _checkout(self, pool: asyncpg.Pool, name: str):
+        """pool.acquire() with timeout, wait histogram and in-use gauge."""
+        started = time.monotonic()
+        try:
+            conn = await pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            metrics.incr(f"db_{name}_acquire_timeouts")
+            raise DatabaseError(f"No {name} connection available after {self.acquire_timeout}s", "acquire")
+        waited = time.monotonic() - started
+        metrics.observe("db_acquire_wait_seconds", waited)
+        overload.record("db_wait", waited)
+        metrics.incr(f"db_{name}_acquires")
+
+        self._in_use[name] = self._in_use.get(name, 0) + 1
+        metrics.set_gauge(f"db_{name}_in_use", self._in_use[name])
+        try:
             yield conn
+        finally:
+            self._in_use[name] -= 1
+            metrics.set_gauge(f"db_{name}_in_use", self._in_use[name])
+            await pool.release(conn)
+
+    # =========================================================================
+    # READ REPLICAS
+    # =========================================================================
+
+    def mark_write(self, user_id: Any) -> None:
+        """Route this user's reads to the primary for sticky_seconds."""
+        if user_id is None or not self._replicas:
+            return
+        now = time.monotonic()
+        self._recent_writes[user_id] = now
+        if len(self._recent_writes) > 10_000:
+            cutoff = now - self.sticky_seconds
+            self._recent_writes = {k: t for k, t in self._recent_writes.items() if t > cutoff}
+
+    def _is_sticky(self, user_id: Any) -> bool:
+        if user_id is None:
+            return False
+        written = self._recent_writes.get(user_id)
+        return written is not None and time.monotonic() - written < self.sticky_seconds
+
+    def _pick_replica(self, user_id: Any = None) -> Optional[int]:
+        """Index of the replica to read from, or None for the primary."""
+        if not self._replicas:
+            return None
+        if self._is_sticky(user_id):
+            metrics.incr("db_sticky_reads")
+            return None
+
+        count = len(self._replicas)
+        for offset in range(count):
+            index = (self._next_replica + offset) % count
+            if self._replica_healthy[index]:
+                self._next_replica = index + 1
+                return index
+
+        metrics.incr("db_replica_fallbacks")
+        return None
+
+    def _replica_failed(self, index: int, error: BaseException) -> None:
+        """Take a replica out of rotation until the next lag check."""
+        logger.warning(f"Replica {index} failed, falling back to primary: {error}")
+        self._replica_healthy[index] = False
+        metrics.incr("db_replica_fallbacks")
+
+    async def check_replica_lag(self) -> list[float]:
+        """Measure replay lag of every replica and update their health."""
+        for index, replica in enumerate(self._replicas):
+            try:
+                async with replica.acquire() as conn:
+                    lag = float(await conn.fetchval(REPLICA_LAG_QUERY, timeout=2) or 0)
+            except Exception as e:
+                logger.warning(f"Replica {index} lag check failed: {e}")
+                lag = float("inf")
+
+            healthy = lag <= self.max_replica_lag
+            if healthy != self._replica_healthy[index]:
+                logger.info(f"Replica {index} {'back in rotation' if healthy else 'out of rotation'} (lag={lag:.1f}s)")
+            self._replica_lag[index] = lag
+            self._replica_healthy[index] = healthy
+            metrics.set_gauge(f"db_replica{index}_lag", lag if lag != float("inf") else -1)
+        return list(self._replica_lag)
+
+    async def _lag_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_replica_lag()
+            except Exception as e:
+                logger.warning(f"Replica lag loop error: {e}")
+
+    async def _read(self, method: str, query: str, args: tuple, read_only: bool, user_id: Any):
+        index = self._pick_replica(user_id) if read_only else None
+        if index is not None:
+            try:
+                metrics.incr(f"db_replica{index}_queries")
+                async with self._checkout(self._replicas[index], f"replica{index}") as conn:
+                    return await getattr(conn, method)(query, *args)
+            except REPLICA_CONNECTION_ERRORS as e:
+                self._replica_failed(index, e)
+
+        metrics.incr("db_primary_queries")
+        async with self._checkout(self.pool, "primary") as conn:
+            return await getattr(conn, method)(query, *args)
+
+    def pool_stats(self) -> dict:
+        """Size / idle connections per pool, plus replica lag and health."""
+        stats = {}
+        pools = [("primary", self._pool)] + [(f"replica{i}", p) for i, p in enumerate(self._replicas)]
+        for name, pool in pools:
+            if pool is None:
+                continue
+            stats[name] = {
+                "size": pool.get_size(),
+                "idle": pool.get_idle_size(),
+                "in_use": self._in_use.get(name, 0),
+            }
+        for index, lag in enumerate(self._replica_lag):
+            stats[f"replica{index}"].update(lag=lag, healthy=self._replica_healthy[index])
+        return stats
 
     # =========================================================================
     # QUERY HELPERS WITH RETRY
     # =========================================================================
 
     @with_retry(max_attempts=3, delay=0.5, exceptions=(asyncpg.PostgresError,))
-    async def execute(self, query: str, *args) -> str:
-        """Execute a query (INSERT, UPDATE, DELETE)."""
-        async with self.acquire() as conn:
+    async def execute(self, query: str, *args, user_id: Any = None) -> str:
+        """Execute a query (INSERT, UPDATE, DELETE). user_id enables read-your-writes."""
+        self.mark_write(user_id)
+        metrics.incr("db_primary_queries")
+        async with self._checkout(self.pool, "primary") as conn:
             return await conn.execute(query, *args)
 
     @with_retry(max_attempts=3, delay=0.5, exceptions=(asyncpg.PostgresError,))
-    async def fetchrow(self, query: str, *args) -> Optional[asyncpg.Record]:
-        """Fetch a single row."""
-        async with self.acquire() as conn:
-            return await conn.fetchrow(query, *args)
+    async def fetchrow(self, query: str, *args, read_only: bool = False, user_id: Any = None) -> Optional[asyncpg.Record]:
+        """Fetch a single row (read_only=True may use a replica)."""
+        return await self._read("fetchrow", query, args, read_only, user_id)
 
     @with_retry(max_attempts=3, delay=0.5, exceptions=(asyncpg.PostgresError,))
-    async def fetch(self, query: str, *args) -> list[asyncpg.Record]:
-        """Fetch multiple rows."""
-        async with self.acquire() as conn:
-            return await conn.fetch(query, *args)
+    async def fetch(self, query: str, *args, read_only: bool = False, user_id: Any = None) -> list[asyncpg.Record]:
+        """Fetch multiple rows (read_only=True may use a replica)."""
+        return await self._read("fetch", query, args, read_only, user_id)
 
     @with_retry(max_attempts=3, delay=0.5, exceptions=(asyncpg.PostgresError,))
-    async def fetchval(self, query: str, *args) -> Any:
-        """Fetch a single value."""
-        async with self.acquire() as conn:
-            return await conn.fetchval(query, *args)
+    async def fetchval(self, query: str, *args, read_only: bool = False, user_id: Any = None) -> Any:
+        """Fetch a single value (read_only=True may use a replica)."""
+        return await self._read("fetchval", query, args, read_only, user_id)
 
     # =========================================================================
     # SAFE JSON HELPERS
@@ -151,6 +385,20 @@ class Database:
         return fallback
 
 
+# =============================================================================
+# MAINTENANCE
+# =============================================================================
+
+async def disable_statement_timeout(conn) -> None:
+    """
+    Lift statement_timeout for the rest of this connection checkout.
+
+    Session-level SET: the pool resets the connection on release (RESET ALL),
+    which restores the pool's statement_timeout for the next user.
+    """
+    await conn.execute("SET statement_timeout = 0")
+
+
 # =============================================================================
 # SINGLETON INSTANCE
 # =============================================================================
@@ -0,0 +1,113 @@
+"""
+Shared HTTP client for LLM providers.
+
+One httpx.AsyncClient per process so TLS connections to Anthropic and
+OpenRouter are reused across calls instead of re-handshaking every turn.
+
+Usage:
+    from core.http import get_http_client
+
+    client = get_http_client()
+    response = await client.post(url, json=payload, timeout=30)
+
+Record/replay (core/cassette.py): configure_cassette("record" | "replay", path)
+before the first get_http_client() call.
+"""
+
+import asyncio
+from typing import Optional
+
+import httpx
+
+from core.cassette import Cassette, RecordingTransport, ReplayTransport
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+ANTHROPIC_BASE_URL = "https://api.anthropic.com"
+OPENROUTER_BASE_URL = "https://openrouter.ai"
+
+PROVIDER_BASE_URLS = (ANTHROPIC_BASE_URL, OPENROUTER_BASE_URL)
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+_client: Optional[httpx.AsyncClient] = None
+_cassette: dict = {"mode": "off", "path": "", "time_scale": 1.0, "strict": False}
+
+
+def configure_cassette(mode: str, path: str = "", time_scale: float = 1.0, strict: bool = False) -> None:
+    """
+    Route the shared client through a cassette.
+
+    Args:
+        mode: "off", "record" (real calls, saved to path) or "replay" (served from path)
+        time_scale: replay delays = recorded delays x time_scale (0 = instant)
+        strict: replay only exact request matches (same body)
+    """
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    if mode != "off" and not path:
+        raise ValueError(f"Cassette mode {mode} needs a path")
+    if _client is not None and not _client.is_closed:
+        logger.warning("configure_cassette() called after the HTTP client was created; applies to the next client")
+    _cassette.update(mode=mode, path=path, time_scale=time_scale, strict=strict)
+    if mode != "off":
+        logger.info(f"HTTP cassette: {mode} {path}")
+
+
+def _transport(limits: httpx.Limits) -> Optional[httpx.AsyncBaseTransport]:
+    mode = _cassette["mode"]
+    if mode == "record":
+        return RecordingTransport(httpx.AsyncHTTPTransport(limits=limits), Cassette(_cassette["path"]))
+    if mode == "replay":
+        return ReplayTransport.from_cassette(
+            Cassette(_cassette["path"]), time_scale=_cassette["time_scale"], strict=_cassette["strict"]
+        )
+    return None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get (or lazily create) the shared client."""
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        transport = _transport(limits)
+        if transport is None:
+            _client = httpx.AsyncClient(timeout=30, limits=limits)
+        else:
+            _client = httpx.AsyncClient(timeout=30, transport=transport)
+    return _client
+
+
+async def prewarm_http(urls: tuple[str, ...] = PROVIDER_BASE_URLS, timeout: float = 5.0) -> int:
+    """
+    Open keep-alive connections to the providers concurrently.
+
+    The response status is irrelevant, only the DNS + TLS handshake matters.
+    Skipped with a cassette (nothing to warm on replay, noise in a recording).
+
+    Returns:
+        Number of providers reached
+    """
+    if _cassette["mode"] != "off":
+        return 0
+    client = get_http_client()
+
+    async def _touch(url: str) -> bool:
+        try:
+            await client.head(url, timeout=timeout)
+            return True
+        except httpx.HTTPError as e:
+            logger.warning(f"HTTP prewarm failed for {url}: {e}")
+            return False
+
+    results = await asyncio.gather(*(_touch(u) for u in urls))
+    return sum(results)
+
+
+async def close_http_client() -> None:
+    """Close the shared client."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,118 @@
+"""
+Event-loop lag monitor.
+
+Two cheap probes:
+- lag sampler: a task sleeps `interval` seconds and measures how late it wakes
+  up (histogram loop_lag_seconds, gauge loop_lag_max_seconds)
+- slow-callback hook: every loop callback is timed; callbacks above
+  `slow_threshold` are logged with the coroutine that ran (task name +
+  coroutine qualname) and counted (loop_slow_callbacks)
+
+Usage:
+    from core.loop_monitor import loop_monitor
+
+    loop_monitor.start()
+    ...
+    await loop_monitor.stop()
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from core.logger import get_logger
+from core.overload import overload
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+_original_handle_run = asyncio.events.Handle._run
+
+
+def describe_callback(handle: asyncio.Handle) -> str:
+    """Human-readable name of what a loop handle runs (task + coroutine when possible)."""
+    callback = getattr(handle, "_callback", None)
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        qualname = getattr(coro, "__qualname__", type(coro).__name__)
+        return f"{owner.get_name()} ({qualname})"
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+class LoopMonitor:
+    """Samples loop lag and reports slow callbacks."""
+
+    def __init__(self, interval: float = 0.25, slow_threshold: float = 0.1, keep: int = 50):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        # (monotonic time, seconds, callback description) of recent slow callbacks
+        self.recent_slow: deque[tuple[float, float, str]] = deque(maxlen=keep)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def configure(self, interval: float, slow_threshold: float) -> None:
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+
+    def start(self) -> None:
+        """Start sampling and install the slow-callback hook (needs a running loop)."""
+        if self._task and not self._task.done():
+            return
+        self._install_hook()
+        self._task = asyncio.create_task(self._sample(), name="loop_monitor")
+
+    async def stop(self) -> None:
+        asyncio.events.Handle._run = _original_handle_run
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sample(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            metrics.observe("loop_lag_seconds", lag)
+            overload.record("loop_lag", lag)
+            self.max_lag = max(self.max_lag, lag)
+            metrics.set_gauge("loop_lag_max_seconds", self.max_lag)
+
+    def _install_hook(self) -> None:
+        monitor = self
+
+        def timed_run(handle):
+            started = time.perf_counter()
+            try:
+                return _original_handle_run(handle)
+            finally:
+                duration = time.perf_counter() - started
+                if duration >= monitor.slow_threshold:
+                    monitor._report_slow(handle, duration)
+
+        asyncio.events.Handle._run = timed_run
+
+    def _report_slow(self, handle: asyncio.Handle, duration: float) -> None:
+        name = describe_callback(handle)
+        self.recent_slow.append((time.monotonic(), duration, name))
+        metrics.incr("loop_slow_callbacks")
+        metrics.observe("loop_slow_callback_seconds", duration)
+        logger.warning(f"Event loop blocked {duration * 1000:.0f}ms by {name}")
+
+    def stats(self) -> dict:
+        return {
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "slow_callbacks": [
+                {"ms": round(duration * 1000), "callback": name}
+                for _, duration, name in list(self.recent_slow)[-10:]
+            ],
+        }
+
+
+# Singleton (started by the entry points)
+loop_monitor = LoopMonitor()
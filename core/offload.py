@@ -0,0 +1,85 @@
+"""
+Process-pool offload for CPU-heavy steps.
+
+Designated pure functions (module-level, picklable arguments) run in a
+ProcessPoolExecutor when their input is large, and inline otherwise: for
+small inputs the pickling round-trip costs more than the work itself.
+
+Usage:
+    from core.offload import offload
+
+    ok = await offload(_verify_in_text, value, text, size=len(text))
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from core.logger import get_logger
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_max_workers = 2
+_min_size = 3000
+
+
+def configure(max_workers: int, min_size: int) -> None:
+    """
+    Args:
+        max_workers: Worker processes (0 = always run inline)
+        min_size: Inputs smaller than this (chars / items) run inline
+    """
+    global _max_workers, _min_size
+    _max_workers = max_workers
+    _min_size = min_size
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if _max_workers <= 0:
+        return None
+    if _executor is None:
+        # spawn: never fork a process that has a running event loop and threads
+        _executor = ProcessPoolExecutor(
+            max_workers=_max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def offload(func: Callable, *args, size: int = 0):
+    """
+    Run func(*args) in the process pool when size >= min_size, inline otherwise.
+
+    A broken pool (worker killed) falls back to inline and is recreated on the
+    next call.
+    """
+    executor = _get_executor() if size >= _min_size else None
+    if executor is None:
+        metrics.incr("offload_inline")
+        return func(*args)
+
+    metrics.incr("offload_process")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        logger.warning(f"Process pool broken while running {func.__name__}, running inline")
+        metrics.incr("offload_broken_pool")
+        _reset_executor()
+        return func(*args)
+
+
+def _reset_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown_offload() -> None:
+    """Stop worker processes (at shutdown)."""
+    _reset_executor()
@@ -0,0 +1,198 @@
+"""
+Adaptive load shedding.
+
+Live signals are smoothed (EWMA) and compared with per-signal thresholds:
+- db_wait: pool acquire wait (seconds), fed by core.database
+- loop_lag: event-loop lag (seconds), fed by core.loop_monitor
+- llm_latency: provider reply time (seconds), fed by the message handlers
+- queue_depth: queued background tasks, read from a registered probe
+
+The degradation level (0 = normal .. MAX_LEVEL) goes up one step while any
+signal is above its degrade threshold, and back down one step only after every
+signal has stayed below its recover threshold for step_down seconds
+(hysteresis: no flapping around a single threshold).
+
+Optional stages declare the level from which they are skipped, so core
+replies stay fast while the extras (coherence lookups, summaries, extraction)
+are shed first.
+
+Usage:
+    from core.overload import overload
+
+    overload.record("llm_latency", elapsed)
+    if overload.allows("coherence"):
+        ...
+"""
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from core.logger import get_logger
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+MAX_LEVEL = 3
+
+# stage -> first level at which it is skipped
+OPTIONAL_STAGES = {
+    "coherence": 1,        # check_luna_coherence + luna_said lookups
+    "summary": 1,          # weekly summary in the prompt
+    "keyword_events": 2,   # keyword search on the timeline
+    "rolling_summary": 2,  # conversation summary refresh (the raw tail grows until it runs)
+    "extraction": 3,       # background memory extraction (last resort: facts are lost)
+}
+
+# name -> degrade threshold (recover threshold = degrade * recover_ratio)
+DEFAULT_THRESHOLDS = {
+    "db_wait": 0.05,
+    "loop_lag": 0.1,
+    "llm_latency": 8.0,
+    "queue_depth": 200,
+}
+
+
+@dataclass
+class Signal:
+    """One smoothed load signal."""
+    name: str
+    degrade_at: float
+    recover_at: float
+    value: float = 0.0
+    probe: Optional[Callable[[], float]] = None
+    initialized: bool = False  # first sample seeds the average (0.0 is a real sample)
+
+    def update(self, sample: float, alpha: float) -> None:
+        if not self.initialized:
+            self.value = sample
+            self.initialized = True
+        else:
+            self.value = alpha * sample + (1 - alpha) * self.value
+
+
+class OverloadController:
+    """Turns load signals into a degradation level, with hysteresis."""
+
+    def __init__(
+        self,
+        thresholds: Optional[dict] = None,
+        recover_ratio: float = 0.5,
+        step_up: float = 5.0,
+        step_down: float = 30.0,
+        alpha: float = 0.3,
+        eval_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.enabled = True
+        self.alpha = alpha
+        self.eval_interval = eval_interval
+        self._clock = clock
+        self._level = 0
+        self._last_change = -math.inf
+        self._last_eval = -math.inf
+        self._calm_since: Optional[float] = None
+        self._signals: dict[str, Signal] = {}
+        self.configure(thresholds or DEFAULT_THRESHOLDS, recover_ratio, step_up, step_down)
+
+    def configure(
+        self,
+        thresholds: dict,
+        recover_ratio: float = 0.5,
+        step_up: float = 5.0,
+        step_down: float = 30.0,
+        enabled: bool = True,
+    ) -> None:
+        """
+        Args:
+            thresholds: signal name -> degrade threshold
+            recover_ratio: recover threshold as a fraction of the degrade one
+            step_up: min seconds between two level increases
+            step_down: seconds of calm before each level decrease
+        """
+        self.enabled = enabled
+        self.step_up = step_up
+        self.step_down = step_down
+        for name, degrade_at in thresholds.items():
+            signal = self._signals.get(name)
+            if signal is None:
+                self._signals[name] = Signal(name, degrade_at, degrade_at * recover_ratio)
+            else:
+                signal.degrade_at, signal.recover_at = degrade_at, degrade_at * recover_ratio
+
+    def register_probe(self, name: str, probe: Callable[[], float]) -> None:
+        """Read `name` from probe() at each evaluation (gauges such as queue depth)."""
+        self._signals[name].probe = probe
+
+    def record(self, name: str, value: float) -> None:
+        """Feed one observation of a pushed signal (unknown names are ignored)."""
+        signal = self._signals.get(name)
+        if signal is not None:
+            signal.update(value, self.alpha)
+
+    @property
+    def level(self) -> int:
+        """Current degradation level (re-evaluated at most every eval_interval)."""
+        if not self.enabled:
+            return 0
+        now = self._clock()
+        if now - self._last_eval >= self.eval_interval:
+            self.evaluate(now)
+        return self._level
+
+    def allows(self, stage: str) -> bool:
+        """False when `stage` is shed at the current level."""
+        if self.level < OPTIONAL_STAGES.get(stage, MAX_LEVEL + 1):
+            return True
+        metrics.incr(f"overload_shed_{stage}")
+        return False
+
+    def evaluate(self, now: Optional[float] = None) -> int:
+        """Update the level from the current signal values."""
+        now = self._clock() if now is None else now
+        self._last_eval = now
+
+        for signal in self._signals.values():
+            if signal.probe is not None:
+                try:
+                    signal.update(float(signal.probe()), self.alpha)
+                except Exception as e:
+                    logger.debug(f"Overload probe {signal.name} failed: {e}")
+
+        hot = [s.name for s in self._signals.values() if s.value >= s.degrade_at]
+        calm = all(s.value <= s.recover_at for s in self._signals.values())
+
+        if hot:
+            self._calm_since = None
+            if self._level < MAX_LEVEL and now - self._last_change >= self.step_up:
+                self._set_level(self._level + 1, now, f"pressure on {', '.join(hot)}")
+        elif calm:
+            if self._calm_since is None:
+                self._calm_since = now
+            since = max(self._calm_since, self._last_change)
+            if self._level > 0 and now - since >= self.step_down:
+                self._set_level(self._level - 1, now, "signals recovered")
+        else:
+            # Between the two thresholds: hold the current level
+            self._calm_since = None
+
+        return self._level
+
+    def _set_level(self, level: int, now: float, reason: str) -> None:
+        logger.warning(f"Overload level {self._level} -> {level} ({reason})")
+        self._level = level
+        self._last_change = now
+        metrics.set_gauge("overload_level", level)
+        metrics.incr("overload_level_changes")
+
+    def stats(self) -> dict:
+        return {
+            "level": self._level,
+            "shed": sorted(stage for stage, at in OPTIONAL_STAGES.items() if self._level >= at),
+            "signals": {name: round(s.value, 4) for name, s in self._signals.items()},
+        }
+
+
+# Singleton (thresholds configured at startup)
+overload = OverloadController()
@@ -0,0 +1,148 @@
+"""
+Declarative stage-graph executor.
+
+A pipeline is a set of stages, each declaring the values it needs (inputs)
+and the values it produces (outputs). run() starts every stage as soon as
+all of its inputs are available, so independent stages overlap instead of
+waiting on each other. Every stage is timed (histogram
+pipeline_<pipeline>_<stage>_seconds).
+
+A stage is an async function called with its inputs as keyword arguments
+and returning a dict with exactly its declared outputs (or None when it
+declares none). Raising PipelineStop ends the run early (e.g. the paywall
+reply replaces the normal answer); stages still running are cancelled.
+
+Usage:
+    from core.pipeline import Pipeline, Stage
+
+    pipeline = Pipeline("turn", [
+        Stage("load_user", load_user, inputs=("telegram_id",), outputs=("user",)),
+        Stage("reply", reply, inputs=("user", "text"), outputs=()),
+    ], initial=("telegram_id", "text"))
+    run = await pipeline.run({"telegram_id": 42, "text": "salut"})
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from core.logger import get_logger
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class PipelineStop(Exception):
+    """Raised by a stage to end the run without running the remaining stages."""
+    pass
+
+
+@dataclass(frozen=True)
+class Stage:
+    """One step of a pipeline."""
+    name: str
+    func: Callable[..., Awaitable[Optional[dict]]]
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+
+
+@dataclass
+class PipelineRun:
+    """Values produced by one run."""
+    values: dict[str, Any]
+    timings: dict[str, float] = field(default_factory=dict)  # stage -> seconds
+    stopped_by: Optional[str] = None
+
+
+class Pipeline:
+    """Runs stages in dependency order, concurrently where possible."""
+
+    def __init__(self, name: str, stages: Iterable[Stage], initial: Iterable[str] = ()):
+        self.name = name
+        self.stages = tuple(stages)
+        self.initial = tuple(initial)
+        self._check()
+
+    def _check(self) -> None:
+        """Reject duplicate outputs, missing inputs and cycles at build time."""
+        producers: dict[str, str] = {key: "<initial>" for key in self.initial}
+        for stage in self.stages:
+            for key in stage.outputs:
+                if key in producers:
+                    raise ValueError(f"{self.name}: '{key}' produced by both {producers[key]} and {stage.name}")
+                producers[key] = stage.name
+
+        for stage in self.stages:
+            missing = [key for key in stage.inputs if key not in producers]
+            if missing:
+                raise ValueError(f"{self.name}: stage {stage.name} needs unknown inputs {missing}")
+
+        available = set(self.initial)
+        remaining = list(self.stages)
+        while remaining:
+            ready = [s for s in remaining if available.issuperset(s.inputs)]
+            if not ready:
+                raise ValueError(f"{self.name}: dependency cycle between {[s.name for s in remaining]}")
+            for stage in ready:
+                available.update(stage.outputs)
+                remaining.remove(stage)
+
+    async def run(self, initial: dict[str, Any]) -> PipelineRun:
+        """
+        Run every stage once.
+
+        Raises:
+            Whatever a stage raises (other than PipelineStop); running stages
+            are cancelled first.
+        """
+        missing = [key for key in self.initial if key not in initial]
+        if missing:
+            raise ValueError(f"{self.name}: missing initial values {missing}")
+
+        result = PipelineRun(values=dict(initial))
+        pending = list(self.stages)
+        running: dict[asyncio.Task, Stage] = {}
+
+        try:
+            while pending or running:
+                for stage in [s for s in pending if all(k in result.values for k in s.inputs)]:
+                    pending.remove(stage)
+                    kwargs = {key: result.values[key] for key in stage.inputs}
+                    task = asyncio.create_task(self._timed(stage, kwargs, result), name=f"{self.name}:{stage.name}")
+                    running[task] = stage
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    try:
+                        outputs = task.result()
+                    except PipelineStop:
+                        result.stopped_by = stage.name
+                        metrics.incr(f"pipeline_{self.name}_stopped_{stage.name}")
+                        return result
+                    result.values.update(self._outputs(stage, outputs))
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        return result
+
+    async def _timed(self, stage: Stage, kwargs: dict, result: PipelineRun) -> Optional[dict]:
+        started = time.perf_counter()
+        try:
+            return await stage.func(**kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            result.timings[stage.name] = elapsed
+            metrics.observe(f"pipeline_{self.name}_{stage.name}_seconds", elapsed)
+
+    def _outputs(self, stage: Stage, outputs: Optional[dict]) -> dict:
+        outputs = outputs or {}
+        if set(outputs) != set(stage.outputs):
+            raise ValueError(
+                f"{self.name}: stage {stage.name} returned {sorted(outputs)}, declared {sorted(stage.outputs)}"
+            )
+        return outputs
@@ -0,0 +1,227 @@
+"""
+On-demand sampling profiler.
+
+A daemon thread snapshots every thread's Python stack (sys._current_frames)
+at a fixed interval for N seconds. Nothing is hooked into the interpreter,
+so the running bot pays only for the sampling itself (~100 stack walks/s).
+
+Asyncio coverage: coroutine frames are part of the event-loop thread's stack
+while they run, and each loop-thread sample is rooted at the task that was
+running (task:<name>), or "loop" when the loop was idle/selecting.
+
+Output (in output_dir):
+- <stamp>.collapsed: one "root;frame;frame count" line per stack
+  (flamegraph.pl / inferno / speedscope import)
+- <stamp>.speedscope.json: speedscope sampled profile
+
+Only one session runs at a time; a second one raises ProfilerBusyError.
+
+Usage:
+    from core.profiler import profiler
+
+    result = await profiler.run(30)
+    print(result.speedscope_path, result.format_top())
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from core.errors import LunaError
+from core.logger import get_logger
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+# (qualname, file, first line)
+Frame = tuple[str, str, int]
+
+# Leaf functions of a thread that is blocked waiting, not burning CPU.
+# Kept in the files (flamegraph shows where threads wait), left out of the top list.
+IDLE_FUNCTIONS = frozenset({
+    "select", "poll", "wait", "_wait_for_tstate_lock", "_worker", "sleep", "accept",
+})
+
+
+class ProfilerBusyError(LunaError):
+    """A profiling session is already running."""
+    pass
+
+
+@dataclass
+class ProfileResult:
+    """Outcome of one profiling session."""
+    collapsed_path: str
+    speedscope_path: str
+    duration: float
+    samples: int
+    # (function, self samples, % of busy samples)
+    top: list[tuple[str, int, float]] = field(default_factory=list)
+
+    def format_top(self) -> str:
+        return "\n".join(f"{pct:5.1f}%  {count:5d}  {name}" for name, count, pct in self.top)
+
+
+def _frame_label(frame: Frame) -> str:
+    qualname, filename, line = frame
+    return f"{qualname} ({filename}:{line})"
+
+
+class SamplingProfiler:
+    """Samples thread stacks (and the running asyncio task) for a fixed duration."""
+
+    def __init__(self, interval: float = 0.01, output_dir: str = "/tmp/luna-profiles", max_depth: int = 128):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.max_depth = max_depth
+        self._active = False
+
+    def configure(self, interval: float, output_dir: str) -> None:
+        self.interval = interval
+        self.output_dir = output_dir
+
+    @property
+    def running(self) -> bool:
+        return self._active
+
+    async def run(self, seconds: float) -> ProfileResult:
+        """
+        Profile the whole process for `seconds` (needs a running loop).
+
+        Raises:
+            ProfilerBusyError: another session is in progress
+        """
+        if self._active:
+            raise ProfilerBusyError("A profiling session is already running")
+        self._active = True
+        metrics.incr("profiler_sessions")
+        try:
+            loop = asyncio.get_running_loop()
+            stop = threading.Event()
+            stacks: Counter = Counter()
+            sampler = threading.Thread(
+                target=self._sample,
+                args=(stop, stacks, loop, threading.get_ident()),
+                name="luna-profiler",
+                daemon=True,
+            )
+            started = time.monotonic()
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            duration = time.monotonic() - started
+            result = await asyncio.to_thread(self._write, stacks, duration)
+            logger.info(f"Profile written: {result.speedscope_path} ({result.samples} samples)")
+            return result
+        finally:
+            self._active = False
+
+    def _sample(self, stop: threading.Event, stacks: Counter, loop, loop_thread: int) -> None:
+        """Sampler thread body: one snapshot of every other thread per interval."""
+        own = threading.get_ident()
+        names = {}
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+        while not stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names.setdefault(thread.ident, thread.name)
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident == loop_thread:
+                    task = current_tasks.get(loop)
+                    root = f"task:{task.get_name()}" if task is not None else "loop"
+                else:
+                    root = f"thread:{names.get(ident, ident)}"
+                stacks[(root,) + self._walk(frame)] += 1
+
+    def _walk(self, frame) -> tuple[Frame, ...]:
+        """Root-first tuple of frames (truncated at max_depth from the leaf)."""
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append((code.co_qualname, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        frames.reverse()
+        return tuple(frames)
+
+    def _write(self, stacks: Counter, duration: float) -> ProfileResult:
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, datetime.now().strftime("profile-%Y%m%d-%H%M%S"))
+        collapsed_path = f"{base}.collapsed"
+        speedscope_path = f"{base}.speedscope.json"
+
+        with open(collapsed_path, "w") as f:
+            for stack, count in stacks.most_common():
+                line = ";".join([stack[0]] + [_frame_label(frame) for frame in stack[1:]])
+                f.write(f"{line.replace(' ', '_')} {count}\n")
+
+        with open(speedscope_path, "w") as f:
+            json.dump(self._speedscope(stacks, duration), f)
+
+        return ProfileResult(
+            collapsed_path=collapsed_path,
+            speedscope_path=speedscope_path,
+            duration=duration,
+            samples=sum(stacks.values()),
+            top=self.top_functions(stacks),
+        )
+
+    def _speedscope(self, stacks: Counter, duration: float) -> dict:
+        frame_index: dict = {}
+        frames: list[dict] = []
+
+        def index(frame) -> int:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                if isinstance(frame, str):
+                    frames.append({"name": frame})
+                else:
+                    qualname, filename, line = frame
+                    frames.append({"name": qualname, "file": filename, "line": line})
+            return frame_index[frame]
+
+        samples, weights = [], []
+        for stack, count in stacks.items():
+            samples.append([index(frame) for frame in stack])
+            weights.append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "luna-profiler",
+            "name": "luna",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"luna ({duration:.0f}s)",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    @staticmethod
+    def top_functions(stacks: Counter, limit: int = 10) -> list[tuple[str, int, float]]:
+        """Hottest leaf functions by self samples, idle waits excluded."""
+        leaves: Counter = Counter()
+        for stack, count in stacks.items():
+            if len(stack) < 2 or stack[-1][0].rsplit(".", 1)[-1] in IDLE_FUNCTIONS:
+                continue
+            leaves[_frame_label(stack[-1])] += count
+        busy = sum(leaves.values()) or 1
+        return [(name, count, count * 100 / busy) for name, count in leaves.most_common(limit)]
+
+
+# Singleton (one session per process)
+profiler = SamplingProfiler()
@@ -0,0 +1,159 @@
+"""
+Supervised background tasks.
+
+Fire-and-forget work (extraction enqueue, follow-ups, ...) runs in named
+lanes instead of bare asyncio.create_task():
+- per-lane concurrency limit and queue bound (excess work is rejected, not piled up)
+- strong references to every task (no garbage-collected tasks)
+- optional per-task deadline (cancelled when exceeded)
+- shutdown() drains lanes by priority, then cancels what is left
+- metrics: queued / running gauges, failed / timeout / rejected counters,
+  wait and run time histograms, per lane
+
+Usage:
+    from core.tasks import task_supervisor
+
+    task_supervisor.submit(coro, "extraction_enqueue", lane="critical")
+    await task_supervisor.shutdown(deadline=10)
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Coroutine, Optional
+
+from core.logger import get_logger
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class Lane:
+    """A named group of tasks sharing a concurrency limit."""
+    name: str
+    max_concurrent: int
+    max_queued: int
+    priority: int = 0  # lower drains first on shutdown
+    timeout: Optional[float] = None
+    queued: int = 0
+    running: int = 0
+    tasks: set = field(default_factory=set)
+    semaphore: Optional[asyncio.Semaphore] = None
+
+    def __post_init__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+
+
+# name -> (max_concurrent, max_queued, priority, timeout seconds)
+DEFAULT_LANES = {
+    "critical": (32, 1000, 0, 30.0),
+    "default": (16, 500, 1, 60.0),
+    "background": (4, 200, 2, 300.0),
+}
+
+
+class TaskSupervisor:
+    """Runs background coroutines in bounded, prioritized lanes."""
+
+    def __init__(self, lanes: Optional[dict] = None):
+        self._lanes: dict[str, Lane] = {}
+        self._closing = False
+        self.configure(lanes or DEFAULT_LANES)
+
+    def configure(self, lanes: dict) -> None:
+        """(Re)define lanes: {name: (max_concurrent, max_queued, priority, timeout)}."""
+        for name, (max_concurrent, max_queued, priority, timeout) in lanes.items():
+            self._lanes[name] = Lane(name, max(1, max_concurrent), max(0, max_queued), priority, timeout)
+
+    def submit(
+        self,
+        coro: Coroutine,
+        name: str,
+        lane: str = "default",
+        timeout: Optional[float] = None,
+    ) -> Optional[asyncio.Task]:
+        """
+        Schedule a coroutine in a lane.
+
+        Returns:
+            The task, or None if rejected (shutting down or lane full)
+        """
+        target = self._lanes.get(lane) or self._lanes["default"]
+        if self._closing or target.queued >= target.max_queued:
+            coro.close()
+            metrics.incr(f"tasks_{target.name}_rejected")
+            logger.warning(f"[{name}] Task rejected (lane {target.name} {'closing' if self._closing else 'full'})")
+            return None
+
+        target.queued += 1
+        self._update_gauges(target)
+        task = asyncio.create_task(self._run(target, coro, name, timeout or target.timeout))
+        target.tasks.add(task)
+        task.add_done_callback(target.tasks.discard)
+        return task
+
+    async def _run(self, lane: Lane, coro: Coroutine, name: str, timeout: Optional[float]):
+        enqueued = time.monotonic()
+        started = None
+        try:
+            async with lane.semaphore:
+                lane.queued -= 1
+                lane.running += 1
+                started = time.monotonic()
+                metrics.observe(f"tasks_{lane.name}_wait_seconds", started - enqueued)
+                self._update_gauges(lane)
+                try:
+                    if timeout:
+                        return await asyncio.wait_for(coro, timeout)
+                    return await coro
+                except asyncio.TimeoutError:
+                    metrics.incr(f"tasks_{lane.name}_timeouts")
+                    logger.error(f"[{name}] Task exceeded {timeout}s deadline, cancelled")
+                except Exception as e:
+                    metrics.incr(f"tasks_{lane.name}_failed")
+                    logger.error(f"[{name}] Task failed: {e}", exc_info=True)
+                finally:
+                    lane.running -= 1
+                    metrics.observe(f"tasks_{lane.name}_run_seconds", time.monotonic() - started)
+                    self._update_gauges(lane)
+        finally:
+            if started is None:
+                # Cancelled while still queued: the coroutine never ran
+                lane.queued -= 1
+                coro.close()
+                self._update_gauges(lane)
+        return None
+
+    async def shutdown(self, deadline: float = 10.0) -> None:
+        """Stop accepting work, drain lanes by priority within `deadline`, cancel the rest."""
+        self._closing = True
+        end = time.monotonic() + deadline
+
+        for lane in sorted(self._lanes.values(), key=lambda l: l.priority):
+            if not lane.tasks:
+                continue
+            remaining = end - time.monotonic()
+            if remaining > 0:
+                await asyncio.wait(set(lane.tasks), timeout=remaining)
+            leftover = [t for t in lane.tasks if not t.done()]
+            for task in leftover:
+                task.cancel()
+            if leftover:
+                await asyncio.wait(leftover)
+                metrics.incr(f"tasks_{lane.name}_cancelled", len(leftover))
+                logger.warning(f"Lane {lane.name}: {len(leftover)} tasks cancelled at shutdown")
+
+    def stats(self) -> dict:
+        return {
+            name: {"queued": lane.queued, "running": lane.running}
+            for name, lane in self._lanes.items()
+        }
+
+    def _update_gauges(self, lane: Lane) -> None:
+        metrics.set_gauge(f"tasks_{lane.name}_queued", lane.queued)
+        metrics.set_gauge(f"tasks_{lane.name}_running", lane.running)
+
+
+# Singleton (lanes configured at startup via configure())
+task_supervisor = TaskSupervisor()
@@ -0,0 +1,182 @@
+"""
+Prompt token counting and budgeting.
+
+count_tokens() uses tiktoken (cl100k_base) when it is installed and its
+encoding is available locally, otherwise a word-piece heuristic (words split
+in ~4-char pieces, punctuation and emoji counted apart), which tracks French
+text much better than len/4. Counts are cached per string: memory sections
+and history turns come back unchanged turn after turn.
+
+PromptBudget packs prioritized pieces (memory sections, history turns) under
+one token limit:
+- highest priority first, ties in insertion order
+- a piece that does not fit is dropped, smaller lower-priority ones may still fit
+- pieces of a chain (history: newest to oldest) stop at the first drop, so the
+  kept history is always a contiguous tail of the conversation
+- pack() reports what was kept and what was dropped
+
+Usage:
+    from core.tokens import PromptBudget, count_tokens, prompt_token_limit
+
+    budget = PromptBudget(prompt_token_limit(model), reserved=count_tokens(system))
+    budget.add("memory", "dates", dates_text, priority=9)
+    budget.add("history", "h3", message["content"], priority=10, chain="history", value=message)
+    packed = budget.pack()
+"""
+
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Optional
+
+from core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Prompt budget (system + memory + history + message) per reply model, matched
+# on a substring of the model id. Well under the context windows on purpose:
+# past this, extra memory/history costs latency and money for little gain.
+MODEL_PROMPT_TOKENS = {
+    "claude-haiku": 8000,
+    "magnum": 6000,
+    "euryale": 6000,
+}
+DEFAULT_PROMPT_TOKENS = 6000
+
+# Chat framing added by the providers around each message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """tiktoken encoding, loaded on first use (None when unavailable)."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            pass
+        except Exception as e:  # encoding file missing and not downloadable
+            logger.warning(f"tiktoken unavailable, using heuristic token counts: {e}")
+    return _encoding
+
+
+def _heuristic_tokens(text: str) -> int:
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        if len(piece) == 1 and not piece.isalnum():
+            # Punctuation: 1 token, emoji and other astral symbols: ~2
+            tokens += 2 if ord(piece) > 0xFFFF else 1
+        else:
+            tokens += (len(piece) + 3) // 4
+            if not piece.isascii():
+                tokens += 1  # accented words split into more pieces
+    return tokens
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Token count of `text` (cached per string)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return _heuristic_tokens(text)
+
+
+def prompt_token_limit(model: str, override: int = 0) -> int:
+    """Prompt budget of a model (override > 0 wins over the per-model table)."""
+    if override > 0:
+        return override
+    for name, limit in MODEL_PROMPT_TOKENS.items():
+        if name in (model or ""):
+            return limit
+    return DEFAULT_PROMPT_TOKENS
+
+
+@dataclass
+class BudgetItem:
+    """One piece competing for the budget."""
+    kind: str  # "memory", "history"...
+    name: str
+    text: str
+    priority: int
+    tokens: int
+    order: int
+    chain: Optional[str] = None
+    value: Any = None  # caller's object (e.g. the history message)
+
+
+@dataclass
+class PackResult:
+    """Outcome of PromptBudget.pack() (items in insertion order)."""
+    limit: int
+    used: int
+    kept: list[BudgetItem] = field(default_factory=list)
+    dropped: list[BudgetItem] = field(default_factory=list)
+
+    def kept_of(self, kind: str) -> list[BudgetItem]:
+        return [item for item in self.kept if item.kind == kind]
+
+    def dropped_names(self) -> list[str]:
+        return [f"{item.kind}:{item.name}" for item in self.dropped]
+
+
+class PromptBudget:
+    """Greedy packing of prioritized pieces under a token limit."""
+
+    def __init__(self, limit: int, reserved: int = 0, separator_tokens: int = 0):
+        """
+        Args:
+            limit: total token budget
+            reserved: tokens already spent (fixed system prompt, user message)
+            separator_tokens: added to every piece (joins, message framing)
+        """
+        self.limit = limit
+        self.reserved = reserved
+        self.separator_tokens = separator_tokens
+        self._items: list[BudgetItem] = []
+
+    def add(self, kind: str, name: str, text: str, priority: int,
+            chain: Optional[str] = None, value: Any = None) -> BudgetItem:
+        item = BudgetItem(
+            kind=kind,
+            name=name,
+            text=text,
+            priority=priority,
+            tokens=count_tokens(text) + self.separator_tokens,
+            order=len(self._items),
+            chain=chain,
+            value=value,
+        )
+        self._items.append(item)
+        return item
+
+    def pack(self) -> PackResult:
+        remaining = self.limit - self.reserved
+        broken_chains = set()
+        kept, dropped = [], []
+        for item in sorted(self._items, key=lambda i: (-i.priority, i.order)):
+            if item.chain in broken_chains or item.tokens > remaining:
+                dropped.append(item)
+                if item.chain is not None:
+                    broken_chains.add(item.chain)
+                continue
+            kept.append(item)
+            remaining -= item.tokens
+
+        def by_order(i):
+            return i.order
+
+        return PackResult(
+            limit=self.limit,
+            used=self.limit - remaining,
+            kept=sorted(kept, key=by_order),
+            dropped=sorted(dropped, key=by_order),
+        )
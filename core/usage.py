@@ -0,0 +1,224 @@
+"""
+LLM token accounting.
+
+Every provider call reports its `usage` block here, tagged with the call
+site (reply, classifier, extraction, weekly_summary, monthly_summary,
+rolling_summary):
+
+- counters llm_calls_<site>, llm_tokens_{input,output,cached}_<site>
+- counters llm_prompt_tokens_<site>_<section>: input tokens split across
+  the prompt sections (system, memory, history, user). Providers only
+  return totals, so each section gets its share of the real input count
+  in proportion to its estimated size.
+- per turn (run_turn wraps the pipeline in usage.turn()): totals of every
+  call made during the turn, optionally written to llm_usage_audit.
+
+Usage:
+    from core.usage import usage
+
+    data = response.json()
+    usage.record("extraction", data, model=HAIKU_MODEL)
+
+    usage.set_sections("reply", system=system, memory=memory_context, history=history)
+"""
+
+import json
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+from core.logger import get_logger
+from core.tasks import task_supervisor
+from core.tokens import count_tokens
+from middleware.metrics import metrics
+
+logger = get_logger(__name__)
+
+USAGE_AUDIT_TABLE = """
+CREATE TABLE IF NOT EXISTS llm_usage_audit (
+    id BIGSERIAL PRIMARY KEY,
+    telegram_id BIGINT,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    calls JSONB NOT NULL,     -- [{"site", "model", "input", "output", "cached"}]
+    sections JSONB NOT NULL,  -- {"reply": {"memory": 812, "history": 1430, ...}}
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_usage_audit_created
+ON llm_usage_audit(created_at);
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Local token estimate (core/tokens.py), only used to split totals across sections."""
+    return count_tokens(text) if text else 0
+
+
+@dataclass
+class TokenUsage:
+    """Token counts of one provider response."""
+    input: int = 0
+    output: int = 0
+    cached: int = 0  # input tokens read from the prompt cache
+
+    @classmethod
+    def from_response(cls, data: dict) -> "TokenUsage":
+        """Parse an Anthropic or OpenAI-style (OpenRouter) `usage` block."""
+        raw = data.get("usage") if isinstance(data, dict) else None
+        if not isinstance(raw, dict):
+            return cls()
+        if "input_tokens" in raw:
+            # Anthropic: input_tokens excludes cache reads and cache writes
+            cached = raw.get("cache_read_input_tokens") or 0
+            written = raw.get("cache_creation_input_tokens") or 0
+            return cls(
+                input=(raw.get("input_tokens") or 0) + cached + written,
+                output=raw.get("output_tokens") or 0,
+                cached=cached,
+            )
+        details = raw.get("prompt_tokens_details") or {}
+        return cls(
+            input=raw.get("prompt_tokens") or 0,
+            output=raw.get("completion_tokens") or 0,
+            cached=details.get("cached_tokens") or 0,
+        )
+
+
+@dataclass
+class TurnUsage:
+    """Calls made while handling one turn."""
+    telegram_id: Optional[int] = None
+    calls: list[dict] = field(default_factory=list)
+    sections: dict[str, dict[str, int]] = field(default_factory=dict)  # site -> section -> tokens
+    pending_sections: dict[str, dict[str, int]] = field(default_factory=dict)  # site -> estimates
+    closed: bool = False
+
+    def totals(self) -> TokenUsage:
+        return TokenUsage(
+            input=sum(c["input"] for c in self.calls),
+            output=sum(c["output"] for c in self.calls),
+            cached=sum(c["cached"] for c in self.calls),
+        )
+
+
+_current_turn: ContextVar[Optional[TurnUsage]] = ContextVar("llm_turn_usage", default=None)
+
+
+class UsageRecorder:
+    """Routes provider usage to the metrics registry and the current turn."""
+
+    def __init__(self):
+        self.audit = False
+        self._pool = None
+
+    def configure(self, pool=None, audit: bool = False) -> None:
+        """
+        Args:
+            pool: DB pool for the audit table
+            audit: write one llm_usage_audit row per turn
+        """
+        self._pool = pool
+        self.audit = audit and pool is not None
+
+    def set_sections(self, site: str, **sections) -> None:
+        """
+        Declare the prompt sections of the next `site` call in this turn.
+        Values are strings or message lists ({"content": ...}).
+        """
+        turn = _current_turn.get()
+        if turn is None or turn.closed:
+            return
+        estimates = {}
+        for name, value in sections.items():
+            if isinstance(value, list):
+                value = "\n".join(str(m.get("content", "")) for m in value)
+            estimates[name] = estimate_tokens(value or "")
+        turn.pending_sections[site] = estimates
+
+    def record(self, site: str, data: dict, model: Optional[str] = None) -> TokenUsage:
+        """Record the `usage` of one provider response (missing usage counts as 0)."""
+        tokens = TokenUsage.from_response(data)
+        metrics.incr(f"llm_calls_{site}")
+        metrics.incr(f"llm_tokens_input_{site}", tokens.input)
+        metrics.incr(f"llm_tokens_output_{site}", tokens.output)
+        metrics.incr(f"llm_tokens_cached_{site}", tokens.cached)
+
+        turn = _current_turn.get()
+        if turn is None or turn.closed:
+            return tokens
+
+        turn.calls.append({
+            "site": site,
+            "model": model,
+            "input": tokens.input,
+            "output": tokens.output,
+            "cached": tokens.cached,
+        })
+        estimates = turn.pending_sections.pop(site, None)
+        if estimates and tokens.input:
+            shares = self._split(tokens.input, estimates)
+            per_site = turn.sections.setdefault(site, {})
+            for section, count in shares.items():
+                per_site[section] = per_site.get(section, 0) + count
+                metrics.incr(f"llm_prompt_tokens_{site}_{section}", count)
+        return tokens
+
+    @staticmethod
+    def _split(total: int, estimates: dict[str, int]) -> dict[str, int]:
+        """Share `total` across sections in proportion to their estimates (sums to total)."""
+        estimated = sum(estimates.values())
+        if estimated <= 0:
+            return {}
+        shares = {name: total * est // estimated for name, est in estimates.items()}
+        # Rounding remainder to the largest section
+        largest = max(estimates, key=estimates.get)
+        shares[largest] += total - sum(shares.values())
+        return shares
+
+    @asynccontextmanager
+    async def turn(self, telegram_id: Optional[int] = None):
+        """Collect the calls made inside the block (including stage tasks it starts)."""
+        current = TurnUsage(telegram_id=telegram_id)
+        token = _current_turn.set(current)
+        try:
+            yield current
+        finally:
+            _current_turn.reset(token)
+            # Calls from background work started by the turn no longer count
+            current.closed = True
+            self._finish(current)
+
+    def _finish(self, turn: TurnUsage) -> None:
+        if not turn.calls:
+            return
+        totals = turn.totals()
+        metrics.incr("llm_turns")
+        metrics.set_gauge("llm_turn_input_tokens", totals.input)
+        metrics.set_gauge("llm_turn_output_tokens", totals.output)
+        logger.debug(
+            f"[{turn.telegram_id}] Turn tokens: in={totals.input} out={totals.output} "
+            f"cached={totals.cached} sections={turn.sections}"
+        )
+        if self.audit:
+            task_supervisor.submit(self._write_audit(turn, totals), "usage_audit", lane="background")
+
+    async def _write_audit(self, turn: TurnUsage, totals: TokenUsage) -> None:
+        async with self._pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO llm_usage_audit
+                    (telegram_id, input_tokens, output_tokens, cached_tokens, calls, sections)
+                VALUES ($1, $2, $3, $4, $5::jsonb, $6::jsonb)
+            """, turn.telegram_id, totals.input, totals.output, totals.cached,
+                json.dumps(turn.calls), json.dumps(turn.sections))
+
+
+async def init_usage_table(conn) -> None:
+    """Create the per-turn audit table."""
+    await conn.execute(USAGE_AUDIT_TABLE)
+
+
+# Singleton (audit configured at startup)
+usage = UsageRecorder()
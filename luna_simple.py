@@ -16,15 +16,27 @@ import logging
 import os
 import random
 import re
+import time
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
-import asyncpg
 import httpx
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
+# Base partagée (même couche que bot/main.py)
+from core.database import Database, disable_statement_timeout
+from core.overload import overload
+from core.usage import usage
+from core.tasks import task_supervisor
+
+# Conversation log (partitions mensuelles)
+from bot.conversations import enforce_retention, ensure_partitions, init_conversations
+
+# Pipeline de tour (partagé avec bot/handlers/messages.py)
+from bot.turn import TurnDeps, build_turn_pipeline, combine_buffered, run_turn
+
 # Memory system imports
 from memory import (
     set_pool as set_memory_pool,
@@ -34,35 +46,29 @@ from memory import (
     get_user as memory_get_user,
     get_relationship,
     update_relationship,
-    extract_unified,  # V2: Single LLM call for all extraction
-    build_prompt_context,
+    extraction_scheduler,  # V2: Debounced + merged unified extraction
     update_tiers,
     # V2: Compression
     set_compression_api_key,
     run_weekly_compression,
     run_monthly_compression,
 )
+from memory.prefilter import prune_outcomes
 
 # NSFW Gate (post-paywall)
 from services.nsfw_gate import NSFWGate
+from services.llm import SOFT_SENSUAL_INSTRUCTION, call_with_breakers
 
 # Phase system
 from services.phases import (
-    Phase,
     get_current_phase,
     get_phase_progress,
-    get_paywall_message,
     maybe_increment_day,
 )
 
-# Prompt builder
-from prompts.luna import build_system_prompt
-
 # Engagement engine (V7)
 from services.engagement import (
-    VariableRewards,
     EngagementState,
-    JealousyHandler,
     ProactiveEngine,
 )
 
@@ -77,6 +83,7 @@ ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 PAYMENT_LINK = os.getenv("PAYMENT_LINK", "")
 ADMIN_ID = int(os.getenv("ADMIN_TELEGRAM_ID", "0"))
+RUN_JOBS_IN_BOT = os.getenv("RUN_JOBS_IN_BOT", "true").lower() in ("true", "1", "yes")
 
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
@@ -95,6 +102,7 @@ PARIS_TZ = ZoneInfo("Europe/Paris")
 
 # Message batching
 BUFFER_DELAY = 3.5  # secondes avant de répondre (laisse l'user finir)
+CONVERSATION_RETENTION_DAYS = 90  # partitions mensuelles de conversations_simple
 message_buffers: dict[int, list[str]] = {}  # telegram_id -> [messages]
 buffer_tasks: dict[int, asyncio.Task] = {}  # telegram_id -> pending task
 
@@ -119,25 +127,6 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 
-# =============================================================================
-# ASYNC HELPERS
-# =============================================================================
-
-def create_safe_task(coro, task_name: str):
-    """
-    Crée une tâche async avec error handling.
-    Les erreurs sont loggées mais ne crashent pas le bot.
-    """
-    async def wrapped():
-        try:
-            return await coro
-        except Exception as e:
-            logger.error(f"[{task_name}] Background task failed: {e}", exc_info=True)
-            return None
-
-    return asyncio.create_task(wrapped())
-
-
 # =============================================================================
 # FIX P0 #2: POST-RESPONSE VALIDATION
 # =============================================================================
@@ -235,13 +224,18 @@ async def validate_response_facts(response: str, user_facts: dict) -> tuple[str,
 # DATABASE
 # =============================================================================
 
-pool: asyncpg.Pool | None = None
+pool: Database | None = None
 
 
 async def init_db():
     """Initialise la DB avec tables mémoire."""
     global pool
-    pool = await asyncpg.create_pool(**DB_CONFIG, min_size=2, max_size=10)
+    pool = Database()
+    await pool.connect(
+        **DB_CONFIG, min_size=2, max_size=10,
+        acquire_timeout=5.0,
+        statement_timeout_ms=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000")),
+    )
 
     # Init memory system pool
     set_memory_pool(pool)
@@ -251,22 +245,13 @@ async def init_db():
     # Init memory tables
     await init_memory_tables(pool)
 
+    # Reprendre les extractions en attente (file persistée)
+    await extraction_scheduler.restore()
+
     # Keep conversations table for history
     async with pool.acquire() as conn:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS conversations_simple (
-                id SERIAL PRIMARY KEY,
-                user_id UUID REFERENCES memory_users(id),
-                role VARCHAR(10) NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-            )
-        """)
-
-        await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_conv_simple_user
-            ON conversations_simple(user_id, created_at DESC)
-        """)
+        await disable_statement_timeout(conn)
+        await init_conversations(conn)
 
         # Add nsfw_gate_data column if not exists
         await conn.execute("""
@@ -350,12 +335,13 @@ async def get_history(user_id, limit: int = 20) -> list[dict]:
     """Récupère l'historique (user_id est un UUID)."""
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
-            SELECT role, content FROM conversations_simple
+            SELECT id, role, content FROM conversations_simple
             WHERE user_id = $1
+              AND created_at > NOW() - make_interval(days => $3)
             ORDER BY created_at DESC
             LIMIT $2
-        """, user_id, limit)
-    return [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
+        """, user_id, limit, CONVERSATION_RETENTION_DAYS)
+    return [{"id": r["id"], "role": r["role"], "content": r["content"]} for r in reversed(rows)]
 
 
 async def load_nsfw_gate(user_id) -> NSFWGate:
@@ -464,8 +450,8 @@ def is_nsfw_message(message: str) -> bool:
     return any(kw in msg_lower for kw in NSFW_KEYWORDS)
 
 
-async def call_haiku(messages: list[dict], system: str, max_tokens: int = 150) -> str:
-    """Appel Claude Haiku."""
+async def call_haiku(messages: list[dict], system: str, max_tokens: int = 150, site: str = "reply") -> str:
+    """Appel Claude Haiku (`site`: étiquette du comptage de tokens)."""
     async with httpx.AsyncClient(timeout=30) as client:
         response = await client.post(
             "https://api.anthropic.com/v1/messages",
@@ -483,6 +469,7 @@ async def call_haiku(messages: list[dict], system: str, max_tokens: int = 150) -
         )
         response.raise_for_status()
         data = response.json()
+        usage.record(site, data, model=HAIKU_MODEL)
         return data["content"][0]["text"]
 
 
@@ -513,7 +500,8 @@ NO seulement si:
 EN CAS DE DOUTE → YES
 
 Réponds UNIQUEMENT: YES ou NO""",
-            max_tokens=5
+            max_tokens=5,
+            site="classifier",
         )
         is_nsfw = "YES" in response.upper()
         logger.info(f"NSFW classifier: '{message[:30]}...' → {is_nsfw}")
@@ -546,6 +534,7 @@ async def call_euryale(messages: list[dict], system: str) -> str:
         )
         response.raise_for_status()
         data = response.json()
+        usage.record("reply", data, model=NSFW_MODEL)
         return data["choices"][0]["message"]["content"]
 
 
@@ -555,14 +544,22 @@ async def generate_response(
     use_nsfw_model: bool,
     is_paid: bool = False  # Kept for backwards compat but ignored in V7+
 ) -> str:
-    """Génère une réponse avec le bon modèle."""
+    """
+    Génère une réponse avec le bon modèle, derrière les disjoncteurs par
+    modèle (une tentative courte; Magnum bascule sur Haiku + prompt soft).
+    """
+    started = time.monotonic()
+    haiku = f"anthropic:{HAIKU_MODEL}"
     try:
         if use_nsfw_model:
             logger.info("Using Magnum (NSFW)")
-            return await call_euryale(messages, system)
+            return await call_with_breakers(
+                lambda: call_euryale(messages, system), f"openrouter:{NSFW_MODEL}",
+                lambda: call_haiku(messages, system + SOFT_SENSUAL_INSTRUCTION), haiku,
+            )
         else:
             logger.info("Using Haiku (SFW)")
-            return await call_haiku(messages, system)
+            return await call_with_breakers(lambda: call_haiku(messages, system), haiku)
     except Exception as e:
         logger.error(f"LLM error: {e}")
         return random.choice([
@@ -570,6 +567,8 @@ async def generate_response(
             "attends j'ai pas capté",
             "pardon je déconnecte, tu disais?",
         ])
+    finally:
+        overload.record("llm_latency", time.monotonic() - started)
 
 
 # =============================================================================
@@ -617,7 +616,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def process_buffered_messages(telegram_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Process tous les messages bufferisés."""
+    """Process tous les messages bufferisés (pipeline de tour partagé, bot/turn.py)."""
     # Récupérer et vider le buffer
     messages_list = message_buffers.pop(telegram_id, [])
     buffer_tasks.pop(telegram_id, None)
@@ -625,181 +624,45 @@ async def process_buffered_messages(telegram_id: int, update: Update, context: C
     if not messages_list:
         return
 
-    # Dédupliquer les messages identiques consécutifs (spam)
-    deduped = []
-    for msg in messages_list:
-        if not deduped or msg.lower() != deduped[-1].lower():
-            deduped.append(msg)
-
-    # Combiner les messages
-    if len(deduped) == 1:
-        combined_text = deduped[0]
-    else:
-        combined_text = " ".join(deduped)
+    # Dédupliquer les messages identiques consécutifs (spam) et combiner
+    combined_text = combine_buffered(messages_list)
+    logger.info(f"[{telegram_id}] Buffered {len(messages_list)} msgs")
 
-    logger.info(f"[{telegram_id}] Buffered {len(messages_list)} msgs → {len(deduped)} deduped")
-
-    # Get/create user with memory system
-    user, relationship = await get_or_create_user_with_context(telegram_id)
-    user_id = user["id"]
-    day = relationship.get("day", 1) if relationship else 1
-    is_paid = relationship.get("paid", False) if relationship else False
-    paywall_shown = relationship.get("paywall_shown", False) if relationship else False
-
-    # Increment message count (new phase system)
-    message_count = await increment_message_count(user_id)
-
-    # Save combined user message
-    await save_message(user_id, "user", combined_text)
-
-    # Get history for extraction (used later with unified extraction)
-    history = await get_history(user_id, limit=10)
-
-    # =========================================================================
-    # PHASE SYSTEM (replaces old day-based logic)
-    # =========================================================================
-    current_phase = get_current_phase(message_count, day, is_paid, paywall_shown)
-    logger.info(f"[{telegram_id}] Phase: {current_phase.value} (msg={message_count}, day={day})")
-
-    # Check NSFW
-    is_nsfw = is_nsfw_message(combined_text)
-
-    # PAYWALL PHASE: Trigger conversion
-    if current_phase == Phase.PAYWALL and not paywall_shown:
-        user_name = user.get("name") or "bébé"
-        paywall_msg = get_paywall_message(user_name)
-        if PAYMENT_LINK:
-            paywall_msg += f"\n\n{PAYMENT_LINK}"
-        await update.message.reply_text(paywall_msg)
-        await save_message(user_id, "assistant", paywall_msg)
-        await mark_paywall_shown(user_id)
-        logger.info(f"[{telegram_id}] PAYWALL TRIGGERED (day={day}, msgs={message_count})")
+    run = await run_turn(turn_pipeline, telegram_id, combined_text, update.message.reply_text)
+    if run.stopped_by:
         return
 
-    # TENSION phase + NSFW request: Tease but don't give (pre-paywall frustration)
-    if current_phase == Phase.TENSION and is_nsfw and not is_paid:
-        # Continue to process but prompt will handle the teasing
-        pass
-
-    # Build memory context
-    memory_context = await build_prompt_context(user_id, combined_text)
-
-    # Get current time in Paris
-    now = datetime.now(PARIS_TZ)
-    current_time = now.strftime("%Hh%M")
-
-    # Get user name for personalization
-    user_name = user.get("name") or None
-
-    # =========================================================================
-    # ENGAGEMENT SYSTEM (V7)
-    # =========================================================================
-    engagement = await load_engagement_state(user_id)
-
-    # Get affection level (variable rewards)
-    affection_level = VariableRewards.get_affection_level(engagement.reward, current_phase.value)
-    affection_modifier = VariableRewards.get_modifier(affection_level)
-    VariableRewards.update_state(engagement.reward, affection_level)
-
-    # Check for jealousy trigger
-    jealousy_modifier = None
-    if JealousyHandler.detect(combined_text):
-        jealousy_modifier = JealousyHandler.get_modifier(current_phase.value)
-        logger.info(f"[{telegram_id}] Jealousy detected: {current_phase.value}")
-
-    # Combine modifiers for mood override
-    mood_override = affection_modifier
-    if jealousy_modifier:
-        mood_override += f"\n\nJALOUSIE: {jealousy_modifier}"
-
-    # =========================================================================
-    # NSFW DETECTION & GATE (Phase LIBRE only)
-    # =========================================================================
-    nsfw_gate = None
-    use_nsfw_model = False
-    nsfw_allowed = False
-    nsfw_blocked_reason = None
-
-    if current_phase == Phase.LIBRE:
-        # Load gate and increment message counter
-        nsfw_gate = await load_nsfw_gate(user_id)
-        nsfw_gate.on_message()
-
-        # Two-pass NSFW detection: keywords first (free), then Haiku confirms
-        if is_nsfw:
-            is_nsfw_request = await classify_nsfw(combined_text)
-            if is_nsfw_request:
-                can_nsfw, reason = nsfw_gate.check()
-                if can_nsfw:
-                    use_nsfw_model = True
-                    nsfw_allowed = True
-                    logger.info(f"[{telegram_id}] NSFW gate: OPEN → Magnum")
-                else:
-                    nsfw_blocked_reason = reason
-                    logger.info(f"[{telegram_id}] NSFW gate: BLOCKED ({reason}) → Haiku")
-            else:
-                logger.info(f"[{telegram_id}] NSFW classifier: SFW → Haiku")
-        else:
-            logger.info(f"[{telegram_id}] No NSFW keywords → Haiku")
-
-    # Build system prompt using NEW UNIFIED BUILDER
-    system = build_system_prompt(
-        phase=current_phase.value,
-        user_name=user_name,
-        memory_context=memory_context,
-        current_time=current_time,
-        nsfw_allowed=nsfw_allowed,
-        nsfw_blocked_reason=nsfw_blocked_reason,
-        mood=mood_override,  # V7: Variable rewards + jealousy
+    values = run.values
+    relationship = values["relationship"]
+    logger.info(
+        f"[{telegram_id}] Phase: {values['phase'].value} | Day {relationship.get('day', 1)} | "
+        f"Msgs: {values['message_count']} | Affection: {values['affection_level']} | NSFW: {values['is_nsfw']}"
     )
 
-    # Get full history for response generation
-    full_history = await get_history(user_id, limit=20)
-    messages = full_history + [{"role": "user", "content": combined_text}]
-
-    # Generate response (use_nsfw_model for paid post-paywall, else old logic)
-    response = await generate_response(messages, system, use_nsfw_model, is_paid)
-
-    # =========================================================================
-    # POST-PAYWALL: Detect climax and update gate
-    # =========================================================================
-    if nsfw_gate and any(pattern in response.lower() for pattern in CLIMAX_PATTERNS):
-        nsfw_gate.on_nsfw_done()
-        logger.info(f"[{telegram_id}] NSFW gate: CLIMAX detected, session counted")
-
-    # Save gate if used
-    if nsfw_gate:
-        await save_nsfw_gate(user_id, nsfw_gate)
-
-    # Save engagement state (V7)
-    await save_engagement_state(user_id, engagement)
-
-    # Clean response
-    response = response.strip()
-    if len(response) > 500:
-        response = response[:500] + "..."
 
-    # FIX P0 #2: Validate response doesn't hallucinate user facts
-    response, hallucination_warnings = await validate_response_facts(response, user)
-    for warning in hallucination_warnings:
-        logger.warning(f"[{telegram_id}] {warning}")
-
-    # Save response
-    await save_message(user_id, "assistant", response)
-
-    # V2: Unified extraction - 1 LLM call for both user facts + Luna statements
-    create_safe_task(
-        extract_unified(user_id, combined_text, response, history),
-        "extract_unified"
-    )
-
-    # Natural delay (shorter since we already waited BUFFER_DELAY)
-    delay = random.uniform(0.3, 1.0)
-    await asyncio.sleep(delay)
-
-    await update.message.reply_text(response)
-
-    logger.info(f"[{telegram_id}] Phase: {current_phase.value} | Day {day} | Msgs: {message_count} | Affection: {affection_level} | NSFW: {is_nsfw}")
+# Même graphe que bot/handlers/messages.py, avec les helpers de ce fichier
+turn_pipeline = build_turn_pipeline(TurnDeps(
+    get_user_with_context=get_or_create_user_with_context,
+    increment_message_count=increment_message_count,
+    save_message=save_message,
+    get_history=get_history,
+    mark_paywall_shown=mark_paywall_shown,
+    load_engagement_state=load_engagement_state,
+    save_engagement_state=save_engagement_state,
+    load_nsfw_gate=load_nsfw_gate,
+    save_nsfw_gate=save_nsfw_gate,
+    classify_nsfw=classify_nsfw,
+    generate_response=generate_response,
+    validate_response_facts=validate_response_facts,
+    is_nsfw_message=is_nsfw_message,
+    climax_patterns=CLIMAX_PATTERNS,
+    timezone=PARIS_TZ,
+    payment_link=PAYMENT_LINK,
+    paywall_name="bébé",
+    reply_model=HAIKU_MODEL,
+    nsfw_model=NSFW_MODEL,
+    prompt_token_limit=int(os.getenv("PROMPT_TOKEN_LIMIT", "0")),
+))
 
 
 async def handle_debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1011,6 +874,11 @@ async def main():
     # Init DB
     await init_db()
 
+    # Délestage: profondeur des files de tâches comme signal de charge
+    overload.register_probe(
+        "queue_depth", lambda: sum(lane["queued"] for lane in task_supervisor.stats().values())
+    )
+
     # Create application
     app = Application.builder().token(TELEGRAM_TOKEN).build()
 
@@ -1038,11 +906,13 @@ async def main():
         except Exception as e:
             logger.error(f"Tier update error: {e}")
 
-    app.job_queue.run_repeating(
-        update_memory_tiers,
-        interval=3600,  # 1 hour
-        first=300,
-    )
+    # Jobs de maintenance: désactivables quand python -m bot.worker les exécute
+    if RUN_JOBS_IN_BOT:
+        app.job_queue.run_repeating(
+            update_memory_tiers,
+            interval=3600,  # 1 hour
+            first=300,
+        )
 
     # V2: Weekly compression (Sundays at 3am Paris time)
     async def weekly_compression_job(context):
@@ -1054,12 +924,13 @@ async def main():
             logger.error(f"Weekly compression error: {e}")
 
     from datetime import time as dt_time
-    app.job_queue.run_daily(
-        weekly_compression_job,
-        time=dt_time(3, 0),  # 3:00 AM
-        days=(6,),  # Sunday only
-        name="weekly_compression"
-    )
+    if RUN_JOBS_IN_BOT:
+        app.job_queue.run_daily(
+            weekly_compression_job,
+            time=dt_time(3, 0),  # 3:00 AM
+            days=(0,),  # Sunday only (JobQueue: 0 = Sunday)
+            name="weekly_compression"
+        )
 
     # V2: Monthly compression (1st of month at 4am)
     async def monthly_compression_job(context):
@@ -1074,26 +945,24 @@ async def main():
         except Exception as e:
             logger.error(f"Monthly compression error: {e}")
 
-    app.job_queue.run_daily(
-        monthly_compression_job,
-        time=dt_time(4, 0),  # 4:00 AM
-        name="monthly_compression"
-    )
+    if RUN_JOBS_IN_BOT:
+        app.job_queue.run_daily(
+            monthly_compression_job,
+            time=dt_time(4, 0),  # 4:00 AM
+            name="monthly_compression"
+        )
 
     # P1 FIX: Daily DB cleanup (2am Paris time)
     async def daily_cleanup_job(context):
         """Nettoie les vieilles données pour éviter la croissance infinie."""
         try:
             async with pool.acquire() as conn:
-                # 1. Supprimer conversations > 90 jours
-                conv_deleted = await conn.fetchval("""
-                    WITH deleted AS (
-                        DELETE FROM conversations_simple
-                        WHERE created_at < NOW() - INTERVAL '90 days'
-                        RETURNING id
-                    )
-                    SELECT COUNT(*) FROM deleted
-                """)
+                # Drops de partitions, gros DELETE: pas de statement_timeout
+                await disable_statement_timeout(conn)
+
+                # 1. Conversations > 90 jours: drop des partitions mensuelles expirées
+                await ensure_partitions(conn)
+                conv_deleted = await enforce_retention(conn, CONVERSATION_RETENTION_DAYS)
 
                 # 2. Supprimer cold events > 180 jours (garder les pinned)
                 events_deleted = await conn.fetchval("""
@@ -1110,35 +979,40 @@ async def main():
                 # 3. Limiter inside_jokes à 20 par user
                 jokes_trimmed = await conn.fetchval("""
                     WITH ranked AS (
-                        SELECT id, user_id,
-                               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY updated_at DESC) as rn
-                        FROM memory_relationships
-                    ),
-                    to_trim AS (
-                        SELECT id FROM ranked WHERE rn > 20
+                        SELECT id,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY user_id
+                                   ORDER BY (times_used * 2 + importance) DESC, last_used DESC
+                               ) as rn
+                        FROM memory_inside_jokes
                     ),
                     deleted AS (
-                        DELETE FROM memory_relationships
-                        WHERE id IN (SELECT id FROM to_trim)
+                        DELETE FROM memory_inside_jokes
+                        WHERE id IN (SELECT id FROM ranked WHERE rn > 20)
                         RETURNING id
                     )
                     SELECT COUNT(*) FROM deleted
                 """)
 
-                if conv_deleted or events_deleted or jokes_trimmed:
+                # 4. Outcomes d'extraction (texte brut): les plus récents seulement
+                outcomes_deleted = await prune_outcomes(conn)
+
+                if conv_deleted or events_deleted or jokes_trimmed or outcomes_deleted:
                     logger.info(
                         f"DB cleanup: {conv_deleted} convs, "
-                        f"{events_deleted} cold events, {jokes_trimmed} jokes trimmed"
+                        f"{events_deleted} cold events, {jokes_trimmed} jokes trimmed, "
+                        f"{outcomes_deleted} extraction outcomes"
                     )
 
         except Exception as e:
             logger.error(f"DB cleanup error: {e}")
 
-    app.job_queue.run_daily(
-        daily_cleanup_job,
-        time=dt_time(2, 0),  # 2:00 AM
-        name="daily_cleanup"
-    )
+    if RUN_JOBS_IN_BOT:
+        app.job_queue.run_daily(
+            daily_cleanup_job,
+            time=dt_time(2, 0),  # 2:00 AM
+            name="daily_cleanup"
+        )
 
     # Start
     logger.info("Luna Simple Bot with Memory V1 starting...")
@@ -1156,8 +1030,10 @@ async def main():
         await app.updater.stop()
         await app.stop()
         await app.shutdown()
+        await task_supervisor.shutdown()
+        await extraction_scheduler.shutdown()
         if pool:
-            await pool.close()
+            await pool.disconnect()
 
 
 if __name__ == "__main__":
@@ -84,17 +84,33 @@ from .extraction import (
 from .retrieval import (
     get_memory_context,
     build_prompt_context,
+    build_prompt_sections,
+    pack_sections,
+    ContextSection,
     get_quick_context,
     get_onboarding_nudge,
     get_compressed_context,  # V2: For long-term users
 )
 
-from .compression import (
-    set_api_key as set_compression_api_key,
-    run_weekly_compression,
-    run_monthly_compression,
-    schedule_compression_jobs,
-)
+from .scheduler import extraction_scheduler
+from .conversation_summary import rolling_summaries
+from .prefilter import extraction_prefilter
+
+# Compression: chargée à la première utilisation (jobs hebdo/mensuels uniquement)
+_LAZY_COMPRESSION = {
+    "set_compression_api_key": "set_api_key",
+    "run_weekly_compression": "run_weekly_compression",
+    "run_monthly_compression": "run_monthly_compression",
+    "schedule_compression_jobs": "schedule_compression_jobs",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_COMPRESSION:
+        from . import compression
+        return getattr(compression, _LAZY_COMPRESSION[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
     # Models
@@ -164,9 +180,15 @@ __all__ = [
     "extract_user_facts",    # Legacy
     "extract_luna_said",     # Legacy
     "extract_from_history",
+    "extraction_scheduler",
+    "extraction_prefilter",
+    "rolling_summaries",
     # Retrieval
     "get_memory_context",
     "build_prompt_context",
+    "build_prompt_sections",
+    "pack_sections",
+    "ContextSection",
     "get_quick_context",
     "get_onboarding_nudge",
     "get_compressed_context",
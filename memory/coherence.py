@@ -124,7 +124,18 @@ async def check_user_contradiction(
     """
     # Chercher un événement similaire
     existing = await find_similar_event(user_id, new_keywords, "moment")
+    return classify_user_contradiction(existing, new_summary, new_keywords)
 
+
+def classify_user_contradiction(
+    existing: Optional[dict],
+    new_summary: str,
+    new_keywords: list[str]
+) -> dict:
+    """
+    Décide store/update/flag à partir de l'événement similaire déjà chargé
+    (version sans DB de check_user_contradiction, pour les écritures en lot).
+    """
     if not existing:
         return {
             "is_contradiction": False,
@@ -2,8 +2,10 @@
 Memory System V2 - Compression Jobs
 
 Crons pour maintenir la mémoire compacte sur 1 an:
-- Weekly (Dimanche 3h): hot→warm, générer weekly summary
-- Monthly (1er du mois 4h): warm→cold, archiver cold >1 an, générer monthly summary
+- Weekly (Dimanche 3h): générer weekly summary
+- Monthly (1er du mois 4h): archiver les vieux cold, générer monthly summary
+- Résumé glissant de conversation (tous les N tours, memory/conversation_summary.py)
+(hot→warm→cold: job horaire crud.update_tiers, incrémental)
 
 Philosophy: "CODE = STUPIDE mais ROBUSTE, LLM = INTELLIGENT"
 Le code fait la plomberie, le LLM résume intelligemment.
@@ -13,23 +15,25 @@ import asyncio
 import json
 import logging
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Awaitable, Callable, Optional, Union
 from uuid import UUID
 
-import httpx
+from core.errors import LLMError
+from core.http import get_http_client
+from core.usage import usage
+from middleware.metrics import metrics
 
 from .crud import (
-    get_pool,
-    get_all_active_users,
     get_hot_events,
     get_events_by_type,
-    update_tiers,
     cleanup_old_cold_events,
     add_summary,
     get_summaries,
     get_inside_jokes_v2,
     get_user_by_id,
     get_relationship,
+    get_users_due,
+    mark_checkpoint,
 )
 
 logger = logging.getLogger(__name__)
@@ -49,55 +53,53 @@ def set_api_key(key: str):
 # WEEKLY COMPRESSION (Dimanche 3h)
 # =============================================================================
 
-async def run_weekly_compression() -> dict:
+async def run_weekly_compression(workers: int = 4, deadline: Optional[float] = None) -> dict:
     """
-    Job hebdomadaire:
-    1. Update tiers (hot→warm pour events > 7 jours)
-    2. Generate weekly summary for each active user
-    3. Archive inactive inside jokes
+    Job hebdomadaire: weekly summary for each active user (workers en parallèle).
+    Les tiers (hot→warm) sont maintenus par le job horaire update_tiers().
+
+    Reprise: chaque user traité est marqué (last_weekly_summary), un run
+    interrompu ne retraite que les users restants de la semaine.
+
+    Args:
+        workers: Nombre de users traités en parallèle
+        deadline: Durée max en secondes (les users restants attendent le prochain run)
 
     Returns:
-        {"users_processed": int, "summaries_created": int, "tiers_updated": int}
+        {"users_processed": int, "summaries_created": int, "users_failed": int, ...}
+
+    Raises:
+        Erreurs hors users (get_users_due, DB): le job est enregistré en échec
     """
     stats = {
         "users_processed": 0,
         "summaries_created": 0,
-        "tiers_updated": 0,
     }
 
-    try:
-        users = await get_all_active_users()
-        logger.info(f"Weekly compression: processing {len(users)} active users")
-
-        for user in users:
-            user_id = user["id"]
-
-            # 1. Update tiers
-            updated = await update_tiers(user_id)
-            stats["tiers_updated"] += updated
-
-            # 2. Generate weekly summary
-            summary = await _generate_weekly_summary(user_id)
-            if summary:
-                # Get current week identifier
-                now = datetime.now()
-                week_id = now.strftime("%Y-W%W")
+    now = datetime.now()
+    week_start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    week_id = now.strftime("%Y-W%W")
+
+    async def process(user_id: UUID) -> None:
+        summary = await _generate_weekly_summary(user_id)
+        if summary:
+            await add_summary(
+                user_id=user_id,
+                summary_type="weekly",
+                period=week_id,
+                summary=summary["summary"],
+                highlights=summary["highlights"]
+            )
+            stats["summaries_created"] += 1
 
-                await add_summary(
-                    user_id=user_id,
-                    summary_type="weekly",
-                    period=week_id,
-                    summary=summary["summary"],
-                    highlights=summary["highlights"]
-                )
-                stats["summaries_created"] += 1
+    user_ids = await get_users_due("last_weekly_summary", week_start)
+    logger.info(f"Weekly compression: processing {len(user_ids)} active users")
 
-            stats["users_processed"] += 1
+    stats.update(await _run_pipeline(
+        "weekly", user_ids, process, "last_weekly_summary", workers, deadline
+    ))
 
-        logger.info(f"Weekly compression complete: {stats}")
-
-    except Exception as e:
-        logger.error(f"Weekly compression error: {e}", exc_info=True)
+    logger.info(f"Weekly compression complete: {stats}")
 
     return stats
 
@@ -105,7 +107,10 @@ async def run_weekly_compression() -> dict:
 async def _generate_weekly_summary(user_id: UUID) -> Optional[dict]:
     """
     Generate weekly summary using LLM.
-    Returns {"summary": str, "highlights": list[str]}
+    Returns {"summary": str, "highlights": list[str]}, None if nothing to summarize.
+
+    Raises:
+        LLMError / httpx.HTTPError: appel LLM raté (le user n'est pas marqué)
     """
     if not OPENROUTER_API_KEY:
         logger.warning("API key not set for compression")
@@ -151,55 +156,30 @@ Règles:
 - Le résumé doit aider Luna à se souvenir du contexte
 """
 
-    try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": HAIKU_MODEL,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 400,
-                    "temperature": 0.3,
-                }
-            )
-
-            data = response.json()
-
-            if "choices" not in data:
-                logger.warning(f"OpenRouter error: {data.get('error', data)}")
-                return None
-
-            content = data["choices"][0]["message"]["content"]
-
-            # Parse JSON
-            result = _safe_parse_json(content)
-            if result and "summary" in result:
-                return result
-
-    except Exception as e:
-        logger.error(f"Weekly summary generation error: {e}")
-
-    return None
+    result = await _call_summary_llm(prompt, "weekly_summary", max_tokens=400)
+    if result is None:
+        raise LLMError("Weekly summary: no usable LLM reply", provider="openrouter")
+    return result
 
 
 # =============================================================================
 # MONTHLY COMPRESSION (1er du mois 4h)
 # =============================================================================
 
-async def run_monthly_compression() -> dict:
+async def run_monthly_compression(workers: int = 4, deadline: Optional[float] = None) -> dict:
     """
     Job mensuel:
-    1. Update tiers (warm→cold pour events > 90 jours)
-    2. Archive cold events > 1 an
-    3. Generate monthly summary
-    4. Archive inactive inside jokes
+    1. Archive old cold events (garde les 50 plus récents par user)
+    2. Generate monthly summary
+    Les tiers (warm→cold) sont maintenus par le job horaire update_tiers().
+
+    Reprise via last_monthly_cleanup (voir run_weekly_compression).
 
     Returns:
-        {"users_processed": int, "summaries_created": int, "events_archived": int}
+        {"users_processed": int, "summaries_created": int, "events_archived": int, ...}
+
+    Raises:
+        Erreurs hors users (voir run_weekly_compression)
     """
     stats = {
         "users_processed": 0,
@@ -207,42 +187,33 @@ async def run_monthly_compression() -> dict:
         "events_archived": 0,
     }
 
-    try:
-        users = await get_all_active_users()
-        logger.info(f"Monthly compression: processing {len(users)} active users")
-
-        for user in users:
-            user_id = user["id"]
-
-            # 1. Update tiers
-            await update_tiers(user_id)
-
-            # 2. Archive old cold events
-            archived = await cleanup_old_cold_events(user_id, days=365)
-            stats["events_archived"] += archived
-
-            # 3. Generate monthly summary
-            summary = await _generate_monthly_summary(user_id)
-            if summary:
-                now = datetime.now()
-                month_id = now.strftime("%Y-%m")
-
-                await add_summary(
-                    user_id=user_id,
-                    summary_type="monthly",
-                    period=month_id,
-                    summary=summary["summary"],
-                    highlights=summary["highlights"],
-                    archived_data=summary.get("archived_data", {})
-                )
-                stats["summaries_created"] += 1
+    now = datetime.now()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month_id = now.strftime("%Y-%m")
+
+    async def process(user_id: UUID) -> None:
+        stats["events_archived"] += await cleanup_old_cold_events(user_id)
+
+        summary = await _generate_monthly_summary(user_id)
+        if summary:
+            await add_summary(
+                user_id=user_id,
+                summary_type="monthly",
+                period=month_id,
+                summary=summary["summary"],
+                highlights=summary["highlights"],
+                archived_data=summary.get("archived_data", {})
+            )
+            stats["summaries_created"] += 1
 
-            stats["users_processed"] += 1
+    user_ids = await get_users_due("last_monthly_cleanup", month_start)
+    logger.info(f"Monthly compression: processing {len(user_ids)} active users")
 
-        logger.info(f"Monthly compression complete: {stats}")
+    stats.update(await _run_pipeline(
+        "monthly", user_ids, process, "last_monthly_cleanup", workers, deadline
+    ))
 
-    except Exception as e:
-        logger.error(f"Monthly compression error: {e}", exc_info=True)
+    logger.info(f"Monthly compression complete: {stats}")
 
     return stats
 
@@ -251,6 +222,9 @@ async def _generate_monthly_summary(user_id: UUID) -> Optional[dict]:
     """
     Generate monthly summary using LLM.
     Includes archived data for cold events.
+
+    Raises:
+        LLMError / httpx.HTTPError: appel LLM raté (le user n'est pas marqué)
     """
     if not OPENROUTER_API_KEY:
         return None
@@ -318,48 +292,204 @@ Règles:
 - Max 3 highlights
 """
 
-    try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": HAIKU_MODEL,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 500,
-                    "temperature": 0.3,
-                }
-            )
+    result = await _call_summary_llm(prompt, "monthly_summary", max_tokens=500)
+    if result is None:
+        raise LLMError("Monthly summary: no usable LLM reply", provider="openrouter")
+
+    # Add archived data
+    result["archived_data"] = {
+        "inactive_jokes": [
+            {k: v.isoformat() if isinstance(v, datetime) else v for k, v in j.items()}
+            for j in inactive_jokes[:10]
+        ],
+        "archived_at": datetime.now().isoformat()
+    }
+    return result
+
 
-            data = response.json()
+# =============================================================================
+# ROLLING CONVERSATION SUMMARY (memory/conversation_summary.py)
+# =============================================================================
 
-            if "choices" not in data:
-                return None
+# Caractères max par message dans le prompt de résumé
+ROLLING_MESSAGE_CHARS = 300
 
-            content = data["choices"][0]["message"]["content"]
-            result = _safe_parse_json(content)
 
-            if result and "summary" in result:
-                # Add archived data
-                result["archived_data"] = {
-                    "inactive_jokes": inactive_jokes[:10],
-                    "archived_at": datetime.now().isoformat()
-                }
-                return result
+async def generate_rolling_summary(
+    previous: Optional[str],
+    messages: list[dict],
+    user_name: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Fond les nouveaux messages dans le résumé glissant de la conversation.
 
+    Args:
+        previous: Résumé précédent (None au premier passage)
+        messages: [{"role", "content"}] les plus anciens d'abord
+        user_name: Prénom du user
+
+    Returns:
+        Le nouveau résumé, ou None (pas de clé / échec LLM)
+    """
+    if not OPENROUTER_API_KEY:
+        logger.warning("API key not set for compression")
+        return None
+    if not messages:
+        return None
+
+    user_name = user_name or "l'utilisateur"
+    messages_text = "\n".join(
+        f"{'Luna' if m['role'] == 'assistant' else user_name}: {m['content'][:ROLLING_MESSAGE_CHARS]}"
+        for m in messages
+    )
+
+    prompt = f"""Mets à jour le résumé de la conversation entre Luna et {user_name}.
+
+RÉSUMÉ PRÉCÉDENT:
+{previous or "(début de la conversation)"}
+
+NOUVEAUX MESSAGES:
+{messages_text}
+
+Génère un JSON:
+{{
+    "summary": "Résumé à jour en 4-6 phrases (sujets en cours, ce qu'il a raconté, ce que Luna a dit ou promis, ton de la conversation)",
+    "highlights": ["moment clé 1", "moment clé 2"]
+}}
+
+Règles:
+- Fusionne avec le résumé précédent, ne le recopie pas
+- Garde ce qui aide Luna à enchaîner naturellement (questions en suspens, promesses)
+- Ignore les détails triviaux
+- Max 800 caractères pour le summary
+"""
+
+    try:
+        result = await _call_summary_llm(prompt, "rolling_summary", max_tokens=400)
+        if result:
+            return str(result["summary"])
     except Exception as e:
-        logger.error(f"Monthly summary generation error: {e}")
+        logger.error(f"Rolling summary generation error: {e}")
 
     return None
 
 
+# =============================================================================
+# PIPELINE
+# =============================================================================
+
+async def _run_pipeline(
+    name: str,
+    user_ids: list[UUID],
+    process: Callable[[UUID], Awaitable[None]],
+    checkpoint: str,
+    workers: int,
+    deadline: Optional[float],
+) -> dict:
+    """
+    Traite les users avec `workers` tâches en parallèle.
+
+    - Checkpoint posé après chaque user réussi (reprise après crash)
+    - Un user en erreur n'est pas marqué: il sera retenté au prochain run
+    - Passé la deadline, plus aucun user n'est démarré
+
+    Returns:
+        {"users_processed", "users_failed", "users_remaining", "deadline_hit", "duration_s"}
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    total = len(user_ids)
+    progress = {"users_processed": 0, "users_failed": 0, "deadline_hit": False}
+    metrics.set_gauge(f"compression_{name}_total", total)
+
+    async def worker() -> None:
+        while True:
+            if deadline is not None and loop.time() - started > deadline:
+                progress["deadline_hit"] = True
+                return
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            try:
+                await process(user_id)
+                await mark_checkpoint(user_id, checkpoint)
+                progress["users_processed"] += 1
+                metrics.incr(f"compression_{name}_done")
+            except Exception as e:
+                progress["users_failed"] += 1
+                metrics.incr(f"compression_{name}_failed")
+                logger.error(f"{name.capitalize()} compression failed for {user_id}: {e}")
+
+            remaining = queue.qsize()
+            metrics.set_gauge(f"compression_{name}_remaining", remaining)
+            done = total - remaining
+            if total >= 10 and done % max(1, total // 10) == 0:
+                logger.info(f"{name.capitalize()} compression progress: {done}/{total}")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(workers, total or 1)))))
+
+    progress["users_remaining"] = queue.qsize()
+    progress["duration_s"] = round(loop.time() - started, 1)
+    metrics.set_gauge(f"compression_{name}_remaining", progress["users_remaining"])
+    metrics.set_gauge(f"compression_{name}_duration_s", progress["duration_s"])
+
+    if progress["deadline_hit"]:
+        logger.warning(
+            f"{name.capitalize()} compression deadline ({deadline}s) reached, "
+            f"{progress['users_remaining']} users left for next run"
+        )
+    return progress
+
+
 # =============================================================================
 # HELPERS
 # =============================================================================
 
+async def _call_summary_llm(prompt: str, site: str, max_tokens: int) -> Optional[dict]:
+    """
+    Appel LLM de résumé (OpenRouter, Haiku).
+
+    Returns:
+        Le JSON {"summary", "highlights"} parsé, ou None (réponse inutilisable)
+
+    Raises:
+        httpx.HTTPError: erreur réseau ou statut HTTP d'erreur
+    """
+    response = await get_http_client().post(
+        "https://openrouter.ai/api/v1/chat/completions",
+        headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        json={
+            "model": HAIKU_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": 0.3,
+        },
+        timeout=30,
+    )
+    response.raise_for_status()
+
+    data = response.json()
+
+    if "choices" not in data:
+        logger.warning(f"OpenRouter error: {data.get('error', data)}")
+        return None
+
+    usage.record(site, data, model=HAIKU_MODEL)
+    result = _safe_parse_json(data["choices"][0]["message"]["content"])
+    if result and "summary" in result:
+        return result
+    return None
+
+
 def _safe_parse_json(content: str) -> Optional[dict]:
     """Parse JSON robustement."""
     import re
@@ -394,13 +524,16 @@ def _safe_parse_json(content: str) -> Optional[dict]:
         return None
 
 
-def _is_stale(last_used: Optional[str], days: int = 30) -> bool:
-    """Check if a timestamp is older than X days."""
+def _is_stale(last_used: Optional[Union[str, datetime]], days: int = 30) -> bool:
+    """Check if a timestamp (datetime or ISO string) is older than X days."""
     if not last_used:
         return True
 
     try:
-        last = datetime.fromisoformat(last_used.replace('Z', '+00:00'))
+        if isinstance(last_used, datetime):
+            last = last_used
+        else:
+            last = datetime.fromisoformat(last_used.replace('Z', '+00:00'))
         return (datetime.now(last.tzinfo) - last).days > days
     except (ValueError, TypeError):
         return True
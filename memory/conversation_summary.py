@@ -0,0 +1,207 @@
+"""
+Memory System - Résumé glissant de la conversation
+
+Au lieu des 20 derniers messages bruts, le prompt de réponse porte un
+résumé de tout ce qui précède + une courte fin brute, donc une taille stable
+quelle que soit la longueur de la conversation:
+- memory_conversation_summaries: un résumé par user + watermark
+  (last_message_id: dernier message de conversations_simple couvert,
+  covered_turns: message_count au moment du résumé)
+- rafraîchi en arrière-plan tous les `every_turns` tours: l'ancien résumé
+  et les messages après le watermark (sauf les `raw_tail` derniers, qui
+  restent bruts) sont fondus par le LLM (memory/compression.py); les lignes
+  encore en écriture différée sont vidées avant la lecture (barrier)
+- fin brute dans le prompt: exactement les messages après le watermark
+  (id > last_message_id, id None = pas encore écrit), messages proactifs
+  compris
+
+Usage:
+    from memory.conversation_summary import rolling_summaries
+
+    summary = await rolling_summaries.get(user_id)
+    history = rolling_summaries.recent_history(history, summary)
+    if rolling_summaries.is_due(user_id, summary, message_count):
+        task_supervisor.submit(rolling_summaries.refresh(user_id, message_count), ...)
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from uuid import UUID
+
+from middleware.metrics import metrics
+
+from .crud import get_pool, get_user_by_id
+from .rows import ConversationSummaryRow
+
+logger = logging.getLogger(__name__)
+
+# Messages max fondus par rafraîchissement (au-delà: les plus anciens sont sautés)
+MAX_MESSAGES_PER_REFRESH = 60
+# Même rétention que conversations_simple (partitions mensuelles)
+CONVERSATION_RETENTION_DAYS = 90
+
+_MISSING = object()
+
+
+class RollingSummaries:
+    """Résumés glissants par user (cache LRU + table)."""
+
+    def __init__(self, every_turns: int = 6, raw_tail: int = 6, max_users: int = 10000):
+        self.every_turns = every_turns
+        self.raw_tail = raw_tail
+        self.max_users = max_users
+        self._api_key: Optional[str] = None
+        self._barrier: Optional[Callable[[], Awaitable[None]]] = None
+        self._cache: OrderedDict = OrderedDict()     # user_id -> ConversationSummaryRow | None
+        self._attempts: OrderedDict = OrderedDict()  # user_id -> message_count du dernier essai
+        self._refreshing: set = set()
+
+    def configure(self, every_turns: int, raw_tail: int, api_key: Optional[str] = None,
+                  barrier: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+        """
+        Args:
+            every_turns: Tours entre deux rafraîchissements
+            raw_tail: Messages bruts gardés hors résumé
+            api_key: Clé OpenRouter (compression chargée au premier résumé)
+            barrier: Attend l'écriture des messages en file (écriture différée)
+        """
+        self.every_turns = max(1, every_turns)
+        self.raw_tail = max(0, raw_tail)
+        self._api_key = api_key
+        self._barrier = barrier
+
+    # Lecture ------------------------------------------------------------------
+
+    async def get(self, user_id: UUID) -> Optional[ConversationSummaryRow]:
+        """Résumé courant du user (None si pas encore de résumé)."""
+        cached = self._cache.get(user_id, _MISSING)
+        if cached is not _MISSING:
+            self._cache.move_to_end(user_id)
+            return cached
+
+        async with get_pool().acquire() as conn:
+            record = await conn.fetchrow("""
+                SELECT summary, last_message_id, covered_turns
+                FROM memory_conversation_summaries
+                WHERE user_id = $1
+            """, user_id)
+        row = ConversationSummaryRow.from_record(record) if record else None
+        self._remember(self._cache, user_id, row)
+        return row
+
+    def recent_history(self, history: list[dict], summary: Optional[ConversationSummaryRow]) -> list[dict]:
+        """
+        Messages de l'historique que le résumé ne couvre pas (tout l'historique sans résumé).
+
+        Gardés: id > last_message_id, et les messages sans id (encore en
+        écriture différée, donc postérieurs au dernier résumé).
+        """
+        if summary is None:
+            return history
+        watermark = summary["last_message_id"]
+        return [m for m in history if m.get("id") is None or m["id"] > watermark]
+
+    def is_due(self, user_id: UUID, summary: Optional[ConversationSummaryRow], message_count: int) -> bool:
+        """Rafraîchir: every_turns tours depuis le résumé (et depuis le dernier essai raté)."""
+        covered = summary["covered_turns"] if summary else 0
+        attempted = self._attempts.get(user_id, covered)
+        return (
+            user_id not in self._refreshing
+            and message_count - covered >= self.every_turns
+            and message_count - attempted >= self.every_turns
+        )
+
+    # Rafraîchissement ---------------------------------------------------------
+
+    async def refresh(self, user_id: UUID, message_count: int) -> bool:
+        """
+        Fond les messages après le watermark dans le résumé (tâche de fond).
+
+        Returns:
+            True si un nouveau résumé a été enregistré
+        """
+        if user_id in self._refreshing:
+            return False
+        self._refreshing.add(user_id)
+        self._remember(self._attempts, user_id, message_count)
+        try:
+            current = await self.get(user_id)
+            after = current["last_message_id"] if current else 0
+
+            # Lignes encore dans le writer: visibles avant la lecture
+            if self._barrier is not None:
+                await self._barrier()
+
+            async with get_pool().acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT id, role, content FROM conversations_simple
+                    WHERE user_id = $1 AND id > $2
+                      AND created_at > NOW() - make_interval(days => $4)
+                    ORDER BY id DESC
+                    LIMIT $3
+                """, user_id, after, MAX_MESSAGES_PER_REFRESH + self.raw_tail, CONVERSATION_RETENTION_DAYS)
+
+            # Plus anciens d'abord, sans la fin brute
+            rows = list(reversed(rows))
+            rows = rows[:len(rows) - self.raw_tail] if self.raw_tail else rows
+            if not rows:
+                return False
+
+            compression = self._compression()
+            user = await get_user_by_id(user_id)
+            summary = await compression.generate_rolling_summary(
+                current["summary"] if current else None,
+                [{"role": r["role"], "content": r["content"]} for r in rows],
+                user.get("name") if user else None,
+            )
+            if not summary:
+                metrics.incr("rolling_summary_failed")
+                return False
+
+            last_message_id = rows[-1]["id"]
+            async with get_pool().acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO memory_conversation_summaries
+                        (user_id, summary, last_message_id, covered_turns, updated_at)
+                    VALUES ($1, $2, $3, $4, NOW())
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        summary = EXCLUDED.summary,
+                        last_message_id = EXCLUDED.last_message_id,
+                        covered_turns = EXCLUDED.covered_turns,
+                        updated_at = NOW()
+                """, user_id, summary, last_message_id, message_count)
+
+            self._remember(self._cache, user_id, ConversationSummaryRow.from_record({
+                "summary": summary,
+                "last_message_id": last_message_id,
+                "covered_turns": message_count,
+            }))
+            self._attempts.pop(user_id, None)
+            metrics.incr("rolling_summary_refreshed")
+            logger.info(f"Rolling summary refreshed for {user_id}: {len(rows)} messages folded")
+            return True
+        finally:
+            self._refreshing.discard(user_id)
+
+    def invalidate(self, user_id: UUID) -> None:
+        self._cache.pop(user_id, None)
+
+    # Helpers -------------------------------------------------------------------
+
+    def _compression(self):
+        """Module compression, importé au premier résumé."""
+        from . import compression
+        if compression.OPENROUTER_API_KEY is None and self._api_key:
+            compression.set_api_key(self._api_key)
+        return compression
+
+    def _remember(self, lru: OrderedDict, user_id: UUID, value) -> None:
+        lru[user_id] = value
+        lru.move_to_end(user_id)
+        while len(lru) > self.max_users:
+            lru.popitem(last=False)
+
+
+# Singleton (configuré au démarrage)
+rolling_summaries = RollingSummaries()
@@ -3,6 +3,15 @@ Memory System - CRUD Operations
 
 Toutes les opérations de base de données pour le système mémoire.
 Utilise asyncpg directement (pas SQLAlchemy).
+
+Pas de SELECT *: chaque lecture ne projette que ses colonnes (rows.py) et
+renvoie des lignes à __slots__. Les gros JSONB de memory_users (state,
+user_patterns, luna_current_life, nsfw_prefs) ne sont lus que par les
+fonctions qui en ont besoin.
+
+Dates du calendrier, inside jokes et likes/dislikes/secrets sont dans des
+tables enfants (models.py): plages de dates et compteurs d'usage sont faits
+par Postgres (index + ON CONFLICT), sans read-modify-write d'un tableau JSONB.
 """
 
 import json
@@ -19,9 +28,50 @@ from .models import (
     EventType,
     TierThreshold,
 )
+from .rows import (
+    UserProfile,
+    UserFactsRow,
+    RelationshipRow,
+    EventRow,
+    SummaryRow,
+    ActiveUserRow,
+    CalendarDateRow,
+    InsideJokeRow,
+)
 
 logger = logging.getLogger(__name__)
 
+# Listes de faits (memory_user_items): champ -> kind
+USER_ITEM_KINDS = {"likes": "like", "dislikes": "dislike", "secrets": "secret"}
+
+# Rang d'un inside joke (même expression que l'index idx_inside_jokes_rank)
+JOKE_RANK = "(times_used * 2 + importance)"
+INSIDE_JOKES_KEEP = 15
+RELATIONSHIP_JOKES = 10  # triggers renvoyés avec la relation
+
+
+def _user_items_expr(kind: str) -> str:
+    return (
+        "ARRAY(SELECT i.value FROM memory_user_items i "
+        f"WHERE i.user_id = memory_users.id AND i.kind = '{kind}' ORDER BY i.created_at, i.value)"
+    )
+
+
+# Colonnes projetées (calculées une fois)
+USER_PROFILE_COLUMNS = UserProfile.columns()
+USER_FACTS_COLUMNS = UserFactsRow.columns(
+    **{field: _user_items_expr(kind) for field, kind in USER_ITEM_KINDS.items()}
+)
+RELATIONSHIP_COLUMNS = RelationshipRow.columns(inside_jokes=(
+    "ARRAY(SELECT j.trigger FROM memory_inside_jokes j "
+    "WHERE j.user_id = memory_relationships.user_id "
+    f"ORDER BY {JOKE_RANK} DESC, j.last_used DESC LIMIT {RELATIONSHIP_JOKES})"
+))
+EVENT_COLUMNS = EventRow.columns()
+SUMMARY_COLUMNS = SummaryRow.columns()
+CALENDAR_DATE_COLUMNS = CalendarDateRow.columns()
+INSIDE_JOKE_COLUMNS = InsideJokeRow.columns()
+
 # Pool global (injecté au démarrage)
 _pool = None
 
@@ -39,39 +89,57 @@ def get_pool():
     return _pool
 
 
+def read_acquire(user_id: Optional[UUID] = None):
+    """
+    acquire() pour les lectures de contexte (timeline, résumés).
+    Va sur un réplica si le pool est un core.database.Database avec réplicas.
+    """
+    pool = get_pool()
+    if hasattr(pool, "mark_write"):
+        return pool.acquire(read_only=True, user_id=user_id)
+    return pool.acquire()
+
+
+def mark_write(user_id: UUID) -> None:
+    """Les lectures de ce user restent sur le primaire quelques secondes (read-your-writes)."""
+    pool = get_pool()
+    if hasattr(pool, "mark_write"):
+        pool.mark_write(user_id)
+
+
 # =============================================================================
 # USERS
 # =============================================================================
 
-async def get_user(telegram_id: int) -> Optional[dict]:
-    """Récupère un user par telegram_id."""
+async def get_user(telegram_id: int) -> Optional[UserProfile]:
+    """Récupère un user par telegram_id (profil, sans JSONB)."""
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT * FROM memory_users WHERE telegram_id = $1
+        row = await conn.fetchrow(f"""
+            SELECT {USER_PROFILE_COLUMNS} FROM memory_users WHERE telegram_id = $1
         """, telegram_id)
-        return dict(row) if row else None
+        return UserProfile.from_record(row) if row else None
 
 
-async def get_user_by_id(user_id: UUID) -> Optional[dict]:
-    """Récupère un user par UUID."""
+async def get_user_by_id(user_id: UUID) -> Optional[UserFactsRow]:
+    """Récupère un user par UUID (profil + facts JSONB du prompt)."""
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT * FROM memory_users WHERE id = $1
+        row = await conn.fetchrow(f"""
+            SELECT {USER_FACTS_COLUMNS} FROM memory_users WHERE id = $1
         """, user_id)
-        return dict(row) if row else None
+        return UserFactsRow.from_record(row) if row else None
 
 
-async def create_user(telegram_id: int) -> dict:
+async def create_user(telegram_id: int) -> UserProfile:
     """Crée un nouveau user."""
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
+        row = await conn.fetchrow(f"""
             INSERT INTO memory_users (telegram_id)
             VALUES ($1)
             ON CONFLICT (telegram_id) DO UPDATE SET telegram_id = $1
-            RETURNING *
+            RETURNING {USER_PROFILE_COLUMNS}
         """, telegram_id)
 
-        user = dict(row)
+        user = UserProfile.from_record(row)
 
         # Créer la relation associée
         await conn.execute("""
@@ -83,7 +151,7 @@ async def create_user(telegram_id: int) -> dict:
         return user
 
 
-async def get_or_create_user(telegram_id: int) -> dict:
+async def get_or_create_user(telegram_id: int) -> UserProfile:
     """Récupère ou crée un user."""
     user = await get_user(telegram_id)
     if user:
@@ -91,26 +159,27 @@ async def get_or_create_user(telegram_id: int) -> dict:
     return await create_user(telegram_id)
 
 
-async def update_user(user_id: UUID, updates: dict) -> dict:
+async def update_user(user_id: UUID, updates: dict) -> UserFactsRow:
     """
     Met à jour les champs d'un user.
 
-    Pour les champs JSONB (likes, secrets, etc.), merge au lieu de remplacer.
+    likes/dislikes/secrets: ajoutés à memory_user_items (sans doublons),
+    family: merge du dict JSONB.
     """
     if not updates:
         return await get_user_by_id(user_id)
 
     async with get_pool().acquire() as conn:
-        # Séparer les champs simples des JSONB arrays
+        # Séparer les champs simples des listes et de family
         simple_fields = {}
-        jsonb_appends = {}
+        list_appends = {}
+        family = None
 
         for key, value in updates.items():
-            if key in ("likes", "dislikes", "secrets") and isinstance(value, list):
-                jsonb_appends[key] = value
+            if key in USER_ITEM_KINDS and isinstance(value, list):
+                list_appends[key] = value
             elif key == "family" and isinstance(value, dict):
-                # Merge family dict
-                jsonb_appends[key] = value
+                family = value
             else:
                 simple_fields[key] = value
 
@@ -129,32 +198,41 @@ async def update_user(user_id: UUID, updates: dict) -> dict:
                 *values
             )
 
-        # Append to JSONB arrays (sans doublons)
-        for field, new_values in jsonb_appends.items():
-            if field == "family":
-                # Merge dict
-                await conn.execute(f"""
-                    UPDATE memory_users
-                    SET {field} = {field} || $2::jsonb,
-                        updated_at = NOW()
-                    WHERE id = $1
-                """, user_id, json.dumps(new_values))
-            else:
-                # Append to array (dedupe)
-                for val in new_values:
-                    await conn.execute(f"""
-                        UPDATE memory_users
-                        SET {field} = (
-                            SELECT jsonb_agg(DISTINCT elem)
-                            FROM jsonb_array_elements({field} || $2::jsonb) elem
-                        ),
-                        updated_at = NOW()
-                        WHERE id = $1
-                    """, user_id, json.dumps([val]))
+        if family:
+            await conn.execute("""
+                UPDATE memory_users
+                SET family = family || $2::jsonb,
+                    updated_at = NOW()
+                WHERE id = $1
+            """, user_id, json.dumps(family))
+
+        if list_appends:
+            await add_user_items(conn, user_id, list_appends)
+            if not simple_fields and not family:
+                await conn.execute("UPDATE memory_users SET updated_at = NOW() WHERE id = $1", user_id)
 
         return await get_user_by_id(user_id)
 
 
+async def add_user_items(conn, user_id: UUID, appends: dict[str, list]) -> None:
+    """Ajoute des likes/dislikes/secrets (doublons exacts ignorés par la clé primaire)."""
+    kinds, values = [], []
+    for field, new_values in appends.items():
+        kind = USER_ITEM_KINDS.get(field)
+        if kind is None:
+            continue
+        for value in new_values:
+            kinds.append(kind)
+            values.append(str(value))
+    if not values:
+        return
+    await conn.execute("""
+        INSERT INTO memory_user_items (user_id, kind, value)
+        SELECT $1, t.kind, t.value FROM UNNEST($2::text[], $3::text[]) AS t(kind, value)
+        ON CONFLICT DO NOTHING
+    """, user_id, kinds, values)
+
+
 async def update_user_state(user_id: UUID, state_updates: dict) -> None:
     """Met à jour l'état temps réel (luna_mood, current_topic, etc.)."""
     async with get_pool().acquire() as conn:
@@ -183,26 +261,35 @@ async def get_user_state(user_id: UUID) -> LunaState:
 # RELATIONSHIPS
 # =============================================================================
 
-async def get_relationship(user_id: UUID) -> Optional[dict]:
-    """Récupère la relation d'un user."""
+async def get_relationship(user_id: UUID) -> Optional[RelationshipRow]:
+    """Récupère la relation d'un user (sans nsfw_gate_data / engagement_state)."""
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT * FROM memory_relationships WHERE user_id = $1
+        row = await conn.fetchrow(f"""
+            SELECT {RELATIONSHIP_COLUMNS} FROM memory_relationships WHERE user_id = $1
         """, user_id)
-        return dict(row) if row else None
+        return RelationshipRow.from_record(row) if row else None
 
 
-async def update_relationship(user_id: UUID, updates: dict) -> dict:
+async def update_relationship(user_id: UUID, updates: dict) -> RelationshipRow:
     """Met à jour la relation."""
     if not updates:
         return await get_relationship(user_id)
 
+    updates = dict(updates)
+    jokes = updates.pop("inside_jokes", None)
+
     async with get_pool().acquire() as conn:
+        if jokes:
+            for joke in [jokes] if isinstance(jokes, str) else jokes:
+                await _insert_joke_if_missing(conn, user_id, joke)
+        if not updates:
+            return await get_relationship(user_id)
+
         sets = []
         values = [user_id]
 
         for i, (k, v) in enumerate(updates.items(), start=2):
-            if k in ("inside_jokes", "pet_names", "shared_memories"):
+            if k in ("pet_names", "shared_memories"):
                 # JSONB arrays - append
                 sets.append(f"{k} = {k} || ${i}::jsonb")
                 values.append(json.dumps([v] if isinstance(v, str) else v))
@@ -220,7 +307,7 @@ async def update_relationship(user_id: UUID, updates: dict) -> dict:
         return await get_relationship(user_id)
 
 
-async def increment_relationship(user_id: UUID, intimacy_delta: int = 0, trust_delta: int = 0) -> dict:
+async def increment_relationship(user_id: UUID, intimacy_delta: int = 0, trust_delta: int = 0) -> RelationshipRow:
     """Incrémente intimacy/trust avec bounds check (1-10)."""
     async with get_pool().acquire() as conn:
         await conn.execute("""
@@ -235,15 +322,17 @@ async def increment_relationship(user_id: UUID, intimacy_delta: int = 0, trust_d
 
 
 async def add_inside_joke(user_id: UUID, joke: str) -> None:
-    """Ajoute un inside joke."""
+    """Ajoute un inside joke (trigger seul, ignoré s'il existe déjà)."""
     async with get_pool().acquire() as conn:
-        await conn.execute("""
-            UPDATE memory_relationships SET
-                inside_jokes = inside_jokes || $2::jsonb,
-                updated_at = NOW()
-            WHERE user_id = $1
-            AND NOT (inside_jokes @> $2::jsonb)
-        """, user_id, json.dumps([joke]))
+        await _insert_joke_if_missing(conn, user_id, joke)
+
+
+async def _insert_joke_if_missing(conn, user_id: UUID, trigger: str) -> None:
+    await conn.execute("""
+        INSERT INTO memory_inside_jokes (user_id, trigger)
+        VALUES ($1, $2)
+        ON CONFLICT (user_id, lower(trigger)) DO NOTHING
+    """, user_id, trigger)
 
 
 async def increment_day(user_id: UUID) -> int:
@@ -271,56 +360,59 @@ async def add_event(
     score: int = 7,
     pinned: bool = False,
     event_date: Optional[datetime] = None
-) -> dict:
+) -> EventRow:
     """Ajoute un événement à la timeline."""
+    mark_write(user_id)
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
+        row = await conn.fetchrow(f"""
             INSERT INTO memory_timeline
                 (user_id, type, summary, keywords, score, pinned, event_date)
             VALUES ($1, $2, $3, $4::jsonb, $5, $6, COALESCE($7, NOW()))
-            RETURNING *
+            ON CONFLICT (user_id, type, md5(lower(summary)))
+            DO UPDATE SET score = GREATEST(memory_timeline.score, EXCLUDED.score)
+            RETURNING {EVENT_COLUMNS}
         """, user_id, event_type, summary, json.dumps(keywords), score, pinned, event_date)
 
         logger.info(f"Event added: [{event_type}] {summary[:50]}...")
-        return dict(row)
+        return EventRow.from_record(row)
 
 
-async def get_hot_events(user_id: UUID, limit: int = 10) -> list[dict]:
+async def get_hot_events(user_id: UUID, limit: int = 10) -> list[EventRow]:
     """Récupère les événements HOT (récents, < 7 jours)."""
-    async with get_pool().acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT * FROM memory_timeline
+    async with read_acquire(user_id) as conn:
+        rows = await conn.fetch(f"""
+            SELECT {EVENT_COLUMNS} FROM memory_timeline
             WHERE user_id = $1 AND tier = 'hot'
             ORDER BY event_date DESC
             LIMIT $2
         """, user_id, limit)
-        return [dict(r) for r in rows]
+        return EventRow.from_records(rows)
 
 
-async def get_pinned_events(user_id: UUID) -> list[dict]:
+async def get_pinned_events(user_id: UUID) -> list[EventRow]:
     """Récupère les événements épinglés (toujours inclus)."""
-    async with get_pool().acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT * FROM memory_timeline
+    async with read_acquire(user_id) as conn:
+        rows = await conn.fetch(f"""
+            SELECT {EVENT_COLUMNS} FROM memory_timeline
             WHERE user_id = $1 AND pinned = TRUE
             ORDER BY event_date DESC
         """, user_id)
-        return [dict(r) for r in rows]
+        return EventRow.from_records(rows)
 
 
 async def get_events_by_keywords(
     user_id: UUID,
     keywords: list[str],
     limit: int = 5
-) -> list[dict]:
+) -> list[EventRow]:
     """Recherche des événements par keywords."""
     if not keywords:
         return []
 
-    async with get_pool().acquire() as conn:
+    async with read_acquire(user_id) as conn:
         # Use ?| operator for JSONB array contains any of the keywords
-        rows = await conn.fetch("""
-            SELECT * FROM memory_timeline
+        rows = await conn.fetch(f"""
+            SELECT {EVENT_COLUMNS} FROM memory_timeline
             WHERE user_id = $1 AND keywords ?| $2
             ORDER BY
                 pinned DESC,
@@ -328,15 +420,15 @@ async def get_events_by_keywords(
                 event_date DESC
             LIMIT $3
         """, user_id, keywords, limit)
-        return [dict(r) for r in rows]
+        return EventRow.from_records(rows)
 
 
-async def get_luna_said(user_id: UUID, topic: Optional[str] = None, limit: int = 5) -> list[dict]:
+async def get_luna_said(user_id: UUID, topic: Optional[str] = None, limit: int = 5) -> list[EventRow]:
     """Récupère ce que Luna a dit (sur un topic ou en général)."""
-    async with get_pool().acquire() as conn:
+    async with read_acquire(user_id) as conn:
         if topic:
-            rows = await conn.fetch("""
-                SELECT * FROM memory_timeline
+            rows = await conn.fetch(f"""
+                SELECT {EVENT_COLUMNS} FROM memory_timeline
                 WHERE user_id = $1
                 AND type = 'luna_said'
                 AND keywords @> $2::jsonb
@@ -344,29 +436,29 @@ async def get_luna_said(user_id: UUID, topic: Optional[str] = None, limit: int =
                 LIMIT $3
             """, user_id, json.dumps([topic]), limit)
         else:
-            rows = await conn.fetch("""
-                SELECT * FROM memory_timeline
+            rows = await conn.fetch(f"""
+                SELECT {EVENT_COLUMNS} FROM memory_timeline
                 WHERE user_id = $1 AND type = 'luna_said'
                 ORDER BY event_date DESC
                 LIMIT $2
             """, user_id, limit)
 
-        return [dict(r) for r in rows]
+        return EventRow.from_records(rows)
 
 
-async def get_events_by_type(user_id: UUID, event_type: str, limit: int = 10) -> list[dict]:
+async def get_events_by_type(user_id: UUID, event_type: str, limit: int = 10) -> list[EventRow]:
     """Récupère les événements d'un type spécifique."""
     async with get_pool().acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT * FROM memory_timeline
+        rows = await conn.fetch(f"""
+            SELECT {EVENT_COLUMNS} FROM memory_timeline
             WHERE user_id = $1 AND type = $2
             ORDER BY event_date DESC
             LIMIT $3
         """, user_id, event_type, limit)
-        return [dict(r) for r in rows]
+        return EventRow.from_records(rows)
 
 
-async def update_event(event_id: UUID, updates: dict) -> dict:
+async def update_event(event_id: UUID, updates: dict) -> Optional[EventRow]:
     """Met à jour un événement."""
     async with get_pool().acquire() as conn:
         sets = []
@@ -381,65 +473,98 @@ async def update_event(event_id: UUID, updates: dict) -> dict:
                 values.append(v)
 
         row = await conn.fetchrow(
-            f"UPDATE memory_timeline SET {', '.join(sets)} WHERE id = $1 RETURNING *",
+            f"UPDATE memory_timeline SET {', '.join(sets)} WHERE id = $1 RETURNING {EVENT_COLUMNS}",
             *values
         )
-        return dict(row) if row else None
+        return EventRow.from_record(row) if row else None
 
 
-async def find_similar_event(user_id: UUID, keywords: list[str], event_type: str) -> Optional[dict]:
+async def find_similar_event(user_id: UUID, keywords: list[str], event_type: str) -> Optional[EventRow]:
     """Trouve un événement similaire (pour éviter doublons)."""
     if not keywords:
         return None
 
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT * FROM memory_timeline
+        row = await conn.fetchrow(f"""
+            SELECT {EVENT_COLUMNS} FROM memory_timeline
             WHERE user_id = $1
             AND type = $2
             AND keywords ?| $3
             ORDER BY event_date DESC
             LIMIT 1
         """, user_id, event_type, keywords)
-        return dict(row) if row else None
+        return EventRow.from_record(row) if row else None
 
 
 # =============================================================================
 # MAINTENANCE (Cron jobs)
 # =============================================================================
 
-async def update_tiers() -> int:
+# (tier source, tier cible, âge en jours au-delà duquel on bascule)
+TIER_TRANSITIONS = (
+    ("hot", "warm", TierThreshold.HOT_DAYS),
+    ("warm", "cold", TierThreshold.WARM_DAYS),
+)
+
+
+async def update_tiers(batch_size: int = 2000, full: bool = False) -> int:
     """
     Met à jour les tiers des événements:
     - hot → warm si > 7 jours
     - warm → cold si > 90 jours
 
-    Retourne le nombre d'événements mis à jour.
-    """
-    now = datetime.now()
-    hot_cutoff = now - timedelta(days=TierThreshold.HOT_DAYS)
-    warm_cutoff = now - timedelta(days=TierThreshold.WARM_DAYS)
-
-    async with get_pool().acquire() as conn:
-        # hot → warm
-        result1 = await conn.execute("""
-            UPDATE memory_timeline SET tier = 'warm'
-            WHERE tier = 'hot' AND event_date < $1 AND pinned = FALSE
-        """, hot_cutoff)
-
-        # warm → cold
-        result2 = await conn.execute("""
-            UPDATE memory_timeline SET tier = 'cold'
-            WHERE tier = 'warm' AND event_date < $1 AND pinned = FALSE
-        """, warm_cutoff)
-
-        count1 = int(result1.split()[-1]) if result1 else 0
-        count2 = int(result2.split()[-1]) if result2 else 0
+    Incrémental: pour chaque transition, seuls les événements dont event_date
+    a franchi le seuil depuis le dernier passage sont traités (high-water mark
+    dans memory_maintenance_state, index partiel idx_timeline_tier_date).
+    Mises à jour par lots de batch_size, chaque lot dans sa propre transaction
+    pour garder des verrous courts.
 
-        if count1 or count2:
-            logger.info(f"Tier update: {count1} hot→warm, {count2} warm→cold")
+    Args:
+        full: Ignore le high-water mark (rattrapage des event_date antidatés)
 
-        return count1 + count2
+    Retourne le nombre d'événements mis à jour.
+    """
+    counts = {}
+
+    async with get_pool().acquire() as conn:
+        for source, target, days in TIER_TRANSITIONS:
+            name = f"tier_{source}_{target}"
+            cutoff = await conn.fetchval("SELECT NOW() - make_interval(days => $1)", days)
+            since = None if full else await conn.fetchval("""
+                SELECT high_water FROM memory_maintenance_state WHERE name = $1
+            """, name)
+
+            moved = 0
+            while True:
+                result = await conn.execute("""
+                    UPDATE memory_timeline SET tier = $2
+                    WHERE id IN (
+                        SELECT id FROM memory_timeline
+                        WHERE tier = $1 AND pinned = FALSE
+                          AND event_date < $3
+                          AND ($4::timestamptz IS NULL OR event_date >= $4)
+                        LIMIT $5
+                    )
+                """, source, target, cutoff, since, batch_size)
+                count = int(result.split()[-1]) if result else 0
+                moved += count
+                if count < batch_size:
+                    break
+
+            await conn.execute("""
+                INSERT INTO memory_maintenance_state (name, high_water, updated_at)
+                VALUES ($1, $2, NOW())
+                ON CONFLICT (name) DO UPDATE
+                SET high_water = EXCLUDED.high_water, updated_at = NOW()
+            """, name, cutoff)
+            counts[name] = moved
+
+    count1 = counts["tier_hot_warm"]
+    count2 = counts["tier_warm_cold"]
+    if count1 or count2:
+        logger.info(f"Tier update: {count1} hot→warm, {count2} warm→cold")
+
+    return count1 + count2
 
 
 async def cleanup_old_cold_events(user_id: UUID, keep_count: int = 50) -> int:
@@ -476,10 +601,11 @@ async def add_summary(
     summary: str,
     highlights: list[str] = None,
     archived_data: dict = None
-) -> dict:
+) -> Optional[SummaryRow]:
     """Ajoute un résumé hebdo ou mensuel."""
+    mark_write(user_id)
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
+        row = await conn.fetchrow(f"""
             INSERT INTO memory_summaries
                 (user_id, type, period, summary, highlights, archived_data)
             VALUES ($1, $2, $3, $4, $5::jsonb, $6::jsonb)
@@ -487,50 +613,50 @@ async def add_summary(
                 summary = EXCLUDED.summary,
                 highlights = EXCLUDED.highlights,
                 archived_data = EXCLUDED.archived_data
-            RETURNING *
+            RETURNING {SUMMARY_COLUMNS}
         """, user_id, summary_type, period,
              summary, json.dumps(highlights or []), json.dumps(archived_data or {}))
 
         logger.info(f"Summary added: [{summary_type}] {period}")
-        return dict(row) if row else None
+        return SummaryRow.from_record(row) if row else None
 
 
 async def get_summaries(
     user_id: UUID,
     summary_type: str = None,
     limit: int = 12
-) -> list[dict]:
+) -> list[SummaryRow]:
     """Récupère les résumés d'un user."""
-    async with get_pool().acquire() as conn:
+    async with read_acquire(user_id) as conn:
         if summary_type:
-            rows = await conn.fetch("""
-                SELECT * FROM memory_summaries
+            rows = await conn.fetch(f"""
+                SELECT {SUMMARY_COLUMNS} FROM memory_summaries
                 WHERE user_id = $1 AND type = $2
                 ORDER BY created_at DESC
                 LIMIT $3
             """, user_id, summary_type, limit)
         else:
-            rows = await conn.fetch("""
-                SELECT * FROM memory_summaries
+            rows = await conn.fetch(f"""
+                SELECT {SUMMARY_COLUMNS} FROM memory_summaries
                 WHERE user_id = $1
                 ORDER BY created_at DESC
                 LIMIT $2
             """, user_id, limit)
 
-        return [dict(r) for r in rows]
+        return SummaryRow.from_records(rows)
 
 
-async def get_latest_summary(user_id: UUID, summary_type: str) -> Optional[dict]:
+async def get_latest_summary(user_id: UUID, summary_type: str) -> Optional[SummaryRow]:
     """Récupère le dernier résumé d'un type."""
-    async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT * FROM memory_summaries
+    async with read_acquire(user_id) as conn:
+        row = await conn.fetchrow(f"""
+            SELECT {SUMMARY_COLUMNS} FROM memory_summaries
             WHERE user_id = $1 AND type = $2
             ORDER BY created_at DESC
             LIMIT 1
         """, user_id, summary_type)
 
-        return dict(row) if row else None
+        return SummaryRow.from_record(row) if row else None
 
 
 # =============================================================================
@@ -544,71 +670,62 @@ async def add_calendar_date(
     event_type: str,
     importance: int = 7
 ) -> None:
-    """Ajoute une date au calendrier."""
-    async with get_pool().acquire() as conn:
-        new_date = {
-            "date": date,
-            "event": event,
-            "type": event_type,
-            "importance": importance
-        }
-
-        await conn.execute("""
-            UPDATE memory_users
-            SET calendar_dates = (
-                SELECT jsonb_agg(elem)
-                FROM (
-                    SELECT elem FROM jsonb_array_elements(calendar_dates) elem
-                    WHERE elem->>'date' != $2
-                    UNION ALL
-                    SELECT $3::jsonb
-                ) sub
-            ),
-            updated_at = NOW()
-            WHERE id = $1
-        """, user_id, date, json.dumps(new_date))
-
-
-async def get_upcoming_dates(user_id: UUID, days_ahead: int = 7, limit: int = 10) -> list[dict]:
-    """Récupère les dates dans les N prochains jours."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    future = (datetime.now() + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
-
-    async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT calendar_dates FROM memory_users WHERE id = $1
-        """, user_id)
-
-        if not row or not row["calendar_dates"]:
-            return []
-
-        dates = row["calendar_dates"]
-        if isinstance(dates, str):
-            dates = json.loads(dates)
-
-        upcoming = [d for d in dates if today <= d.get("date", "") <= future]
-        # Sort by date and limit
-        upcoming.sort(key=lambda d: d.get("date", ""))
-        return upcoming[:limit]
+    """Ajoute une date au calendrier (remplace l'entrée existante à la même date)."""
+    async with get_pool().acquire() as conn:
+        await upsert_calendar_dates(conn, user_id, [
+            {"date": date, "event": event, "type": event_type, "importance": importance}
+        ])
+
+
+async def upsert_calendar_dates(conn, user_id: UUID, dates: list[dict]) -> None:
+    """Insère des dates {"date": "YYYY-MM-DD", ...}; une seule entrée par date (la dernière gagne)."""
+    by_day = {datetime.strptime(d["date"], "%Y-%m-%d").date(): d for d in dates}
+    if not by_day:
+        return
+    await conn.execute("""
+        INSERT INTO memory_calendar_dates (user_id, date, event, type, importance)
+        SELECT $1, t.date, t.event, t.type, t.importance
+        FROM UNNEST($2::date[], $3::text[], $4::text[], $5::int[]) AS t(date, event, type, importance)
+        ON CONFLICT (user_id, date) DO UPDATE SET
+            event = EXCLUDED.event,
+            type = EXCLUDED.type,
+            importance = EXCLUDED.importance,
+            created_at = NOW()
+    """,
+        user_id,
+        list(by_day),
+        [d.get("event") or "" for d in by_day.values()],
+        [d.get("type") or "plan" for d in by_day.values()],
+        [int(d.get("importance") or 7) for d in by_day.values()],
+    )
+
+
+async def get_upcoming_dates(user_id: UUID, days_ahead: int = 7, limit: int = 10) -> list[CalendarDateRow]:
+    """Récupère les dates dans les N prochains jours (plage sur la clé (user_id, date))."""
+    today = datetime.now().date()
+    future = today + timedelta(days=days_ahead)
+
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT {CALENDAR_DATE_COLUMNS} FROM memory_calendar_dates
+            WHERE user_id = $1 AND date BETWEEN $2 AND $3
+            ORDER BY date
+            LIMIT $4
+        """, user_id, today, future, limit)
+
+        return CalendarDateRow.from_records(rows)
 
 
 async def cleanup_past_dates(user_id: UUID) -> int:
-    """Supprime les dates passées."""
-    today = datetime.now().strftime("%Y-%m-%d")
+    """Supprime les dates passées. Retourne le nombre de dates supprimées."""
+    today = datetime.now().date()
 
     async with get_pool().acquire() as conn:
         result = await conn.execute("""
-            UPDATE memory_users
-            SET calendar_dates = (
-                SELECT COALESCE(jsonb_agg(elem), '[]'::jsonb)
-                FROM jsonb_array_elements(calendar_dates) elem
-                WHERE elem->>'date' >= $2
-            ),
-            updated_at = NOW()
-            WHERE id = $1
+            DELETE FROM memory_calendar_dates WHERE user_id = $1 AND date < $2
         """, user_id, today)
 
-        return 1 if result else 0
+        return int(result.split()[-1]) if result else 0
 
 
 # =============================================================================
@@ -685,93 +802,126 @@ async def add_inside_joke_v2(
     context: str,
     importance: int = 6
 ) -> None:
-    """Ajoute un inside joke avec tracking."""
-    now = datetime.now().isoformat()
-
+    """Ajoute un inside joke, ou incrémente son usage s'il existe (atomique)."""
     async with get_pool().acquire() as conn:
-        # Check if joke exists
-        rel = await conn.fetchrow("""
-            SELECT inside_jokes FROM memory_relationships WHERE user_id = $1
-        """, user_id)
+        async with conn.transaction():
+            await upsert_inside_jokes(conn, user_id, [
+                {"trigger": trigger, "context": context, "importance": importance}
+            ])
 
-        jokes = rel["inside_jokes"] if rel and rel["inside_jokes"] else []
-        if isinstance(jokes, str):
-            jokes = json.loads(jokes)
 
-        # Find existing joke by trigger
-        existing_idx = next(
-            (i for i, j in enumerate(jokes)
-             if isinstance(j, dict) and j.get("trigger", "").lower() == trigger.lower()),
-            None
-        )
+async def upsert_inside_jokes(conn, user_id: UUID, jokes: list[dict], keep: int = INSIDE_JOKES_KEEP) -> None:
+    """
+    Upsert des jokes par trigger (insensible à la casse) puis garde le top `keep`.
 
-        if existing_idx is not None:
-            # Update existing
-            jokes[existing_idx]["times_used"] = jokes[existing_idx].get("times_used", 0) + 1
-            jokes[existing_idx]["last_used"] = now
+    Un joke déjà présent voit times_used augmenter de son nombre d'occurrences
+    dans le lot (ON CONFLICT: pas de lecture préalable, pas de course entre
+    deux extractions).
+    """
+    merged: dict[str, dict] = {}
+    for joke in jokes:
+        key = joke["trigger"].lower()
+        if key in merged:
+            merged[key]["times_used"] += 1
         else:
-            # Add new
-            jokes.append({
-                "trigger": trigger,
-                "context": context,
-                "importance": importance,
-                "times_used": 1,
-                "last_used": now,
-                "created_at": now
-            })
-
-        # Sort by usage and keep top 15
-        jokes = sorted(
-            [j for j in jokes if isinstance(j, dict)],
-            key=lambda x: (x.get("times_used", 0) * 2 + x.get("importance", 0)),
-            reverse=True
-        )[:15]
-
-        await conn.execute("""
-            UPDATE memory_relationships
-            SET inside_jokes = $2::jsonb,
-                updated_at = NOW()
+            merged[key] = {**joke, "times_used": 1}
+    if not merged:
+        return
+
+    await conn.execute("""
+        INSERT INTO memory_inside_jokes (user_id, trigger, context, importance, times_used)
+        SELECT $1, t.trigger, t.context, t.importance, t.times_used
+        FROM UNNEST($2::text[], $3::text[], $4::int[], $5::int[]) AS t(trigger, context, importance, times_used)
+        ON CONFLICT (user_id, lower(trigger)) DO UPDATE SET
+            times_used = memory_inside_jokes.times_used + EXCLUDED.times_used,
+            last_used = NOW()
+    """,
+        user_id,
+        [j["trigger"] for j in merged.values()],
+        [j.get("context") or "" for j in merged.values()],
+        [int(j.get("importance") or 5) for j in merged.values()],
+        [j["times_used"] for j in merged.values()],
+    )
+    await trim_inside_jokes(conn, user_id, keep)
+
+
+async def trim_inside_jokes(conn, user_id: UUID, keep: int = INSIDE_JOKES_KEEP) -> None:
+    """Supprime les jokes au-delà du top `keep` (par usage puis récence)."""
+    await conn.execute(f"""
+        DELETE FROM memory_inside_jokes
+        WHERE id IN (
+            SELECT id FROM memory_inside_jokes
             WHERE user_id = $1
-        """, user_id, json.dumps(jokes))
+            ORDER BY {JOKE_RANK} DESC, last_used DESC
+            OFFSET $2
+        )
+    """, user_id, keep)
 
 
-async def get_inside_jokes_v2(user_id: UUID, limit: int = 10) -> list[dict]:
+async def get_inside_jokes_v2(user_id: UUID, limit: int = 10) -> list[InsideJokeRow]:
     """Récupère les inside jokes triés par usage."""
     async with get_pool().acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT inside_jokes FROM memory_relationships WHERE user_id = $1
-        """, user_id)
-
-        if not row or not row["inside_jokes"]:
-            return []
-
-        jokes = row["inside_jokes"]
-        if isinstance(jokes, str):
-            jokes = json.loads(jokes)
+        rows = await conn.fetch(f"""
+            SELECT {INSIDE_JOKE_COLUMNS} FROM memory_inside_jokes
+            WHERE user_id = $1
+            ORDER BY {JOKE_RANK} DESC, last_used DESC
+            LIMIT $2
+        """, user_id, limit)
 
-        # Filter valid jokes and sort
-        valid_jokes = [j for j in jokes if isinstance(j, dict) and j.get("trigger")]
-        return sorted(
-            valid_jokes,
-            key=lambda x: (x.get("times_used", 0) * 2 + x.get("importance", 0)),
-            reverse=True
-        )[:limit]
+        return InsideJokeRow.from_records(rows)
 
 
 # =============================================================================
 # BULK OPERATIONS
 # =============================================================================
 
-async def get_all_active_users(days_inactive: int = 30) -> list[dict]:
+async def get_all_active_users(days_inactive: int = 30) -> list[ActiveUserRow]:
     """Récupère tous les users actifs récemment."""
     cutoff = datetime.now() - timedelta(days=days_inactive)
 
     async with get_pool().acquire() as conn:
         rows = await conn.fetch("""
-            SELECT u.*, r.day, r.paid
+            SELECT u.id, u.telegram_id, u.name, r.day, r.paid
             FROM memory_users u
             JOIN memory_relationships r ON r.user_id = u.id
             WHERE u.updated_at > $1
         """, cutoff)
 
-        return [dict(r) for r in rows]
+        return ActiveUserRow.from_records(rows)
+
+
+# Colonnes de checkpoint des jobs de compression (reprise après crash)
+COMPRESSION_CHECKPOINTS = ("last_weekly_summary", "last_monthly_cleanup")
+
+
+async def get_users_due(checkpoint: str, period_start: datetime, days_inactive: int = 30) -> list[UUID]:
+    """
+    Users actifs dont le checkpoint est antérieur au début de la période
+    (pas encore traités par le job en cours).
+    """
+    if checkpoint not in COMPRESSION_CHECKPOINTS:
+        raise ValueError(f"Unknown checkpoint column: {checkpoint}")
+    cutoff = datetime.now() - timedelta(days=days_inactive)
+
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT u.id
+            FROM memory_users u
+            JOIN memory_relationships r ON r.user_id = u.id
+            WHERE u.updated_at > $1
+              AND (u.{checkpoint} IS NULL OR u.{checkpoint} < $2)
+            ORDER BY u.id
+        """, cutoff, period_start)
+
+        return [r["id"] for r in rows]
+
+
+async def mark_checkpoint(user_id: UUID, checkpoint: str) -> None:
+    """Marque un user comme traité pour le job (sans toucher updated_at)."""
+    if checkpoint not in COMPRESSION_CHECKPOINTS:
+        raise ValueError(f"Unknown checkpoint column: {checkpoint}")
+
+    async with get_pool().acquire() as conn:
+        await conn.execute(f"""
+            UPDATE memory_users SET {checkpoint} = NOW() WHERE id = $1
+        """, user_id)
@@ -21,6 +21,10 @@ from uuid import UUID
 
 import httpx
 
+from core.http import get_http_client
+from core.usage import usage
+from core.offload import offload
+
 # =============================================================================
 # SECURITY: Sensitive Data Patterns (FIX #6)
 # =============================================================================
@@ -156,17 +160,15 @@ def _is_user_own_name(name: str, message: str) -> bool:
     return False
 
 
-from .crud import (
-    get_pool,
-    get_user_by_id,
-    update_user,
-    add_event,
-    find_similar_event,
-    add_inside_joke_v2,
-    add_calendar_date,
-    update_user_patterns,
+from .coherence import classify_user_contradiction
+from .persistence import (
+    ExtractionWrites,
+    MemorySnapshot,
+    load_snapshot,
+    _as_dict,
+    _as_list,
 )
-from .coherence import check_user_contradiction
+from .prefilter import extraction_prefilter, log_outcome
 
 logger = logging.getLogger(__name__)
 
@@ -193,35 +195,36 @@ async def _call_openrouter_with_retry(
 
     for attempt in range(max_retries):
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
-                response = await client.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "model": HAIKU_MODEL,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "max_tokens": 600,
-                        "temperature": 0,
-                    }
-                )
-
-                data = response.json()
-
-                if "choices" in data:
-                    return data["choices"][0]["message"]["content"]
-
-                # API error - log and retry
-                error_msg = data.get("error", {}).get("message", str(data))
-                logger.warning(f"OpenRouter attempt {attempt + 1}/{max_retries} failed: {error_msg}")
-
-                # Rate limit - wait longer
-                if response.status_code == 429:
-                    await asyncio.sleep(RETRY_DELAY * (attempt + 2))
-                else:
-                    await asyncio.sleep(RETRY_DELAY)
+            response = await get_http_client().post(
+                "https://openrouter.ai/api/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                    "Content-Type": "application/json",
+                },
+                json={
+                    "model": HAIKU_MODEL,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "max_tokens": 600,
+                    "temperature": 0,
+                },
+                timeout=30,
+            )
+
+            data = response.json()
+
+            if "choices" in data:
+                usage.record("extraction", data, model=HAIKU_MODEL)
+                return data["choices"][0]["message"]["content"]
+
+            # API error - log and retry
+            error_msg = data.get("error", {}).get("message", str(data))
+            logger.warning(f"OpenRouter attempt {attempt + 1}/{max_retries} failed: {error_msg}")
+
+            # Rate limit - wait longer
+            if response.status_code == 429:
+                await asyncio.sleep(RETRY_DELAY * (attempt + 2))
+            else:
+                await asyncio.sleep(RETRY_DELAY)
 
         except httpx.TimeoutException:
             logger.warning(f"OpenRouter timeout (attempt {attempt + 1}/{max_retries})")
@@ -382,6 +385,11 @@ def _verify_in_text(value: str, *texts: str) -> bool:
     return False
 
 
+async def _verify_in_text_offloaded(value: str, *texts: str) -> bool:
+    """_verify_in_text dans le pool de processus quand les textes sont gros (lots fusionnés)."""
+    return await offload(_verify_in_text, value, *texts, size=sum(len(t) for t in texts if t))
+
+
 def _verify_date_in_text(date_str: str, *texts: str) -> bool:
     """
     Vérifie qu'une date mentionnée apparaît dans les textes.
@@ -465,11 +473,7 @@ EXEMPLES CONCRETS:
 ⛔ "Mon frère Patrick" → {{"type": "name", "value": "Patrick"}} ← FAUX!
 ✅ "Mon frère Patrick" → {{"type": "family", "value": "frère: Patrick"}} ← CORRECT!
 
-MESSAGE UTILISATEUR:
-{user_message}
-
-RÉPONSE LUNA:
-{luna_response}
+{exchange}
 
 HISTORIQUE RÉCENT:
 {history}
@@ -652,12 +656,30 @@ def _is_bad_pattern(pattern: dict) -> bool:
 # UNIFIED EXTRACTION FUNCTION
 # =============================================================================
 
+def _format_exchange(user_message: str, luna_response: str, max_chars: int,
+                     turns: Optional[list[tuple[str, str]]] = None) -> str:
+    """Section message/réponse du prompt (un tour, ou les tours fusionnés numérotés)."""
+    if not turns or len(turns) < 2:
+        return f"MESSAGE UTILISATEUR:\n{user_message[:max_chars]}\n\nRÉPONSE LUNA:\n{luna_response[:max_chars]}"
+
+    blocks = [
+        f"Tour {i}\nUTILISATEUR: {user_turn}\nLUNA: {luna_turn}"
+        for i, (user_turn, luna_turn) in enumerate(turns, 1)
+    ]
+    return (
+        f"ÉCHANGE ({len(turns)} tours, dans l'ordre; chaque réponse LUNA répond "
+        f"au message UTILISATEUR du même tour):\n\n" + "\n\n".join(blocks)
+    )
+
+
 async def extract_unified(
     user_id: UUID,
     user_message: str,
     luna_response: str,
     history: list[dict],
-    min_importance: int = 3
+    min_importance: int = 3,
+    max_chars: int = 500,
+    turns: Optional[list[tuple[str, str]]] = None,
 ) -> dict:
     """
     Extraction unifiée - UN SEUL appel LLM pour tout.
@@ -668,6 +690,11 @@ async def extract_unified(
         luna_response: Réponse de Luna
         history: Historique récent des messages
         min_importance: Score minimum pour stocker (défaut: 3)
+        max_chars: Troncature des messages dans le prompt (plus large
+            quand plusieurs tours sont fusionnés par le scheduler)
+        turns: Tours fusionnés [(message user, réponse Luna)], dans l'ordre:
+            le prompt les présente en "Tour N" pour garder qui répond à quoi
+            (user_message / luna_response restent les textes de vérification)
 
     Returns:
         {
@@ -698,6 +725,11 @@ async def extract_unified(
         logger.warning(f"SENSITIVE DATA detected, skipping extraction: {user_message[:50]}...")
         return {"extracted": {}, "stored": {}, "skipped": ["sensitive_data_blocked"]}
 
+    # Pré-filtre local: saute l'appel LLM pour les tours sans contenu extractible
+    decision = extraction_prefilter.evaluate(user_message, luna_response)
+    if not decision.extract:
+        return {"extracted": {}, "stored": {}, "skipped": ["prefilter_low_score"]}
+
     # Formater l'historique
     history_text = "\n".join([
         f"USER: {m.get('content', '')[:100]}" if m.get('role') == 'user'
@@ -707,8 +739,7 @@ async def extract_unified(
 
     # Appel LLM unifié avec RETRY (FIX #8)
     prompt = UNIFIED_EXTRACTION_PROMPT.format(
-        user_message=user_message[:500],
-        luna_response=luna_response[:500],
+        exchange=_format_exchange(user_message, luna_response, max_chars, turns),
         history=history_text
     )
 
@@ -729,17 +760,27 @@ async def extract_unified(
     stored = {}
     skipped = []
 
-    # Get current user for dedup
-    current_user = await get_user_by_id(user_id)
-    if not current_user:
-        return {"extracted": extracted, "stored": {}, "skipped": ["user_not_found"]}
-
-    # --- USER FACTS (array) ---
     user_facts = extracted.get("user_facts") or []
     # Handle legacy single user_fact format
     if not user_facts and extracted.get("user_fact"):
         user_facts = [extracted.get("user_fact")]
+    luna_stmt = extracted.get("luna_statement") or {}
+    event = extracted.get("emotional_event") or {}
+    joke = extracted.get("inside_joke") or {}
+    cal_date = extracted.get("calendar_date") or {}
+    pattern = extracted.get("user_pattern") or {}
+
+    # UNE lecture (user + événements similaires), puis dedup en mémoire
+    snapshot = await load_snapshot(user_id, {
+        "luna_said": _extract_keywords(luna_stmt.get("revealed") or ""),
+        "moment": _extract_keywords(event.get("summary") or ""),
+    })
+    if not snapshot:
+        return {"extracted": extracted, "stored": {}, "skipped": ["user_not_found"]}
+
+    writes = ExtractionWrites(user_id)
 
+    # --- USER FACTS (array) ---
     stored_facts = []
     for fact in user_facts:
         if not isinstance(fact, dict):
@@ -773,7 +814,7 @@ async def extract_unified(
                 continue
 
         if fact.get("value") and fact.get("importance", 0) >= min_importance:
-            fact_stored = await _store_user_fact(user_id, fact, current_user, user_message)
+            fact_stored = _plan_user_fact(writes, snapshot, fact, user_message)
             if fact_stored:
                 stored_facts.append(fact_stored)
             else:
@@ -783,37 +824,34 @@ async def extract_unified(
         stored["user_facts"] = stored_facts
 
     # --- LUNA STATEMENT (FIX #4: verify in luna_response) ---
-    luna_stmt = extracted.get("luna_statement") or {}
     if luna_stmt.get("revealed") and luna_stmt.get("importance", 0) >= min_importance:
         revealed = luna_stmt.get("revealed", "")
         # ANTI-HALLUCINATION: La révélation doit apparaître dans la réponse de Luna
-        if not _verify_in_text(revealed, luna_response):
+        if not await _verify_in_text_offloaded(revealed, luna_response):
             logger.warning(f"HALLUCINATION blocked: luna_statement '{revealed[:50]}' not in luna_response")
             skipped.append(f"luna_statement hallucination: {revealed[:50]}")
         else:
-            stmt_stored = await _store_luna_statement(user_id, luna_stmt)
+            stmt_stored = _plan_luna_statement(writes, snapshot, luna_stmt)
             if stmt_stored:
                 stored["luna_statement"] = stmt_stored
             else:
                 skipped.append(f"luna_statement: duplicate")
 
     # --- EMOTIONAL EVENT (FIX #2: verify in messages) ---
-    event = extracted.get("emotional_event") or {}
     if event.get("summary") and event.get("importance", 0) >= min_importance:
         summary = event.get("summary", "")
         # ANTI-HALLUCINATION: L'événement doit être mentionné dans user_message ou luna_response
-        if not _verify_in_text(summary, user_message, luna_response):
+        if not await _verify_in_text_offloaded(summary, user_message, luna_response):
             logger.warning(f"HALLUCINATION blocked: emotional_event '{summary[:50]}' not in messages")
             skipped.append(f"emotional_event hallucination: {summary[:50]}")
         else:
-            event_stored = await _store_emotional_event(user_id, event, log_contradictions=True)
+            event_stored = _plan_emotional_event(writes, snapshot, event, log_contradictions=True)
             if event_stored:
                 stored["emotional_event"] = event_stored
             else:
                 skipped.append(f"emotional_event: duplicate or contradiction")
 
     # --- INSIDE JOKE (FIX #1: verify in messages) ---
-    joke = extracted.get("inside_joke") or {}
     if joke.get("trigger") and joke.get("importance", 0) >= min_importance:
         trigger = joke.get("trigger", "")
         context = joke.get("context", "")
@@ -821,16 +859,14 @@ async def extract_unified(
         if _is_bad_inside_joke(joke):
             skipped.append("inside_joke: filtered (mentions Luna error)")
         # ANTI-HALLUCINATION: Le trigger ou contexte doit apparaître dans les messages
-        elif not _verify_in_text(trigger, user_message, luna_response) and not _verify_in_text(context, user_message, luna_response):
+        elif (not await _verify_in_text_offloaded(trigger, user_message, luna_response)
+              and not await _verify_in_text_offloaded(context, user_message, luna_response)):
             logger.warning(f"HALLUCINATION blocked: inside_joke trigger='{trigger}' context='{context[:30]}' not in messages")
             skipped.append(f"inside_joke hallucination: {trigger}")
         else:
-            joke_stored = await _store_inside_joke(user_id, joke)
-            if joke_stored:
-                stored["inside_joke"] = joke_stored
+            stored["inside_joke"] = _plan_inside_joke(writes, joke)
 
     # --- CALENDAR DATE (FIX #3: verify date mention in messages) ---
-    cal_date = extracted.get("calendar_date") or {}
     if cal_date.get("date") and cal_date.get("importance", 0) >= min_importance:
         date_str = cal_date.get("date", "")
         event_desc = cal_date.get("event", "")
@@ -839,23 +875,39 @@ async def extract_unified(
             logger.warning(f"HALLUCINATION blocked: calendar_date '{date_str}' - no date mention in messages")
             skipped.append(f"calendar_date hallucination: {date_str} {event_desc[:30]}")
         else:
-            date_stored = await _store_calendar_date(user_id, cal_date)
+            date_stored = _plan_calendar_date(writes, cal_date)
             if date_stored:
                 stored["calendar_date"] = date_stored
 
     # --- USER PATTERN (with validation) ---
-    pattern = extracted.get("user_pattern") or {}
     if pattern.get("pattern_type") and pattern.get("value"):
         # Filter out bad patterns mentioning user complaints
         if not _is_bad_pattern(pattern):
-            await _update_user_pattern(user_id, pattern)
+            _plan_user_pattern(writes, pattern)
             stored["user_pattern"] = pattern
         else:
             skipped.append("user_pattern: filtered (mentions complaint)")
 
+    # UNE transaction pour toutes les écritures
+    inserted = await writes.commit()
+
+    # Événements rejetés par l'index de dedup (extraction concurrente)
+    stmt_stored = stored.get("luna_statement")
+    if stmt_stored and ("luna_said", stmt_stored["revealed"]) not in inserted:
+        del stored["luna_statement"]
+        skipped.append("luna_statement: duplicate")
+    event_stored = stored.get("emotional_event")
+    if event_stored and not event_stored.get("updated") and (event_stored["type"], event_stored["summary"]) not in inserted:
+        del stored["emotional_event"]
+        skipped.append("emotional_event: duplicate or contradiction")
+
     if stored:
         logger.info(f"Unified extraction stored: {list(stored.keys())}")
 
+    # Outcome: métriques shadow + données d'entraînement du pré-filtre
+    extraction_prefilter.record_outcome(decision, stored)
+    await log_outcome(user_id, user_message, luna_response, decision.score, stored)
+
     return {
         "extracted": extracted,
         "stored": stored,
@@ -902,15 +954,15 @@ def _is_valid_name(value: str) -> bool:
     return True
 
 
-async def _store_user_fact(user_id: UUID, fact: dict, current_user: dict, user_message: str = "") -> Optional[dict]:
-    """Store a user fact after dedup."""
+def _plan_user_fact(writes: ExtractionWrites, snapshot: MemorySnapshot, fact: dict, user_message: str = "") -> Optional[dict]:
+    """Plan a user fact write after dedup against the snapshot."""
     fact_type = fact.get("type")
     value = fact.get("value")
 
     if not fact_type or not value:
         return None
 
-    updates = {}
+    current_user = snapshot.user
 
     # Simple fields
     if fact_type in ["name", "age", "job", "location"]:
@@ -940,69 +992,61 @@ async def _store_user_fact(user_id: UUID, fact: dict, current_user: dict, user_m
                 return None
 
         current_value = current_user.get(fact_type)
-        if value != current_value:
-            # Pour "name" et "age": ne PAS écraser si une valeur existe et importance < 8
-            # (importance 6 = famille/ami, importance 8+ = info du user lui-même)
-            if fact_type in ["name", "age"] and current_value and fact.get("importance", 5) < 8:
-                logger.info(f"Skipping {fact_type} override: '{value}' (importance {fact.get('importance')}) won't replace '{current_value}'")
-                return None
-            updates[fact_type] = value
-        else:
+        if value == current_value:
             return None  # Duplicate
+        # Pour "name" et "age": ne PAS écraser si une valeur existe et importance < 8
+        # (importance 6 = famille/ami, importance 8+ = info du user lui-même)
+        if fact_type in ["name", "age"] and current_value and fact.get("importance", 5) < 8:
+            logger.info(f"Skipping {fact_type} override: '{value}' (importance {fact.get('importance')}) won't replace '{current_value}'")
+            return None
+        writes.simple_fields[fact_type] = value
+        current_user[fact_type] = value
 
     # List fields
     elif fact_type in ["like", "dislike", "secret"]:
         field = f"{fact_type}s"  # like -> likes
-        existing = current_user.get(field, []) or []
-        existing_lower = [str(v).lower() for v in existing]
-
-        if str(value).lower() not in existing_lower:
-            updates[field] = [value]  # Append mode in update_user
-        else:
+        existing = _as_list(current_user.get(field))
+        if str(value).lower() in [str(v).lower() for v in existing]:
             return None  # Duplicate
+        writes.list_appends.setdefault(field, []).append(value)
+        current_user[field] = existing + [value]
 
     # Family dict
     elif fact_type == "family":
-        existing_family = current_user.get("family", {}) or {}
         # Value should be "relation: member" format
-        if ":" in str(value):
-            relation, member = str(value).split(":", 1)
-            if relation.strip() not in existing_family:
-                updates["family"] = {relation.strip(): member.strip()}
-            else:
-                return None  # Duplicate
+        if ":" not in str(value):
+            return None
+        existing_family = _as_dict(current_user.get("family"))
+        relation, member = str(value).split(":", 1)
+        if relation.strip() in existing_family:
+            return None  # Duplicate
+        writes.family[relation.strip()] = member.strip()
+        current_user["family"] = {**existing_family, relation.strip(): member.strip()}
 
-    if updates:
-        await update_user(user_id, updates)
-        return {"type": fact_type, "value": value, "importance": fact.get("importance", 5)}
+    else:
+        return None
 
-    return None
+    return {"type": fact_type, "value": value, "importance": fact.get("importance", 5)}
 
 
-async def _store_luna_statement(user_id: UUID, stmt: dict) -> Optional[dict]:
-    """Store a Luna revelation after dedup."""
+def _plan_luna_statement(writes: ExtractionWrites, snapshot: MemorySnapshot, stmt: dict) -> Optional[dict]:
+    """Plan a Luna revelation after dedup."""
     revealed = stmt.get("revealed")
     keywords = _extract_keywords(revealed)
 
     # Check for duplicates
-    existing = await find_similar_event(user_id, keywords, "luna_said")
-    if existing:
+    if snapshot.find_similar(keywords, "luna_said"):
         return None
 
     importance = stmt.get("importance", 7)
-    await add_event(
-        user_id=user_id,
-        event_type="luna_said",
-        summary=revealed,
-        keywords=keywords,
-        score=importance
-    )
+    writes.add_event("luna_said", revealed, keywords, importance)
+    snapshot.remember_event("luna_said", revealed, keywords)
 
     return {"revealed": revealed, "topic": stmt.get("topic"), "importance": importance}
 
 
-async def _store_emotional_event(user_id: UUID, event: dict, log_contradictions: bool = False) -> Optional[dict]:
-    """Store an emotional event after contradiction check.
+def _plan_emotional_event(writes: ExtractionWrites, snapshot: MemorySnapshot, event: dict, log_contradictions: bool = False) -> Optional[dict]:
+    """Plan an emotional event after contradiction check.
 
     FIX #7: Si log_contradictions=True, les contradictions sont loggées au lieu d'être silencieuses.
     """
@@ -1010,57 +1054,45 @@ async def _store_emotional_event(user_id: UUID, event: dict, log_contradictions:
     event_type = event.get("type", "moment")
     keywords = _extract_keywords(summary)
 
-    # Check contradiction
-    contradiction = await check_user_contradiction(user_id, summary, keywords)
+    # Check contradiction (contre les "moment" similaires du snapshot)
+    existing = snapshot.find_similar(keywords, "moment")
+    contradiction = classify_user_contradiction(existing, summary, keywords)
 
     if contradiction["action"] == "store":
         importance = event.get("importance", 7)
-        await add_event(
-            user_id=user_id,
-            event_type=event_type,
-            summary=summary,
-            keywords=keywords,
-            score=importance
-        )
+        writes.add_event(event_type, summary, keywords, importance)
+        snapshot.remember_event(event_type, summary, keywords)
         return {"summary": summary, "type": event_type, "importance": importance}
 
     elif contradiction["action"] == "update":
         # FIX #7: Alerter sur les contradictions au lieu de silencieusement mettre à jour
         if log_contradictions:
-            old_summary = contradiction.get("old_summary", "unknown")
+            old_summary = contradiction.get("existing_fact") or "unknown"
             logger.warning(
-                f"CONTRADICTION detected for user {user_id}: "
+                f"CONTRADICTION detected for user {writes.user_id}: "
                 f"OLD='{old_summary[:50]}' → NEW='{summary[:50]}'"
             )
         return {"summary": summary, "type": event_type, "updated": True, "had_contradiction": True}
 
-    elif contradiction["action"] == "skip":
-        # FIX #7: Également logger les skips pour visibilité
-        if log_contradictions:
-            logger.info(f"Event skipped (duplicate or conflict): '{summary[:50]}'")
-        return None
-
+    # FIX #7: Également logger les skips pour visibilité
+    if log_contradictions:
+        logger.info(f"Event skipped (duplicate or conflict): '{summary[:50]}'")
     return None
 
 
-async def _store_inside_joke(user_id: UUID, joke: dict) -> Optional[dict]:
-    """Store an inside joke using V2 format."""
+def _plan_inside_joke(writes: ExtractionWrites, joke: dict) -> dict:
+    """Plan an inside joke (V2 format, merged in the commit transaction)."""
     trigger = joke.get("trigger")
     context = joke.get("context", "")
     importance = joke.get("importance", 5)
 
-    await add_inside_joke_v2(
-        user_id=user_id,
-        trigger=trigger,
-        context=context,
-        importance=importance
-    )
+    writes.inside_jokes.append({"trigger": trigger, "context": context, "importance": importance})
 
     return {"trigger": trigger, "context": context, "importance": importance}
 
 
-async def _store_calendar_date(user_id: UUID, cal_date: dict) -> Optional[dict]:
-    """Store a calendar date."""
+def _plan_calendar_date(writes: ExtractionWrites, cal_date: dict) -> Optional[dict]:
+    """Plan a calendar date."""
     date_str = cal_date.get("date")
     event_desc = cal_date.get("event")
     event_type = cal_date.get("type", "plan")
@@ -1073,19 +1105,14 @@ async def _store_calendar_date(user_id: UUID, cal_date: dict) -> Optional[dict]:
         logger.warning(f"Invalid date format: {date_str}")
         return None
 
-    await add_calendar_date(
-        user_id=user_id,
-        date=date_str,
-        event=event_desc,
-        event_type=event_type,
-        importance=importance
-    )
+    new_date = {"date": date_str, "event": event_desc, "type": event_type, "importance": importance}
+    writes.calendar_dates = [d for d in writes.calendar_dates if d["date"] != date_str] + [new_date]
 
-    return {"date": date_str, "event": event_desc, "type": event_type, "importance": importance}
+    return new_date
 
 
-async def _update_user_pattern(user_id: UUID, pattern: dict) -> None:
-    """Update user pattern detection."""
+def _plan_user_pattern(writes: ExtractionWrites, pattern: dict) -> None:
+    """Plan user pattern detection."""
     pattern_type = pattern.get("pattern_type")
     value = pattern.get("value")
 
@@ -1097,15 +1124,15 @@ async def _update_user_pattern(user_id: UUID, pattern: dict) -> None:
                 hours = list(range(start, end + 1))
             else:
                 hours = [int(value)]
-            await update_user_patterns(user_id, "active_hours", hours)
+            writes.patterns["active_hours"] = hours
         except ValueError:
             pass
 
     elif pattern_type == "mood_trigger":
-        await update_user_patterns(user_id, "mood_triggers", [value])
+        writes.patterns["mood_triggers"] = [value]
 
     elif pattern_type == "communication_style":
-        await update_user_patterns(user_id, "communication_style", value)
+        writes.patterns["communication_style"] = value
 
 
 # =============================================================================
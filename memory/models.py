@@ -157,12 +157,193 @@ ON memory_timeline USING GIN(keywords);
 
 CREATE INDEX IF NOT EXISTS idx_timeline_pinned
 ON memory_timeline(user_id, pinned) WHERE pinned = TRUE;
+
+-- Maintenance des tiers: ne lit que les lignes qui changent de tier
+CREATE INDEX IF NOT EXISTS idx_timeline_tier_date
+ON memory_timeline(tier, event_date) WHERE pinned = FALSE;
+"""
+
+MAINTENANCE_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS memory_maintenance_state (
+    name VARCHAR(50) PRIMARY KEY,  -- ex: 'tier_hot_warm'
+    high_water TIMESTAMP WITH TIME ZONE,  -- dernier seuil traité
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+"""
+
+# Dedup des événements: garantie par index unique (pas de read-then-write).
+# Voir aussi migrations/dedup_memory_timeline.sql
+TIMELINE_DEDUP_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_timeline_dedup
+ON memory_timeline(user_id, type, md5(lower(summary)));
+"""
+
+# Supprime les doublons existants (garde pinned puis le plus ancien)
+TIMELINE_DEDUP_CLEANUP = """
+DELETE FROM memory_timeline t
+USING (
+    SELECT id,
+           ROW_NUMBER() OVER (
+               PARTITION BY user_id, type, md5(lower(summary))
+               ORDER BY pinned DESC, created_at ASC, id
+           ) AS rn
+    FROM memory_timeline
+) d
+WHERE t.id = d.id AND d.rn > 1;
+"""
+
+EXTRACTION_QUEUE_TABLE = """
+CREATE TABLE IF NOT EXISTS memory_extraction_queue (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+
+    -- Tour en attente d'extraction (fusionné avec les suivants)
+    user_message TEXT NOT NULL,
+    luna_response TEXT NOT NULL,
+    history JSONB DEFAULT '[]',
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_extraction_queue_user
+ON memory_extraction_queue(user_id, id);
+"""
+
+EXTRACTION_OUTCOMES_TABLE = """
+CREATE TABLE IF NOT EXISTS memory_extraction_outcomes (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+
+    -- Données d'entraînement du pré-filtre (memory/prefilter.py)
+    user_message TEXT NOT NULL,
+    luna_response TEXT NOT NULL,
+    score REAL,  -- score du pré-filtre au moment de l'appel
+    stored_count INTEGER NOT NULL,  -- nb d'éléments stockés (label: > 0)
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Tables créées avant la colonne user_id (lignes existantes: user_id NULL)
+ALTER TABLE memory_extraction_outcomes
+ADD COLUMN IF NOT EXISTS user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE;
+
+CREATE INDEX IF NOT EXISTS idx_extraction_outcomes_user
+ON memory_extraction_outcomes(user_id);
+"""
+
+# Résumé glissant de la conversation (memory/conversation_summary.py).
+# Watermark: last_message_id = dernier message de conversations_simple
+# couvert, covered_turns = message_count au moment du résumé.
+CONVERSATION_SUMMARIES_TABLE = """
+CREATE TABLE IF NOT EXISTS memory_conversation_summaries (
+    user_id UUID PRIMARY KEY REFERENCES memory_users(id) ON DELETE CASCADE,
+    summary TEXT NOT NULL,
+    last_message_id BIGINT NOT NULL,
+    covered_turns INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+"""
+
+# === Listes normalisées (au lieu des tableaux JSONB) ===
+# Requêtes par plage et compteurs faits par Postgres (ON CONFLICT), sans
+# read-modify-write du tableau entier. Les colonnes JSONB d'origine restent
+# en place (lecture seule) jusqu'au drop, voir migrations/normalize_memory_lists.sql
+
+CALENDAR_DATES_TABLE = """
+CREATE TABLE IF NOT EXISTS memory_calendar_dates (
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+    date DATE NOT NULL,
+    event TEXT NOT NULL,
+    type VARCHAR(30) DEFAULT 'plan',  -- anniversary, promise, plan, birthday
+    importance INTEGER DEFAULT 7,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    -- Une entrée par date (la plus récente remplace), sert aussi aux plages
+    PRIMARY KEY (user_id, date)
+);
+"""
+
+INSIDE_JOKES_TABLE = """
+CREATE TABLE IF NOT EXISTS memory_inside_jokes (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+    trigger TEXT NOT NULL,
+    context TEXT DEFAULT '',
+    importance INTEGER DEFAULT 6,
+    times_used INTEGER DEFAULT 1,
+    last_used TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Upsert par trigger (insensible à la casse)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inside_jokes_trigger
+ON memory_inside_jokes(user_id, lower(trigger));
+
+-- Top N par usage
+CREATE INDEX IF NOT EXISTS idx_inside_jokes_rank
+ON memory_inside_jokes(user_id, (times_used * 2 + importance) DESC);
+"""
+
+USER_ITEMS_TABLE = """
+CREATE TABLE IF NOT EXISTS memory_user_items (
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+    kind VARCHAR(10) NOT NULL,  -- like, dislike, secret
+    value TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    PRIMARY KEY (user_id, kind, value)
+);
+"""
+
+# Copie des tableaux JSONB existants (idempotent: ON CONFLICT DO NOTHING).
+# Les éléments malformés (pas un objet / date invalide) sont ignorés.
+CHILD_TABLES_BACKFILL = """
+INSERT INTO memory_calendar_dates (user_id, date, event, type, importance)
+SELECT DISTINCT ON (u.id, (d->>'date')::date)
+       u.id, (d->>'date')::date, COALESCE(d->>'event', ''),
+       COALESCE(d->>'type', 'plan'), CASE WHEN d->>'importance' ~ '^\\d+$' THEN (d->>'importance')::int ELSE 7 END
+FROM memory_users u, jsonb_array_elements(
+    CASE WHEN jsonb_typeof(u.calendar_dates) = 'array' THEN u.calendar_dates ELSE '[]'::jsonb END
+) d
+WHERE jsonb_typeof(d) = 'object' AND d->>'date' ~ '^\\d{4}-\\d{2}-\\d{2}$'
+ON CONFLICT DO NOTHING;
+
+INSERT INTO memory_inside_jokes (user_id, trigger, context, importance, times_used, last_used, created_at)
+SELECT DISTINCT ON (r.user_id, lower(j.trigger))
+       r.user_id, j.trigger, j.context, j.importance, j.times_used,
+       COALESCE(j.last_used, NOW()), COALESCE(j.created_at, NOW())
+FROM memory_relationships r, jsonb_array_elements(
+    CASE WHEN jsonb_typeof(r.inside_jokes) = 'array' THEN r.inside_jokes ELSE '[]'::jsonb END
+) e,
+LATERAL (
+    SELECT CASE WHEN jsonb_typeof(e) = 'string' THEN e #>> '{}' ELSE e->>'trigger' END AS trigger,
+           COALESCE(e->>'context', '') AS context,
+           CASE WHEN e->>'importance' ~ '^\\d+$' THEN (e->>'importance')::int ELSE 6 END AS importance,
+           CASE WHEN e->>'times_used' ~ '^\\d+$' THEN (e->>'times_used')::int ELSE 1 END AS times_used,
+           (e->>'last_used')::timestamptz AS last_used,
+           (e->>'created_at')::timestamptz AS created_at
+) j
+WHERE r.user_id IS NOT NULL AND COALESCE(j.trigger, '') != ''
+ORDER BY r.user_id, lower(j.trigger), j.times_used DESC
+ON CONFLICT DO NOTHING;
+
+INSERT INTO memory_user_items (user_id, kind, value)
+SELECT u.id, l.kind, e #>> '{}'
+FROM memory_users u,
+LATERAL (VALUES ('like', u.likes), ('dislike', u.dislikes), ('secret', u.secrets)) l(kind, items),
+jsonb_array_elements(CASE WHEN jsonb_typeof(l.items) = 'array' THEN l.items ELSE '[]'::jsonb END) e
+WHERE jsonb_typeof(e) IN ('string', 'number') AND e #>> '{}' != ''
+ON CONFLICT DO NOTHING;
 """
 
 # Types pour le code Python
 from typing import TypedDict, Optional
 from datetime import datetime
 
+import asyncpg
+
+from core.database import disable_statement_timeout
+
 
 class UserFacts(TypedDict, total=False):
     """Facts sur l'utilisateur."""
@@ -291,10 +472,27 @@ async def init_memory_tables(pool) -> None:
     À appeler au démarrage du bot.
     """
     async with pool.acquire() as conn:
+        # Index de dedup, backfill: peuvent dépasser le statement_timeout du pool
+        await disable_statement_timeout(conn)
         await conn.execute(USERS_TABLE)
         await conn.execute(RELATIONSHIPS_TABLE)
         await conn.execute(SUMMARIES_TABLE)
         await conn.execute(TIMELINE_TABLE)
+        await conn.execute(MAINTENANCE_STATE_TABLE)
+        try:
+            await conn.execute(TIMELINE_DEDUP_INDEX)
+        except asyncpg.UniqueViolationError:
+            # Base existante avec doublons: nettoyage unique puis index
+            async with conn.transaction():
+                await conn.execute(TIMELINE_DEDUP_CLEANUP)
+                await conn.execute(TIMELINE_DEDUP_INDEX)
+            print("Timeline duplicates removed, dedup index created")
+        await conn.execute(EXTRACTION_QUEUE_TABLE)
+        await conn.execute(EXTRACTION_OUTCOMES_TABLE)
+        await conn.execute(CALENDAR_DATES_TABLE)
+        await conn.execute(INSIDE_JOKES_TABLE)
+        await conn.execute(USER_ITEMS_TABLE)
+        await conn.execute(CONVERSATION_SUMMARIES_TABLE)
 
         # === MIGRATIONS V2 ===
         # Ajouter colonnes manquantes sur memory_users (si upgrade)
@@ -322,5 +520,31 @@ async def init_memory_tables(pool) -> None:
             ALTER TABLE memory_users
             ADD COLUMN IF NOT EXISTS last_monthly_cleanup TIMESTAMP WITH TIME ZONE;
         """)
+        # Colonnes projetées par get_relationship (aussi pour le worker, qui
+        # ne passe pas par les migrations de bot/main.py)
+        await conn.execute("""
+            ALTER TABLE memory_relationships
+            ADD COLUMN IF NOT EXISTS message_count INTEGER DEFAULT 0;
+        """)
+        await conn.execute("""
+            ALTER TABLE memory_relationships
+            ADD COLUMN IF NOT EXISTS paywall_shown BOOLEAN DEFAULT FALSE;
+        """)
+
+        # Backfill des tables enfants, une seule fois (marqueur dans
+        # memory_maintenance_state, posé dans la même transaction)
+        try:
+            async with conn.transaction():
+                first_run = await conn.fetchval("""
+                    INSERT INTO memory_maintenance_state (name) VALUES ('backfill_child_tables')
+                    ON CONFLICT (name) DO NOTHING
+                    RETURNING name
+                """)
+                if first_run:
+                    await conn.execute(CHILD_TABLES_BACKFILL)
+                    print("Calendar dates, inside jokes and user items backfilled")
+        except asyncpg.PostgresError as e:
+            # Donnée JSONB illisible: rollback (marqueur compris), retenté au prochain démarrage
+            print(f"Child tables backfill failed, run migrations/normalize_memory_lists.sql: {e}")
 
     print("Memory tables initialized")
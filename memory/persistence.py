@@ -0,0 +1,209 @@
+"""
+Memory System - Batched Persistence
+
+Écritures groupées des résultats d'extraction:
+1. load_snapshot(): UNE lecture (user + événements similaires) avant le dedup
+2. Le dedup se fait en mémoire contre ce snapshot (extraction.py)
+3. ExtractionWrites.commit(): tout est écrit dans UNE transaction
+   (UNNEST pour la timeline, ON CONFLICT sur l'index unique de dedup;
+   listes, dates et inside jokes en upsert sur leurs tables enfants)
+
+L'index idx_timeline_dedup (user_id, type, md5(lower(summary))) garantit
+l'absence de doublons même si deux extractions tournent en parallèle.
+"""
+
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+from uuid import UUID
+
+from .crud import (
+    USER_FACTS_COLUMNS,
+    add_user_items,
+    get_pool,
+    mark_write,
+    upsert_calendar_dates,
+    upsert_inside_jokes,
+)
+
+logger = logging.getLogger(__name__)
+
+# Types d'événements comparés par keywords avant insertion
+SIMILARITY_TYPES = ("luna_said", "moment")
+
+
+def _as_list(value) -> list:
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return []
+    return value if isinstance(value, list) else []
+
+
+def _as_dict(value) -> dict:
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+# =============================================================================
+# SNAPSHOT
+# =============================================================================
+
+@dataclass
+class MemorySnapshot:
+    """État lu une seule fois avant le dedup."""
+    user: dict
+    # type -> événements (plus récent d'abord) partageant au moins un keyword
+    similar_events: dict[str, list[dict]] = field(default_factory=dict)
+
+    def find_similar(self, keywords: list[str], event_type: str) -> Optional[dict]:
+        """Équivalent mémoire de crud.find_similar_event."""
+        if not keywords:
+            return None
+        wanted = set(keywords)
+        for event in self.similar_events.get(event_type, []):
+            if wanted.intersection(event["keywords"]):
+                return event
+        return None
+
+    def remember_event(self, event_type: str, summary: str, keywords: list[str]) -> None:
+        """Ajoute un événement planifié (dedup à l'intérieur d'un même lot)."""
+        self.similar_events.setdefault(event_type, []).insert(
+            0, {"type": event_type, "summary": summary, "keywords": keywords}
+        )
+
+
+async def load_snapshot(user_id: UUID, keywords_by_type: dict[str, list[str]]) -> Optional[MemorySnapshot]:
+    """
+    Charge le user et les événements similaires en une acquisition.
+
+    Args:
+        keywords_by_type: {"luna_said": [...], "moment": [...]} keywords candidats
+    """
+    async with get_pool().acquire() as conn:
+        row = await conn.fetchrow(f"SELECT {USER_FACTS_COLUMNS} FROM memory_users WHERE id = $1", user_id)
+        if not row:
+            return None
+
+        similar: dict[str, list[dict]] = {}
+        for event_type in SIMILARITY_TYPES:
+            keywords = keywords_by_type.get(event_type) or []
+            if not keywords:
+                continue
+            rows = await conn.fetch("""
+                SELECT id, type, summary, keywords FROM memory_timeline
+                WHERE user_id = $1 AND type = $2 AND keywords ?| $3
+                ORDER BY event_date DESC
+                LIMIT 20
+            """, user_id, event_type, keywords)
+            similar[event_type] = [
+                {**dict(r), "keywords": _as_list(r["keywords"])} for r in rows
+            ]
+
+    return MemorySnapshot(user=dict(row), similar_events=similar)
+
+
+# =============================================================================
+# WRITES
+# =============================================================================
+
+@dataclass
+class ExtractionWrites:
+    """Écritures planifiées pour un user, appliquées par commit()."""
+    user_id: UUID
+    simple_fields: dict = field(default_factory=dict)
+    list_appends: dict[str, list] = field(default_factory=dict)
+    family: dict = field(default_factory=dict)
+    events: list[dict] = field(default_factory=list)
+    calendar_dates: list[dict] = field(default_factory=list)
+    inside_jokes: list[dict] = field(default_factory=list)
+    patterns: dict = field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return not (
+            self.simple_fields or self.list_appends or self.family or self.events
+            or self.calendar_dates or self.inside_jokes or self.patterns
+        )
+
+    def add_event(self, event_type: str, summary: str, keywords: list[str], score: int) -> None:
+        self.events.append({"type": event_type, "summary": summary, "keywords": keywords, "score": score})
+
+    async def commit(self) -> set[tuple[str, str]]:
+        """
+        Écrit tout dans une transaction.
+
+        Returns:
+            (type, summary) des événements réellement insérés
+            (ceux en conflit avec l'index de dedup sont ignorés)
+        """
+        if self.is_empty():
+            return set()
+
+        inserted: set[tuple[str, str]] = set()
+        mark_write(self.user_id)
+        async with get_pool().acquire() as conn:
+            async with conn.transaction():
+                await self._write_user(conn)
+                if self.list_appends:
+                    await add_user_items(conn, self.user_id, self.list_appends)
+                if self.calendar_dates:
+                    await upsert_calendar_dates(conn, self.user_id, self.calendar_dates)
+                if self.events:
+                    inserted = await self._write_events(conn)
+                if self.inside_jokes:
+                    await upsert_inside_jokes(conn, self.user_id, self.inside_jokes)
+        return inserted
+
+    async def _write_user(self, conn) -> None:
+        """Un seul UPDATE memory_users pour faits, famille, patterns (et updated_at)."""
+        sets = []
+        values: list = [self.user_id]
+
+        def param(value) -> str:
+            values.append(value)
+            return f"${len(values)}"
+
+        for key, value in self.simple_fields.items():
+            sets.append(f"{key} = {param(value)}")
+
+        if self.family:
+            sets.append(f"family = COALESCE(family, '{{}}'::jsonb) || {param(json.dumps(self.family))}::jsonb")
+
+        if self.patterns:
+            sets.append(
+                f"user_patterns = COALESCE(user_patterns, '{{}}'::jsonb) || {param(json.dumps(self.patterns))}::jsonb"
+            )
+
+        # Listes et dates vivent dans les tables enfants, mais comptent comme activité
+        if not sets and not (self.list_appends or self.calendar_dates):
+            return
+        sets.append("updated_at = NOW()")
+        await conn.execute(
+            f"UPDATE memory_users SET {', '.join(sets)} WHERE id = $1",
+            *values
+        )
+
+    async def _write_events(self, conn) -> set[tuple[str, str]]:
+        rows = await conn.fetch("""
+            INSERT INTO memory_timeline (user_id, type, summary, keywords, score)
+            SELECT $1, t.type, t.summary, t.keywords::jsonb, t.score
+            FROM UNNEST($2::text[], $3::text[], $4::text[], $5::int[])
+                AS t(type, summary, keywords, score)
+            ON CONFLICT (user_id, type, md5(lower(summary))) DO NOTHING
+            RETURNING type, summary
+        """,
+            self.user_id,
+            [e["type"] for e in self.events],
+            [e["summary"] for e in self.events],
+            [json.dumps(e["keywords"]) for e in self.events],
+            [e["score"] for e in self.events],
+        )
+        for row in rows:
+            logger.info(f"Event added: [{row['type']}] {row['summary'][:50]}...")
+        return {(r["type"], r["summary"]) for r in rows}
@@ -0,0 +1,437 @@
+"""
+Memory System - Extraction Pre-filter
+
+Score local (CPU, sans LLM) qui prédit si un tour contient quelque chose
+d'extractible (fait, date, événement, révélation de Luna).
+Si le score est sous le seuil, extract_unified saute l'appel LLM.
+
+- Features: heuristiques regex (1ère personne, verbes de faits, dates, émotions...)
+- Modèle: régression logistique minuscule (poids JSON), entraînable sur les
+  résultats d'extraction loggés dans memory_extraction_outcomes
+- Poids dans un répertoire de données (EXTRACTION_PREFILTER_WEIGHTS_PATH),
+  rechargés quand le fichier change (entraînement par la CLI ou un autre
+  process)
+- Outcomes: user_id (supprimés avec le user), rétention dans le nettoyage
+  quotidien (prune_outcomes: les plus récents seulement, âge max)
+- Modes: "off" (toujours extraire), "shadow" (on extrait quand même, mais on
+  mesure ce qu'on aurait sauté/raté), "on" (on saute vraiment)
+
+Usage:
+    python -m memory.prefilter train [--min-samples 200]
+"""
+
+import json
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+from uuid import UUID
+
+from middleware.metrics import metrics
+
+from .crud import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Hors du package (installé en lecture seule), surchargé par configure()
+WEIGHTS_PATH = Path("/app/data/prefilter_weights.json")
+# Délai min entre deux vérifications du fichier de poids (secondes)
+RELOAD_CHECK_INTERVAL = 60.0
+
+# Outcomes gardés: assez pour un entraînement, jamais plus vieux que N jours
+MAX_TRAINING_SAMPLES = 20000
+OUTCOMES_RETENTION_DAYS = 90
+
+
+# =============================================================================
+# FEATURES
+# =============================================================================
+
+def _rx(*patterns: str) -> re.Pattern:
+    return re.compile("|".join(patterns), re.IGNORECASE)
+
+
+FIRST_PERSON_RX = _rx(r"\bje\b", r"\bj'", r"\bmoi\b", r"\bmon\b", r"\bma\b", r"\bmes\b", r"\bm'")
+FACT_VERB_RX = _rx(
+    r"m'appelle", r"\bc'est\s+\w+\s+mon", r"moi\s+c'?est", r"\bj'ai\s+\d+\s*ans",
+    r"\bbosse", r"\btravaille", r"\bhabite", r"\bvis\s+(?:à|a|en)", r"\bétudie",
+    r"\baime\b", r"\badore", r"\bkiffe", r"\bdéteste", r"\bsuis\s+(?:né|\w+eur|\w+ien)",
+)
+RELATION_RX = _rx(
+    r"\b(?:mon|ma)\s+(?:frère|sœur|soeur|père|mère|mere|pote|ami|amie|copine|copain|ex|chien|chat|boss|chef)",
+    r"\bfamille\b", r"\bparents\b",
+)
+DATE_RX = _rx(
+    r"\bdemain\b", r"\bce\s+soir\b", r"\bce\s+week-?end\b", r"\bsemaine\s+prochaine\b",
+    r"\b(?:lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche)\b",
+    r"\b(?:janvier|février|fevrier|mars|avril|mai|juin|juillet|août|aout|septembre|octobre|novembre|décembre|decembre)\b",
+    r"\b\d{1,2}[/.-]\d{1,2}\b", r"\banniv", r"\bexam", r"\bentretien\b", r"\brdv\b",
+)
+EMOTION_RX = _rx(
+    r"t'aime", r"\btriste", r"\bpeur\b", r"\bangoiss", r"\bpleur", r"\bdéprim",
+    r"\bcontent", r"\bheureu", r"\bénervé", r"\bseul", r"\bmanques?\b", r"\bpromis",
+)
+SMALL_TALK_RX = _rx(
+    r"^\W*(?:mdr|ptdr|lol|haha+|ok+|oui|non|ouais|cool|grave|trop|bien|bof|salut|coucou|hey|yo|bonne\s+nuit|merci|bisous?)\W*$",
+)
+LUNA_REVEAL_RX = _rx(
+    r"\bmoi\s+aussi\b", r"\bmon\s+(?:ex|père|pere|chat|taf|boulot)", r"\bma\s+(?:mère|mere|pote)",
+    r"\bpixel\b", r"\bquand\s+j'étais", r"\bje\s+t'avoue", r"\bsecret\b",
+)
+DIGIT_RX = re.compile(r"\d")
+
+FEATURE_NAMES = (
+    "user_length",
+    "first_person",
+    "fact_verbs",
+    "relations",
+    "dates",
+    "emotions",
+    "small_talk",
+    "luna_reveal",
+    "digits",
+    "question_only",
+)
+
+
+def extract_features(user_message: str, luna_response: str) -> list[float]:
+    """Vecteur de features (ordre = FEATURE_NAMES)."""
+    user = user_message or ""
+    luna = luna_response or ""
+    lines = [l for l in user.splitlines() if l.strip()] or [user]
+
+    return [
+        min(len(user) / 200.0, 2.0),
+        min(len(FIRST_PERSON_RX.findall(user)) / 3.0, 2.0),
+        float(len(FACT_VERB_RX.findall(user))),
+        float(len(RELATION_RX.findall(user))),
+        float(len(DATE_RX.findall(user)) + len(DATE_RX.findall(luna)) * 0.5),
+        float(len(EMOTION_RX.findall(user))),
+        sum(1 for l in lines if SMALL_TALK_RX.match(l.strip())) / len(lines),
+        float(len(LUNA_REVEAL_RX.findall(luna))),
+        1.0 if DIGIT_RX.search(user) else 0.0,
+        1.0 if user.strip().endswith("?") and not FIRST_PERSON_RX.search(user) else 0.0,
+    ]
+
+
+def extract_features_batch(turns: list[tuple[str, str]]) -> list[list[float]]:
+    """Features pour un lot de tours (entraînement / évaluation hors ligne)."""
+    return [extract_features(u, l) for u, l in turns]
+
+
+# =============================================================================
+# MODEL
+# =============================================================================
+
+# Poids par défaut (priors à la main) utilisés tant qu'aucun modèle n'est entraîné
+DEFAULT_WEIGHTS = {
+    "bias": -1.6,
+    "weights": {
+        "user_length": 0.8,
+        "first_person": 0.9,
+        "fact_verbs": 1.6,
+        "relations": 1.2,
+        "dates": 1.1,
+        "emotions": 0.9,
+        "small_talk": -2.0,
+        "luna_reveal": 0.8,
+        "digits": 0.4,
+        "question_only": -0.8,
+    },
+}
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class LinearModel:
+    """Régression logistique (pur Python, ~10 features)."""
+
+    def __init__(self, weights: Optional[list[float]] = None, bias: float = 0.0):
+        self.weights = weights or [0.0] * len(FEATURE_NAMES)
+        self.bias = bias
+
+    def predict_proba(self, features: list[float]) -> float:
+        z = self.bias + sum(w * x for w, x in zip(self.weights, features))
+        return _sigmoid(z)
+
+    def fit(
+        self,
+        X: list[list[float]],
+        y: list[int],
+        epochs: int = 200,
+        lr: float = 0.1,
+        l2: float = 0.001,
+    ) -> "LinearModel":
+        """Descente de gradient batch, poids des classes équilibrés."""
+        n = len(X)
+        if n == 0:
+            return self
+        positives = sum(y) or 1
+        negatives = (n - sum(y)) or 1
+        class_weight = {1: n / (2 * positives), 0: n / (2 * negatives)}
+
+        for _ in range(epochs):
+            grad_w = [0.0] * len(self.weights)
+            grad_b = 0.0
+            for features, label in zip(X, y):
+                err = (self.predict_proba(features) - label) * class_weight[label]
+                grad_b += err
+                for i, x in enumerate(features):
+                    grad_w[i] += err * x
+            self.bias -= lr * grad_b / n
+            self.weights = [
+                w - lr * (g / n + l2 * w)
+                for w, g in zip(self.weights, grad_w)
+            ]
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "bias": self.bias,
+            "weights": dict(zip(FEATURE_NAMES, self.weights)),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LinearModel":
+        weights = data.get("weights", {})
+        return cls(
+            weights=[float(weights.get(name, 0.0)) for name in FEATURE_NAMES],
+            bias=float(data.get("bias", 0.0)),
+        )
+
+
+def load_model(path: Path = WEIGHTS_PATH) -> LinearModel:
+    """Charge les poids entraînés, sinon les priors par défaut."""
+    try:
+        return LinearModel.from_dict(json.loads(path.read_text(encoding="utf-8")))
+    except FileNotFoundError:
+        return LinearModel.from_dict(DEFAULT_WEIGHTS)
+    except (ValueError, OSError) as e:
+        logger.warning(f"Prefilter weights unreadable ({e}), using defaults")
+        return LinearModel.from_dict(DEFAULT_WEIGHTS)
+
+
+# =============================================================================
+# PRE-FILTER
+# =============================================================================
+
+@dataclass
+class PrefilterDecision:
+    """Résultat du pré-filtre pour un tour."""
+    score: float
+    extract: bool        # Appeler le LLM ?
+    would_skip: bool     # Ce que le modèle aurait fait (utile en shadow)
+
+
+class ExtractionPrefilter:
+    """Décide si un tour vaut un appel LLM d'extraction."""
+
+    MODES = ("off", "shadow", "on")
+
+    def __init__(self, threshold: float = 0.2, mode: str = "shadow", weights_path: Path = WEIGHTS_PATH):
+        self.threshold = threshold
+        self.mode = mode
+        self.weights_path = weights_path
+        self._model: Optional[LinearModel] = None
+        self._weights_mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def configure(self, threshold: float, mode: str, weights_path: Optional[str] = None) -> None:
+        """Injecte la config (appelé au démarrage)."""
+        if mode not in self.MODES:
+            logger.warning(f"Unknown prefilter mode '{mode}', using 'shadow'")
+            mode = "shadow"
+        self.threshold = threshold
+        self.mode = mode
+        if weights_path:
+            self.weights_path = Path(weights_path)
+            self.reload()
+
+    @property
+    def model(self) -> LinearModel:
+        now = time.monotonic()
+        if self._model is not None and now - self._checked_at >= RELOAD_CHECK_INTERVAL:
+            # Poids réentraînés ailleurs (CLI, autre instance): rechargés au prochain tour
+            self._checked_at = now
+            if self._mtime() != self._weights_mtime:
+                logger.info(f"Prefilter weights changed, reloading {self.weights_path}")
+                self._model = None
+        if self._model is None:
+            self._checked_at = now
+            self._weights_mtime = self._mtime()
+            self._model = load_model(self.weights_path)
+        return self._model
+
+    def reload(self) -> None:
+        """Recharge les poids (après un entraînement)."""
+        self._model = None
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return self.weights_path.stat().st_mtime
+        except OSError:
+            return None
+
+    def evaluate(self, user_message: str, luna_response: str) -> PrefilterDecision:
+        """Score un tour et décide si on appelle le LLM."""
+        if self.mode == "off":
+            return PrefilterDecision(score=1.0, extract=True, would_skip=False)
+
+        score = self.model.predict_proba(extract_features(user_message, luna_response))
+        would_skip = score < self.threshold
+        metrics.incr("prefilter_evaluated")
+
+        if would_skip:
+            metrics.incr("prefilter_would_skip")
+            if self.mode == "on":
+                metrics.incr("prefilter_calls_saved")
+                return PrefilterDecision(score, extract=False, would_skip=True)
+
+        return PrefilterDecision(score, extract=True, would_skip=would_skip)
+
+    def record_outcome(self, decision: PrefilterDecision, stored: dict) -> None:
+        """
+        Compare la décision au résultat réel de l'extraction.
+        En shadow: un skip qui aurait perdu des données = fait manqué.
+        """
+        if self.mode != "shadow" or not decision.would_skip:
+            return
+        if stored:
+            metrics.incr("prefilter_facts_missed")
+        else:
+            metrics.incr("prefilter_calls_saved_shadow")
+
+
+# Singleton (configuré au démarrage via configure())
+extraction_prefilter = ExtractionPrefilter()
+
+
+# =============================================================================
+# OUTCOME LOG + TRAINING
+# =============================================================================
+
+async def log_outcome(user_id: UUID, user_message: str, luna_response: str, score: float, stored: dict) -> None:
+    """Logge le résultat d'un appel d'extraction (données d'entraînement)."""
+    try:
+        async with get_pool().acquire() as conn:
+            await conn.execute("""
+                INSERT INTO memory_extraction_outcomes (user_id, user_message, luna_response, score, stored_count)
+                VALUES ($1, $2, $3, $4, $5)
+            """, user_id, user_message[:2000], luna_response[:2000], score, len(stored))
+    except Exception as e:
+        logger.warning(f"Prefilter outcome log failed: {e}")
+
+
+async def prune_outcomes(conn, keep: int = MAX_TRAINING_SAMPLES,
+                         retention_days: int = OUTCOMES_RETENTION_DAYS) -> int:
+    """
+    Rétention des outcomes (nettoyage quotidien): garde les `keep` plus
+    récents, jamais plus vieux que `retention_days`. Par lots de 5000.
+
+    Returns:
+        Nombre de lignes supprimées
+    """
+    cutoff_id = await conn.fetchval("""
+        SELECT id FROM memory_extraction_outcomes
+        ORDER BY id DESC
+        OFFSET $1 LIMIT 1
+    """, keep)
+
+    total = 0
+    while True:
+        deleted = await conn.fetchval("""
+            WITH deleted AS (
+                DELETE FROM memory_extraction_outcomes
+                WHERE id IN (
+                    SELECT id FROM memory_extraction_outcomes
+                    WHERE id <= $1
+                       OR created_at < NOW() - make_interval(days => $2)
+                    LIMIT 5000
+                )
+                RETURNING id
+            )
+            SELECT COUNT(*) FROM deleted
+        """, cutoff_id or 0, retention_days)
+        total += deleted
+        if deleted < 5000:
+            return total
+
+
+async def train_from_outcomes(pool, min_samples: int = 200, path: Path = WEIGHTS_PATH) -> Optional[dict]:
+    """
+    Entraîne le modèle sur les outcomes loggés et écrit les poids.
+
+    Returns:
+        {"samples": int, "positives": int, "accuracy": float} ou None si pas assez de données
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT user_message, luna_response, stored_count
+            FROM memory_extraction_outcomes
+            ORDER BY id DESC
+            LIMIT $1
+        """, MAX_TRAINING_SAMPLES)
+
+    if len(rows) < min_samples:
+        logger.info(f"Prefilter training skipped: {len(rows)} samples < {min_samples}")
+        return None
+
+    X = extract_features_batch([(r["user_message"], r["luna_response"]) for r in rows])
+    y = [1 if r["stored_count"] > 0 else 0 for r in rows]
+
+    model = LinearModel.from_dict(DEFAULT_WEIGHTS).fit(X, y)
+    # Écriture atomique: une instance qui recharge ne lit jamais un fichier partiel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(model.to_dict(), indent=2), encoding="utf-8")
+    tmp.replace(path)
+    if path == extraction_prefilter.weights_path:
+        extraction_prefilter.reload()
+
+    correct = sum(1 for f, label in zip(X, y) if (model.predict_proba(f) >= 0.5) == bool(label))
+    stats = {"samples": len(y), "positives": sum(y), "accuracy": correct / len(y)}
+    logger.info(f"Prefilter trained: {stats}")
+    return stats
+
+
+def main():
+    """CLI: python -m memory.prefilter train"""
+    import argparse
+    import asyncio
+
+    import asyncpg
+
+    from config.settings import settings
+
+    parser = argparse.ArgumentParser(description="Extraction pre-filter")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--min-samples", type=int, default=200)
+    args = parser.parse_args()
+
+    async def run():
+        pool = await asyncpg.create_pool(**settings.DB_CONFIG, min_size=1, max_size=2)
+        try:
+            stats = await train_from_outcomes(
+                pool,
+                min_samples=args.min_samples,
+                path=Path(settings.EXTRACTION_PREFILTER_WEIGHTS_PATH),
+            )
+            print(stats or "Not enough samples")
+        finally:
+            await pool.close()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
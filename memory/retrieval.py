@@ -2,7 +2,9 @@
 Memory System V2 - Context Retrieval
 
 Construit le contexte mémoire à injecter dans les prompts Luna.
-Budget: ~5K tokens max pour le contexte mémoire.
+Budget en tokens (core/tokens.py): les sections sont retenues par priorité
+décroissante tant qu'elles tiennent; le tour budgète mémoire et historique
+ensemble (build_prompt_sections + bot/turn.py).
 
 Priorisation:
 1. Pinned events (toujours)
@@ -13,14 +15,20 @@ Priorisation:
 6. User patterns
 7. Relevant events (keyword match)
 8. Weekly summary (si > 30 jours)
+
+Sous charge (core/overload.py), les étapes optionnelles sont sautées:
+coherence, summary, keyword_events.
 """
 
 import logging
 import re
 from datetime import datetime
-from typing import Optional
+from typing import NamedTuple, Optional
 from uuid import UUID
 
+from core.overload import overload
+from core.tokens import PromptBudget
+
 from .crud import (
     get_pool,
     get_user_by_id,
@@ -42,8 +50,17 @@ from .models import MemoryContext, RelationshipStatus
 
 logger = logging.getLogger(__name__)
 
-# Token budget approximation (1 token ≈ 4 chars in French)
-MAX_CONTEXT_CHARS = 20000  # ~5K tokens
+# Budget de la section mémoire seule (build_prompt_context)
+MAX_CONTEXT_TOKENS = 5000
+# "\n\n" entre deux sections
+SECTION_SEPARATOR_TOKENS = 1
+
+
+class ContextSection(NamedTuple):
+    """Section mémoire candidate (priorité 10 = indispensable)."""
+    priority: int
+    name: str
+    text: str
 
 
 # =============================================================================
@@ -104,15 +121,15 @@ async def get_memory_context(
     pinned = await get_pinned_events(user_id)
     hot = await get_hot_events(user_id, limit=5)
 
-    # Keyword search
+    # Keyword search (étape optionnelle: délestée sous charge)
     keywords = extract_message_keywords(current_message)
     relevant = []
-    if keywords:
+    if keywords and overload.allows("keyword_events"):
         relevant = await get_events_by_keywords(user_id, keywords, limit=3)
 
-    # Luna coherence check
+    # Luna coherence check (étape optionnelle: délestée sous charge)
     luna_said = []
-    if include_coherence:
+    if include_coherence and overload.allows("coherence"):
         coherence = await check_luna_coherence(user_id, current_message)
         if coherence["has_previous"]:
             for topic in keywords[:3]:
@@ -129,33 +146,28 @@ async def get_memory_context(
     }
 
 
-async def build_prompt_context(
+async def build_prompt_sections(
     user_id: UUID,
     current_message: str
-) -> str:
+) -> list[ContextSection]:
     """
-    Construit la section mémoire V2 à injecter dans le prompt Luna.
+    Sections mémoire V2 candidates pour le prompt Luna, sans budget:
+    (priorité, nom, texte), priorité décroissante (10 = indispensable).
     Inclut: inside_jokes, calendar, user_patterns, luna_life.
 
-    Token budget: ~5K tokens max.
+    Le budget tokens est appliqué par l'appelant (core/tokens.PromptBudget),
+    conjointement avec l'historique pour le tour (bot/turn.py).
     """
     ctx = await get_memory_context(user_id, current_message)
-    parts = []
-    total_chars = 0
+    sections: list[ContextSection] = []
 
-    def add_part(text: str, priority: int = 5) -> bool:
-        """Add a part if within budget. Returns True if added."""
-        nonlocal total_chars
-        if total_chars + len(text) > MAX_CONTEXT_CHARS:
-            return False
-        parts.append((priority, text))
-        total_chars += len(text)
-        return True
+    def add_part(name: str, text: str, priority: int = 5) -> None:
+        sections.append(ContextSection(priority, name, text))
 
     # 1. User identity reminder (highest priority)
     user_reminder = build_memory_reminder(ctx["user"], ctx["relationship"])
     if user_reminder:
-        add_part(user_reminder, priority=10)
+        add_part("identity", user_reminder, priority=10)
 
     # 2. V2: Upcoming dates (important for immersion)
     upcoming = await get_upcoming_dates(user_id, limit=3)
@@ -164,7 +176,7 @@ async def build_prompt_context(
             f"- {d['date']}: {d['event']} ({d['type']})"
             for d in upcoming
         ])
-        add_part(f"📅 DATES À VENIR:\n{dates_text}", priority=9)
+        add_part("dates", f"📅 DATES À VENIR:\n{dates_text}", priority=9)
 
     # 3. V2: Inside jokes (active ones)
     jokes = await get_inside_jokes_v2(user_id)
@@ -174,7 +186,7 @@ async def build_prompt_context(
             f"- \"{j['trigger']}\" → {j['context']}"
             for j in active_jokes
         ])
-        add_part(f"😂 INSIDE JOKES:\n{jokes_text}", priority=8)
+        add_part("inside_jokes", f"😂 INSIDE JOKES:\n{jokes_text}", priority=8)
 
     # 4. Hot events (sorted by score)
     if ctx["hot_events"]:
@@ -183,7 +195,7 @@ async def build_prompt_context(
             f"- [{e['type']}] {e['summary']}"
             for e in sorted_events[:4]
         ])
-        add_part(f"🔥 ÉVÉNEMENTS RÉCENTS:\n{events_text}", priority=7)
+        add_part("hot_events", f"🔥 ÉVÉNEMENTS RÉCENTS:\n{events_text}", priority=7)
 
     # 5. Coherence - what Luna already said
     if ctx["luna_said"]:
@@ -191,7 +203,7 @@ async def build_prompt_context(
             f"- {e['summary']}"
             for e in ctx["luna_said"][:3]
         ])
-        add_part(f"⚠️ TU AS DÉJÀ DIT:\n{luna_text}\nReste cohérente.", priority=9)
+        add_part("luna_said", f"⚠️ TU AS DÉJÀ DIT:\n{luna_text}\nReste cohérente.", priority=9)
 
     # 6. V2: User patterns (helps Luna adapt)
     patterns = await get_user_patterns(user_id)
@@ -205,7 +217,7 @@ async def build_prompt_context(
         if patterns.get("mood_triggers"):
             pattern_parts.append(f"Sensible à: {', '.join(patterns['mood_triggers'][:3])}")
         if pattern_parts:
-            add_part(f"🎯 PROFIL USER:\n" + "\n".join(pattern_parts), priority=6)
+            add_part("user_patterns", f"🎯 PROFIL USER:\n" + "\n".join(pattern_parts), priority=6)
 
     # 7. V2: Luna's current life (immersion)
     luna_life = await get_luna_life(user_id)
@@ -220,7 +232,7 @@ async def build_prompt_context(
         if luna_life.get("recent_event"):
             life_parts.append(f"Event: {luna_life['recent_event']}")
         if life_parts:
-            add_part(f"🏠 VIE DE LUNA:\n" + "\n".join(life_parts), priority=5)
+            add_part("luna_life", f"🏠 VIE DE LUNA:\n" + "\n".join(life_parts), priority=5)
 
     # 8. Relevant events (if message triggers keywords)
     if ctx["relevant_events"]:
@@ -228,25 +240,50 @@ async def build_prompt_context(
             f"- {e['summary']}"
             for e in ctx["relevant_events"][:2]
         ])
-        add_part(f"🔍 PERTINENT:\n{relevant_text}", priority=6)
+        add_part("relevant_events", f"🔍 PERTINENT:\n{relevant_text}", priority=6)
 
     # 9. V2: Weekly summary (if > 30 days relationship)
     relationship = ctx.get("relationship", {})
-    if relationship.get("day", 0) > 30:
+    if relationship.get("day", 0) > 30 and overload.allows("summary"):
         summary = await get_latest_summary(user_id, "weekly")
         if summary:
-            add_part(f"📝 RÉSUMÉ RÉCENT:\n{summary['summary'][:300]}", priority=4)
+            add_part("weekly_summary", f"📝 RÉSUMÉ RÉCENT:\n{summary['summary'][:300]}", priority=4)
 
     # 10. Anti-invention rule (always include)
-    add_part(build_dont_invent_reminder(), priority=10)
+    add_part("dont_invent", build_dont_invent_reminder(), priority=10)
 
     # 11. Relationship stage
     stage = _get_relationship_stage(ctx["relationship"])
-    add_part(f"📊 STADE: {stage}", priority=8)
+    add_part("stage", f"📊 STADE: {stage}", priority=8)
+
+    # Priorité décroissante (tri stable: ordre du code à priorité égale)
+    sections.sort(key=lambda s: s.priority, reverse=True)
+    return sections
+
 
-    # Sort by priority (highest first) and join
-    parts.sort(key=lambda x: x[0], reverse=True)
-    return "\n\n".join(text for _, text in parts)
+def pack_sections(budget: PromptBudget, sections: list[ContextSection]) -> None:
+    """Ajoute les sections mémoire au budget (kind "memory")."""
+    for section in sections:
+        budget.add("memory", section.name, section.text, section.priority)
+
+
+async def build_prompt_context(
+    user_id: UUID,
+    current_message: str,
+    max_tokens: int = MAX_CONTEXT_TOKENS
+) -> str:
+    """
+    Section mémoire seule, sous son propre budget (max_tokens).
+    Le tour (bot/turn.py) budgète mémoire + historique ensemble à partir
+    de build_prompt_sections().
+    """
+    sections = await build_prompt_sections(user_id, current_message)
+    budget = PromptBudget(max_tokens, separator_tokens=SECTION_SEPARATOR_TOKENS)
+    pack_sections(budget, sections)
+    packed = budget.pack()
+    if packed.dropped:
+        logger.info(f"Memory context over budget ({max_tokens} tokens), dropped: {packed.dropped_names()}")
+    return "\n\n".join(item.text for item in packed.kept)
 
 
 async def get_quick_context(user_id: UUID) -> dict:
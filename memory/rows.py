@@ -0,0 +1,146 @@
+"""
+Memory System - Lignes compactes
+
+Les requêtes de crud.py ne sélectionnent que les colonnes utiles (pas de
+SELECT *) et renvoient ces lignes à __slots__ au lieu de dict(record):
+- pas de dict par ligne (moins d'allocations, ~3x plus petit en mémoire)
+- même API lecture qu'un dict: row["name"], row.get("name"), dict(row), "x" in row
+- une colonne non projetée n'existe pas: row.get() renvoie le défaut,
+  row["x"] lève KeyError (comme un dict sans la clé)
+
+Les colonnes SQL projetées sont dérivées des __slots__ (COLUMNS), donc une
+seule liste à maintenir par type de ligne.
+"""
+
+from typing import Any, Iterator
+
+
+class Row:
+    """Ligne compacte: attributs à __slots__, lecture façon dict."""
+
+    __slots__ = ()
+
+    @classmethod
+    def columns(cls, prefix: str = "", **exprs: str) -> str:
+        """
+        Liste SQL des colonnes de la ligne (ex: "id, name" ou "u.id, u.name").
+
+        exprs: colonnes calculées, nom -> expression SQL ("expr AS nom"),
+        ex: les listes lues depuis une table enfant.
+        """
+        return ", ".join(
+            f"{exprs[name]} AS {name}" if name in exprs else f"{prefix}{name}"
+            for name in cls.__slots__
+        )
+
+    @classmethod
+    def from_record(cls, record) -> "Row":
+        """Construit la ligne depuis un asyncpg.Record (ou un dict)."""
+        row = cls.__new__(cls)
+        for name in cls.__slots__:
+            object.__setattr__(row, name, record.get(name))
+        return row
+
+    @classmethod
+    def from_records(cls, records) -> list:
+        return [cls.from_record(r) for r in records]
+
+    # API dict (lecture) ------------------------------------------------------
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        object.__setattr__(self, key, value)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self) -> tuple[str, ...]:
+        return self.__slots__
+
+    def values(self) -> list:
+        return [getattr(self, name) for name in self.__slots__]
+
+    def items(self) -> list[tuple[str, Any]]:
+        return [(name, getattr(self, name)) for name in self.__slots__]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.__slots__
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Row):
+            return type(self) is type(other) and self.items() == other.items()
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.items())
+        return f"{type(self).__name__}({fields})"
+
+
+class UserProfile(Row):
+    """memory_users sans JSONB (lookups par telegram_id, handlers)."""
+    __slots__ = ("id", "telegram_id", "name", "age", "job", "location", "timezone")
+
+
+class UserFactsRow(Row):
+    """memory_users + facts du prompt (likes/dislikes/secrets: memory_user_items)."""
+    __slots__ = UserProfile.__slots__ + ("likes", "dislikes", "secrets", "family")
+
+
+class RelationshipRow(Row):
+    """
+    memory_relationships sans les blobs d'état (nsfw_gate_data, engagement_state).
+    inside_jokes: triggers des jokes les plus utilisés (memory_inside_jokes).
+    """
+    __slots__ = (
+        "user_id", "day", "intimacy", "trust", "status", "inside_jokes", "pet_names",
+        "paid", "paid_at", "message_count", "paywall_shown",
+    )
+
+
+class EventRow(Row):
+    """memory_timeline (sans user_id / created_at)."""
+    __slots__ = ("id", "type", "summary", "keywords", "score", "tier", "pinned", "event_date")
+
+
+class SummaryRow(Row):
+    """memory_summaries sans archived_data."""
+    __slots__ = ("id", "type", "period", "summary", "highlights", "created_at")
+
+
+class ActiveUserRow(Row):
+    """Users actifs (jobs de compression)."""
+    __slots__ = ("id", "telegram_id", "name", "day", "paid")
+
+
+class CalendarDateRow(Row):
+    """memory_calendar_dates (date: datetime.date)."""
+    __slots__ = ("date", "event", "type", "importance")
+
+
+class ConversationSummaryRow(Row):
+    """memory_conversation_summaries (résumé glissant + watermark)."""
+    __slots__ = ("summary", "last_message_id", "covered_turns")
+
+
+class InsideJokeRow(Row):
+    """memory_inside_jokes (last_used / created_at: datetime)."""
+    __slots__ = ("trigger", "context", "importance", "times_used", "last_used", "created_at")
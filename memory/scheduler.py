@@ -0,0 +1,258 @@
+"""
+Memory System - Extraction Scheduler
+
+File d'attente par utilisateur pour l'extraction mémoire en arrière-plan:
+- Debounce: on attend que l'utilisateur se calme avant d'extraire
+- Fusion: jusqu'à N tours consécutifs dans UN SEUL appel extract_unified
+- Concurrence globale bornée (sémaphore)
+- Persistance dans memory_extraction_queue: la file survit aux redémarrages
+
+Usage:
+    from memory.scheduler import extraction_scheduler
+
+    await extraction_scheduler.enqueue(user_id, user_msg, response, history)
+    await extraction_scheduler.restore()   # au démarrage
+    await extraction_scheduler.shutdown()  # à l'arrêt
+"""
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+from uuid import UUID
+
+from middleware.metrics import metrics
+
+from .crud import get_pool
+from .extraction import (
+    extract_unified,
+    _contains_sensitive_data,
+    _detect_prompt_injection,
+)
+
+logger = logging.getLogger(__name__)
+
+# Troncature par tour dans le prompt fusionné (extract_unified tronque à 500 sinon)
+MAX_CHARS_PER_TURN = 500
+MAX_MERGED_CHARS = 2000
+
+
+@dataclass
+class PendingTurn:
+    """Un tour (message user + réponse Luna) en attente d'extraction."""
+    user_message: str
+    luna_response: str
+    history: list[dict] = field(default_factory=list)
+    queue_id: Optional[int] = None  # id dans memory_extraction_queue
+
+
+def merge_turns(turns: list[PendingTurn]) -> Optional[tuple[str, str, list[dict], list[tuple[str, str]]]]:
+    """
+    Fusionne plusieurs tours en un seul input pour extract_unified.
+
+    Les tours avec injection ou données sensibles sont écartés individuellement
+    (sinon un seul tour bloquerait tout le lot).
+
+    Returns:
+        (user_message, luna_response, history, pairs) ou None si rien à extraire.
+        user_message / luna_response: textes joints (vérification anti-hallucination),
+        pairs: [(message, réponse)] par tour, pour garder l'appariement dans le prompt
+    """
+    kept = [
+        t for t in turns
+        if not _detect_prompt_injection(t.user_message)
+        and not _contains_sensitive_data(t.user_message)
+    ]
+    if not kept:
+        return None
+
+    pairs = [(t.user_message[:MAX_CHARS_PER_TURN], t.luna_response[:MAX_CHARS_PER_TURN]) for t in kept]
+    user_message = "\n".join(user for user, _ in pairs)
+    luna_response = "\n".join(luna for _, luna in pairs)
+    # Contexte = l'historique d'avant le premier tour du lot
+    return user_message, luna_response, kept[0].history, pairs
+
+
+class ExtractionScheduler:
+    """Coalesce les extractions par utilisateur."""
+
+    def __init__(self, debounce: float = 20.0, max_batch: int = 4, max_concurrent: int = 3):
+        self.debounce = debounce
+        self.max_batch = max_batch
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._pending: dict[UUID, list[PendingTurn]] = {}
+        self._timers: dict[UUID, asyncio.Task] = {}
+        self._running: set[asyncio.Task] = set()
+        self._in_flight = 0
+        self._persist = True
+
+    def configure(self, debounce: float, max_batch: int, max_concurrent: int, persist: bool = True):
+        """Injecte la config (appelé au démarrage, avant tout enqueue)."""
+        self.debounce = debounce
+        self.max_batch = max(1, max_batch)
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent))
+        self._persist = persist
+
+    # -------------------------------------------------------------------------
+    # API
+    # -------------------------------------------------------------------------
+
+    async def enqueue(
+        self,
+        user_id: UUID,
+        user_message: str,
+        luna_response: str,
+        history: list[dict],
+    ) -> None:
+        """Ajoute un tour et (re)lance le debounce de l'utilisateur."""
+        turn = PendingTurn(user_message, luna_response, history[-5:])
+        if self._persist:
+            turn.queue_id = await self._save(user_id, turn)
+
+        self._pending.setdefault(user_id, []).append(turn)
+        metrics.incr("extraction_turns_queued")
+        self._update_gauges()
+
+        if len(self._pending[user_id]) >= self.max_batch:
+            self._cancel_timer(user_id)
+            self._spawn(self._flush(user_id))
+        else:
+            self._reset_timer(user_id)
+
+    async def restore(self) -> int:
+        """
+        Recharge la file persistée (après redémarrage) et planifie les flush.
+
+        Returns:
+            Nombre de tours restaurés
+        """
+        async with get_pool().acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT id, user_id, user_message, luna_response, history
+                FROM memory_extraction_queue
+                ORDER BY id
+            """)
+
+        for row in rows:
+            history = row["history"]
+            if isinstance(history, str):
+                history = json.loads(history)
+            self._pending.setdefault(row["user_id"], []).append(PendingTurn(
+                row["user_message"], row["luna_response"], history or [], row["id"]
+            ))
+
+        for user_id in self._pending:
+            self._reset_timer(user_id)
+
+        self._update_gauges()
+        if rows:
+            logger.info(f"Extraction queue restored: {len(rows)} turns, {len(self._pending)} users")
+        return len(rows)
+
+    async def shutdown(self, timeout: float = 10.0) -> None:
+        """
+        Arrête les timers et attend les extractions en cours.
+        Les tours non traités restent en base pour restore().
+        """
+        for user_id in list(self._timers):
+            self._cancel_timer(user_id)
+        if self._running:
+            await asyncio.wait(self._running, timeout=timeout)
+
+    def pending_count(self) -> int:
+        return sum(len(turns) for turns in self._pending.values())
+
+    # -------------------------------------------------------------------------
+    # INTERNALS
+    # -------------------------------------------------------------------------
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    def _cancel_timer(self, user_id: UUID) -> None:
+        timer = self._timers.pop(user_id, None)
+        if timer and not timer.done():
+            timer.cancel()
+
+    def _reset_timer(self, user_id: UUID) -> None:
+        self._cancel_timer(user_id)
+        self._timers[user_id] = asyncio.create_task(self._debounced(user_id))
+
+    async def _debounced(self, user_id: UUID) -> None:
+        await asyncio.sleep(self.debounce)
+        self._timers.pop(user_id, None)
+        self._spawn(self._flush(user_id))
+
+    async def _flush(self, user_id: UUID) -> None:
+        """Extrait un lot de tours (max_batch) pour un utilisateur."""
+        turns = self._pending.get(user_id, [])
+        batch, rest = turns[:self.max_batch], turns[self.max_batch:]
+        if not batch:
+            return
+        if rest:
+            self._pending[user_id] = rest
+            self._reset_timer(user_id)
+        else:
+            self._pending.pop(user_id, None)
+        self._update_gauges()
+
+        merged = merge_turns(batch)
+        try:
+            if merged:
+                user_message, luna_response, history, pairs = merged
+                async with self._semaphore:
+                    self._in_flight += 1
+                    metrics.set_gauge("extraction_in_flight", self._in_flight)
+                    try:
+                        await extract_unified(
+                            user_id, user_message, luna_response, history,
+                            max_chars=MAX_MERGED_CHARS, turns=pairs,
+                        )
+                    finally:
+                        self._in_flight -= 1
+                        metrics.set_gauge("extraction_in_flight", self._in_flight)
+                metrics.incr("extraction_calls")
+                metrics.incr("extraction_turns_merged", len(batch))
+            else:
+                metrics.incr("extraction_batches_skipped")
+        except Exception as e:
+            logger.error(f"Extraction batch failed for {user_id}: {e}", exc_info=True)
+            metrics.incr("extraction_errors")
+
+        # Même en cas d'erreur: pas de retry infini sur un lot empoisonné
+        await self._delete([t.queue_id for t in batch if t.queue_id is not None])
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("extraction_queue_turns", self.pending_count())
+        metrics.set_gauge("extraction_queue_users", len(self._pending))
+
+    async def _save(self, user_id: UUID, turn: PendingTurn) -> Optional[int]:
+        try:
+            async with get_pool().acquire() as conn:
+                return await conn.fetchval("""
+                    INSERT INTO memory_extraction_queue (user_id, user_message, luna_response, history)
+                    VALUES ($1, $2, $3, $4)
+                    RETURNING id
+                """, user_id, turn.user_message, turn.luna_response, json.dumps(turn.history))
+        except Exception as e:
+            # La file en mémoire continue de fonctionner sans persistance
+            logger.warning(f"Extraction queue persist failed: {e}")
+            return None
+
+    async def _delete(self, queue_ids: list[int]) -> None:
+        if not queue_ids:
+            return
+        try:
+            async with get_pool().acquire() as conn:
+                await conn.execute("""
+                    DELETE FROM memory_extraction_queue WHERE id = ANY($1::bigint[])
+                """, queue_ids)
+        except Exception as e:
+            logger.warning(f"Extraction queue cleanup failed: {e}")
+
+
+# Singleton (configuré au démarrage via configure())
+extraction_scheduler = ExtractionScheduler()
@@ -21,6 +21,10 @@ class JSONFormatter(logging.Formatter):
         return json.dumps(log_data, ensure_ascii=False)
 
 
+# Upper bounds (seconds) of histogram buckets; the last bucket is +inf
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
 class Metrics:
     """Simple internal metrics tracker."""
 
@@ -31,6 +35,27 @@ class Metrics:
         self.llm_errors = 0
         self.last_error: str | None = None
         self.last_error_time: float | None = None
+        # Named counters/gauges for subsystems (extraction queue, pools, ...)
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self.histograms: dict[str, dict] = {}
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Record a duration (seconds) in a bucketed histogram."""
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = {"buckets": [0] * (len(HISTOGRAM_BUCKETS) + 1), "count": 0, "sum": 0.0}
+            self.histograms[name] = hist
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if value <= bound), len(HISTOGRAM_BUCKETS))
+        hist["buckets"][index] += 1
+        hist["count"] += 1
+        hist["sum"] += value
 
     def record_message(self):
         self.messages_processed += 1
@@ -53,6 +78,16 @@ class Metrics:
             "llm_errors": self.llm_errors,
             "llm_success_rate": f"{(1 - self.llm_errors / max(1, self.llm_calls)) * 100:.1f}%",
             "last_error": self.last_error,
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": {
+                name: {
+                    "count": h["count"],
+                    "avg": h["sum"] / max(1, h["count"]),
+                    "buckets": dict(zip([*map(str, HISTOGRAM_BUCKETS), "inf"], h["buckets"])),
+                }
+                for name, h in self.histograms.items()
+            },
         }
 
 
@@ -0,0 +1,21 @@
+-- Dedup memory_timeline + unique index used by batched extraction writes
+-- Run: cat migrations/dedup_memory_timeline.sql | docker exec -i luna_postgres psql -U luna -d luna_db
+
+BEGIN;
+
+-- Garder la version la plus ancienne de chaque (user, type, summary); pinned gagne
+DELETE FROM memory_timeline t
+USING (
+    SELECT id,
+           ROW_NUMBER() OVER (
+               PARTITION BY user_id, type, md5(lower(summary))
+               ORDER BY pinned DESC, created_at ASC, id
+           ) AS rn
+    FROM memory_timeline
+) d
+WHERE t.id = d.id AND d.rn > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_timeline_dedup
+ON memory_timeline(user_id, type, md5(lower(summary)));
+
+COMMIT;
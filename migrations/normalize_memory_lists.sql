@@ -0,0 +1,88 @@
+-- Listes JSONB -> tables enfants indexées (calendar_dates, inside_jokes, likes/dislikes/secrets)
+-- Run: cat migrations/normalize_memory_lists.sql | docker exec -i luna_postgres psql -U luna -d luna_db
+-- Idempotent. init_memory_tables() fait la même chose au premier démarrage.
+-- Les colonnes JSONB d'origine ne sont plus écrites; les supprimer une fois vérifié:
+--   ALTER TABLE memory_users DROP COLUMN calendar_dates, DROP COLUMN likes, DROP COLUMN dislikes, DROP COLUMN secrets;
+--   ALTER TABLE memory_relationships DROP COLUMN inside_jokes;
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS memory_calendar_dates (
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+    date DATE NOT NULL,
+    event TEXT NOT NULL,
+    type VARCHAR(30) DEFAULT 'plan',  -- anniversary, promise, plan, birthday
+    importance INTEGER DEFAULT 7,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    -- Une entrée par date (la plus récente remplace), sert aussi aux plages
+    PRIMARY KEY (user_id, date)
+);
+CREATE TABLE IF NOT EXISTS memory_inside_jokes (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+    trigger TEXT NOT NULL,
+    context TEXT DEFAULT '',
+    importance INTEGER DEFAULT 6,
+    times_used INTEGER DEFAULT 1,
+    last_used TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Upsert par trigger (insensible à la casse)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inside_jokes_trigger
+ON memory_inside_jokes(user_id, lower(trigger));
+
+-- Top N par usage
+CREATE INDEX IF NOT EXISTS idx_inside_jokes_rank
+ON memory_inside_jokes(user_id, (times_used * 2 + importance) DESC);
+CREATE TABLE IF NOT EXISTS memory_user_items (
+    user_id UUID REFERENCES memory_users(id) ON DELETE CASCADE,
+    kind VARCHAR(10) NOT NULL,  -- like, dislike, secret
+    value TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    PRIMARY KEY (user_id, kind, value)
+);
+
+INSERT INTO memory_calendar_dates (user_id, date, event, type, importance)
+SELECT DISTINCT ON (u.id, (d->>'date')::date)
+       u.id, (d->>'date')::date, COALESCE(d->>'event', ''),
+       COALESCE(d->>'type', 'plan'), CASE WHEN d->>'importance' ~ '^\d+$' THEN (d->>'importance')::int ELSE 7 END
+FROM memory_users u, jsonb_array_elements(
+    CASE WHEN jsonb_typeof(u.calendar_dates) = 'array' THEN u.calendar_dates ELSE '[]'::jsonb END
+) d
+WHERE jsonb_typeof(d) = 'object' AND d->>'date' ~ '^\d{4}-\d{2}-\d{2}$'
+ON CONFLICT DO NOTHING;
+
+INSERT INTO memory_inside_jokes (user_id, trigger, context, importance, times_used, last_used, created_at)
+SELECT DISTINCT ON (r.user_id, lower(j.trigger))
+       r.user_id, j.trigger, j.context, j.importance, j.times_used,
+       COALESCE(j.last_used, NOW()), COALESCE(j.created_at, NOW())
+FROM memory_relationships r, jsonb_array_elements(
+    CASE WHEN jsonb_typeof(r.inside_jokes) = 'array' THEN r.inside_jokes ELSE '[]'::jsonb END
+) e,
+LATERAL (
+    SELECT CASE WHEN jsonb_typeof(e) = 'string' THEN e #>> '{}' ELSE e->>'trigger' END AS trigger,
+           COALESCE(e->>'context', '') AS context,
+           CASE WHEN e->>'importance' ~ '^\d+$' THEN (e->>'importance')::int ELSE 6 END AS importance,
+           CASE WHEN e->>'times_used' ~ '^\d+$' THEN (e->>'times_used')::int ELSE 1 END AS times_used,
+           (e->>'last_used')::timestamptz AS last_used,
+           (e->>'created_at')::timestamptz AS created_at
+) j
+WHERE r.user_id IS NOT NULL AND COALESCE(j.trigger, '') != ''
+ORDER BY r.user_id, lower(j.trigger), j.times_used DESC
+ON CONFLICT DO NOTHING;
+
+INSERT INTO memory_user_items (user_id, kind, value)
+SELECT u.id, l.kind, e #>> '{}'
+FROM memory_users u,
+LATERAL (VALUES ('like', u.likes), ('dislike', u.dislikes), ('secret', u.secrets)) l(kind, items),
+jsonb_array_elements(CASE WHEN jsonb_typeof(l.items) = 'array' THEN l.items ELSE '[]'::jsonb END) e
+WHERE jsonb_typeof(e) IN ('string', 'number') AND e #>> '{}' != ''
+ON CONFLICT DO NOTHING;
+
+INSERT INTO memory_maintenance_state (name) VALUES ('backfill_child_tables')
+ON CONFLICT (name) DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,58 @@
+-- Convert conversations_simple to monthly range partitions (retention via DROP PARTITION)
+-- Run: cat migrations/partition_conversations.sql | docker exec -i luna_postgres psql -U luna -d luna_db
+-- Stop the bot first: rows written during the copy would be lost.
+
+BEGIN;
+
+ALTER TABLE conversations_simple RENAME TO conversations_simple_legacy;
+ALTER INDEX IF EXISTS idx_conv_simple_user RENAME TO idx_conv_simple_user_legacy;
+
+CREATE TABLE conversations_simple (
+    id BIGSERIAL,
+    user_id UUID REFERENCES memory_users(id),
+    role VARCHAR(10) NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX idx_conv_simple_user ON conversations_simple(user_id, created_at DESC);
+
+-- Une partition par mois, du plus vieux message (90 jours de rétention) à M+2
+DO $$
+DECLARE
+    m DATE;
+BEGIN
+    FOR m IN
+        SELECT generate_series(
+            date_trunc('month', LEAST(
+                COALESCE((SELECT MIN(created_at) FROM conversations_simple_legacy), NOW()),
+                NOW()
+            ))::date,
+            date_trunc('month', NOW() + INTERVAL '2 months')::date,
+            INTERVAL '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF conversations_simple FOR VALUES FROM (%L) TO (%L)',
+            'conversations_simple_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM'),
+            m, (m + INTERVAL '1 month')::date
+        );
+    END LOOP;
+END $$;
+
+-- Filet de sécurité: lignes hors des partitions mensuelles (job de nettoyage arrêté)
+CREATE TABLE IF NOT EXISTS conversations_simple_default PARTITION OF conversations_simple DEFAULT;
+
+INSERT INTO conversations_simple (id, user_id, role, content, created_at)
+SELECT id, user_id, role, content, COALESCE(created_at, NOW())
+FROM conversations_simple_legacy;
+
+SELECT setval(
+    pg_get_serial_sequence('conversations_simple', 'id'),
+    COALESCE((SELECT MAX(id) FROM conversations_simple), 1)
+);
+
+DROP TABLE conversations_simple_legacy;
+
+COMMIT;
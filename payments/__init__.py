@@ -3,10 +3,19 @@ Payments module for Luna Bot.
 
 Usage:
     from payments import check_paywall, is_subscriber
+
+Submodules are imported on first attribute access (lazy startup).
 """
 
-from payments.paywall import check_paywall, get_paywall_message, PaywallReason
-from payments.subscription import is_subscriber, mark_paid
+import importlib
+
+_LAZY = {
+    "check_paywall": "payments.paywall",
+    "get_paywall_message": "payments.paywall",
+    "PaywallReason": "payments.paywall",
+    "is_subscriber": "payments.subscription",
+    "mark_paid": "payments.subscription",
+}
 
 __all__ = [
     "check_paywall",
@@ -15,3 +24,9 @@ __all__ = [
     "is_subscriber",
     "mark_paid",
 ]
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,10 +3,18 @@ Photos module for Luna Bot.
 
 Usage:
     from photos import send_photo, check_access, PhotoCategory
+
+Submodules are imported on first attribute access (lazy startup).
 """
 
-from photos.sender import send_photo, PhotoCategory
-from photos.access import check_access, get_denial_message
+import importlib
+
+_LAZY = {
+    "send_photo": "photos.sender",
+    "PhotoCategory": "photos.access",
+    "check_access": "photos.access",
+    "get_denial_message": "photos.access",
+}
 
 __all__ = [
     "send_photo",
@@ -14,3 +22,9 @@ __all__ = [
     "get_denial_message",
     "PhotoCategory",
 ]
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
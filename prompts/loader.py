@@ -0,0 +1,35 @@
+"""
+Prompt file loader.
+
+Les fichiers prompts/*.txt sont lus une seule fois puis servis depuis la mémoire.
+preload_prompts() les charge tous en une passe au démarrage; sinon chaque
+fichier est lu à la première utilisation.
+"""
+
+from pathlib import Path
+
+PROMPTS_DIR = Path(__file__).parent
+
+_cache: dict[str, str] = {}
+
+
+def load_prompt(name: str) -> str:
+    """
+    Retourne le contenu d'un prompt.
+
+    Args:
+        name: Nom du fichier sans extension ("level_sfw", "modifiers", ...)
+    """
+    text = _cache.get(name)
+    if text is None:
+        text = (PROMPTS_DIR / f"{name}.txt").read_text(encoding="utf-8")
+        _cache[name] = text
+    return text
+
+
+def preload_prompts() -> int:
+    """Charge tous les prompts .txt en une passe. Retourne le nombre de fichiers."""
+    for path in sorted(PROMPTS_DIR.glob("*.txt")):
+        if path.stem not in _cache:
+            _cache[path.stem] = path.read_text(encoding="utf-8")
+    return len(_cache)
@@ -0,0 +1,212 @@
+"""
+Benchmark: SELECT * + dict(record) vs projected columns + slotted rows.
+
+Measures, for the memory reads of one turn (user lookup, relationship,
+prompt facts, hot/pinned/keyword/luna_said events, latest summary):
+- bytes transferred: text size of every column returned
+- allocations: tracemalloc bytes retained by the rows handed to callers
+
+Offline by default (synthetic rows sized like a long-running user). With
+--dsn, byte counts come from Postgres itself (pg_column_size over real rows
+of one user).
+
+Usage:
+    python scripts/bench_memory_rows.py
+    python scripts/bench_memory_rows.py --dsn postgresql://... --telegram-id 123
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory.rows import (  # noqa: E402
+    UserProfile,
+    UserFactsRow,
+    RelationshipRow,
+    EventRow,
+    SummaryRow,
+)
+
+# (table, row class, rows per turn) for the reads of one turn
+TURN_READS = (
+    ("memory_users", UserProfile, 1),         # get_or_create_user
+    ("memory_relationships", RelationshipRow, 2),  # turn + retrieval
+    ("memory_users", UserFactsRow, 1),        # get_user_by_id (prompt facts)
+    ("memory_timeline", EventRow, 5 + 3 + 3 + 6),  # hot, pinned, keywords, luna_said
+    ("memory_summaries", SummaryRow, 1),      # latest weekly summary
+)
+
+TABLE_KEYS = {"memory_users": "id", "memory_relationships": "user_id",
+              "memory_timeline": "user_id", "memory_summaries": "user_id"}
+
+
+# =============================================================================
+# SYNTHETIC ROWS
+# =============================================================================
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def synthetic_rows() -> dict[str, dict]:
+    """Full rows (every column, JSONB as text like asyncpg returns it)."""
+    user_id = uuid.uuid4()
+    user = {
+        "id": user_id, "telegram_id": 123456789, "name": "Maxime", "age": 29,
+        "job": "développeur", "location": "Lyon", "timezone": "Europe/Paris",
+        "likes": json.dumps([f"passion numéro {i}" for i in range(25)]),
+        "dislikes": json.dumps([f"truc relou {i}" for i in range(10)]),
+        "secrets": json.dumps([f"secret assez long à raconter {i}" for i in range(6)]),
+        "family": json.dumps({"mère": "Anne", "frère": "Paul", "soeur": "Léa"}),
+        "nsfw_prefs": json.dumps({"likes": ["x"] * 8, "dislikes": ["y"] * 4, "limits": ["z"] * 3}),
+        "state": json.dumps({"luna_mood": "playful", "current_topic": "travail", "last_message_at": _now().isoformat()}),
+        "user_patterns": json.dumps({"active_hours": list(range(18, 24)), "mood_triggers": ["travail", "ex"] * 5,
+                                     "communication_style": "direct"}),
+        "calendar_dates": json.dumps([{"date": "2026-01-%02d" % (i + 1), "event": f"événement prévu {i}",
+                                       "type": "plan", "importance": 7} for i in range(20)]),
+        "luna_current_life": json.dumps({"mood": "chill", "current_project": "refonte site client",
+                                         "pixel_status": "dort sur mes genoux", "recent_event": "call client"}),
+        "last_memory_extraction": _now(), "last_weekly_summary": _now(), "last_monthly_cleanup": _now(),
+        "created_at": _now(), "updated_at": _now(),
+    }
+    relationship = {
+        "id": uuid.uuid4(), "user_id": user_id, "day": 64, "intimacy": 8, "trust": 7, "status": "intimate",
+        "inside_jokes": json.dumps([{"trigger": f"blague {i}", "context": "une histoire de chat qui parle",
+                                     "importance": 6, "times_used": 3, "last_used": _now().isoformat(),
+                                     "created_at": _now().isoformat()} for i in range(15)]),
+        "pet_names": json.dumps(["chaton", "mon coeur"]),
+        "shared_memories": json.dumps([f"souvenir partagé numéro {i}" for i in range(20)]),
+        "paid": True, "paid_at": _now(), "first_contact": _now(), "updated_at": _now(),
+        "nsfw_gate_data": json.dumps({"messages_since_nsfw": 12, "nsfw_count_today": 1, "last_nsfw_at": _now().isoformat()}),
+        "message_count": 812,
+        "engagement_state": json.dumps({"reward": {"messages_since_reward": 3, "reward_streak": 1},
+                                        "photo": {"photos_sent_today": 0}, "voice": {"voices_sent_today": 0},
+                                        "proactive": {"proactives_today": 1}}),
+        "paywall_shown": True,
+    }
+    event = {
+        "id": uuid.uuid4(), "user_id": user_id, "type": "moment",
+        "summary": "Il a eu une grosse dispute avec son boss au sujet du projet",
+        "keywords": json.dumps(["travail", "boss", "dispute"]), "score": 8, "tier": "hot", "pinned": False,
+        "event_date": _now(), "created_at": _now(),
+    }
+    summary = {
+        "id": uuid.uuid4(), "user_id": user_id, "type": "weekly", "period": "2026-W03",
+        "summary": "Semaine intense: boulot stressant, premier je t'aime, projet de voyage. " * 3,
+        "highlights": json.dumps([f"moment clé {i}" for i in range(5)]),
+        "archived_data": json.dumps({"events": [event["summary"]] * 40, "jokes": ["vieille blague"] * 10}),
+        "created_at": _now(),
+    }
+    return {"memory_users": user, "memory_relationships": relationship,
+            "memory_timeline": event, "memory_summaries": summary}
+
+
+def _text_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        return 8  # timestamptz, binary
+    if isinstance(value, uuid.UUID):
+        return 16
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, int):
+        return 4 if abs(value) < 2 ** 31 else 8
+    return len(str(value).encode())
+
+
+# =============================================================================
+# MEASURES
+# =============================================================================
+
+def measure_bytes(rows: dict[str, dict]) -> tuple[int, int]:
+    """(SELECT * bytes, projected bytes) for one turn."""
+    full = projected = 0
+    for table, row_cls, count in TURN_READS:
+        row = rows[table]
+        full += count * sum(_text_size(v) for v in row.values())
+        projected += count * sum(_text_size(row.get(name)) for name in row_cls.__slots__)
+    return full, projected
+
+
+def measure_allocations(rows: dict[str, dict], turns: int = 1000) -> tuple[int, int]:
+    """(dict(record) bytes, slotted row bytes) retained per turn."""
+    def retained(build) -> int:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [build() for _ in range(turns)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return (after - before) // turns
+
+    def as_dicts():
+        return [dict(rows[table]) for table, _, count in TURN_READS for _ in range(count)]
+
+    def as_rows():
+        return [row_cls.from_record(rows[table]) for table, row_cls, count in TURN_READS for _ in range(count)]
+
+    return retained(as_dicts), retained(as_rows)
+
+
+async def measure_bytes_live(dsn: str, telegram_id: int) -> tuple[int, int]:
+    """Same as measure_bytes, using pg_column_size on the real rows of one user."""
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        user_id = await conn.fetchval("SELECT id FROM memory_users WHERE telegram_id = $1", telegram_id)
+        if user_id is None:
+            raise SystemExit(f"No memory_users row for telegram_id={telegram_id}")
+        full = projected = 0
+        for table, row_cls, count in TURN_READS:
+            key = TABLE_KEYS[table]
+            size_all = await conn.fetchval(
+                f"SELECT COALESCE(AVG(pg_column_size(t.*)), 0) FROM {table} t WHERE {key} = $1", user_id
+            )
+            size_cols = await conn.fetchval(
+                f"SELECT COALESCE(AVG({' + '.join(f'COALESCE(pg_column_size({c}), 0)' for c in row_cls.__slots__)}), 0) "
+                f"FROM {table} WHERE {key} = $1", user_id
+            )
+            full += int(count * size_all)
+            projected += int(count * size_cols)
+        return full, projected
+    finally:
+        await conn.close()
+
+
+def _report(label: str, before: int, after: int) -> None:
+    saved = before - after
+    print(f"{label:<28} {before:>9,} B -> {after:>9,} B   saved {saved:>9,} B ({saved * 100 / max(1, before):.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", help="Postgres DSN (bytes measured on real rows)")
+    parser.add_argument("--telegram-id", type=int, help="User to measure with --dsn")
+    parser.add_argument("--turns", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = synthetic_rows()
+    if args.dsn:
+        if args.telegram_id is None:
+            parser.error("--dsn needs --telegram-id")
+        full, projected = asyncio.run(measure_bytes_live(args.dsn, args.telegram_id))
+    else:
+        full, projected = measure_bytes(rows)
+    dict_bytes, row_bytes = measure_allocations(rows, args.turns)
+
+    print(f"Per turn ({sum(count for _, _, count in TURN_READS)} rows read)")
+    _report("transferred (column bytes)", full, projected)
+    _report("retained (Python objects)", dict_bytes, row_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,36 @@ Anti-Repetition System
 ----------------------
 Évite que Luna répète les mêmes phrases/expressions.
 
-- Track les N dernières réponses par user
-- Détecte les patterns répétitifs
+- Index des N dernières réponses par user, chacune stockée une seule fois
+  sous forme de shingles hachés (trigrammes de mots, crc32)
+- Détecte les phrases répétitives (quasi-doublons inclus) en O(shingles)
 - Injecte des instructions pour varier
+
+Mémoire bornée: MAX_SHINGLES_PER_RESPONSE entiers de 4 octets par réponse,
+MAX_CACHED_RESPONSES réponses par user, MAX_USERS users (LRU).
 """
 
 import logging
 import re
-from collections import defaultdict
+import zlib
+from array import array
+from collections import OrderedDict, deque
 from dataclasses import dataclass
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
-# Cache en mémoire des dernières réponses (reset au restart)
-# Format: {user_id: [response1, response2, ...]}
-_response_cache: dict[int, list[str]] = defaultdict(list)
+# Réponses indexées par user (= fenêtre de comparaison des phrases)
+MAX_CACHED_RESPONSES = 5
+# Fenêtre pour les patterns bannis (plus courte: ils sont fréquents)
+BANNED_WINDOW = 3
+MAX_SHINGLES_PER_RESPONSE = 128
+MAX_USERS = 10_000
 
-MAX_CACHED_RESPONSES = 10
+SHINGLE_WORDS = 3
+# Part des shingles d'une phrase déjà vus pour la considérer répétée
+REPEAT_THRESHOLD = 0.6
+MIN_PHRASE_CHARS = 15
 
 # Phrases/patterns que Luna répète trop souvent
 BANNED_PATTERNS = [
@@ -41,6 +54,8 @@ TRANSITION_PHRASES = [
     "sinon", "au fait", "tiens", "d'ailleurs"
 ]
 
+_BANNED_RE = [re.compile(p, re.IGNORECASE) for p in BANNED_PATTERNS]
+
 
 @dataclass
 class RepetitionCheck:
@@ -73,14 +88,93 @@ def extract_phrases(text: str, min_words: int = 3) -> list[str]:
     return phrases
 
 
-def add_response(user_id: int, response: str) -> None:
-    """Ajoute une réponse au cache."""
-    cache = _response_cache[user_id]
-    cache.append(response)
+def shingle_hashes(phrase: str) -> set[int]:
+    """Trigrammes de mots (texte normalisé) hachés en entiers 32 bits."""
+    words = phrase.split()
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(phrase.encode())} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode())
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
 
-    # Keep only last N
-    if len(cache) > MAX_CACHED_RESPONSES:
-        _response_cache[user_id] = cache[-MAX_CACHED_RESPONSES:]
+def banned_mask(text: str) -> int:
+    """Bitmask des BANNED_PATTERNS présents dans le texte."""
+    mask = 0
+    for i, pattern in enumerate(_BANNED_RE):
+        if pattern.search(text):
+            mask |= 1 << i
+    return mask
+
+
+class ShingleIndex:
+    """
+    Réponses récentes d'un user: shingles hachés + compteur inversé.
+
+    counts[h] = nb de réponses de la fenêtre contenant le shingle h, tenu à
+    jour à l'ajout et à l'éviction: une vérification ne relit jamais les
+    anciennes réponses.
+    """
+
+    __slots__ = ("entries", "counts", "total")
+
+    def __init__(self):
+        # (shingles, banned mask) par réponse, la plus ancienne à gauche
+        self.entries: deque[tuple[array, int]] = deque()
+        self.counts: dict[int, int] = {}
+        self.total = 0  # réponses ajoutées depuis le début (rappel de variété)
+
+    def add(self, shingles: set[int], mask: int) -> None:
+        if len(self.entries) >= MAX_CACHED_RESPONSES:
+            old, _ = self.entries.popleft()
+            for h in old:
+                left = self.counts[h] - 1
+                if left:
+                    self.counts[h] = left
+                else:
+                    del self.counts[h]
+
+        stored = array("I", sorted(shingles)[:MAX_SHINGLES_PER_RESPONSE])
+        for h in stored:
+            self.counts[h] = self.counts.get(h, 0) + 1
+        self.entries.append((stored, mask))
+        self.total += 1
+
+    def seen_ratio(self, shingles: set[int]) -> float:
+        """Part des shingles déjà présents dans la fenêtre."""
+        if not shingles:
+            return 0.0
+        return sum(1 for h in shingles if h in self.counts) / len(shingles)
+
+    def recent_banned(self, window: int = BANNED_WINDOW) -> int:
+        mask = 0
+        for _, entry_mask in list(self.entries)[-window:]:
+            mask |= entry_mask
+        return mask
+
+
+# Index en mémoire par user (reset au restart), LRU sur MAX_USERS
+_response_cache: "OrderedDict[int, ShingleIndex]" = OrderedDict()
+
+
+def _get_index(user_id: int, create: bool = False) -> Optional[ShingleIndex]:
+    index = _response_cache.get(user_id)
+    if index is None and create:
+        index = _response_cache[user_id] = ShingleIndex()
+        if len(_response_cache) > MAX_USERS:
+            _response_cache.popitem(last=False)
+    if index is not None:
+        _response_cache.move_to_end(user_id)
+    return index
+
+
+def add_response(user_id: int, response: str) -> None:
+    """Ajoute une réponse à l'index du user (une seule fois, déjà hachée)."""
+    shingles: set[int] = set()
+    for phrase in extract_phrases(response):
+        shingles |= shingle_hashes(phrase)
+    _get_index(user_id, create=True).add(shingles, banned_mask(response))
 
 
 def check_repetition(user_id: int, new_response: str) -> RepetitionCheck:
@@ -90,38 +184,23 @@ def check_repetition(user_id: int, new_response: str) -> RepetitionCheck:
     Returns:
         RepetitionCheck avec les infos de répétition
     """
-    cache = _response_cache.get(user_id, [])
+    index = _get_index(user_id)
     repeated = []
 
-    new_phrases = extract_phrases(new_response)
-    new_normalized = normalize_text(new_response)
-
-    # Check against cached responses
-    for old_response in cache[-5:]:  # Check last 5 only
-        old_normalized = normalize_text(old_response)
-        old_phrases = extract_phrases(old_response)
-
-        # Check for exact phrase matches
-        for new_phrase in new_phrases:
-            if len(new_phrase) > 15:  # Only check substantial phrases
-                for old_phrase in old_phrases:
-                    if new_phrase in old_phrase or old_phrase in new_phrase:
-                        if new_phrase not in repeated:
-                            repeated.append(new_phrase)
-
-    # Check for banned patterns
-    banned_found = []
-    for pattern in BANNED_PATTERNS:
-        if re.search(pattern, new_response, re.IGNORECASE):
-            # Check if used recently
-            for old_response in cache[-3:]:
-                if re.search(pattern, old_response, re.IGNORECASE):
-                    match = re.search(pattern, new_response, re.IGNORECASE)
-                    if match and match.group() not in banned_found:
-                        banned_found.append(match.group())
-                    break
-
-    repeated.extend(banned_found)
+    if index is not None:
+        # Phrases dont la plupart des shingles sont déjà dans la fenêtre
+        for phrase in extract_phrases(new_response):
+            if len(phrase) > MIN_PHRASE_CHARS and phrase not in repeated:
+                if index.seen_ratio(shingle_hashes(phrase)) >= REPEAT_THRESHOLD:
+                    repeated.append(phrase)
+
+        # Patterns bannis déjà utilisés dans les dernières réponses
+        recent = index.recent_banned()
+        for i, pattern in enumerate(_BANNED_RE):
+            if recent & (1 << i):
+                match = pattern.search(new_response)
+                if match and match.group() not in repeated:
+                    repeated.append(match.group())
 
     if repeated:
         instruction = get_anti_repetition_instruction(repeated)
@@ -160,8 +239,8 @@ Sois naturelle et spontanée."""
 
 def should_add_variety_reminder(user_id: int) -> bool:
     """Détermine si on doit rappeler de varier (tous les ~10 messages)."""
-    cache = _response_cache.get(user_id, [])
-    return len(cache) > 0 and len(cache) % 10 == 0
+    index = _response_cache.get(user_id)
+    return index is not None and index.total % 10 == 0
 
 
 def clear_cache(user_id: int) -> None:
@@ -0,0 +1,208 @@
+"""
+Circuit breakers + requêtes "hedged" pour les appels LLM.
+
+CircuitBreaker (un par provider/modèle):
+- CLOSED: les appels passent, on garde une fenêtre glissante (succès, latence)
+- OPEN: taux d'erreur (ou d'appels trop lents) au-dessus du seuil
+  → les appels sont refusés immédiatement (CircuitOpenError), le fallback
+  prend le relais en quelques millisecondes
+- HALF_OPEN: après open_seconds, un appel test; succès → CLOSED, échec → OPEN
+
+hedged_call(): lance le primaire, puis le fallback si le primaire n'a pas
+répondu après un délai basé sur son p95; le premier succès gagne.
+
+Usage:
+    breaker = circuit_breakers.get("openrouter:magnum")
+    result = await breaker.call(coro_fn, *args)
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from enum import Enum
+from typing import Awaitable, Callable, Optional
+
+from middleware.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+# Valeur du gauge circuit_<name>_state
+STATE_GAUGE = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Appel refusé: le circuit est ouvert."""
+
+
+class CircuitBreaker:
+    """Disjoncteur sur fenêtre glissante (taux d'erreur + appels lents)."""
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_call: float = 20.0,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        # (ok, latence en secondes) des derniers appels
+        self._calls: deque[tuple[bool, float]] = deque(maxlen=window)
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._set_state(CircuitState.HALF_OPEN)
+        return self._state
+
+    def allow(self) -> bool:
+        """True si un appel peut partir (en HALF_OPEN: un seul appel test à la fois)."""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        metrics.incr(f"circuit_{self.name}_rejected")
+        return False
+
+    def record(self, ok: bool, latency: float) -> None:
+        """Enregistre le résultat d'un appel (un appel trop lent compte comme un échec)."""
+        failed = not ok or latency > self.slow_call
+        self._calls.append((not failed, latency))
+
+        if self._state == CircuitState.HALF_OPEN:
+            self._probe_in_flight = False
+            if failed:
+                self._open()
+            else:
+                self._calls.clear()
+                self._set_state(CircuitState.CLOSED)
+            return
+
+        if self._state == CircuitState.CLOSED and self.failure_rate() >= self.error_rate:
+            self._open()
+
+    def failure_rate(self) -> float:
+        if len(self._calls) < self.min_calls:
+            return 0.0
+        return sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+
+    def p95(self) -> Optional[float]:
+        """p95 de la latence des succès récents (None si pas assez d'échantillons)."""
+        latencies = sorted(latency for ok, latency in self._calls if ok)
+        if len(latencies) < self.min_calls:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    async def call(self, fn: Callable[..., Awaitable], *args, **kwargs):
+        """Exécute fn sous le disjoncteur (CircuitOpenError si refusé)."""
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception:
+            self.record(False, time.monotonic() - started)
+            raise
+        except asyncio.CancelledError:
+            # Perdant d'un hedge: ni succès ni échec
+            if self._state == CircuitState.HALF_OPEN:
+                self._probe_in_flight = False
+            raise
+        self.record(True, time.monotonic() - started)
+        return result
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        if self._state != CircuitState.OPEN:
+            logger.warning(f"Circuit {self.name} OPEN (failure rate {self.failure_rate():.0%})")
+            metrics.incr(f"circuit_{self.name}_opened")
+        self._set_state(CircuitState.OPEN)
+
+    def _set_state(self, state: CircuitState) -> None:
+        if state != self._state and state == CircuitState.CLOSED:
+            logger.info(f"Circuit {self.name} CLOSED")
+        self._state = state
+        metrics.set_gauge(f"circuit_{self.name}_state", STATE_GAUGE[state])
+
+
+class CircuitBreakerRegistry:
+    """Un disjoncteur par nom (provider:modèle), créé à la demande."""
+
+    def __init__(self, **defaults):
+        self._defaults = defaults
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def configure(self, **defaults) -> None:
+        """Config appliquée aux disjoncteurs créés ensuite."""
+        self._defaults.update(defaults)
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **self._defaults)
+            self._breakers[name] = breaker
+        return breaker
+
+    def states(self) -> dict[str, str]:
+        return {name: b.state.value for name, b in self._breakers.items()}
+
+
+async def hedged_call(
+    primary: Callable[[], Awaitable],
+    fallback: Callable[[], Awaitable],
+    delay: float,
+):
+    """
+    Lance primary; si pas de réponse après `delay`, lance aussi fallback.
+    Le premier succès gagne, l'autre est annulé.
+    Si primary échoue avant le délai, fallback part immédiatement.
+
+    Raises:
+        La dernière exception si les deux échouent
+    """
+    primary_task = asyncio.create_task(primary())
+    tasks = [primary_task]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done and primary_task.exception() is None:
+            return primary_task.result()
+
+        hedged = not done
+        if hedged:
+            metrics.incr("llm_hedges_fired")
+        error: Optional[BaseException] = None if hedged else primary_task.exception()
+        tasks.append(asyncio.create_task(fallback()))
+
+        pending = {t for t in tasks if not t.done()}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if hedged and task is not primary_task:
+                        metrics.incr("llm_hedges_won")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
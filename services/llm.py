@@ -4,8 +4,12 @@ import asyncio
 import random
 import logging
 import httpx
-from pathlib import Path
+from typing import Awaitable, Callable, Optional
 from config.settings import settings
+from core.http import get_http_client
+from core.usage import usage
+from prompts.loader import load_prompt
+from services.circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, hedged_call
 
 # Settings aliases
 ANTHROPIC_API_KEY = settings.ANTHROPIC_API_KEY
@@ -22,6 +26,13 @@ RETRY_DELAYS = [1, 2, 4]  # Backoff exponentiel en secondes
 
 logger = logging.getLogger(__name__)
 
+# Un disjoncteur par "provider:modèle"
+circuit_breakers = CircuitBreakerRegistry(
+    error_rate=settings.LLM_BREAKER_ERROR_RATE,
+    slow_call=settings.LLM_BREAKER_SLOW_CALL,
+    open_seconds=settings.LLM_BREAKER_OPEN_SECONDS,
+)
+
 
 def clean_response(text: str) -> str:
     """Supprime les astérisques d'action (*rit*, *sourit*, etc.) de la réponse."""
@@ -33,11 +44,18 @@ def clean_response(text: str) -> str:
     return cleaned.strip()
 
 
-# Charger les system prompts
-PROMPT_PATH = Path(__file__).parent.parent / "prompts" / "luna.txt"
-PROMPT_NSFW_PATH = Path(__file__).parent.parent / "prompts" / "luna_nsfw.txt"
-BASE_SYSTEM_PROMPT = PROMPT_PATH.read_text(encoding="utf-8")
-NSFW_SYSTEM_PROMPT = PROMPT_NSFW_PATH.read_text(encoding="utf-8")
+# System prompts chargés à la première utilisation (voir prompts/loader.py)
+_LAZY_PROMPTS = {
+    "BASE_SYSTEM_PROMPT": "luna",
+    "NSFW_SYSTEM_PROMPT": "luna_nsfw",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_PROMPTS:
+        return load_prompt(_LAZY_PROMPTS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # URL Anthropic
 ANTHROPIC_URL = "https://api.anthropic.com/v1/messages"
@@ -48,13 +66,23 @@ async def call_openrouter(
     system_prompt: str,
     model: str = "anthracite-org/magnum-v4-72b",
     max_tokens: int = 100,
-    temperature: float = 0.8
+    temperature: float = 0.8,
+    raise_on_failure: bool = False,
+    attempts: int = MAX_RETRIES,
+    timeout: float = 45,
 ) -> str:
     """
     Appelle l'API OpenRouter pour les modèles premium.
+
+    raise_on_failure: lève l'erreur au lieu de renvoyer un message naturel
+    (pour que la chaîne de fallback et les disjoncteurs voient l'échec).
+    attempts/timeout: derrière un disjoncteur, une seule tentative courte
+    (call_with_breakers): les relances passent par le fallback.
     """
     if not OPENROUTER_API_KEY:
         logger.error("OPENROUTER_API_KEY non configuré")
+        if raise_on_failure:
+            raise RuntimeError("OPENROUTER_API_KEY not configured")
         return random.choice(NATURAL_ERROR_MESSAGES)
 
     headers = {
@@ -64,9 +92,10 @@ async def call_openrouter(
         "X-Title": "Luna"
     }
 
-    # Format OpenAI (system message + conversation)
+    # Format OpenAI (system message + conversation). L'historique est déjà
+    # budgété en amont (résumé glissant + fin brute, bot/turn.py): pas de coupe ici
     formatted_messages = [{"role": "system", "content": system_prompt}]
-    for msg in messages[-10:]:
+    for msg in messages:
         formatted_messages.append({
             "role": msg["role"],
             "content": msg["content"]
@@ -88,48 +117,53 @@ async def call_openrouter(
 
     last_error = None
 
-    for attempt in range(MAX_RETRIES):
+    for attempt in range(attempts):
         try:
-            async with httpx.AsyncClient(timeout=45) as client:
-                response = await client.post(
-                    OPENROUTER_URL,
-                    headers=headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                data = response.json()
-                raw_text = data["choices"][0]["message"]["content"]
-                return clean_response(raw_text)
+            response = await get_http_client().post(
+                OPENROUTER_URL,
+                headers=headers,
+                json=payload,
+                timeout=timeout,
+            )
+            response.raise_for_status()
+            data = response.json()
+            usage.record("reply", data, model=model)
+            raw_text = data["choices"][0]["message"]["content"]
+            return clean_response(raw_text)
 
         except httpx.TimeoutException as e:
             last_error = e
-            logger.warning(f"OpenRouter timeout (attempt {attempt + 1}/{MAX_RETRIES})")
-            if attempt < MAX_RETRIES - 1:
+            logger.warning(f"OpenRouter timeout (attempt {attempt + 1}/{attempts})")
+            if attempt < attempts - 1:
                 await asyncio.sleep(RETRY_DELAYS[attempt])
 
         except httpx.HTTPStatusError as e:
             status = e.response.status_code
             if status == 429:
                 last_error = e
-                logger.warning(f"OpenRouter rate limited (attempt {attempt + 1}/{MAX_RETRIES})")
-                if attempt < MAX_RETRIES - 1:
+                logger.warning(f"OpenRouter rate limited (attempt {attempt + 1}/{attempts})")
+                if attempt < attempts - 1:
                     await asyncio.sleep(RETRY_DELAYS[attempt] * 2)
             elif 400 <= status < 500:
                 logger.error(f"OpenRouter client error {status}: {e}")
+                if raise_on_failure:
+                    raise
                 return random.choice(NATURAL_ERROR_MESSAGES)
             else:
                 last_error = e
-                logger.warning(f"OpenRouter server error {status} (attempt {attempt + 1}/{MAX_RETRIES})")
-                if attempt < MAX_RETRIES - 1:
+                logger.warning(f"OpenRouter server error {status} (attempt {attempt + 1}/{attempts})")
+                if attempt < attempts - 1:
                     await asyncio.sleep(RETRY_DELAYS[attempt])
 
         except Exception as e:
             last_error = e
             logger.error(f"OpenRouter unexpected error: {type(e).__name__}: {e}")
-            if attempt < MAX_RETRIES - 1:
+            if attempt < attempts - 1:
                 await asyncio.sleep(RETRY_DELAYS[attempt])
 
-    logger.error(f"OpenRouter failed after {MAX_RETRIES} attempts: {last_error}")
+    logger.error(f"OpenRouter failed after {attempts} attempts: {last_error}")
+    if raise_on_failure:
+        raise last_error
     return random.choice(NATURAL_EXIT_MESSAGES)
 
 
@@ -165,7 +199,8 @@ async def call_anthropic_direct(
     messages: list[dict],
     system_prompt: str,
     max_tokens: int = MAX_TOKENS,
-    temperature: float = 0.8
+    temperature: float = 0.8,
+    timeout: float = 30,
 ) -> str:
     """Direct Anthropic API call for fallback."""
     headers = {
@@ -179,20 +214,65 @@ async def call_anthropic_direct(
         "max_tokens": max_tokens,
         "temperature": temperature,
         "system": system_prompt,
-        "messages": messages[-20:]
+        "messages": messages
     }
 
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(ANTHROPIC_URL, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return clean_response(data["content"][0]["text"])
+        response = await get_http_client().post(ANTHROPIC_URL, headers=headers, json=payload, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        usage.record("reply", data, model=LLM_MODEL)
+        return clean_response(data["content"][0]["text"])
     except Exception as e:
         logger.error(f"Anthropic fallback failed: {e}")
         raise
 
 
+async def call_with_breakers(
+    primary: Callable[[], Awaitable[str]],
+    primary_name: str,
+    fallback: Optional[Callable[[], Awaitable[str]]] = None,
+    fallback_name: Optional[str] = None,
+) -> str:
+    """
+    Appel de réponse derrière les disjoncteurs (un par "provider:modèle").
+
+    - une seule tentative, bornée à LLM_ATTEMPT_TIMEOUT (un timeout compte
+      comme un échec pour le disjoncteur): pas de relances ici, c'est le
+      fallback qui prend le relais
+    - circuit du primaire ouvert: fallback immédiat (CircuitOpenError)
+    - LLM_HEDGE_ENABLED: le fallback part aussi si le primaire dépasse son p95
+
+    Raises:
+        La dernière erreur si le primaire (et le fallback) échouent
+    """
+    primary_breaker = circuit_breakers.get(primary_name)
+
+    async def guarded_primary():
+        return await primary_breaker.call(_bounded, primary)
+
+    if fallback is None:
+        return await guarded_primary()
+
+    fallback_breaker = circuit_breakers.get(fallback_name)
+
+    async def guarded_fallback():
+        logger.info(f"Fallback: {fallback_name}")
+        return await fallback_breaker.call(_bounded, fallback)
+
+    if settings.LLM_HEDGE_ENABLED:
+        return await hedged_call(guarded_primary, guarded_fallback, hedge_delay(primary_breaker))
+    try:
+        return await guarded_primary()
+    except Exception as e:
+        logger.warning(f"Primary LLM call failed ({primary_name}): {e}")
+    return await guarded_fallback()
+
+
+async def _bounded(fn: Callable[[], Awaitable[str]]) -> str:
+    return await asyncio.wait_for(fn(), settings.LLM_ATTEMPT_TIMEOUT)
+
+
 async def call_with_graceful_fallback(
     messages: list[dict],
     system_prompt: str,
@@ -209,25 +289,49 @@ async def call_with_graceful_fallback(
     1. Primary call (Magnum or Haiku based on tier)
     2. If Magnum fails: Haiku + soft sensual prompt
     3. If all fail: Natural Luna exit message
+
+    Each provider/model sits behind a circuit breaker (call_with_breakers):
+    one short attempt per call, the fallback is used right away when it
+    fails or while the primary's circuit is open.
     """
-    # Primary call
+    timeout = settings.LLM_ATTEMPT_TIMEOUT
+    if provider == "openrouter":
+        primary_name = f"openrouter:{model}"
+
+        async def primary():
+            return await call_openrouter(
+                messages, system_prompt, model, max_tokens, temperature,
+                raise_on_failure=True, attempts=1, timeout=timeout,
+            )
+    else:
+        primary_name = f"anthropic:{LLM_MODEL}"
+
+        async def primary():
+            return await call_anthropic_direct(messages, system_prompt, MAX_TOKENS, timeout=timeout)
+
+    fallback = None
+    if provider == "openrouter" and tier >= 2:
+        # Fallback 1: If was Magnum, try Haiku with soft prompt
+        soft_prompt = system_prompt + SOFT_SENSUAL_INSTRUCTION
+
+        async def soft_fallback():
+            return await call_anthropic_direct(messages, soft_prompt, MAX_TOKENS, timeout=timeout)
+
+        fallback = soft_fallback
+
     try:
-        if provider == "openrouter":
-            return await call_openrouter(messages, system_prompt, model, max_tokens, temperature)
-        else:
-            return await call_anthropic_direct(messages, system_prompt, MAX_TOKENS)
+        return await call_with_breakers(primary, primary_name, fallback, f"anthropic:{LLM_MODEL}")
     except Exception as e:
-        logger.warning(f"Primary LLM call failed: {e}")
-
-    # Fallback 1: If was Magnum, try Haiku with soft prompt
-    if provider == "openrouter" and tier >= 2:
-        logger.info("Fallback: Trying Haiku with soft sensual prompt")
-        try:
-            soft_prompt = system_prompt + SOFT_SENSUAL_INSTRUCTION
-            return await call_anthropic_direct(messages, soft_prompt, MAX_TOKENS)
-        except Exception as e:
-            logger.warning(f"Haiku fallback failed: {e}")
+        logger.warning(f"LLM calls failed: {e}")
 
     # Fallback 2: Natural exit message
     logger.error("All LLM calls failed, using natural exit")
     return random.choice(NATURAL_EXIT_MESSAGES)
+
+
+def hedge_delay(breaker: CircuitBreaker) -> float:
+    """Délai avant le hedge: p95 du primaire, borné (max tant qu'on n'a pas assez d'échantillons)."""
+    p95 = breaker.p95()
+    if p95 is None:
+        return settings.LLM_HEDGE_MAX_DELAY
+    return min(settings.LLM_HEDGE_MAX_DELAY, max(settings.LLM_HEDGE_MIN_DELAY, p95))
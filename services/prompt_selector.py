@@ -13,31 +13,54 @@ logger = logging.getLogger(__name__)
 # Import des prompts NSFW V7
 sys.path.insert(0, str(Path(__file__).parent.parent / "prompts"))
 from nsfw_prompts import NSFW_PROMPTS, format_nsfw_prompt
+from prompts.loader import load_prompt
 
-# Charger les prompts
-PROMPTS_DIR = Path(__file__).parent.parent / "prompts"
+# Prompts chargés à la première utilisation (voir prompts/loader.py)
+_LAZY_PROMPTS = {
+    "PROMPT_SFW": "level_sfw",
+    "PROMPT_FLIRT": "level_flirt",
+    "PROMPT_NSFW": "luna_nsfw",
+    "MODIFIERS": "modifiers",
+}
 
-PROMPT_SFW = (PROMPTS_DIR / "level_sfw.txt").read_text(encoding="utf-8")
-PROMPT_FLIRT = (PROMPTS_DIR / "level_flirt.txt").read_text(encoding="utf-8")
-PROMPT_NSFW = (PROMPTS_DIR / "luna_nsfw.txt").read_text(encoding="utf-8")
-MODIFIERS = (PROMPTS_DIR / "modifiers.txt").read_text(encoding="utf-8")
+_modifier_sections: dict[str, str] | None = None
 
-# Parser les modifiers
-MODIFIER_SECTIONS = {}
-current_modifier = None
-current_content = []
 
-for line in MODIFIERS.split('\n'):
-    if line.startswith('### '):
-        if current_modifier:
-            MODIFIER_SECTIONS[current_modifier] = '\n'.join(current_content)
-        current_modifier = line[4:].strip()
-        current_content = []
-    elif current_modifier:
-        current_content.append(line)
+def _parse_modifiers(text: str) -> dict[str, str]:
+    """Découpe modifiers.txt en sections '### NOM'."""
+    sections = {}
+    current_modifier = None
+    current_content = []
 
-if current_modifier:
-    MODIFIER_SECTIONS[current_modifier] = '\n'.join(current_content)
+    for line in text.split('\n'):
+        if line.startswith('### '):
+            if current_modifier:
+                sections[current_modifier] = '\n'.join(current_content)
+            current_modifier = line[4:].strip()
+            current_content = []
+        elif current_modifier:
+            current_content.append(line)
+
+    if current_modifier:
+        sections[current_modifier] = '\n'.join(current_content)
+
+    return sections
+
+
+def get_modifier_sections() -> dict[str, str]:
+    """Sections de modifiers, parsées une seule fois."""
+    global _modifier_sections
+    if _modifier_sections is None:
+        _modifier_sections = _parse_modifiers(load_prompt("modifiers"))
+    return _modifier_sections
+
+
+def __getattr__(name: str):
+    if name in _LAZY_PROMPTS:
+        return load_prompt(_LAZY_PROMPTS[name])
+    if name == "MODIFIER_SECTIONS":
+        return get_modifier_sections()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # ============== V3: Tier-based prompt selection ==============
@@ -55,15 +78,16 @@ def get_prompt_for_tier(tier: int, modifier: str | None = None) -> str:
     """
     # Sélectionner le prompt de base par tier
     if tier == 1:
-        base_prompt = PROMPT_SFW
+        base_prompt = load_prompt("level_sfw")
     elif tier == 2:
-        base_prompt = PROMPT_FLIRT  # V3: New flirt prompt
+        base_prompt = load_prompt("level_flirt")  # V3: New flirt prompt
     else:  # tier >= 3
-        base_prompt = PROMPT_NSFW
+        base_prompt = load_prompt("luna_nsfw")
 
     # Ajouter le modifier si présent
-    if modifier and modifier in MODIFIER_SECTIONS:
-        modifier_text = MODIFIER_SECTIONS[modifier]
+    modifier_sections = get_modifier_sections()
+    if modifier and modifier in modifier_sections:
+        modifier_text = modifier_sections[modifier]
         base_prompt = f"{base_prompt}\n\n## ⚠️ INSTRUCTION SPÉCIALE\n{modifier_text}"
         logger.info(f"Prompt modifier applied: {modifier}")
 
@@ -107,8 +131,9 @@ def get_nsfw_prompt_v7(
     )
 
     # Add modifier if present
-    if modifier and modifier in MODIFIER_SECTIONS:
-        modifier_text = MODIFIER_SECTIONS[modifier]
+    modifier_sections = get_modifier_sections()
+    if modifier and modifier in modifier_sections:
+        modifier_text = modifier_sections[modifier]
         base_prompt = f"{base_prompt}\n\n## INSTRUCTION SPÉCIALE\n{modifier_text}"
         logger.info(f"NSFW prompt modifier applied: {modifier}")
 
@@ -138,18 +163,20 @@ def get_prompt_for_tier_v7(
     Returns:
         Le prompt système complet
     """
+    modifier_sections = get_modifier_sections()
+
     # Tier 1: SFW
     if tier == 1:
-        base_prompt = PROMPT_SFW
-        if modifier and modifier in MODIFIER_SECTIONS:
-            base_prompt = f"{base_prompt}\n\n## INSTRUCTION SPÉCIALE\n{MODIFIER_SECTIONS[modifier]}"
+        base_prompt = load_prompt("level_sfw")
+        if modifier and modifier in modifier_sections:
+            base_prompt = f"{base_prompt}\n\n## INSTRUCTION SPÉCIALE\n{modifier_sections[modifier]}"
         return base_prompt
 
     # Tier 2: FLIRT
     if tier == 2:
-        base_prompt = PROMPT_FLIRT
-        if modifier and modifier in MODIFIER_SECTIONS:
-            base_prompt = f"{base_prompt}\n\n## INSTRUCTION SPÉCIALE\n{MODIFIER_SECTIONS[modifier]}"
+        base_prompt = load_prompt("level_flirt")
+        if modifier and modifier in modifier_sections:
+            base_prompt = f"{base_prompt}\n\n## INSTRUCTION SPÉCIALE\n{modifier_sections[modifier]}"
         return base_prompt
 
     # Tier 3: NSFW avec états V7
@@ -512,3 +512,2147 @@ class TestSecrets:
         instruction = secrets_engine.get_secret_instruction(secret)
         assert "RÉVÉLATION SPONTANÉE" in instruction
         assert secret.content in instruction
+
+
+# ============== STARTUP TESTS ==============
+
+class TestStartup:
+    """Tests pour le chemin de demarrage (prompts, import-time report)."""
+
+    def test_load_prompt_is_cached(self):
+        from prompts import loader
+        loader._cache.clear()
+        first = loader.load_prompt("level_sfw")
+        assert "level_sfw" in loader._cache
+        assert loader.load_prompt("level_sfw") is first
+
+    def test_preload_prompts_loads_all_files(self):
+        from prompts import loader
+        loader._cache.clear()
+        count = loader.preload_prompts()
+        assert count == len(list(loader.PROMPTS_DIR.glob("*.txt")))
+
+    def test_compression_not_imported_eagerly(self):
+        import subprocess
+        import sys
+        code = "import sys, memory; print('memory.compression' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        assert out.stdout.strip() == "False"
+
+    def test_parse_importtime(self):
+        from bot.startup_report import parse_importtime, summarize_by_package
+        stderr = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       100 |        100 |     json.decoder\n"
+            "import time:       300 |        400 |   json\n"
+            "import time:        50 |        450 | services\n"
+        )
+        timings = parse_importtime(stderr)
+        assert [t.module for t in timings] == ["json.decoder", "json", "services"]
+        assert timings[1].cumulative_us == 400
+        assert timings[0].depth == 2
+        assert summarize_by_package(timings) == {"json": 400, "services": 50}
+
+
+# ============== EXTRACTION SCHEDULER TESTS ==============
+
+class TestExtractionScheduler:
+    """Tests pour la file d'extraction (fusion des tours)."""
+
+    def test_merge_turns(self):
+        from memory.scheduler import PendingTurn, merge_turns
+        history = [{"role": "user", "content": "salut"}]
+        merged = merge_turns([
+            PendingTurn("je bosse comme plombier", "trop bien", history),
+            PendingTurn("et j'ai un chat", "il s'appelle comment ?", []),
+        ])
+        user_message, luna_response, ctx, pairs = merged
+        assert user_message == "je bosse comme plombier\net j'ai un chat"
+        assert "il s'appelle comment ?" in luna_response
+        assert ctx == history
+        assert pairs == [("je bosse comme plombier", "trop bien"), ("et j'ai un chat", "il s'appelle comment ?")]
+
+    def test_merged_prompt_keeps_turn_pairing(self):
+        import asyncio
+        from memory import extraction
+
+        prompts = []
+
+        async def fake_llm(prompt):
+            prompts.append(prompt)
+            return None
+
+        pairs = [("je bosse comme plombier", "trop bien"), ("ma sœur s'est mariée", "oh félicitations à elle")]
+        with patch.object(extraction, "OPENROUTER_API_KEY", "k"), \
+             patch.object(extraction, "_call_openrouter_with_retry", fake_llm):
+            asyncio.run(extraction.extract_unified(
+                "u1", "\n".join(u for u, _ in pairs), "\n".join(r for _, r in pairs), [], turns=pairs,
+            ))
+
+        prompt = prompts[0]
+        assert "Tour 2\nUTILISATEUR: ma sœur s'est mariée\nLUNA: oh félicitations à elle" in prompt
+        assert "MESSAGE UTILISATEUR:" not in prompt
+
+    def test_merge_drops_sensitive_turns(self):
+        from memory.scheduler import PendingTurn, merge_turns
+        merged = merge_turns([
+            PendingTurn("mon mail c'est test@example.com", "ok", []),
+            PendingTurn("j'adore le foot", "cool", []),
+        ])
+        assert merged[0] == "j'adore le foot"
+
+    def test_merge_all_filtered(self):
+        from memory.scheduler import PendingTurn, merge_turns
+        assert merge_turns([PendingTurn("appelle-moi au 0612345678", "ok", [])]) is None
+
+    def test_batches_and_bounds_concurrency(self):
+        import asyncio
+        from memory import scheduler as sched_module
+
+        calls = []
+
+        async def fake_extract(user_id, user_message, luna_response, history, max_chars=500, turns=None):
+            calls.append((user_id, user_message))
+            await asyncio.sleep(0.01)
+
+        async def run():
+            original = sched_module.extract_unified
+            sched_module.extract_unified = fake_extract
+            try:
+                s = sched_module.ExtractionScheduler()
+                s.configure(debounce=0.05, max_batch=3, max_concurrent=1, persist=False)
+                for i in range(4):
+                    await s.enqueue("u1", f"message numero {i}", "ok", [])
+                await s.enqueue("u2", "autre user", "ok", [])
+                await asyncio.sleep(0.2)
+                await s.shutdown()
+                return s.pending_count()
+            finally:
+                sched_module.extract_unified = original
+
+        pending = asyncio.run(run())
+        assert pending == 0
+        # u1: 1 lot de 3 (max_batch) + 1 lot debounced, u2: 1 lot
+        assert len(calls) == 3
+        assert calls[0][1].count("\n") == 2
+
+
+# ============== EXTRACTION PREFILTER TESTS ==============
+
+class TestExtractionPrefilter:
+    """Tests pour le pre-filtre local d'extraction."""
+
+    def test_small_talk_scores_low(self):
+        from memory.prefilter import ExtractionPrefilter
+        p = ExtractionPrefilter(threshold=0.2, mode="on")
+        assert not p.evaluate("mdr", "haha t'es bête").extract
+        assert not p.evaluate("ok", "ok").extract
+
+    def test_facts_score_high(self):
+        from memory.prefilter import ExtractionPrefilter
+        p = ExtractionPrefilter(threshold=0.2, mode="on")
+        assert p.evaluate("je m'appelle Lucas, je bosse à Lyon", "enchantée").extract
+        assert p.evaluate("mon anniv c'est le 12/03", "noté !").extract
+
+    def test_shadow_mode_never_skips(self):
+        from memory.prefilter import ExtractionPrefilter
+        p = ExtractionPrefilter(threshold=0.2, mode="shadow")
+        decision = p.evaluate("mdr", "haha")
+        assert decision.extract
+        assert decision.would_skip
+
+    def test_shadow_records_missed_facts(self):
+        from memory.prefilter import ExtractionPrefilter
+        from middleware.metrics import metrics
+        p = ExtractionPrefilter(threshold=0.2, mode="shadow")
+        before = metrics.counters.get("prefilter_facts_missed", 0)
+        p.record_outcome(p.evaluate("ok", "ok"), {"user_facts": [{}]})
+        assert metrics.counters["prefilter_facts_missed"] == before + 1
+
+    def test_model_fit_separates_classes(self):
+        from memory.prefilter import LinearModel, extract_features_batch
+        turns = [("je m'appelle Paul", "cool"), ("j'habite à Nantes", "ah oui")] * 5
+        turns += [("mdr", "haha"), ("ok", "ok")] * 5
+        X = extract_features_batch(turns)
+        y = [1] * 10 + [0] * 10
+        model = LinearModel().fit(X, y, epochs=300, lr=0.5)
+        assert model.predict_proba(X[0]) > 0.5
+        assert model.predict_proba(X[-1]) < 0.5
+
+    def test_model_roundtrip(self):
+        from memory.prefilter import LinearModel, DEFAULT_WEIGHTS
+        model = LinearModel.from_dict(DEFAULT_WEIGHTS)
+        assert LinearModel.from_dict(model.to_dict()).weights == model.weights
+
+    def test_weights_reloaded_when_file_changes(self, tmp_path):
+        import json
+        from memory import prefilter
+        from memory.prefilter import ExtractionPrefilter
+
+        path = tmp_path / "weights.json"
+        p = ExtractionPrefilter(threshold=0.2, mode="on")
+        p.configure(threshold=0.2, mode="on", weights_path=str(path))
+        assert p.model.bias == prefilter.DEFAULT_WEIGHTS["bias"]
+
+        path.write_text(json.dumps({"weights": {}, "bias": 3.0}), encoding="utf-8")
+        with patch.object(prefilter, "RELOAD_CHECK_INTERVAL", 0):
+            assert p.model.bias == 3.0
+
+    def test_training_writes_data_path_and_reloads(self, tmp_path):
+        import asyncio
+        from memory import prefilter
+
+        rows = [{"user_message": "je m'appelle Paul", "luna_response": "cool", "stored_count": 1},
+                {"user_message": "mdr", "luna_response": "haha", "stored_count": 0}] * 3
+        path = tmp_path / "data" / "weights.json"
+        with patch.object(prefilter.extraction_prefilter, "weights_path", path), \
+             patch.object(prefilter.extraction_prefilter, "reload") as reload:
+            stats = asyncio.run(prefilter.train_from_outcomes(_FakeJobPool(_FakeSqlConn(rows)), 4, path))
+
+        assert stats["samples"] == 6
+        assert path.exists()
+        reload.assert_called_once()
+
+    def test_prune_outcomes_keeps_newest(self):
+        import asyncio
+        from memory.prefilter import prune_outcomes
+
+        class _Conn:
+            def __init__(self):
+                self.calls = []
+                self.results = [501, 5000, 12]
+
+            async def fetchval(self, query, *args):
+                self.calls.append((query, args))
+                return self.results.pop(0)
+
+        conn = _Conn()
+        assert asyncio.run(prune_outcomes(conn, keep=20000, retention_days=30)) == 5012
+        assert conn.calls[0][1] == (20000,)
+        assert conn.calls[1][1] == (501, 30)
+        assert "DELETE FROM memory_extraction_outcomes" in conn.calls[2][0]
+
+    def test_outcome_logged_with_user_id(self):
+        import asyncio
+        from memory import prefilter
+
+        conn = _FakeSqlConn()
+        with patch("memory.prefilter.get_pool", return_value=_FakeJobPool(conn)):
+            asyncio.run(prefilter.log_outcome("u1", "salut", "coucou", 0.4, {"user_facts": [{}]}))
+        assert conn.executed[0][1] == ("u1", "salut", "coucou", 0.4, 1)
+
+
+# ============== BATCHED PERSISTENCE TESTS ==============
+
+class TestBatchedPersistence:
+    """Tests pour le dedup en memoire des ecritures d'extraction."""
+
+    def _snapshot(self, **user):
+        from memory.persistence import MemorySnapshot
+        return MemorySnapshot(user={"likes": '["foot"]', "family": {}, **user})
+
+    def test_list_fact_dedup_within_batch(self):
+        from memory.extraction import _plan_user_fact
+        from memory.persistence import ExtractionWrites
+        writes = ExtractionWrites("u1")
+        snapshot = self._snapshot()
+        fact = {"type": "like", "value": "rap", "importance": 5}
+        assert _plan_user_fact(writes, snapshot, fact)
+        assert _plan_user_fact(writes, snapshot, fact) is None
+        assert _plan_user_fact(writes, snapshot, {"type": "like", "value": "Foot"}) is None
+        assert writes.list_appends == {"likes": ["rap"]}
+
+    def test_name_not_overridden_by_low_importance(self):
+        from memory.extraction import _plan_user_fact
+        from memory.persistence import ExtractionWrites
+        writes = ExtractionWrites("u1")
+        snapshot = self._snapshot(name="Lucas")
+        fact = {"type": "name", "value": "Pierre", "importance": 6}
+        assert _plan_user_fact(writes, snapshot, fact, "moi c'est Pierre") is None
+        assert writes.is_empty()
+
+    def test_luna_statement_dedup_against_snapshot(self):
+        from memory.extraction import _plan_luna_statement, _extract_keywords
+        from memory.persistence import ExtractionWrites
+        writes = ExtractionWrites("u1")
+        snapshot = self._snapshot()
+        stmt = {"revealed": "mon père est parti quand j'avais dix ans", "importance": 8}
+        assert _plan_luna_statement(writes, snapshot, stmt)
+        assert _plan_luna_statement(writes, snapshot, stmt) is None
+        assert len(writes.events) == 1
+        assert writes.events[0]["keywords"] == _extract_keywords(stmt["revealed"])
+
+    def test_commit_upserts_child_tables(self):
+        import asyncio
+        from memory import crud
+        from memory.persistence import ExtractionWrites
+
+        conn = _FakeSqlConn()
+        writes = ExtractionWrites("u1")
+        writes.list_appends = {"likes": ["rap"]}
+        writes.calendar_dates = [{"date": "2026-02-14", "event": "resto", "type": "plan", "importance": 8}]
+        writes.inside_jokes = [
+            {"trigger": "Pixel", "context": "", "importance": 5},
+            {"trigger": "pixel", "context": "", "importance": 5},
+            {"trigger": "croissant", "context": "la boulangerie", "importance": 6},
+        ]
+        crud.set_pool(_FakeJobPool(conn))
+        try:
+            asyncio.run(writes.commit())
+        finally:
+            crud.set_pool(None)
+
+        tables = [q.split("INTO ")[1].split()[0] for q, _ in conn.executed if "INSERT INTO" in q]
+        assert tables == ["memory_user_items", "memory_calendar_dates", "memory_inside_jokes"]
+        _, joke_args = next(c for c in conn.executed if "memory_inside_jokes (" in c[0])
+        # Même trigger deux fois dans le lot: une ligne, times_used = 2
+        assert joke_args[1] == ["Pixel", "croissant"] and joke_args[4] == [2, 1]
+        assert any("DELETE FROM memory_inside_jokes" in q for q, _ in conn.executed)
+        assert all("jsonb_array_elements" not in q for q, _ in conn.executed)
+
+
+# ============== COMPRESSION PIPELINE TESTS ==============
+
+class TestCompressionPipeline:
+    """Tests pour le pipeline de compression (workers, checkpoints, deadline)."""
+
+    def _run(self, user_ids, process, workers=2, deadline=None):
+        import asyncio
+        from memory import compression
+
+        checkpoints = []
+
+        async def fake_checkpoint(user_id, checkpoint):
+            checkpoints.append(user_id)
+
+        with patch.object(compression, "mark_checkpoint", fake_checkpoint):
+            stats = asyncio.run(compression._run_pipeline(
+                "test", user_ids, process, "last_weekly_summary", workers, deadline
+            ))
+        return stats, checkpoints
+
+    def test_processes_all_users_in_parallel(self):
+        import asyncio
+        running = {"now": 0, "max": 0}
+
+        async def process(user_id):
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+
+        stats, checkpoints = self._run(list(range(6)), process, workers=3)
+        assert stats["users_processed"] == 6
+        assert sorted(checkpoints) == list(range(6))
+        assert running["max"] == 3
+
+    def test_failed_user_not_checkpointed(self):
+        async def process(user_id):
+            if user_id == 1:
+                raise RuntimeError("LLM down")
+
+        stats, checkpoints = self._run([0, 1, 2], process)
+        assert stats["users_failed"] == 1
+        assert 1 not in checkpoints
+
+    def test_deadline_leaves_remaining_users(self):
+        import asyncio
+
+        async def process(user_id):
+            await asyncio.sleep(0.05)
+
+        stats, checkpoints = self._run(list(range(10)), process, workers=1, deadline=0.01)
+        assert stats["deadline_hit"]
+        assert stats["users_remaining"] > 0
+        assert len(checkpoints) + stats["users_remaining"] == 10
+
+    def _weekly_with_llm(self, summary_llm):
+        import asyncio
+        from memory import compression
+
+        checkpoints = []
+
+        async def fake_checkpoint(user_id, checkpoint):
+            checkpoints.append(user_id)
+
+        events = [{"type": "fact", "summary": f"e{i}"} for i in range(3)]
+        with patch.object(compression, "OPENROUTER_API_KEY", "k"), \
+             patch.object(compression, "get_users_due", AsyncMock(return_value=["u1"])), \
+             patch.object(compression, "get_hot_events", AsyncMock(return_value=events)), \
+             patch.object(compression, "get_user_by_id", AsyncMock(return_value={"name": "Max"})), \
+             patch.object(compression, "get_relationship", AsyncMock(return_value={"day": 3})), \
+             patch.object(compression, "add_summary", AsyncMock()), \
+             patch.object(compression, "mark_checkpoint", fake_checkpoint), \
+             patch.object(compression, "_call_summary_llm", summary_llm):
+            stats = asyncio.run(compression.run_weekly_compression(workers=1))
+        return stats, checkpoints
+
+    def test_llm_failure_not_checkpointed(self):
+        import httpx
+
+        for llm in (AsyncMock(side_effect=httpx.ConnectError("provider down")), AsyncMock(return_value=None)):
+            stats, checkpoints = self._weekly_with_llm(llm)
+            assert stats["users_failed"] == 1
+            assert checkpoints == []
+
+    def test_llm_success_checkpointed(self):
+        stats, checkpoints = self._weekly_with_llm(AsyncMock(return_value={"summary": "s", "highlights": []}))
+        assert stats["summaries_created"] == 1
+        assert checkpoints == ["u1"]
+
+
+# ============== CONVERSATION PARTITION TESTS ==============
+
+class TestConversationPartitions:
+    """Tests pour le partitionnement mensuel de conversations_simple."""
+
+    def test_month_partitions_cross_year(self):
+        from datetime import date
+        from bot.conversations import month_partitions
+        parts = month_partitions(date(2025, 11, 17), 3)
+        assert [p[0] for p in parts] == [
+            "conversations_simple_y2025m11",
+            "conversations_simple_y2025m12",
+            "conversations_simple_y2026m01",
+        ]
+        assert parts[1][1] == date(2025, 12, 1)
+        assert parts[1][2] == date(2026, 1, 1)
+
+    def test_expired_partitions(self):
+        from datetime import date
+        from bot.conversations import expired_partitions
+        names = [
+            "conversations_simple_y2025m01",
+            "conversations_simple_y2025m02",
+            "conversations_simple_y2025m03",
+            "conversations_simple_legacy",
+        ]
+        # Février se termine le 1er mars: expiré avec un cutoff au 1er mars
+        assert expired_partitions(names, date(2025, 3, 1)) == [
+            "conversations_simple_y2025m01",
+            "conversations_simple_y2025m02",
+        ]
+        assert expired_partitions(names, date(2025, 2, 15)) == ["conversations_simple_y2025m01"]
+        assert "conversations_simple_default" not in expired_partitions(
+            names + ["conversations_simple_default"], date(2030, 1, 1)
+        )
+
+    @staticmethod
+    def _partition_conn(stray: bool):
+        """Conn où aucune partition mensuelle n'existe; `stray`: le DEFAULT a des lignes."""
+        from contextlib import asynccontextmanager
+
+        conn = MagicMock()
+        conn.executed = []
+
+        async def execute(query, *args):
+            conn.executed.append(" ".join(query.split()))
+            return "INSERT 0 4"
+
+        async def fetchval(query, *args):
+            return stray if "EXISTS" in query else False
+
+        @asynccontextmanager
+        async def transaction():
+            conn.executed.append("BEGIN")
+            yield
+            conn.executed.append("COMMIT")
+
+        conn.execute = execute
+        conn.fetchval = fetchval
+        conn.transaction = transaction
+        return conn
+
+    def test_ensure_partitions_creates_default(self):
+        import asyncio
+        from bot.conversations import ensure_partitions
+        conn = self._partition_conn(stray=False)
+        assert asyncio.run(ensure_partitions(conn, months_ahead=1)) == 2
+        assert conn.executed[0] == (
+            "CREATE TABLE IF NOT EXISTS conversations_simple_default "
+            "PARTITION OF conversations_simple DEFAULT"
+        )
+        assert "BEGIN" not in conn.executed
+        assert not any("DETACH" in q for q in conn.executed)
+
+    def test_ensure_partitions_moves_default_rows(self):
+        import asyncio
+        from bot.conversations import ensure_partitions
+        conn = self._partition_conn(stray=True)
+        assert asyncio.run(ensure_partitions(conn, months_ahead=0)) == 1
+        steps = conn.executed[1:]
+        assert steps[0] == "BEGIN"
+        assert steps[1].startswith("ALTER TABLE conversations_simple DETACH PARTITION conversations_simple_default")
+        assert steps[2].startswith("CREATE TABLE IF NOT EXISTS conversations_simple_y")
+        assert "DELETE FROM conversations_simple_default" in steps[3]
+        assert "INSERT INTO conversations_simple_y" in steps[3]
+        assert steps[4] == "ALTER TABLE conversations_simple ATTACH PARTITION conversations_simple_default DEFAULT"
+        assert steps[5] == "COMMIT"
+
+
+# ============== HISTORY CACHE TESTS ==============
+
+class TestHistoryCache:
+    """Tests pour le ring buffer d'historique par user."""
+
+    def test_miss_until_hydrated(self):
+        from bot.conversations import HistoryCache
+        cache = HistoryCache(max_turns=4)
+        cache.append("u1", "user", "ignored")  # pas en cache: pas de write-through
+        assert cache.get("u1", 2) is None
+        cache.hydrate("u1", [{"id": 7, "role": "user", "content": "salut"}])
+        assert cache.get("u1", 2) == [{"id": 7, "role": "user", "content": "salut"}]
+
+    def test_ring_buffer_keeps_latest(self):
+        from bot.conversations import HistoryCache
+        cache = HistoryCache(max_turns=3)
+        cache.hydrate("u1", [])
+        for i in range(5):
+            cache.append("u1", "user", f"m{i}")
+        assert [m["content"] for m in cache.get("u1", 3)] == ["m2", "m3", "m4"]
+        assert [m["content"] for m in cache.get("u1", 2)] == ["m3", "m4"]
+        # Plus que la capacité: il faut passer par Postgres
+        assert cache.get("u1", 10) is None
+
+    def test_lru_eviction_by_bytes(self):
+        from bot.conversations import HistoryCache
+        cache = HistoryCache(max_turns=10, max_bytes=25)
+        cache.hydrate("u1", [{"role": "user", "content": "a" * 10}])
+        cache.hydrate("u2", [{"role": "user", "content": "b" * 10}])
+        cache.get("u1", 1)  # u1 devient le plus récent
+        cache.hydrate("u3", [{"role": "user", "content": "c" * 10}])
+        assert cache.get("u2", 1) is None
+        assert cache.get("u1", 1) is not None
+        assert cache._bytes == 20
+
+    def test_byte_accounting_on_wraparound(self):
+        from bot.conversations import HistoryCache
+        cache = HistoryCache(max_turns=2)
+        cache.hydrate("u1", [])
+        for content in ("aa", "bbbb", "c"):
+            cache.append("u1", "user", content)
+        assert cache._bytes == 5
+
+    def _slow_load(self, read_rows, saved_id):
+        """get_history en miss; un message (id saved_id) est sauvé pendant fetch_history."""
+        import asyncio
+        from bot import conversations
+        from bot.conversations import ConversationWriter, HistoryCache
+
+        cache = HistoryCache(max_turns=10)
+        conn = MagicMock()
+        conn.fetchval = AsyncMock(return_value=saved_id)
+
+        async def run():
+            reading = asyncio.Event()
+            release = asyncio.Event()
+
+            async def slow_fetch(user_id, limit, retention_days=90):
+                reading.set()
+                await release.wait()
+                return read_rows
+
+            with patch.object(conversations, "fetch_history", slow_fetch):
+                load = asyncio.create_task(conversations.get_history("u1", limit=10))
+                await reading.wait()
+                await conversations.save_message("u1", "assistant", "paywall")
+                release.set()
+                return await load
+
+        with patch.object(conversations, "history_cache", cache), \
+             patch.object(conversations, "writer", ConversationWriter()), \
+             patch.object(conversations, "_pool", _FakeJobPool(conn)):
+            returned = asyncio.run(run())
+        return returned, cache
+
+    def test_message_saved_during_load_is_kept(self):
+        read = [{"id": 40, "role": "user", "content": "salut"}]
+        returned, cache = self._slow_load(read, saved_id=41)
+
+        assert [m["content"] for m in returned] == ["salut", "paywall"]
+        assert [m["id"] for m in cache.get("u1", 10)] == [40, 41]
+        assert not cache._hydrating
+
+    def test_message_saved_during_load_not_duplicated(self):
+        # La lecture voit déjà la ligne insérée pendant le chargement
+        read = [{"id": 40, "role": "user", "content": "salut"},
+                {"id": 41, "role": "assistant", "content": "paywall"}]
+        returned, cache = self._slow_load(read, saved_id=41)
+
+        assert [m["id"] for m in returned] == [40, 41]
+        assert [m["id"] for m in cache.get("u1", 10)] == [40, 41]
+
+
+# ============== CONVERSATION WRITER TESTS ==============
+
+class _FakeCopyConn:
+    def __init__(self, batches, fail=0):
+        self.batches = batches
+        self.fail = fail
+        self.next_id = 100
+
+    async def fetch(self, query, count):
+        ids = [{"id": self.next_id + i} for i in range(count)]
+        self.next_id += count
+        return ids
+
+    async def copy_records_to_table(self, table, records, columns):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("db down")
+        self.batches.append(list(records))
+
+
+class _FakeCopyPool:
+    def __init__(self, fail=0):
+        self.batches = []
+        self.conn = _FakeCopyConn(self.batches, fail)
+
+    def acquire(self):
+        pool = self
+
+        class _Ctx:
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return _Ctx()
+
+
+class TestConversationWriter:
+    """Tests pour l'écriture différée du log de conversation."""
+
+    def test_rows_batched_by_size_and_drained_on_close(self):
+        import asyncio
+        from bot import conversations
+        from bot.conversations import ConversationWriter
+        pool = _FakeCopyPool()
+
+        async def run():
+            writer = ConversationWriter(flush_interval=10, flush_rows=3)
+            writer.start()
+            for i in range(5):
+                await writer.append("u1", "user", f"m{i}")
+            await writer.close()
+
+        with patch.object(conversations, "_pool", pool):
+            asyncio.run(run())
+        assert [len(b) for b in pool.batches] == [3, 2]
+        contents = [r[2] for b in pool.batches for r in b]
+        assert contents == ["m0", "m1", "m2", "m3", "m4"]
+        # created_at côté client: ordre préservé
+        stamps = [r[3] for b in pool.batches for r in b]
+        assert stamps == sorted(stamps)
+
+    def test_before_ack_waits_for_commit(self):
+        import asyncio
+        from bot import conversations
+        from bot.conversations import ConversationWriter
+        pool = _FakeCopyPool()
+
+        async def run():
+            writer = ConversationWriter(flush_interval=0.001, durability="before_ack")
+            writer.start()
+            await writer.append("u1", "user", "salut")
+            flushed = len(pool.batches)
+            await writer.close()
+            return flushed
+
+        with patch.object(conversations, "_pool", pool):
+            assert asyncio.run(run()) == 1
+
+    def test_flush_retries_after_failure(self):
+        import asyncio
+        from bot import conversations
+        from bot.conversations import ConversationWriter
+        pool = _FakeCopyPool(fail=1)
+
+        async def run():
+            writer = ConversationWriter(flush_interval=0.001)
+            writer.start()
+            await writer.append("u1", "user", "salut")
+            await writer.barrier()
+            await writer.close()
+
+        with patch.object(conversations, "_pool", pool), \
+             patch.object(conversations.asyncio, "sleep", AsyncMock()):
+            asyncio.run(run())
+        assert len(pool.batches) == 1
+
+    def test_seq_follows_queue_order_under_backpressure(self):
+        import asyncio
+        from bot.conversations import ConversationWriter
+
+        async def run():
+            writer = ConversationWriter(max_queue=1)
+            writer._queue = asyncio.Queue(maxsize=1)
+            writer._cond = asyncio.Condition()
+            await writer.append("u1", "user", "a")
+            blocked = asyncio.create_task(writer.append("u1", "user", "b"))
+            await asyncio.sleep(0)  # b attend de la place
+            items = [writer._queue.get_nowait()]
+            await writer.append("u1", "user", "c")  # prend la place avant que b se réveille
+            items.append(writer._queue.get_nowait())
+            await blocked
+            items.append(writer._queue.get_nowait())
+            return items
+
+        items = asyncio.run(run())
+        assert [item[1][2] for item in items] == ["a", "c", "b"]
+        assert [item[0] for item in items] == [1, 2, 3]
+
+    def test_flush_fills_ids_of_cached_messages(self):
+        import asyncio
+        from bot import conversations
+        from bot.conversations import ConversationWriter, HistoryCache
+        pool = _FakeCopyPool()
+        cache = HistoryCache(max_turns=10)
+        cache.hydrate("u1", [{"id": 99, "role": "user", "content": "avant"}])
+
+        async def run():
+            writer = ConversationWriter(flush_interval=0.001)
+            writer.start()
+            with patch.object(conversations, "writer", writer):
+                await conversations.save_message("u1", "user", "salut")
+                pending = cache.get("u1", 10)
+                await writer.barrier()
+            await writer.close()
+            return pending
+
+        with patch.object(conversations, "_pool", pool), \
+             patch.object(conversations, "history_cache", cache):
+            pending = asyncio.run(run())
+
+        assert [m["id"] for m in pending] == [99, None]
+        assert [m["id"] for m in cache.get("u1", 10)] == [99, 100]
+        assert pool.batches[0][0][4] == 100
+
+
+# ============== READ REPLICA TESTS ==============
+
+class TestReplicaRouting:
+    """Tests pour le routage des lectures vers les réplicas."""
+
+    def _db(self, replicas=2):
+        from core.database import Database
+        db = Database()
+        db._pool = MagicMock(name="primary")
+        db._replicas = [MagicMock(name=f"replica{i}") for i in range(replicas)]
+        db._replica_healthy = [True] * replicas
+        db._replica_lag = [0.0] * replicas
+        return db
+
+    def test_round_robin_over_healthy_replicas(self):
+        db = self._db()
+        assert [db._pick_replica() for _ in range(3)] == [0, 1, 0]
+        db._replica_healthy[0] = False
+        assert [db._pick_replica() for _ in range(2)] == [1, 1]
+
+    def test_fallback_to_primary_when_all_lag(self):
+        db = self._db()
+        db._replica_healthy = [False, False]
+        assert db._pick_replica() is None
+
+    def test_read_your_writes_stickiness(self):
+        db = self._db()
+        db.mark_write("u1")
+        assert db._pick_replica("u1") is None
+        assert db._pick_replica("u2") is not None
+        db.sticky_seconds = 0
+        assert db._pick_replica("u1") is not None
+
+    def test_lag_check_updates_health(self):
+        import asyncio
+        db = self._db()
+        db.max_replica_lag = 5.0
+        lags = iter([1.0, 30.0])
+
+        class _Conn:
+            async def fetchval(self, query, timeout=None):
+                return next(lags)
+
+        class _Ctx:
+            async def __aenter__(self):
+                return _Conn()
+
+            async def __aexit__(self, *exc):
+                return False
+
+        for replica in db._replicas:
+            replica.acquire = lambda: _Ctx()
+        assert asyncio.run(db.check_replica_lag()) == [1.0, 30.0]
+        assert db._replica_healthy == [True, False]
+
+    def test_crud_read_falls_back_to_primary_when_replica_fails(self):
+        import asyncio
+        from memory import crud
+        from middleware.metrics import metrics
+
+        db = self._db(replicas=1)
+        db._replicas[0].acquire = AsyncMock(side_effect=ConnectionRefusedError("replica down"))
+        conn = _FakeSqlConn([{"id": "e1", "type": "moment", "summary": "promo", "score": 8}])
+        db._pool.acquire = AsyncMock(return_value=conn)
+        db._pool.release = AsyncMock()
+        before = metrics.counters.get("db_replica_fallbacks", 0)
+
+        with patch.object(crud, "_pool", db):
+            events = asyncio.run(crud.get_hot_events("u1"))
+
+        assert [e["summary"] for e in events] == ["promo"]
+        assert db._replica_healthy == [False]
+        assert metrics.counters["db_replica_fallbacks"] == before + 1
+        db._pool.release.assert_awaited_once_with(conn)
+        # Réplica hors rotation: la lecture suivante va directement au primaire
+        assert db._pick_replica("u1") is None
+
+
+# ============== DATABASE LAYER TESTS ==============
+
+class TestDatabaseLayer:
+    """Tests pour la couche Database partagée (timeouts, métriques de saturation)."""
+
+    def test_acquire_timeout_raises_database_error(self):
+        import asyncio
+        from core.database import Database
+        from core.errors import DatabaseError
+        db = Database()
+        db._pool = MagicMock()
+        db._pool.acquire = AsyncMock(side_effect=asyncio.TimeoutError())
+        db.acquire_timeout = 0.1
+
+        async def run():
+            async with db.acquire():
+                pass
+
+        with pytest.raises(DatabaseError):
+            asyncio.run(run())
+
+    def test_in_use_gauge_and_wait_histogram(self):
+        import asyncio
+        from core.database import Database
+        from middleware.metrics import metrics
+        db = Database()
+        db._pool = MagicMock()
+        db._pool.acquire = AsyncMock(return_value="conn")
+        db._pool.release = AsyncMock()
+        before = metrics.histograms.get("db_acquire_wait_seconds", {}).get("count", 0)
+
+        async def run():
+            async with db.acquire() as conn:
+                assert conn == "conn"
+                assert metrics.gauges["db_primary_in_use"] == 1
+            assert metrics.gauges["db_primary_in_use"] == 0
+
+        asyncio.run(run())
+        db._pool.release.assert_awaited_once_with("conn")
+        assert metrics.histograms["db_acquire_wait_seconds"]["count"] == before + 1
+
+    def test_histogram_buckets(self):
+        from middleware.metrics import Metrics
+        m = Metrics()
+        for value in (0.0005, 0.02, 10):
+            m.observe("wait", value)
+        hist = m.get_stats()["histograms"]["wait"]
+        assert hist["count"] == 3
+        assert hist["buckets"]["0.001"] == 1
+        assert hist["buckets"]["0.05"] == 1
+        assert hist["buckets"]["inf"] == 1
+
+    def test_crud_reads_plain_pool_without_replicas(self):
+        from memory import crud
+        pool = MagicMock(spec=["acquire"])
+        with patch.object(crud, "_pool", pool):
+            crud.read_acquire("u1")
+            crud.mark_write("u1")
+        pool.acquire.assert_called_once_with()
+
+
+# ============== CIRCUIT BREAKER TESTS ==============
+
+class TestCircuitBreaker:
+    """Tests pour les disjoncteurs et les requêtes hedged."""
+
+    def test_opens_on_error_rate_then_half_open_probe(self):
+        from services.circuit_breaker import CircuitBreaker, CircuitState
+        breaker = CircuitBreaker("test", min_calls=4, error_rate=0.5, open_seconds=0)
+        for ok in (True, False, True, False):
+            breaker.record(ok, 0.1)
+        # open_seconds=0: passe directement en HALF_OPEN à la lecture
+        assert breaker._state == CircuitState.OPEN
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert breaker.allow() is True
+        assert breaker.allow() is False  # un seul appel test
+        breaker.record(True, 0.1)
+        assert breaker.state == CircuitState.CLOSED
+
+    def test_slow_calls_count_as_failures(self):
+        from services.circuit_breaker import CircuitBreaker, CircuitState
+        breaker = CircuitBreaker("slow", min_calls=2, error_rate=0.5, slow_call=1.0)
+        breaker.record(True, 5.0)
+        breaker.record(True, 5.0)
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.allow() is False
+
+    def test_hedge_fires_fallback_when_primary_slow(self):
+        import asyncio
+        from services.circuit_breaker import hedged_call
+
+        async def slow():
+            await asyncio.sleep(5)
+            return "primary"
+
+        async def fast():
+            return "fallback"
+
+        assert asyncio.run(hedged_call(slow, fast, delay=0.01)) == "fallback"
+
+    def test_hedge_keeps_fast_primary(self):
+        import asyncio
+        from services.circuit_breaker import hedged_call
+        fallback = AsyncMock(return_value="fallback")
+
+        async def fast():
+            return "primary"
+
+        assert asyncio.run(hedged_call(fast, fallback, delay=1)) == "primary"
+        fallback.assert_not_called()
+
+    def test_open_circuit_skips_primary(self):
+        import asyncio
+        from services import llm
+        breaker = llm.circuit_breakers.get("openrouter:test-model")
+        breaker._open()
+        breaker.open_seconds = 60
+        primary = AsyncMock(return_value="magnum")
+        with patch.object(llm, "call_openrouter", primary), \
+             patch.object(llm, "call_anthropic_direct", AsyncMock(return_value="haiku")):
+            result = asyncio.run(llm.call_with_graceful_fallback(
+                [{"role": "user", "content": "salut"}], "system", "openrouter", "test-model", tier=2
+            ))
+        assert result == "haiku"
+        primary.assert_not_called()
+
+    def test_slow_primary_bounded_to_one_short_attempt(self):
+        import asyncio
+        import time
+        from services import llm
+
+        async def slow(*args, **kwargs):
+            await asyncio.sleep(5)
+            return "magnum"
+
+        primary = AsyncMock(side_effect=slow)
+        with patch.object(llm, "call_openrouter", primary), \
+             patch.object(llm, "call_anthropic_direct", AsyncMock(return_value="haiku")), \
+             patch.object(llm.settings, "LLM_ATTEMPT_TIMEOUT", 0.05), \
+             patch.object(llm.settings, "LLM_HEDGE_ENABLED", False):
+            started = time.monotonic()
+            result = asyncio.run(llm.call_with_graceful_fallback(
+                [{"role": "user", "content": "salut"}], "system", "openrouter", "slow-model", tier=2
+            ))
+
+        assert result == "haiku"
+        assert time.monotonic() - started < 1
+        assert primary.call_args.kwargs["attempts"] == 1
+        assert [ok for ok, _ in llm.circuit_breakers.get("openrouter:slow-model")._calls] == [False]
+
+    def test_live_reply_falls_back_to_haiku(self):
+        import asyncio
+        from bot.handlers import messages
+
+        haiku = AsyncMock(return_value="coucou")
+        with patch.object(messages, "call_magnum", AsyncMock(side_effect=RuntimeError("503"))), \
+             patch.object(messages, "call_haiku", haiku), \
+             patch.object(messages.settings, "MAGNUM_MODEL", "magnum-live-test"):
+            result = asyncio.run(messages.generate_response([{"role": "user", "content": "hey"}], "system", True))
+
+        assert result == "coucou"
+        assert haiku.call_args[0][1].endswith(messages.SOFT_SENSUAL_INSTRUCTION)
+
+
+# ============== TASK SUPERVISOR TESTS ==============
+
+class TestTaskSupervisor:
+    """Tests pour le superviseur de tâches en arrière-plan."""
+
+    def test_lane_concurrency_limit(self):
+        import asyncio
+        from core.tasks import TaskSupervisor
+
+        async def run():
+            supervisor = TaskSupervisor({"default": (2, 10, 0, None)})
+            running, peak = 0, 0
+
+            async def job():
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+            tasks = [supervisor.submit(job(), "job") for _ in range(6)]
+            await asyncio.gather(*tasks)
+            return peak
+
+        assert asyncio.run(run()) == 2
+
+    def test_rejects_when_lane_full_and_after_shutdown(self):
+        import asyncio
+        from core.tasks import TaskSupervisor
+
+        async def run():
+            supervisor = TaskSupervisor({"default": (1, 2, 0, None)})
+            first = supervisor.submit(asyncio.sleep(0.01), "a")
+            second = supervisor.submit(asyncio.sleep(0.01), "b")
+            third = supervisor.submit(asyncio.sleep(0.01), "c")  # file pleine
+            await supervisor.shutdown(deadline=1)
+            late = supervisor.submit(asyncio.sleep(0), "late")
+            return first, second, third, late
+
+        first, second, third, late = asyncio.run(run())
+        assert first is not None and second is not None
+        assert third is None and late is None
+
+    def test_failures_and_deadlines_are_contained(self):
+        import asyncio
+        from core.tasks import TaskSupervisor
+        from middleware.metrics import metrics
+
+        async def boom():
+            raise ValueError("boom")
+
+        async def run():
+            supervisor = TaskSupervisor({"default": (4, 10, 0, None)})
+            failed = supervisor.submit(boom(), "boom")
+            slow = supervisor.submit(asyncio.sleep(5), "slow", timeout=0.01)
+            return await asyncio.gather(failed, slow)
+
+        before = metrics.counters.get("tasks_default_timeouts", 0)
+        assert asyncio.run(run()) == [None, None]
+        assert metrics.counters["tasks_default_timeouts"] == before + 1
+
+    def test_shutdown_cancels_after_deadline(self):
+        import asyncio
+        from core.tasks import TaskSupervisor
+
+        async def run():
+            supervisor = TaskSupervisor({"default": (1, 10, 0, None)})
+            task = supervisor.submit(asyncio.sleep(5), "slow")
+            await asyncio.sleep(0)
+            await supervisor.shutdown(deadline=0.01)
+            return task.cancelled()
+
+        assert asyncio.run(run()) is True
+
+
+# ============== SCHEDULED JOBS TESTS ==============
+
+class _FakeJobConn:
+    def __init__(self, locked=True, recent=None):
+        self.locked = locked
+        self.recent = recent
+        self.queries = []
+
+    async def fetchval(self, query, *args):
+        self.queries.append(query)
+        if "pg_try_advisory_lock" in query:
+            return self.locked
+        if "FROM job_runs" in query:
+            return self.recent
+        if "INSERT INTO job_runs" in query:
+            return 1
+        return None
+
+    async def execute(self, query, *args):
+        self.queries.append((query, args))
+
+
+class _FakeJobPool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        conn = self.conn
+
+        class _Ctx:
+            async def __aenter__(self):
+                return conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return _Ctx()
+
+
+class TestScheduledJobs:
+    """Tests pour les jobs planifiés (élection par advisory lock, historique)."""
+
+    def test_next_run_daily_respects_days(self):
+        from datetime import datetime, time as dt_time
+        from bot.jobs import JobSpec, next_run
+        # days=(6,) = samedi (convention JobQueue: 0 = dimanche)
+        spec = JobSpec("w", AsyncMock(), at=dt_time(3, 0), days=(6,))
+        monday = datetime(2026, 10, 19, 12, 0)
+        assert next_run(spec, monday) == datetime(2026, 10, 24, 3, 0)
+
+    def test_next_run_interval_and_once(self):
+        from datetime import datetime, timedelta
+        from bot.jobs import JobSpec, next_run
+        now = datetime(2026, 10, 19, 12, 0)
+        every = JobSpec("i", AsyncMock(), interval=3600, first=300)
+        assert next_run(every, now) == now + timedelta(seconds=300)
+        assert next_run(every, now, last=now) == now + timedelta(hours=1)
+        once = JobSpec("o", AsyncMock(), once=True, first=600)
+        assert next_run(once, now, last=now) is None
+
+    def test_run_exclusive_records_history(self):
+        import asyncio
+        from bot import jobs
+        func = AsyncMock()
+        conn = _FakeJobConn()
+        with patch.object(jobs, "_pool", _FakeJobPool(conn)):
+            status = asyncio.run(jobs.run_exclusive(jobs.JobSpec("t", func, interval=60)))
+        assert status == "ok"
+        func.assert_awaited_once()
+        update = next(q for q in conn.queries if isinstance(q, tuple) and "UPDATE job_runs" in q[0])
+        assert update[1][1] == "ok"
+        assert "pg_advisory_unlock" in conn.queries[-1][0]
+
+    def test_run_exclusive_skips_without_lock_or_in_dedup_window(self):
+        import asyncio
+        from bot import jobs
+        func = AsyncMock()
+        for conn in (_FakeJobConn(locked=False), _FakeJobConn(recent=1)):
+            with patch.object(jobs, "_pool", _FakeJobPool(conn)):
+                assert asyncio.run(jobs.run_exclusive(jobs.JobSpec("t", func, interval=60))) is None
+        func.assert_not_called()
+
+    def test_failed_job_is_recorded_as_error(self):
+        import asyncio
+        from bot import jobs
+        conn = _FakeJobConn()
+        func = AsyncMock(side_effect=RuntimeError("boom"))
+        with patch.object(jobs, "_pool", _FakeJobPool(conn)):
+            assert asyncio.run(jobs.run_exclusive(jobs.JobSpec("t", func, interval=60))) == "error"
+
+    def test_migrations_lift_statement_timeout(self):
+        import asyncio
+        from memory.models import init_memory_tables
+
+        conn = MagicMock()
+        conn.execute = AsyncMock()
+        conn.fetchval = AsyncMock(return_value=None)
+        asyncio.run(init_memory_tables(_FakeJobPool(conn)))
+        assert conn.execute.call_args_list[0].args[0] == "SET statement_timeout = 0"
+
+    def test_worker_pool_uses_worker_statement_timeout(self):
+        import asyncio
+        from bot import worker
+
+        db = MagicMock()
+        db.acquire = _FakeJobPool(MagicMock(execute=AsyncMock())).acquire
+        with patch.object(worker.database, "init_db", AsyncMock(return_value=db)) as init_db, \
+             patch.object(worker, "init_memory_tables", AsyncMock()), \
+             patch.object(worker.settings, "DB_STATEMENT_TIMEOUT_MS", 30000), \
+             patch.object(worker.settings, "DB_WORKER_STATEMENT_TIMEOUT_MS", 0):
+            asyncio.run(worker.init_worker_db())
+        assert init_db.call_args.kwargs["statement_timeout_ms"] == 0
+
+    def test_compression_failures_recorded_as_error(self):
+        import asyncio
+        from bot import jobs
+        from memory import compression
+
+        spec = jobs.JobSpec("weekly_compression", jobs.job_weekly_compression, at=None, days=(0,))
+        outcomes = {
+            "users_failed": AsyncMock(return_value={"users_processed": 2, "users_failed": 1}),
+            "db_error": AsyncMock(side_effect=ConnectionRefusedError("db down")),
+        }
+        for case, run in outcomes.items():
+            conn = _FakeJobConn()
+            with patch.object(jobs, "_pool", _FakeJobPool(conn)), \
+                 patch.object(compression, "OPENROUTER_API_KEY", "k"), \
+                 patch.object(compression, "run_weekly_compression", run):
+                assert asyncio.run(jobs.run_exclusive(spec)) == "error", case
+
+    def test_compression_db_error_propagates(self):
+        import asyncio
+        from memory import compression
+
+        with patch.object(compression, "get_users_due", AsyncMock(side_effect=ConnectionRefusedError("db down"))):
+            with pytest.raises(ConnectionRefusedError):
+                asyncio.run(compression.run_weekly_compression())
+
+
+# ============== LOOP MONITOR / OFFLOAD TESTS ==============
+
+def _cpu_square(x):
+    return x * x
+
+
+class TestLoopMonitorAndOffload:
+    """Tests pour le moniteur de lag et l'offload en pool de processus."""
+
+    def test_slow_callback_is_reported_with_coroutine_name(self):
+        import asyncio
+        import time
+        from core.loop_monitor import LoopMonitor
+
+        async def blocking_step():
+            time.sleep(0.05)
+
+        async def run():
+            monitor = LoopMonitor(interval=0.01, slow_threshold=0.02)
+            monitor.start()
+            await asyncio.create_task(blocking_step(), name="blocker")
+            await asyncio.sleep(0.02)
+            await monitor.stop()
+            return monitor
+
+        monitor = asyncio.run(run())
+        names = [name for _, _, name in monitor.recent_slow]
+        assert any("blocker" in n and "blocking_step" in n for n in names)
+        assert monitor.max_lag >= 0.02
+
+    def test_hook_removed_on_stop(self):
+        import asyncio
+        from core import loop_monitor as lm
+
+        async def run():
+            monitor = lm.LoopMonitor()
+            monitor.start()
+            await monitor.stop()
+
+        asyncio.run(run())
+        assert asyncio.events.Handle._run is lm._original_handle_run
+
+    def test_offload_inline_below_threshold(self):
+        import asyncio
+        from core import offload
+        offload.configure(max_workers=2, min_size=100)
+        with patch.object(offload, "_get_executor") as get_executor:
+            assert asyncio.run(offload.offload(_cpu_square, 7, size=10)) == 49
+        get_executor.assert_not_called()
+
+    def test_offload_uses_process_pool_above_threshold(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        from core import offload
+        offload.configure(max_workers=2, min_size=100)
+        with ThreadPoolExecutor(1) as pool, patch.object(offload, "_get_executor", return_value=pool):
+            assert asyncio.run(offload.offload(_cpu_square, 8, size=1000)) == 64
+
+
+# ============== PROFILER TESTS ==============
+
+class TestProfiler:
+    """Tests du profiler par échantillonnage (/profile)."""
+
+    def test_profile_writes_files_and_top(self, tmp_path):
+        import asyncio
+        import json
+        import time
+        from core.profiler import SamplingProfiler
+
+        def spin(seconds):
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+
+        async def run():
+            profiler = SamplingProfiler(interval=0.005, output_dir=str(tmp_path))
+            session = asyncio.create_task(profiler.run(0.2))
+            await asyncio.sleep(0.01)
+            await asyncio.create_task(asyncio.to_thread(spin, 0.15))
+            spin(0.05)
+            return await session
+
+        result = asyncio.run(run())
+        assert result.samples > 0
+        assert any("spin" in name for name, _, _ in result.top)
+
+        with open(result.collapsed_path) as f:
+            lines = f.read().splitlines()
+        assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+        assert any(line.startswith("task:") for line in lines)
+
+        with open(result.speedscope_path) as f:
+            doc = json.load(f)
+        profile = doc["profiles"][0]
+        assert profile["type"] == "sampled"
+        assert len(profile["samples"]) == len(profile["weights"])
+
+    def test_sessions_cannot_overlap(self, tmp_path):
+        import asyncio
+        from core.profiler import SamplingProfiler, ProfilerBusyError
+
+        async def run():
+            profiler = SamplingProfiler(interval=0.01, output_dir=str(tmp_path))
+            first = asyncio.create_task(profiler.run(0.05))
+            await asyncio.sleep(0)
+            assert profiler.running
+            with pytest.raises(ProfilerBusyError):
+                await profiler.run(0.05)
+            await first
+            return profiler
+
+        profiler = asyncio.run(run())
+        assert not profiler.running
+
+    def test_top_excludes_idle_waits(self):
+        from collections import Counter
+        from core.profiler import SamplingProfiler
+
+        stacks = Counter({
+            ("loop", ("run", "a.py", 1), ("EpollSelector.select", "selectors.py", 1)): 90,
+            ("task:t", ("handle", "b.py", 1), ("render", "b.py", 10)): 10,
+        })
+        top = SamplingProfiler.top_functions(stacks)
+        assert top == [("render (b.py:10)", 10, 100.0)]
+
+
+# ============== OVERLOAD TESTS ==============
+
+class TestOverloadController:
+    """Tests du délestage adaptatif (niveaux + hystérésis)."""
+
+    def _controller(self, clock):
+        from core.overload import OverloadController
+        return OverloadController(
+            thresholds={"db_wait": 0.1, "queue_depth": 100},
+            recover_ratio=0.5, step_up=5, step_down=30, alpha=1.0, clock=lambda: clock[0],
+        )
+
+    def test_steps_up_one_level_per_interval(self):
+        clock = [0.0]
+        ctl = self._controller(clock)
+        ctl.record("db_wait", 0.5)
+        assert ctl.evaluate(0) == 1
+        assert ctl.evaluate(2) == 1  # step_up not elapsed
+        assert ctl.evaluate(5) == 2
+        assert ctl.evaluate(10) == 3
+        assert ctl.evaluate(20) == 3  # MAX_LEVEL
+
+    def test_hysteresis_holds_between_thresholds(self):
+        clock = [0.0]
+        ctl = self._controller(clock)
+        ctl.record("db_wait", 0.5)
+        ctl.evaluate(0)
+        ctl.record("db_wait", 0.07)  # below degrade, above recover
+        assert ctl.evaluate(100) == 1
+        ctl.record("db_wait", 0.01)
+        assert ctl.evaluate(101) == 1  # calm only just started
+        assert ctl.evaluate(131) == 0
+
+    def test_allows_sheds_optional_stages_by_level(self):
+        clock = [0.0]
+        ctl = self._controller(clock)
+        assert ctl.allows("coherence") and ctl.allows("extraction")
+        ctl.record("db_wait", 0.5)
+        clock[0] = 10.0
+        assert not ctl.allows("coherence")
+        assert ctl.allows("keyword_events")
+        assert ctl.allows("reply")  # undeclared stages are never shed
+        assert ctl.stats()["shed"] == ["coherence", "summary"]
+
+    def test_probe_and_disabled(self):
+        clock = [0.0]
+        ctl = self._controller(clock)
+        ctl.register_probe("queue_depth", lambda: 500)
+        assert ctl.evaluate(0) == 1
+        ctl.configure({"db_wait": 0.1, "queue_depth": 100}, enabled=False)
+        assert ctl.level == 0
+        assert ctl.allows("extraction")
+
+    def test_zero_samples_smooth_a_spike(self):
+        from core.overload import OverloadController
+        ctl = OverloadController(thresholds={"queue_depth": 100}, alpha=0.3, clock=lambda: 0.0)
+        ctl.record("queue_depth", 0)
+        ctl.record("queue_depth", 200)  # pic isolé après une file vide
+        assert ctl.stats()["signals"]["queue_depth"] == 60
+        assert ctl.evaluate(0) == 0
+
+
+# ============== PIPELINE TESTS ==============
+
+def _turn_deps(log, count=5, relationship=None):
+    """TurnDeps en mémoire: chaque appel est tracé dans `log`."""
+    from datetime import timezone
+    from bot.turn import TurnDeps
+    from services.engagement import EngagementState
+
+    def traced(name, result=None):
+        async def call(*args, **kwargs):
+            log.append(name)
+            return result
+        return call
+
+    async def generate_response(messages, system, use_nsfw):
+        log.append("llm")
+        return "  coucou toi  "
+
+    async def validate(response, user):
+        return response, []
+
+    return TurnDeps(
+        get_user_with_context=traced("load_user", ({"id": "u1", "name": "Max"}, relationship or {"day": 1})),
+        increment_message_count=traced("count", count),
+        save_message=traced("save_message"),
+        get_history=traced("history", [{"role": "user", "content": "avant"}]),
+        mark_paywall_shown=traced("mark_paywall_shown"),
+        load_engagement_state=traced("load_engagement", EngagementState()),
+        save_engagement_state=traced("save_engagement"),
+        load_nsfw_gate=traced("load_nsfw_gate"),
+        save_nsfw_gate=traced("save_nsfw_gate"),
+        classify_nsfw=traced("classify_nsfw", False),
+        generate_response=generate_response,
+        validate_response_facts=validate,
+        is_nsfw_message=lambda text: False,
+        climax_patterns=(),
+        timezone=timezone.utc,
+        natural_delay=False,
+    )
+
+
+class TestPipeline:
+    """Tests du moteur de pipeline par graphe d'étapes et du tour partagé."""
+
+    def test_independent_stages_run_concurrently(self):
+        import asyncio
+        from core.pipeline import Pipeline, Stage
+
+        async def slow(key, value):
+            await asyncio.sleep(0.05)
+            return {key: value}
+
+        async def join(a, b):
+            return {"sum": a + b}
+
+        pipeline = Pipeline("t", [
+            Stage("a", lambda x: slow("a", x), ("x",), ("a",)),
+            Stage("b", lambda x: slow("b", x * 2), ("x",), ("b",)),
+            Stage("join", join, ("a", "b"), ("sum",)),
+        ], initial=("x",))
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            result = await pipeline.run({"x": 1})
+            return result, loop.time() - started
+
+        result, elapsed = asyncio.run(run())
+        assert result.values["sum"] == 3
+        assert elapsed < 0.09
+        assert set(result.timings) == {"a", "b", "join"}
+
+    def test_build_rejects_bad_graphs(self):
+        from core.pipeline import Pipeline, Stage
+
+        async def noop(**kwargs):
+            return None
+
+        with pytest.raises(ValueError, match="unknown inputs"):
+            Pipeline("t", [Stage("a", noop, ("missing",), ())])
+        with pytest.raises(ValueError, match="produced by both"):
+            Pipeline("t", [Stage("a", noop, (), ("x",)), Stage("b", noop, (), ("x",))])
+        with pytest.raises(ValueError, match="cycle"):
+            Pipeline("t", [Stage("a", noop, ("y",), ("x",)), Stage("b", noop, ("x",), ("y",))])
+
+    def test_stop_cancels_running_stages(self):
+        import asyncio
+        from core.pipeline import Pipeline, PipelineStop, Stage
+
+        cancelled = []
+
+        async def stop():
+            raise PipelineStop()
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return {"late": 1}
+
+        async def after(late):
+            return None
+
+        pipeline = Pipeline("t", [
+            Stage("stop", stop),
+            Stage("slow", slow, (), ("late",)),
+            Stage("after", after, ("late",)),
+        ])
+        result = asyncio.run(pipeline.run({}))
+        assert result.stopped_by == "stop"
+        assert cancelled == [True]
+
+    def test_turn_runs_full_graph(self):
+        import asyncio
+        from bot.turn import build_turn_pipeline, run_turn
+
+        log, replies = [], []
+
+        async def reply(text):
+            replies.append(text)
+
+        pipeline = build_turn_pipeline(_turn_deps(log))
+        with patch("bot.turn.rolling_summaries.get", AsyncMock(return_value=None)), \
+             patch("bot.turn.build_prompt_sections", AsyncMock(return_value=[])), \
+             patch("bot.turn.overload.allows", return_value=True), \
+             patch("bot.turn.task_supervisor") as supervisor:
+            result = asyncio.run(run_turn(pipeline, 42, "salut", reply))
+            supervisor.submit.call_args[0][0].close()
+
+        assert result.stopped_by is None
+        assert replies == ["coucou toi"]
+        assert log.index("llm") > log.index("history")
+        assert "load_nsfw_gate" not in log  # gate only in LIBRE phase
+
+    def test_turn_paywall_stops_before_llm(self):
+        import asyncio
+        from bot.turn import build_turn_pipeline, run_turn
+
+        log, replies = [], []
+
+        async def reply(text):
+            replies.append(text)
+
+        pipeline = build_turn_pipeline(_turn_deps(log, count=40, relationship={"day": 3}))
+        with patch("bot.turn.rolling_summaries.get", AsyncMock(return_value=None)), \
+             patch("bot.turn.build_prompt_sections", AsyncMock(return_value=[])):
+            result = asyncio.run(run_turn(pipeline, 42, "salut", reply))
+
+        assert result.stopped_by == "paywall"
+        assert "llm" not in log and "mark_paywall_shown" in log
+        assert len(replies) == 1
+
+
+# ============== MEMORY ROWS TESTS ==============
+
+class _FakeRowConn:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    async def fetchrow(self, query, *args):
+        self.queries.append(query)
+        return self.rows[0] if self.rows else None
+
+    async def fetch(self, query, *args):
+        self.queries.append(query)
+        return self.rows
+
+
+class _FakeSqlConn:
+    def __init__(self, rows=None):
+        self.rows = rows or []
+        self.executed = []
+
+    async def execute(self, query, *args):
+        self.executed.append((query, args))
+        return "DELETE 2" if query.lstrip().startswith("DELETE") else "INSERT 0 1"
+
+    async def fetch(self, query, *args):
+        self.executed.append((query, args))
+        return self.rows
+
+    def transaction(self):
+        class _Tx:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return _Tx()
+
+
+class TestMemoryRows:
+    """Tests des requêtes projetées et des lignes à __slots__ (memory/crud.py)."""
+
+    def test_row_keeps_only_projected_columns(self):
+        from memory.rows import UserProfile
+
+        record = {"id": "u1", "telegram_id": 42, "name": "Max", "likes": "[...]", "state": "{}"}
+        row = UserProfile.from_record(record)
+        assert not hasattr(row, "__dict__")
+        assert row["name"] == "Max" and row.get("job") is None
+        assert row.get("likes", "absent") == "absent"
+        assert "state" not in row
+        with pytest.raises(KeyError):
+            row["likes"]
+        assert dict(row)["telegram_id"] == 42
+        assert row == UserProfile.from_record(dict(row))
+
+    def test_queries_are_projected(self):
+        import asyncio
+        from memory import crud
+        from memory.rows import EventRow, UserProfile
+
+        conn = _FakeRowConn([{"id": "e1", "type": "moment", "summary": "s", "user_id": "u1"}])
+        crud.set_pool(_FakeJobPool(conn))
+        try:
+            user = asyncio.run(crud.get_user(42))
+            events = asyncio.run(crud.get_hot_events("u1", limit=5))
+        finally:
+            crud.set_pool(None)
+
+        assert isinstance(user, UserProfile)
+        assert isinstance(events[0], EventRow) and events[0]["summary"] == "s"
+        assert all("*" not in q for q in conn.queries)
+        assert "likes" not in conn.queries[0]
+        assert EventRow.columns() in conn.queries[1]
+
+    def test_columns_prefix(self):
+        from memory.rows import SummaryRow
+        assert SummaryRow.columns("s.").startswith("s.id, s.type")
+        assert "archived_data" not in SummaryRow.columns()
+
+
+# ============== ANTI-REPETITION TESTS ==============
+
+class TestAntiRepetition:
+    """Tests de l'index de shingles (services/anti_repetition.py)."""
+
+    def setup_method(self):
+        from services import anti_repetition
+        anti_repetition._response_cache.clear()
+
+    def test_detects_near_duplicate_phrase(self):
+        from services.anti_repetition import add_response, check_repetition
+
+        add_response(1, "J'ai passé toute la journée à coder sur le projet du client. Pixel dort.")
+        check = check_repetition(1, "J'ai passé toute la journée à coder sur le projet de Marc!")
+        assert check.has_repetition
+        assert check.repeated_phrases[0].startswith("jai passé toute la journée")
+        assert not check_repetition(1, "On se fait un ciné ce soir avec les copines?").has_repetition
+        assert not check_repetition(2, "J'ai passé toute la journée à coder sur le projet du client").has_repetition
+
+    def test_banned_pattern_repeated(self):
+        from services.anti_repetition import add_response, check_repetition
+
+        add_response(1, "Raconte-moi ta journée")
+        check = check_repetition(1, "Haha ok raconte moi tout")
+        assert check.repeated_phrases == ["raconte moi"]
+        assert check.instruction is not None
+
+    def test_window_and_users_are_bounded(self, monkeypatch):
+        from services import anti_repetition as ar
+
+        ar.add_response(1, "Je suis allée courir au parc ce matin avec ma voisine")
+        for i in range(ar.MAX_CACHED_RESPONSES):
+            ar.add_response(1, f"Message numéro {i} sur un sujet complètement différent {i}")
+        index = ar._response_cache[1]
+        assert len(index.entries) == ar.MAX_CACHED_RESPONSES
+        assert sum(index.counts.values()) == sum(len(s) for s, _ in index.entries)
+        assert not ar.check_repetition(1, "Je suis allée courir au parc ce matin").has_repetition
+
+        monkeypatch.setattr(ar, "MAX_USERS", 2)
+        for user_id in (2, 3):
+            ar.add_response(user_id, "Salut toi, bien dormi cette nuit?")
+        assert list(ar._response_cache) == [2, 3]
+
+    def test_variety_reminder_every_ten_responses(self):
+        from services.anti_repetition import add_response, should_add_variety_reminder
+
+        reminders = []
+        for i in range(20):
+            add_response(1, f"réponse {i}")
+            reminders.append(should_add_variety_reminder(1))
+        assert [i for i, r in enumerate(reminders) if r] == [9, 19]
+
+
+# ============== MEMORY CHILD TABLES TESTS ==============
+
+class TestMemoryChildTables:
+    """Tests des tables enfants (dates, inside jokes, likes) de memory/crud.py."""
+
+    def _run(self, conn, coro_factory):
+        import asyncio
+        from memory import crud
+
+        crud.set_pool(_FakeJobPool(conn))
+        try:
+            return asyncio.run(coro_factory())
+        finally:
+            crud.set_pool(None)
+
+    def test_upcoming_dates_is_a_range_query(self):
+        from datetime import date
+        from memory import crud
+        from memory.rows import CalendarDateRow
+
+        conn = _FakeSqlConn([{"date": date(2026, 10, 20), "event": "ciné", "type": "plan", "importance": 6}])
+        dates = self._run(conn, lambda: crud.get_upcoming_dates("u1", days_ahead=7, limit=3))
+
+        query, args = conn.executed[0]
+        assert "BETWEEN $2 AND $3" in query and "calendar_dates" not in query.split("FROM")[0]
+        assert (args[2] - args[1]).days == 7 and args[3] == 3
+        assert isinstance(dates[0], CalendarDateRow) and str(dates[0]["date"]) == "2026-10-20"
+
+    def test_calendar_date_upsert_keeps_last_per_day(self):
+        from datetime import date
+        from memory import crud
+
+        conn = _FakeSqlConn()
+        self._run(conn, lambda: crud.upsert_calendar_dates(conn, "u1", [
+            {"date": "2026-02-14", "event": "resto"},
+            {"date": "2026-02-14", "event": "ciné", "type": "plan", "importance": 8},
+        ]))
+        query, args = conn.executed[0]
+        assert "ON CONFLICT (user_id, date) DO UPDATE" in query
+        assert args[1] == [date(2026, 2, 14)] and args[2] == ["ciné"]
+        assert self._run(conn, lambda: crud.cleanup_past_dates("u1")) == 2
+
+    def test_add_inside_joke_is_atomic_upsert(self):
+        from memory import crud
+
+        conn = _FakeSqlConn()
+        self._run(conn, lambda: crud.add_inside_joke_v2("u1", "Pixel", "le chat", 7))
+        upsert, trim = (q for q, _ in conn.executed)
+        assert "ON CONFLICT (user_id, lower(trigger)) DO UPDATE" in upsert
+        assert "times_used = memory_inside_jokes.times_used + EXCLUDED.times_used" in upsert
+        assert "SELECT" not in upsert.split("INSERT")[0]
+        assert crud.JOKE_RANK in trim and conn.executed[1][1][1] == crud.INSIDE_JOKES_KEEP
+
+    def test_user_facts_lists_come_from_items(self):
+        from memory import crud
+
+        assert "memory_user_items" in crud.USER_FACTS_COLUMNS
+        assert "AS likes" in crud.USER_FACTS_COLUMNS and "AS secrets" in crud.USER_FACTS_COLUMNS
+        assert "memory_inside_jokes" in crud.RELATIONSHIP_COLUMNS
+
+        conn = _FakeSqlConn()
+        self._run(conn, lambda: crud.add_user_items(conn, "u1", {"likes": ["rap", "foot"], "secrets": ["x"]}))
+        _, args = conn.executed[0]
+        assert args[1] == ["like", "like", "secret"] and args[2] == ["rap", "foot", "x"]
+
+    def test_stale_accepts_datetimes(self):
+        from datetime import datetime, timedelta, timezone
+        from memory.compression import _is_stale
+
+        assert not _is_stale(datetime.now(timezone.utc) - timedelta(days=2))
+        assert _is_stale((datetime.now(timezone.utc) - timedelta(days=40)).isoformat())
+
+
+# ============== HTTP CASSETTE TESTS ==============
+
+class TestHttpCassette:
+    """Tests de l'enregistrement / rejeu du trafic provider (core/cassette.py)."""
+
+    URL = "https://api.anthropic.com/v1/messages"
+
+    def _record(self, path, handler, payloads):
+        import asyncio
+        import httpx
+        from core.cassette import Cassette, RecordingTransport
+
+        transport = RecordingTransport(httpx.MockTransport(handler), Cassette(str(path)))
+
+        async def run():
+            async with httpx.AsyncClient(transport=transport) as client:
+                for payload in payloads:
+                    try:
+                        await client.post(self.URL, json=payload)
+                    except httpx.TransportError:
+                        pass
+
+        asyncio.run(run())
+        return transport
+
+    def test_record_then_replay(self, tmp_path):
+        import asyncio
+        import httpx
+        from core.cassette import Cassette, ReplayTransport
+
+        path = tmp_path / "llm.jsonl.gz"
+
+        def handler(request):
+            return httpx.Response(200, json={"content": [{"text": "coucou"}]}, headers={"set-cookie": "x"})
+
+        assert self._record(path, handler, [{"model": "m", "max_tokens": 10}]).recorded == 1
+        interaction = Cassette(str(path)).load()[0]
+        assert interaction.status == 200 and interaction.request_bytes > 0
+        assert all(k != "set-cookie" for k, _ in interaction.headers)
+
+        async def replay():
+            transport = ReplayTransport.from_cassette(Cassette(str(path)), time_scale=0)
+            async with httpx.AsyncClient(transport=transport) as client:
+                # Ordre des clés différent: même empreinte
+                response = await client.post(self.URL, json={"max_tokens": 10, "model": "m"})
+            return response
+
+        response = asyncio.run(replay())
+        assert response.json()["content"][0]["text"] == "coucou"
+
+    def test_fallback_strict_and_errors(self):
+        import asyncio
+        import httpx
+        import pytest
+        from core.cassette import CassetteMissError, Interaction, ReplayTransport, request_key
+
+        ok = Interaction("POST", self.URL, request_key("POST", self.URL, b'{"a":1}'), 7,
+                         status=200, chunks=[(0.0, b'{"ok":true}')])
+        timeout = Interaction("POST", self.URL, "other", 7, error="ReadTimeout")
+
+        async def call(transport, payload):
+            async with httpx.AsyncClient(transport=transport) as client:
+                return await client.post(self.URL, json=payload)
+
+        strict = ReplayTransport([ok], time_scale=0, strict=True)
+        with pytest.raises(CassetteMissError):
+            asyncio.run(call(strict, {"a": 2}))
+
+        loose = ReplayTransport([ok, timeout], time_scale=0)
+        assert asyncio.run(call(loose, {"a": 2})).json() == {"ok": True}
+        with pytest.raises(httpx.ReadTimeout):
+            asyncio.run(call(loose, {"a": 3}))
+
+    def test_time_scale_compresses_latency(self):
+        import asyncio
+        import time
+        import httpx
+        from core.cassette import Interaction, ReplayTransport
+
+        interaction = Interaction("POST", self.URL, "k", 0, status=200, ttfb=0.2,
+                                  chunks=[(0.2, b"ab"), (0.4, b"cd")])
+
+        async def run():
+            transport = ReplayTransport([interaction], time_scale=0.1)
+            async with httpx.AsyncClient(transport=transport) as client:
+                started = time.perf_counter()
+                response = await client.post(self.URL, content=b"x")
+                return response.content, time.perf_counter() - started
+
+        body, elapsed = asyncio.run(run())
+        assert body == b"abcd"
+        assert 0.03 <= elapsed < 0.2
+
+    def test_http_client_uses_cassette(self, tmp_path):
+        import asyncio
+        from core import http
+        from core.cassette import Cassette, Interaction, ReplayTransport
+
+        path = tmp_path / "c.jsonl"
+        Cassette(str(path)).append(Interaction("GET", "https://openrouter.ai/", "k", 0, status=204))
+        try:
+            http.configure_cassette("replay", str(path), time_scale=0)
+            http._client = None
+            client = http.get_http_client()
+            assert isinstance(client._transport, ReplayTransport)
+            assert asyncio.run(http.prewarm_http()) == 0
+            assert asyncio.run(client.get("https://openrouter.ai/")).status_code == 204
+        finally:
+            http.configure_cassette("off")
+            asyncio.run(http.close_http_client())
+
+
+# ============== TOKEN USAGE TESTS ==============
+
+class TestTokenUsage:
+    """Tests du comptage de tokens par appel et par tour (core/usage.py)."""
+
+    def test_parse_provider_usage(self):
+        from core.usage import TokenUsage
+
+        anthropic = TokenUsage.from_response({"usage": {
+            "input_tokens": 100, "output_tokens": 20,
+            "cache_read_input_tokens": 900, "cache_creation_input_tokens": 50,
+        }})
+        assert (anthropic.input, anthropic.output, anthropic.cached) == (1050, 20, 900)
+
+        openrouter = TokenUsage.from_response({"usage": {
+            "prompt_tokens": 800, "completion_tokens": 40, "prompt_tokens_details": {"cached_tokens": 300},
+        }})
+        assert (openrouter.input, openrouter.output, openrouter.cached) == (800, 40, 300)
+        assert TokenUsage.from_response({"choices": []}) == TokenUsage()
+
+    def test_turn_attributes_sections(self):
+        import asyncio
+        from core.usage import UsageRecorder
+        from middleware.metrics import metrics
+
+        recorder = UsageRecorder()
+        before = metrics.counters.get("llm_tokens_input_classifier", 0)
+
+        async def run():
+            async with recorder.turn(42) as turn:
+                recorder.record("classifier", {"usage": {"input_tokens": 30, "output_tokens": 1}})
+                recorder.set_sections("reply", system="s" * 400, memory="m" * 1200, history=[{"content": "h" * 400}])
+                recorder.record("reply", {"usage": {"prompt_tokens": 1001, "completion_tokens": 50}})
+            # Après le tour (extraction en arrière-plan): hors du tour
+            recorder.record("extraction", {"usage": {"prompt_tokens": 500, "completion_tokens": 10}})
+            return turn
+
+        turn = asyncio.run(run())
+        assert [c["site"] for c in turn.calls] == ["classifier", "reply"]
+        assert turn.totals().input == 1031
+        sections = turn.sections["reply"]
+        assert sum(sections.values()) == 1001
+        assert sections["memory"] > sections["system"] and sections["system"] == 200
+        assert metrics.counters["llm_tokens_input_classifier"] == before + 30
+
+    def test_run_turn_collects_usage(self):
+        import asyncio
+        from unittest.mock import patch
+        from bot.turn import build_turn_pipeline, run_turn
+        from core.usage import usage
+
+        from dataclasses import replace
+
+        deps = _turn_deps([])
+        generate = deps.generate_response
+
+        async def generate_with_usage(messages, system, use_nsfw):
+            usage.record("reply", {"usage": {"input_tokens": 120, "output_tokens": 15}})
+            return await generate(messages, system, use_nsfw)
+
+        deps = replace(deps, generate_response=generate_with_usage)
+        turns = []
+        original_finish = usage._finish
+
+        def capture(turn):
+            turns.append(turn)
+            original_finish(turn)
+
+        from memory.retrieval import ContextSection
+
+        sections = [ContextSection(10, "identity", "Il s'appelle Max.")]
+        with patch("bot.turn.rolling_summaries.get", AsyncMock(return_value=None)), \
+             patch("bot.turn.build_prompt_sections", AsyncMock(return_value=sections)), \
+             patch("bot.turn.overload.allows", return_value=False), \
+             patch.object(usage, "_finish", capture):
+            asyncio.run(run_turn(build_turn_pipeline(deps), 42, "salut", AsyncMock()))
+
+        assert turns and turns[0].telegram_id == 42
+        assert turns[0].calls[0]["input"] == 120
+        assert set(turns[0].sections["reply"]) == {"system", "memory", "history", "user"}
+
+
+# ============== PROMPT BUDGET TESTS ==============
+
+class TestPromptBudget:
+    """Tests du budget tokens du prompt (core/tokens.py, mémoire + historique)."""
+
+    def test_count_tokens_heuristic_and_cache(self):
+        from core.tokens import count_tokens, prompt_token_limit
+
+        count_tokens.cache_clear()
+        assert count_tokens("") == 0
+        assert count_tokens("salut, ça va ?") >= 5
+        assert count_tokens("a" * 40) < count_tokens(" ".join(["a"] * 40))
+        count_tokens("salut, ça va ?")
+        assert count_tokens.cache_info().hits >= 1
+
+        assert prompt_token_limit("claude-haiku-4-5-20251001") == 8000
+        assert prompt_token_limit("anthracite-org/magnum-v4-72b", override=3000) == 3000
+
+    def test_pack_by_priority_keeps_history_contiguous(self):
+        from core.tokens import PromptBudget, count_tokens
+
+        big = "mot " * 60
+        budget = PromptBudget(limit=count_tokens(big) + 30, reserved=10)
+        budget.add("memory", "low", "petite note", priority=2)
+        budget.add("memory", "big", big, priority=9)
+        budget.add("history", "0", "dernier message", priority=10, chain="history")
+        budget.add("history", "1", big, priority=8, chain="history")
+        budget.add("history", "2", "court", priority=7, chain="history")
+        packed = budget.pack()
+
+        assert [i.name for i in packed.kept] == ["low", "big", "0"]
+        # "2" tiendrait, mais "1" est tombé: l'historique reste une suite continue
+        assert packed.dropped_names() == ["history:1", "history:2"]
+        assert packed.used <= packed.limit
+
+    def test_build_prompt_context_orders_by_priority_under_budget(self):
+        import asyncio
+        from memory.retrieval import ContextSection, build_prompt_context
+
+        sections = [
+            ContextSection(10, "identity", "Il s'appelle Max."),
+            ContextSection(7, "hot_events", "événement " * 200),
+            ContextSection(4, "weekly_summary", "Bonne semaine."),
+        ]
+        with patch("memory.retrieval.build_prompt_sections", AsyncMock(return_value=sections)):
+            context = asyncio.run(build_prompt_context("u1", "salut", max_tokens=50))
+
+        assert context == "Il s'appelle Max.\n\nBonne semaine."
+
+    def test_turn_prompt_trims_old_history(self):
+        import asyncio
+        from dataclasses import replace
+        from bot.turn import build_turn_pipeline, run_turn
+        from core.tokens import count_tokens
+        from memory.retrieval import ContextSection
+        from prompts.luna import build_system_prompt
+
+        history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message numéro {i} " * 20}
+                   for i in range(20)]
+        log, sent = [], []
+        deps = _turn_deps(log)
+
+        async def get_history(user_id, limit=20):
+            return history
+
+        async def generate_response(messages, system, use_nsfw):
+            sent.append(messages)
+            return "ok"
+
+        base = count_tokens(build_system_prompt(phase="hook", memory_context="")) + 400
+        deps = replace(deps, get_history=get_history, generate_response=generate_response, prompt_token_limit=base)
+        sections = [ContextSection(10, "identity", "Il s'appelle Max."),
+                    ContextSection(4, "weekly_summary", "résumé " * 300)]
+        with patch("bot.turn.rolling_summaries.get", AsyncMock(return_value=None)), \
+             patch("bot.turn.build_prompt_sections", AsyncMock(return_value=sections)), \
+             patch("bot.turn.overload.allows", return_value=False):
+            run = asyncio.run(run_turn(build_turn_pipeline(deps), 42, "salut", AsyncMock()))
+
+        prompt_history = run.values["prompt_history"]
+        assert 0 < len(prompt_history) < len(history)
+        assert prompt_history == history[-len(prompt_history):]
+        assert sent[0][:-1] == prompt_history
+        assert "memory:weekly_summary" in run.values["prompt_dropped"]
+        assert "Il s'appelle Max." in run.values["system"]
+
+
+# ============== ROLLING SUMMARY TESTS ==============
+
+class TestRollingSummary:
+    """Tests du résumé glissant de conversation (memory/conversation_summary.py)."""
+
+    def test_raw_tail_and_due(self):
+        from memory.conversation_summary import RollingSummaries
+        from memory.rows import ConversationSummaryRow
+
+        summaries = RollingSummaries(every_turns=6, raw_tail=4)
+        history = [{"id": i, "role": "user", "content": str(i)} for i in range(1, 21)]
+        summary = ConversationSummaryRow.from_record({"summary": "s", "last_message_id": 12, "covered_turns": 12})
+
+        assert summaries.recent_history(history, None) == history
+        # Exactement les messages après le watermark
+        assert summaries.recent_history(history, summary) == history[-8:]
+
+        assert not summaries.is_due("u1", None, 5)
+        assert summaries.is_due("u1", None, 6)
+        assert not summaries.is_due("u1", summary, 17)
+        assert summaries.is_due("u1", summary, 18)
+
+    def test_refresh_folds_messages_before_tail(self):
+        import asyncio
+        from memory import compression
+        from memory.conversation_summary import RollingSummaries
+
+        # ORDER BY id DESC
+        rows = [{"id": i, "role": "user" if i % 2 else "assistant", "content": f"m{i}"} for i in range(110, 100, -1)]
+        conn = _FakeSqlConn(rows)
+        summaries = RollingSummaries(every_turns=6, raw_tail=4)
+        summaries._cache["u1"] = None
+        generate = AsyncMock(return_value="Ils ont parlé de son boulot.")
+
+        with patch("memory.conversation_summary.get_pool", return_value=_FakeJobPool(conn)), \
+             patch("memory.conversation_summary.get_user_by_id", AsyncMock(return_value={"name": "Max"})), \
+             patch.object(compression, "OPENROUTER_API_KEY", "k"), \
+             patch.object(compression, "generate_rolling_summary", generate):
+            assert asyncio.run(summaries.refresh("u1", 9)) is True
+
+        previous, messages, name = generate.call_args[0]
+        assert previous is None and name == "Max"
+        assert [m["content"] for m in messages] == [f"m{i}" for i in range(101, 107)]
+        query, args = conn.executed[-1]
+        assert "ON CONFLICT (user_id)" in query
+        assert args == ("u1", "Ils ont parlé de son boulot.", 106, 9)
+        cached = asyncio.run(summaries.get("u1"))
+        assert cached["covered_turns"] == 9 and not summaries.is_due("u1", cached, 10)
+
+    def test_raw_tail_keeps_proactive_and_unflushed_messages(self):
+        from memory.conversation_summary import RollingSummaries
+        from memory.rows import ConversationSummaryRow
+
+        summaries = RollingSummaries(every_turns=6, raw_tail=2)
+        # Résumé au tour 12; depuis: un message proactif (pas de tour compté)
+        # et un message encore dans le writer (id inconnu)
+        history = [{"id": i, "role": "user", "content": f"m{i}"} for i in range(1, 11)]
+        history += [
+            {"id": 11, "role": "assistant", "content": "tu fais quoi ce soir?"},
+            {"id": None, "role": "user", "content": "rien de spécial"},
+        ]
+        summary = ConversationSummaryRow.from_record({"summary": "s", "last_message_id": 8, "covered_turns": 12})
+
+        kept = summaries.recent_history(history, summary)
+        assert [m["content"] for m in kept] == ["m9", "m10", "tu fais quoi ce soir?", "rien de spécial"]
+
+    def test_refresh_waits_for_writer_before_reading(self):
+        import asyncio
+        from memory import compression
+        from memory.conversation_summary import RollingSummaries
+
+        rows = [{"id": i, "role": "user", "content": f"m{i}"} for i in range(10, 0, -1)]
+        conn = _FakeSqlConn(rows)
+        reads_at_barrier = []
+
+        async def barrier():
+            reads_at_barrier.append(len(conn.executed))
+
+        summaries = RollingSummaries()
+        summaries.configure(every_turns=6, raw_tail=2, barrier=barrier)
+        summaries._cache["u1"] = None
+
+        with patch("memory.conversation_summary.get_pool", return_value=_FakeJobPool(conn)), \
+             patch("memory.conversation_summary.get_user_by_id", AsyncMock(return_value=None)), \
+             patch.object(compression, "OPENROUTER_API_KEY", "k"), \
+             patch.object(compression, "generate_rolling_summary", AsyncMock(return_value="résumé")):
+            assert asyncio.run(summaries.refresh("u1", 6)) is True
+
+        assert reads_at_barrier == [0]
+
+    def test_failed_refresh_waits_before_retry(self):
+        import asyncio
+        from memory import compression
+        from memory.conversation_summary import RollingSummaries
+
+        rows = [{"id": i, "role": "user", "content": f"m{i}"} for i in range(20, 0, -1)]
+        summaries = RollingSummaries(every_turns=6, raw_tail=4)
+        summaries._cache["u1"] = None
+
+        with patch("memory.conversation_summary.get_pool", return_value=_FakeJobPool(_FakeSqlConn(rows))), \
+             patch("memory.conversation_summary.get_user_by_id", AsyncMock(return_value=None)), \
+             patch.object(compression, "OPENROUTER_API_KEY", "k"), \
+             patch.object(compression, "generate_rolling_summary", AsyncMock(return_value=None)):
+            assert asyncio.run(summaries.refresh("u1", 6)) is False
+
+        assert not summaries.is_due("u1", None, 7)
+        assert summaries.is_due("u1", None, 12)
+
+    def test_turn_sends_summary_and_raw_tail(self):
+        import asyncio
+        from dataclasses import replace
+        from bot.turn import build_turn_pipeline, run_turn
+        from memory.rows import ConversationSummaryRow
+
+        history = [{"id": i + 1, "role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+                   for i in range(20)]
+        log, sent = [], []
+
+        async def get_history(user_id, limit=20):
+            return history
+
+        async def generate_response(messages, system, use_nsfw):
+            sent.append((messages, system))
+            return "ok"
+
+        # Watermark au message 12: les 8 suivants restent bruts
+        deps = replace(_turn_deps(log), get_history=get_history, generate_response=generate_response)
+        summary = ConversationSummaryRow.from_record(
+            {"summary": "Il a parlé de son chat Pixel.", "last_message_id": 12, "covered_turns": 4}
+        )
+        with patch("bot.turn.rolling_summaries.get", AsyncMock(return_value=summary)), \
+             patch("bot.turn.build_prompt_sections", AsyncMock(return_value=[])), \
+             patch("bot.turn.overload.allows", return_value=False):
+            asyncio.run(run_turn(build_turn_pipeline(deps), 42, "salut", AsyncMock()))
+
+        messages, system = sent[0]
+        assert messages[:-1] == [{"role": m["role"], "content": m["content"]} for m in history[-8:]]
+        assert "Il a parlé de son chat Pixel." in system